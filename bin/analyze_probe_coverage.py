@@ -9,6 +9,7 @@ import os
 
 from catch import coverage_analysis
 from catch import probe
+from catch.utils import cover_cache
 from catch.utils import ncbi_neighbors, seq_io, version, log
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
@@ -23,12 +24,14 @@ def main(args):
             # Download a FASTA for an NCBI taxonomic ID
             taxid = ds[len('download:'):]
             ds_fasta_tf = ncbi_neighbors.construct_fasta_for_taxid(taxid)
-            genomes_grouped += [seq_io.read_genomes_from_fasta(ds_fasta_tf.name)]
+            genomes_grouped += [seq_io.read_genomes_from_fasta(
+                ds_fasta_tf.name, index_dir=args.genome_index_dir)]
             genomes_grouped_names += ['taxid:' + str(taxid)]
             ds_fasta_tf.close()
         elif os.path.isfile(ds):
             # Process a custom fasta file with sequences
-            genomes_grouped += [seq_io.read_genomes_from_fasta(ds)]
+            genomes_grouped += [seq_io.read_genomes_from_fasta(
+                ds, index_dir=args.genome_index_dir)]
             genomes_grouped_names += [os.path.basename(ds)]
         else:
             # Process an individual dataset
@@ -47,6 +50,20 @@ def main(args):
         probe.set_max_num_processes_for_probe_finding_pools(
             args.max_num_processes)
 
+    # Save and reuse maps of k-mers to probes
+    if args.kmer_probe_map_dir:
+        probe.set_kmer_probe_map_dir(args.kmer_probe_map_dir)
+
+    # Find the probes that cover a sequence with a vectorized scan
+    if args.vectorized_kmer_scan:
+        probe.set_use_vectorized_scan(True)
+
+    # Save and reuse the ranges that probes cover in sequences
+    if args.cover_cache_dir:
+        probe.set_cover_cache(cover_cache.CoverCache(
+            args.cover_cache_dir,
+            max_size=int(args.cover_cache_max_size * 1024**3)))
+
     # On macOS, starting with Python 3.8, new processes begin following the
     #   spawn behavior rather than fork; apparently, forking processes in
     #   macOS can cause crashes, but CATCH with older versions of
@@ -79,13 +96,11 @@ def main(args):
         island_of_exact_match=args.island_of_exact_match,
         cover_extension=args.cover_extension,
         kmer_probe_map_k=args.kmer_probe_map_k)
-    analyzer.run()
-    if args.write_analysis_to_tsv:
-        analyzer.write_data_matrix_as_tsv(
-            args.write_analysis_to_tsv)
-    if args.write_sliding_window_coverage:
-        analyzer.write_sliding_window_coverage(
-            args.write_sliding_window_coverage)
+    # Write results for each genome as they are computed, rather than
+    # storing the probe covers in all genomes
+    analyzer.run_streaming(
+        analysis_tsv_fn=args.write_analysis_to_tsv,
+        sliding_window_coverage_fn=args.write_sliding_window_coverage)
     if args.write_probe_map_counts_to_tsv:
         analyzer.write_probe_map_counts(
                 args.write_probe_map_counts_to_tsv)
@@ -197,6 +212,42 @@ if __name__ == "__main__":
               "k as the k-mer length in mappings; if no such k exists, it "
               "will use a randomized approach with KMER_PROBE_LENGTH_K as "
               "the k-mer length."))
+    parser.add_argument('--kmer-probe-map-dir',
+        help=("(Optional) Directory in which to save maps of k-mers to "
+              "probes, keyed by the probes and the parameters used to "
+              "construct them. When this is re-run with the same probes, "
+              "the map is loaded, memory-mapped, from this directory rather "
+              "than constructed, and the scan reads it directly"))
+    parser.add_argument('--vectorized-kmer-scan',
+        dest="vectorized_kmer_scan",
+        action="store_true",
+        help=("When finding the probes that cover a sequence, look up all "
+              "k-mers of the sequence at once rather than one k-mer at a "
+              "time. This is generally considerably faster, at the cost of "
+              "an encoded array for each sequence and holding the map of "
+              "k-mers to probes as arrays. The output is the same"))
+    parser.add_argument('--cover-cache-dir',
+        help=("(Optional) Directory in which to cache the ranges that "
+              "probes cover in each target sequence, keyed by the "
+              "sequence and the hybridization parameters. An entry holds "
+              "the covers of every probe already mapped to the sequence, "
+              "identified by its sequence, so later runs with the same "
+              "sequences and parameters read these from the cache and "
+              "only map the probes not yet in it (e.g., candidate probes "
+              "added since an earlier run)"))
+    parser.add_argument('--cover-cache-max-size',
+        type=float,
+        default=4,
+        help=("(Optional) Maximum size, in GB, of the directory given by "
+              "--cover-cache-dir; when it is exceeded, the least recently "
+              "used entries are removed (default: 4)"))
+    parser.add_argument('--genome-index-dir',
+        help=("(Optional) Directory in which to store indexed copies of the "
+              "input FASTA files, keyed by their contents. When set, the "
+              "sequences of target genomes are not all held in memory; "
+              "rather, each is read, memory-mapped, from its index only "
+              "when it is needed. This reduces memory usage considerably "
+              "for datasets with many genomes"))
 
     # Logging levels and version
     parser.add_argument('--debug',
@@ -25,6 +25,8 @@ from catch.filter import probe_designer
 from catch.filter import reverse_complement_filter
 from catch.filter import set_cover_filter
 from catch.utils import cluster
+from catch.utils import cover_cache
+from catch.utils import kmer_index
 from catch.utils import ncbi_neighbors
 from catch.utils import seq_io, version, log
 
@@ -83,12 +85,14 @@ def main(args):
                 segment = None
             ds_fasta_tf = ncbi_neighbors.construct_fasta_for_taxid(taxid,
                     segment=segment, write_to=taxid_fn)
-            genomes_grouped += [seq_io.read_genomes_from_fasta(ds_fasta_tf.name)]
+            genomes_grouped += [seq_io.read_genomes_from_fasta(
+                ds_fasta_tf.name, index_dir=args.genome_index_dir)]
             genomes_grouped_names += ['taxid:' + str(taxid)]
             ds_fasta_tf.close()
         elif os.path.isfile(ds):
             # Process a custom fasta file with sequences
-            genomes_grouped += [seq_io.read_genomes_from_fasta(ds)]
+            genomes_grouped += [seq_io.read_genomes_from_fasta(
+                ds, index_dir=args.genome_index_dir)]
             genomes_grouped_names += [os.path.basename(ds)]
         else:
             # Process an individual dataset
@@ -141,8 +145,9 @@ def main(args):
     avoided_genomes_fasta = []
     if args.avoid_genomes:
         for ag in args.avoid_genomes:
-            if os.path.isfile(ag):
-                # Process a custom fasta file with sequences
+            if os.path.isfile(ag) or kmer_index.is_index(ag):
+                # Process a custom fasta file with sequences, or an index
+                # of genomes made with index_genomes.py
                 avoided_genomes_fasta += [ag]
             else:
                 # Process an individual dataset
@@ -214,6 +219,22 @@ def main(args):
             args.max_num_processes)
         base_filter.set_max_num_processes_for_filter_over_groupings(
             args.max_num_processes)
+        near_duplicate_filter.set_max_num_processes_for_near_duplicate_filter(
+            args.max_num_processes)
+
+    # Save and reuse maps of k-mers to probes
+    if args.kmer_probe_map_dir:
+        probe.set_kmer_probe_map_dir(args.kmer_probe_map_dir)
+
+    # Find the probes that cover a sequence with a vectorized scan
+    if args.vectorized_kmer_scan:
+        probe.set_use_vectorized_scan(True)
+
+    # Save and reuse the ranges that probes cover in sequences
+    if args.cover_cache_dir:
+        probe.set_cover_cache(cover_cache.CoverCache(
+            args.cover_cache_dir,
+            max_size=int(args.cover_cache_max_size * 1024**3)))
 
     # Raise exceptions or warn based on use of adapter arguments
     if args.add_adapters:
@@ -304,7 +325,8 @@ def main(args):
                 "than the desired coverage"), args.filter_with_lsh_hamming,
                 args.mismatches)
         ndf = near_duplicate_filter.NearDuplicateFilterWithHammingDistance(
-            args.filter_with_lsh_hamming, args.probe_length)
+            args.filter_with_lsh_hamming, args.probe_length,
+            use_parallel=args.filter_with_lsh_parallel)
         filters += [ndf]
     elif args.filter_with_lsh_minhash is not None:
         if args.mismatches < 3:
@@ -314,11 +336,18 @@ def main(args):
                 "may cause the probes to achieve less than the desired "
                 "coverage"), args.mismatches)
         ndf = near_duplicate_filter.NearDuplicateFilterWithMinHash(
-            args.filter_with_lsh_minhash)
+            args.filter_with_lsh_minhash,
+            use_parallel=args.filter_with_lsh_parallel)
         filters += [ndf]
     else:
         df = duplicate_filter.DuplicateFilter()
         filters += [df]
+    # Without near-duplicate filtering, only generate each distinct candidate
+    #     probe once, so that a probe is not built for every duplicate
+    #     (the duplicate filter then has nothing left to remove); filters
+    #     before it only remove probes, so their output is unchanged
+    unique_candidates = (args.filter_with_lsh_hamming is None and
+                         args.filter_with_lsh_minhash is None)
 
     # Set cover filter (scf) -- solve the problem by treating it as
     #     an instance of the set cover problem
@@ -336,7 +365,9 @@ def main(args):
         coverage=args.coverage,
         cover_extension=args.cover_extension,
         kmer_probe_map_k=kmer_probe_map_k_scf,
-        kmer_probe_map_use_native_dict=args.use_native_dict_when_finding_tolerant_coverage)
+        kmer_probe_map_use_native_dict=args.use_native_dict_when_finding_tolerant_coverage,
+        use_lazy_greedy=args.lazy_greedy_set_cover,
+        use_bitmap_universes=args.bitmap_set_cover_universes)
     filters += [scf]
 
     # [Optional]
@@ -408,7 +439,8 @@ def main(args):
                                       cluster_threshold=cluster_threshold,
                                       cluster_merge_after=cluster_merge_after,
                                       cluster_method=cluster_method,
-                                      cluster_fragment_length=cluster_fragment_length)
+                                      cluster_fragment_length=cluster_fragment_length,
+                                      unique_candidates=unique_candidates)
     pb.design()
 
     # Write the final probes to the file args.output_probes
@@ -428,13 +460,11 @@ def main(args):
             cover_extension=args.cover_extension,
             kmer_probe_map_k=kmer_probe_map_k_analyzer,
             rc_too=args.add_reverse_complements)
-        analyzer.run()
-        if args.write_analysis_to_tsv:
-            analyzer.write_data_matrix_as_tsv(
-                args.write_analysis_to_tsv)
-        if args.write_sliding_window_coverage:
-            analyzer.write_sliding_window_coverage(
-                args.write_sliding_window_coverage)
+        # Write results for each genome as they are computed, rather than
+        # storing the probe covers in all genomes
+        analyzer.run_streaming(
+            analysis_tsv_fn=args.write_analysis_to_tsv,
+            sliding_window_coverage_fn=args.write_sliding_window_coverage)
         if args.write_probe_map_counts_to_tsv:
             analyzer.write_probe_map_counts(
                     args.write_probe_map_counts_to_tsv)
@@ -606,7 +636,14 @@ def init_and_parse_args(args_type : _ARGS_TYPES):
         nargs='+',
         help=("One or more genomes to avoid; penalize probes based "
               "on how much of each of these genomes they cover. "
-              "The value is a path to a FASTA file."))
+              "The value is a path to a FASTA file, or to an index of "
+              "genomes built with index_genomes.py; an index is built "
+              "once and then queried with candidate probes rather than "
+              "scanned, which is much faster for large genomes (e.g., "
+              "a host genome). To be queried, the index's k-mer length "
+              "must match the k-mer length of the map from k-mers to "
+              "probes used for the tolerant parameters (see "
+              "--kmer-probe-map-k)."))
     parser.add_argument('-mt', '--mismatches-tolerant',
         type=int,
         help=("(Optional) A more tolerant value for 'mismatches'; "
@@ -877,6 +914,14 @@ def init_and_parse_args(args_type : _ARGS_TYPES):
               "FILTER_WITH_LSH_MINHASH above ~0.7 may start to require "
               "significant memory and runtime for near-duplicate detection, "
               "and should not be needed in practice."))
+    parser.add_argument('--filter-with-lsh-parallel',
+        dest="filter_with_lsh_parallel",
+        action="store_true",
+        help=("(Optional) When using --filter-with-lsh-hamming or "
+              "--filter-with-lsh-minhash, find near-duplicates using "
+              "multiple processes, with the hash tables sharded by key "
+              "across processes. The output is the same as without this "
+              "argument."))
 
     # Miscellaneous technical adjustments
     parser.add_argument('--small-seq-skip',
@@ -951,6 +996,66 @@ def init_and_parse_args(args_type : _ARGS_TYPES):
               "this may result in substantial memory usage; but it may provide "
               "an improvement in runtime when there are relatively few "
               "candidate probes and a very large avoided genomes input"))
+    parser.add_argument('--lazy-greedy-set-cover',
+        dest="lazy_greedy_set_cover",
+        action="store_true",
+        help=("When solving set cover instances, select probes with a "
+              "lazy evaluation of the greedy algorithm: keep candidate "
+              "probes in a priority queue and only re-evaluate the one at "
+              "the top, rather than re-evaluating every candidate probe. "
+              "This can be much faster when there are many candidate "
+              "probes. The output may differ from the default when "
+              "candidate probes are equally good, since ties are broken "
+              "differently"))
+    parser.add_argument('--bitmap-set-cover-universes',
+        dest="bitmap_set_cover_universes",
+        action="store_true",
+        help=("When solving set cover instances, store the bases of each "
+              "target genome that are not yet covered in a bitmap rather "
+              "than in a list of intervals. This makes it faster to count "
+              "the uncovered bases that each candidate probe covers, "
+              "especially when target genomes are long or fragmented, at "
+              "the cost of 1 byte of memory per base of each target genome. "
+              "The output is the same"))
+    parser.add_argument('--kmer-probe-map-dir',
+        help=("(Optional) Directory in which to save maps of k-mers to "
+              "probes, keyed by the probes and the parameters used to "
+              "construct them. When a map is needed again -- e.g., by "
+              "another filter or by a re-run with the same probes -- it is "
+              "loaded, memory-mapped, from this directory rather than "
+              "constructed. The scan reads the loaded map directly, with "
+              "or without --vectorized-kmer-scan, so processes share it "
+              "through the operating system's page cache"))
+    parser.add_argument('--vectorized-kmer-scan',
+        dest="vectorized_kmer_scan",
+        action="store_true",
+        help=("When finding the probes that cover a sequence, look up all "
+              "k-mers of the sequence at once rather than one k-mer at a "
+              "time. This is generally considerably faster, at the cost of "
+              "an encoded array for each sequence and holding the map of "
+              "k-mers to probes as arrays. The output is the same"))
+    parser.add_argument('--cover-cache-dir',
+        help=("(Optional) Directory in which to cache the ranges that "
+              "probes cover in each target sequence, keyed by the "
+              "sequence and the hybridization parameters. An entry holds "
+              "the covers of every probe already mapped to the sequence, "
+              "identified by its sequence, so later runs with the same "
+              "sequences and parameters read these from the cache and "
+              "only map the probes not yet in it (e.g., candidate probes "
+              "added since an earlier run)"))
+    parser.add_argument('--cover-cache-max-size',
+        type=float,
+        default=4,
+        help=("(Optional) Maximum size, in GB, of the directory given by "
+              "--cover-cache-dir; when it is exceeded, the least recently "
+              "used entries are removed (default: 4)"))
+    parser.add_argument('--genome-index-dir',
+        help=("(Optional) Directory in which to store indexed copies of the "
+              "input FASTA files, keyed by their contents. When set, the "
+              "sequences of target genomes are not all held in memory; "
+              "rather, each is read, memory-mapped, from its index only "
+              "when it is needed. This reduces memory usage considerably "
+              "for datasets with many genomes"))
     parser.add_argument('--ncbi-api-key',
         help=("API key to use for NCBI e-utils. Using this increases the "
               "limit on requests/second and may prevent an IP address "
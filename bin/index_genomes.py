@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Build an index of the k-mers in genomes to avoid in probe design.
+
+The index is built once and can be given, in place of a FASTA file, to
+the --avoid-genomes argument of design.py. Candidate probes are then
+looked up in the index rather than the genomes being scanned in every
+design.
+"""
+
+import argparse
+import logging
+
+from catch.utils import kmer_index
+from catch.utils import log, version
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+logger = logging.getLogger(__name__)
+
+
+def main(args):
+    kmer_index.build(args.fasta, args.output, k=args.k,
+                     num_passes=args.num_passes,
+                     bloom_bits_per_kmer=args.bloom_filter_bits_per_kmer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fasta',
+        nargs='+',
+        help=("Path to one or more FASTA files (possibly gzip-compressed) "
+              "of the genomes to index"))
+    parser.add_argument('-o', '--output',
+        required=True,
+        help=("Path to a directory to create for the index; give this "
+              "path to --avoid-genomes of design.py"))
+    parser.add_argument('-k',
+        type=int,
+        default=20,
+        help=("Length of the k-mers to index (at most 32). To be queried, "
+              "this must match the k-mer length of the map from k-mers to "
+              "probes that design.py uses with the tolerant parameters "
+              "(see --kmer-probe-map-k of design.py); otherwise, design.py "
+              "scans the sequences stored in the index. (Default: 20.)"))
+    parser.add_argument('--num-passes',
+        type=int,
+        default=1,
+        help=("Sort the k-mers in this many passes over the genomes; "
+              "memory use is roughly inversely proportional to this, so "
+              "increase it to index a large genome with limited memory. "
+              "(Default: 1.)"))
+    parser.add_argument('--bloom-filter-bits-per-kmer',
+        type=float,
+        help=("If set, also build a Bloom filter of the k-mers, with "
+              "this many bits per k-mer (e.g., 10 gives a false positive "
+              "rate of about 1%%). It is checked before the sorted k-mers "
+              "are searched, which speeds up queries, especially when "
+              "the index does not fit in memory."))
+    parser.add_argument("--debug",
+                        dest="log_level",
+                        action="store_const",
+                        const=logging.DEBUG,
+                        default=logging.WARNING,
+                        help=("Debug output"))
+    parser.add_argument("--verbose",
+                        dest="log_level",
+                        action="store_const",
+                        const=logging.INFO,
+                        help=("Verbose output"))
+    parser.add_argument('--version', '-V',
+                        action='version',
+                        version=version.get_version())
+    args = parser.parse_args()
+
+    log.configure_logging(args.log_level)
+    main(args)
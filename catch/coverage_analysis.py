@@ -55,7 +55,7 @@ the probes, though this could be generalized to any desired coverage):
 """
 
 from collections import Counter
-from collections import defaultdict
+from collections import deque
 import logging
 
 import numpy as np
@@ -71,6 +71,98 @@ __author__ = 'Hayden Metsky <hayden@mit.edu>'
 logger = logging.getLogger(__name__)
 
 
+def _bp_covered(covers):
+    """Count the number of bp covered by intervals.
+
+    Args:
+        covers: list of intervals (s, e); there may be duplicates
+
+    Returns:
+        number of bp in the union of the intervals
+    """
+    # Make an IntervalSet out of all covers to merge overlapping
+    # ones and make it easy to count the number of bp covered
+    return len(interval.IntervalSet(covers))
+
+
+def _average_coverage(covers, gnm):
+    """Calculate the average coverage/depth provided by intervals in a genome.
+
+    Args:
+        covers: list of intervals (s, e) covered by probes in gnm; there
+            may be duplicates
+        gnm: instance of genome.Genome
+
+    Returns:
+        tuple (average over all bases, average over unambiguous bases)
+    """
+    # Count the total number of bases covered by all the probe
+    # hybridizations
+    # (covers may include duplicates if two probes hybridize to
+    # the same region, so it is important not to convert probes
+    # to an IntervalSet or merge its intervals)
+    total_covered = sum(c[1] - c[0] for c in covers)
+
+    # Divide by the genome length to average across bases
+    # (do this including ambiguous bases ('N') and not including them)
+    avg_covg_over_all = float(total_covered) / gnm.size(False)
+    avg_covg_over_unambig = float(total_covered) / gnm.size(True)
+    return (avg_covg_over_all, avg_covg_over_unambig)
+
+
+def _sliding_coverage(covers, genome_length, window_length, window_stride):
+    """Calculate the average coverage/depth in sliding windows of a genome.
+
+    Rather than counting the depth at every base, this computes the total
+    depth before each window endpoint from cumulative sums over the sorted
+    cover endpoints: the total depth in [0, x) is the sum, over covers
+    (s, e), of min(x, e) - min(x, s).
+
+    Args:
+        covers: list of intervals (s, e) covered by probes in the genome;
+            there may be duplicates
+        genome_length: length of the genome
+        window_length: number of bp in a window
+        window_stride: number of bp by which to step
+
+    Returns:
+        tuple (positions, coverage) of np.arrays such that coverage[w] is
+        the average, across the bases in a window centered at positions[w],
+        of the number of covers that include each base; windows that would
+        stretch past the end of the genome are instead placed to end at
+        the end of the genome
+    """
+    window_starts = np.arange(0, genome_length, window_stride)
+    window_starts = np.minimum(window_starts,
+                               max(0, genome_length - window_length))
+    # Windows moved to end at the end of the genome are all the same
+    window_starts = np.unique(window_starts)
+    window_ends = np.minimum(window_starts + window_length, genome_length)
+
+    covers = np.array(covers, dtype=np.int64).reshape(-1, 2)
+    starts = np.sort(covers[:, 0])
+    ends = np.sort(covers[:, 1])
+    starts_cumsum = np.concatenate(([0], np.cumsum(starts)))
+    ends_cumsum = np.concatenate(([0], np.cumsum(ends)))
+
+    def total_depth_before(x):
+        # For covers with s < x, min(x, s) = s, and otherwise it is x;
+        # likewise for e
+        num_starts_before = np.searchsorted(starts, x)
+        num_ends_before = np.searchsorted(ends, x)
+        sum_min_start = (starts_cumsum[num_starts_before] +
+                         x * (len(starts) - num_starts_before))
+        sum_min_end = (ends_cumsum[num_ends_before] +
+                       x * (len(ends) - num_ends_before))
+        return sum_min_end - sum_min_start
+
+    window_totals = (total_depth_before(window_ends) -
+                     total_depth_before(window_starts))
+    positions = window_starts + window_length / 2
+    coverage = window_totals / (window_ends - window_starts)
+    return positions, coverage
+
+
 class Analyzer:
     """Methods for testing quality control of a probe set.
     """
@@ -202,7 +294,22 @@ class Analyzer:
         it maps to (not counting reverse complements).
         """
         logger.info("Finding probe covers across target genomes")
+        self._open_probe_finding_pool()
 
+        self.target_covers = {}
+        self.probe_map_counts = Counter()
+        for i, j, gnm, rc, gnm_covers in self._iter_covers_in_target_genomes():
+            if i not in self.target_covers:
+                self.target_covers[i] = {}
+            if j not in self.target_covers[i]:
+                self.target_covers[i][j] = {False: None, True: None}
+            self.target_covers[i][j][rc] = gnm_covers
+
+        probe.close_probe_finding_pool()
+
+    def _open_probe_finding_pool(self):
+        """Construct a k-mer to probe map and open a probe finding pool.
+        """
         logger.info("Building map from k-mers to probes")
         # Note that if adapters are added to the probes before this filter
         # is run (which would be typical), then self.lcf_thres will likely
@@ -210,64 +317,92 @@ class Analyzer:
         # be constructed using the random approach (yielding many k-mers
         # and thus a slower runtime in finding probe covers) rather than
         # the pigeonhole approach.
-        kmer_probe_map = probe.SharedKmerProbeMap.construct(
-            probe.construct_kmer_probe_map_to_find_probe_covers(
+        kmer_probe_map = \
+            probe.construct_kmer_probe_map_for_probe_finding_pool(
                 self.probes, self.mismatches, self.lcf_thres,
                 min_k=self.kmer_probe_map_k, k=self.kmer_probe_map_k)
-        )
         probe.open_probe_finding_pool(kmer_probe_map,
-                                      self.cover_range_fn)
+                                      self.cover_range_fn,
+                                      canonical_kmers=self.rc_too,
+                                      use_bloom_filter=True)
+
+    def _iter_covers_in_target_genomes(self):
+        """Find intervals in each target genome covered by the probe set.
+
+        A probe finding pool must be open. The sequences of all target
+        genomes are scanned together with
+        probe.find_probe_covers_in_sequences(), which, for short genomes,
+        gives each process many whole genomes to scan at a time. When
+        self.rc_too is True, the covers in the reverse complement of a
+        genome are found in the same scan as those in the genome. This
+        also counts, in self.probe_map_counts, the sequences that each
+        probe maps to (not counting reverse complements).
 
-        self.target_covers = {}
-        self.probe_map_counts = Counter()
-        for i, j, gnm, rc in self._iter_target_genomes():
-            if not rc:
-                logger.info(("Computing coverage in grouping %d (of %d), "
-                             "with target genome %d (of %d)"), i + 1,
-                            len(self.target_genomes), j + 1,
-                            len(self.target_genomes[i]))
-            if i not in self.target_covers:
-                self.target_covers[i] = {}
-            if j not in self.target_covers[i]:
-                self.target_covers[i][j] = {False: None, True: None}
-
-            gnm_covers = []
+        Yields:
+            i, j, gnm, rc, covers
+                - i, j, gnm, rc are as yielded by _iter_target_genomes()
+                - covers is a list of all the intervals covered by the
+                  probes in gnm (see _find_covers_in_target_genomes() for
+                  details)
+        """
+        # Track, in order, the genomes whose sequences have been given to
+        # the scan and how many sequences each has
+        genomes_scanned = deque()
+        def sequences():
+            for i, genomes_from_group in enumerate(self.target_genomes):
+                for j, gnm in enumerate(genomes_from_group):
+                    gnm_seqs = gnm.seqs
+                    genomes_scanned.append((i, j, gnm,
+                                            [len(s) for s in gnm_seqs]))
+                    yield from gnm_seqs
+
+        # Find probe cover ranges, while allowing the ranges to overlap
+        # (e.g., if one probe covers two regions that overlap); each
+        # iteration takes the ranges in the first sequence of a genome,
+        # and those in the genome's other sequences are taken with next()
+        all_probe_cover_ranges = probe.find_probe_covers_in_sequences(
+            sequences(), merge_overlapping=False, rc_too=self.rc_too)
+        for probe_cover_ranges in all_probe_cover_ranges:
+            i, j, gnm, seq_lens = genomes_scanned.popleft()
+            logger.info(("Computing coverage in grouping %d (of %d), "
+                         "with target genome %d (of %d)"), i + 1,
+                        len(self.target_genomes), j + 1,
+                        len(self.target_genomes[i]))
+
+            gnm_covers = {False: [], True: []}
             length_so_far = 0
-            for sequence in gnm.seqs:
-                if rc:
-                    # Take the reverse complement of sequence
-                    rc_map = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
-                    sequence = ''.join([rc_map.get(b, b)
-                                       for b in sequence[::-1]])
-
-                # Find cover ranges of the probes, while allowing the ranges
-                # to overlap (e.g., if one probe covers two regions that
-                # overlap)
-                probe_cover_ranges = probe.find_probe_covers_in_sequence(
-                    sequence,
-                    merge_overlapping=False)
-                for p, cover_ranges in probe_cover_ranges.items():
-                    if not rc:
-                        self.probe_map_counts[p] += 1
-
-                    for cover_range in cover_ranges:
-                        # Extend the range covered by probe p on both sides
-                        # by self.cover_extension
-                        cover_start = max(0,
-                            cover_range[0] - self.cover_extension)
-                        cover_end = min(len(sequence),
-                            cover_range[1] + self.cover_extension)
-                        # The endpoints of the cover give positions in just
-                        # this sequence (chromosome), so adjust them (according
-                        # to length_so_far) to give a unique integer position
-                        # in the genome gnm
-                        adjusted_cover = (cover_start + length_so_far,
-                                          cover_end + length_so_far)
-                        gnm_covers += [adjusted_cover]
-                length_so_far += len(sequence)
-            self.target_covers[i][j][rc] = gnm_covers
-
-        probe.close_probe_finding_pool()
+            for seq_idx, seq_len in enumerate(seq_lens):
+                if seq_idx > 0:
+                    probe_cover_ranges = next(all_probe_cover_ranges)
+                if self.rc_too:
+                    # The second element gives ranges in the reverse
+                    # complement of the sequence
+                    strands = zip([False, True], probe_cover_ranges)
+                else:
+                    strands = [(False, probe_cover_ranges)]
+                for rc, strand_probe_cover_ranges in strands:
+                    for p, cover_ranges in strand_probe_cover_ranges.items():
+                        if not rc:
+                            self.probe_map_counts[p] += 1
+
+                        for cover_range in cover_ranges:
+                            # Extend the range covered by probe p on both
+                            # sides by self.cover_extension
+                            cover_start = max(0,
+                                cover_range[0] - self.cover_extension)
+                            cover_end = min(seq_len,
+                                cover_range[1] + self.cover_extension)
+                            # The endpoints of the cover give positions in
+                            # just this sequence (chromosome), so adjust
+                            # them (according to length_so_far) to give a
+                            # unique integer position in the genome gnm
+                            adjusted_cover = (cover_start + length_so_far,
+                                              cover_end + length_so_far)
+                            gnm_covers[rc] += [adjusted_cover]
+                length_so_far += seq_len
+            yield i, j, gnm, False, gnm_covers[False]
+            if self.rc_too:
+                yield i, j, gnm, True, gnm_covers[True]
 
     def _compute_bp_covered_in_target_genomes(self):
         """Count number of bp covered by probes in each target genome.
@@ -289,11 +424,7 @@ class Analyzer:
             if j not in self.bp_covered[i]:
                 self.bp_covered[i][j] = {False: None, True: None}
             covers = self.target_covers[i][j][rc]
-
-            # Make an IntervalSet out of all covers to merge overlapping
-            # ones and make it easy to count the number of bp covered
-            covers_set = interval.IntervalSet(covers)
-            self.bp_covered[i][j][rc] = len(covers_set)
+            self.bp_covered[i][j][rc] = _bp_covered(covers)
 
     def _compute_average_coverage_in_target_genomes(self):
         """Calculate the average coverage/depth in each target genome.
@@ -319,20 +450,7 @@ class Analyzer:
             if j not in self.average_coverage[i]:
                 self.average_coverage[i][j] = {False: None, True: None}
             covers = self.target_covers[i][j][rc]
-
-            # Count the total number of bases covered by all the probe
-            # hybridizations
-            # (covers may include duplicates if two probes hybridize to
-            # the same region, so it is important not to convert probes
-            # to an IntervalSet or merge its intervals)
-            total_covered = sum(c[1] - c[0] for c in covers)
-
-            # Divide by the genome length to average across bases
-            # (do this including ambiguous bases ('N') and not including them)
-            avg_covg_over_all = float(total_covered) / gnm.size(False)
-            avg_covg_over_unambig = float(total_covered) / gnm.size(True)
-            self.average_coverage[i][j][rc] = (avg_covg_over_all,
-                                               avg_covg_over_unambig)
+            self.average_coverage[i][j][rc] = _average_coverage(covers, gnm)
 
     def _compute_sliding_coverage_in_target_genomes(self,
                                                     window_length,
@@ -343,11 +461,12 @@ class Analyzer:
         so that self.target_covers can be accessed.
 
         This saves a dict, self.sliding_coverage, as follows:
-        self.sliding_coverage[i][j][b] gives a dict D provided by the probes
-        in genome j of target genome grouping i (in the reverse complement
-        of j if b is True, and in the provided sequence if b is False).
-        D is a dict mapping a position p of a target genome to the average
-        coverage/depth provided by the probes in a window centered at p.
+        self.sliding_coverage[i][j][b] gives a tuple (positions, coverage)
+        for the probes in genome j of target genome grouping i (in the
+        reverse complement of j if b is True, and in the provided sequence
+        if b is False). positions and coverage are np.arrays such that
+        coverage[w] is the average coverage/depth provided by the probes in
+        a window centered at positions[w].
 
         The value is the average, taken across the bases in the window, of
         the number of probes that hybridize to a region that includes each base
@@ -364,54 +483,8 @@ class Analyzer:
                 self.sliding_coverage[i][j] = {False: None, True: None}
             covers = self.target_covers[i][j][rc]
 
-            # Build a dict mapping endpoints to a list of False/True
-            # values, where False indicates the endpoint is an end of
-            # a probe and True indicates the endpoint is a start of a
-            # probe
-            endpoints = defaultdict(list)
-            for c in covers:
-                endpoints[c[0]].append(True)
-                endpoints[c[1]].append(False)
-
-            # Store, at each base in gnm, the number of probes that cover
-            # a region including the base
-            probe_counts = np.zeros(gnm.size(False), dtype='uint16')
-            curr_count = 0
-            prev_endpoint = None
-            for endpoint in sorted(endpoints.keys()):
-                if prev_endpoint != None:
-                    # Update number of probes between prev_endpoint and
-                    # endpoint
-                    for pos in range(prev_endpoint, endpoint):
-                        probe_counts[pos] = curr_count
-                # Compute the net change in number of probe covers at
-                # this endpoint, which will last until the next endpoint
-                endpoint_types = endpoints[endpoint]
-                net_change = sum([1 if t == True else -1
-                                  for t in endpoint_types])
-                curr_count += net_change
-                prev_endpoint = endpoint
-            # Don't bother updating counts between prev_endpoint and the end of
-            # the genome because all probes should have been ended, so
-            # curr_count should equal 0
-            # (also, if probes cover the very end of the genome, prev_endpoint
-            # might equal the end of the genome)
-
-            # Slide over windows and fill in the dict gnm_sliding_coverage
-            gnm_sliding_coverage = {}
-            for window_start in np.arange(0, gnm.size(False), window_stride):
-                window_end = window_start + window_length
-                if window_end > gnm.size(False):
-                    # This window stretches past the end of the genome, so
-                    # make a new one that goes up to the very end
-                    window_end = gnm.size(False)
-                    window_start = window_end - window_length
-                middle = window_start + (window_length / 2)
-                window_average_count = np.average(
-                    probe_counts[window_start:window_end])
-                gnm_sliding_coverage[middle] = window_average_count
-
-            self.sliding_coverage[i][j][rc] = gnm_sliding_coverage
+            self.sliding_coverage[i][j][rc] = _sliding_coverage(covers,
+                gnm.size(False), window_length, window_stride)
 
     def run(self, window_length=50, window_stride=25):
         """Run all analysis methods.
@@ -430,6 +503,128 @@ class Analyzer:
         self._compute_sliding_coverage_in_target_genomes(
             window_length, window_stride)
 
+    def run_streaming(self, analysis_tsv_fn=None,
+                      sliding_window_coverage_fn=None,
+                      window_length=50, window_stride=25):
+        """Run all analysis methods, one target genome at a time.
+
+        Unlike run(), this does not store the covers in all target genomes.
+        For each target genome (and its reverse complement), it finds the
+        covers, computes all metrics, appends rows to the output files, and
+        then discards the covers; so memory usage is bounded by the covers
+        in one genome. self.bp_covered and self.average_coverage are saved
+        as with run(), but self.target_covers and self.sliding_coverage are
+        not.
+
+        Args:
+            analysis_tsv_fn: if set, path to which to write the output of
+                write_data_matrix_as_tsv()
+            sliding_window_coverage_fn: if set, path to which to write the
+                output of write_sliding_window_coverage()
+            window_length: number of bp in a window (for use in computing
+                coverage over sliding windows)
+            window_stride: number of bp by which to step (for use in computing
+                coverage over sliding windows)
+        """
+        analysis_tsv_f, sliding_f = None, None
+        if analysis_tsv_fn is not None:
+            analysis_tsv_f = open(analysis_tsv_fn, 'w')
+            analysis_tsv_f.write(
+                '\t'.join(self._data_matrix_header()) + '\n')
+        if sliding_window_coverage_fn is not None:
+            sliding_f = open(sliding_window_coverage_fn, 'w')
+
+        logger.info("Finding probe covers and computing coverage across "
+                    "target genomes")
+        self._open_probe_finding_pool()
+
+        self.probe_map_counts = Counter()
+        self.bp_covered = {}
+        self.average_coverage = {}
+        try:
+            for i, j, gnm, rc, covers in \
+                    self._iter_covers_in_target_genomes():
+                if i not in self.bp_covered:
+                    self.bp_covered[i] = {}
+                    self.average_coverage[i] = {}
+                if j not in self.bp_covered[i]:
+                    self.bp_covered[i][j] = {False: None, True: None}
+                    self.average_coverage[i][j] = {False: None, True: None}
+
+                self.bp_covered[i][j][rc] = _bp_covered(covers)
+                self.average_coverage[i][j][rc] = _average_coverage(covers,
+                                                                    gnm)
+                if analysis_tsv_f is not None:
+                    row = self._data_matrix_row(i, j, gnm, rc)
+                    analysis_tsv_f.write(
+                        '\t'.join([str(entry) for entry in row]) + '\n')
+                if sliding_f is not None:
+                    positions, coverage = _sliding_coverage(covers,
+                        gnm.size(False), window_length, window_stride)
+                    sliding_f.write(self._sliding_coverage_lines(i, j, rc,
+                        positions, coverage))
+                del covers
+        finally:
+            probe.close_probe_finding_pool()
+            if analysis_tsv_f is not None:
+                analysis_tsv_f.close()
+            if sliding_f is not None:
+                sliding_f.close()
+
+    def _genome_name(self, i, j, rc):
+        """Make a name for a target genome to use in output.
+
+        Args:
+            i: index of a target genome grouping
+            j: index of a genome in grouping i
+            rc: True iff the name is for the reverse complement
+
+        Returns:
+            name of genome j in grouping i
+        """
+        name = "%s, genome %d" % (self.target_genomes_names[i], j)
+        if rc:
+            name += " (rc)"
+        return name
+
+    def _data_matrix_header(self):
+        """Return the header of the data matrix written as a TSV.
+
+        Returns:
+            list of column names
+        """
+        return ["Genome",
+                "Num bases covered",
+                "Frac bases covered",
+                "Frac bases covered over unambig",
+                "Average coverage/depth",
+                "Average coverage/depth over unambig"]
+
+    def _data_matrix_row(self, i, j, gnm, rc):
+        """Return a row of the data matrix written as a TSV.
+
+        self.bp_covered and self.average_coverage must contain values for
+        the genome.
+
+        Args:
+            i, j, gnm, rc: as yielded by self._iter_target_genomes()
+
+        Returns:
+            list of values in the row for genome j in grouping i
+        """
+        bp_covered = self.bp_covered[i][j][rc]
+        frac_covered_all = float(bp_covered) / gnm.size(False)
+        frac_covered_unambig = float(bp_covered) / gnm.size(True)
+
+        avg_covg_all, avg_covg_unambig = self.average_coverage[i][j][rc]
+
+        return [self._genome_name(i, j, rc),
+                bp_covered,
+                frac_covered_all,
+                frac_covered_unambig,
+                avg_covg_all,
+                avg_covg_unambig]
+
     def write_data_matrix_as_tsv(self, fn):
         """Write 2D array representing results as a TSV file.
 
@@ -437,32 +632,11 @@ class Analyzer:
             fn: path to file to write to
         """
         # Make row headers
-        data = [["Genome",
-                 "Num bases covered",
-                 "Frac bases covered",
-                 "Frac bases covered over unambig",
-                 "Average coverage/depth",
-                 "Average coverage/depth over unambig"]]
+        data = [self._data_matrix_header()]
 
         # Create a row for every genome, including reverse complements
         for i, j, gnm, rc in self._iter_target_genomes():
-            col_header = "%s, genome %d" % (self.target_genomes_names[i], j)
-            if rc:
-                col_header += " (rc)"
-
-            bp_covered = self.bp_covered[i][j][rc]
-            frac_covered_all = float(bp_covered) / gnm.size(False)
-            frac_covered_unambig = float(bp_covered) / gnm.size(True)
-
-            avg_covg_all, avg_covg_unambig = self.average_coverage[i][j][rc]
-
-            row = [col_header,
-                   bp_covered,
-                   frac_covered_all,
-                   frac_covered_unambig,
-                   avg_covg_all,
-                   avg_covg_unambig]
-            data += [row]
+            data += [self._data_matrix_row(i, j, gnm, rc)]
 
         # Write to fn as a TSV
         with open(fn, 'w') as f:
@@ -484,9 +658,7 @@ class Analyzer:
 
         # Create a row for every genome, including reverse complements
         for i, j, gnm, rc in self._iter_target_genomes():
-            col_header = "%s, genome %d" % (self.target_genomes_names[i], j)
-            if rc:
-                col_header += " (rc)"
+            col_header = self._genome_name(i, j, rc)
 
             # Format bp covered
             bp_covered = self.bp_covered[i][j][rc]
@@ -542,14 +714,24 @@ class Analyzer:
         with open(fn, 'w') as f:
             # Create an entry for every genome, including reverse complements
             for i, j, gnm, rc in self._iter_target_genomes():
-                header = "%s, genome %d" % (self.target_genomes_names[i], j)
-                if rc:
-                    header += " (rc)"
-                gnm_sliding_coverage = self.sliding_coverage[i][j][rc]
-                for pos in sorted(gnm_sliding_coverage.keys()):
-                    covg = gnm_sliding_coverage[pos]
-                    line = '\t'.join([str(x) for x in [header, pos, covg]])
-                    f.write(line + '\n')
+                positions, coverage = self.sliding_coverage[i][j][rc]
+                f.write(self._sliding_coverage_lines(i, j, rc, positions,
+                                                     coverage))
+
+    def _sliding_coverage_lines(self, i, j, rc, positions, coverage):
+        """Format coverage in sliding windows of a genome for output.
+
+        Args:
+            i, j, rc: as yielded by self._iter_target_genomes()
+            positions, coverage: output of _sliding_coverage() for the genome
+
+        Returns:
+            string with one line per window
+        """
+        header = self._genome_name(i, j, rc)
+        return ''.join(['%s\t%s\t%s\n' % (header, pos, covg)
+                        for pos, covg in zip(positions.tolist(),
+                                             coverage.tolist())])
 
     def write_probe_map_counts(self, fn):
         """Write number of sequences mapped by each probe to a file.
@@ -309,16 +309,16 @@ class AdapterFilter(BaseFilter):
             the number of 'B' adapter votes.
         """
         logger.info("Building map from k-mers to probes")
-        kmer_probe_map = probe.SharedKmerProbeMap.construct(
-            probe.construct_kmer_probe_map_to_find_probe_covers(
+        kmer_probe_map = \
+            probe.construct_kmer_probe_map_for_probe_finding_pool(
                 probes,
                 self.mismatches,
                 self.lcf_thres,
                 min_k=self.kmer_probe_map_k,
                 k=self.kmer_probe_map_k)
-        )
         probe.open_probe_finding_pool(kmer_probe_map,
-                                      self.cover_range_fn)
+                                      self.cover_range_fn,
+                                      use_bloom_filter=True)
 
         def iter_all_seqs():
             for genomes_from_group in target_genomes:
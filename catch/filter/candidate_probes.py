@@ -4,20 +4,197 @@ These functions compute lists of many (likely redundant) probes, termed
 candidate probes, from a sequence of list of sequences.
 """
 
+from collections import OrderedDict
 import logging
-import re
 import sys
 
 import numpy as np
 
 from catch import probe
+from catch.utils import fingerprint
 from catch.utils import seq_io
+from catch.utils import twobit
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
 logger = logging.getLogger(__name__)
 
 
+def _n_string_windows(seq_bytes, min_n_string_length):
+    """Find strings of N's in a sequence.
+
+    Args:
+        seq_bytes: sequence as bytes
+        min_n_string_length: minimum length of a string of N's
+
+    Returns:
+        tuple (run_starts, run_ends, ends_n_string) where run_starts and
+        run_ends are np.arrays giving the [start, end) of each maximal
+        string of min_n_string_length or more N's in seq_bytes, in order,
+        and ends_n_string is an np.array such that the number of strings of
+        min_n_string_length N's (possibly overlapping) that end before
+        position i is ends_n_string[i]
+    """
+    is_n = np.frombuffer(seq_bytes, dtype=np.uint8) == ord('N')
+
+    # Find the start and end of each maximal run of N's
+    padded = np.zeros(len(is_n) + 2, dtype=np.int8)
+    padded[1:-1] = is_n
+    changes = np.diff(padded)
+    run_starts = np.flatnonzero(changes == 1)
+    run_ends = np.flatnonzero(changes == -1)
+    is_long = (run_ends - run_starts) >= min_n_string_length
+    run_starts = run_starts[is_long]
+    run_ends = run_ends[is_long]
+
+    # Count, with a cumulative sum, the N's up to each position; a
+    # string of min_n_string_length N's ends at position i (exclusive)
+    # iff there are min_n_string_length N's in [i - min_n_string_length, i)
+    n_cumsum = np.zeros(len(is_n) + 1, dtype=np.int64)
+    np.cumsum(is_n, out=n_cumsum[1:])
+    ends_here = np.zeros(len(is_n) + 1, dtype=np.int64)
+    if min_n_string_length <= len(is_n):
+        ends_here[min_n_string_length:] = (
+            (n_cumsum[min_n_string_length:] -
+             n_cumsum[:len(n_cumsum) - min_n_string_length]) ==
+            min_n_string_length)
+    ends_n_string = np.cumsum(ends_here)
+    return (run_starts, run_ends, ends_n_string)
+
+
+def candidate_probe_windows(seq,
+                            probe_length,
+                            probe_stride,
+                            min_n_string_length=2):
+    """Find the positions of candidate probes in a sequence.
+
+    This computes, with vectorized operations rather than by building
+    each probe, the windows of seq that make_candidate_probes_from_sequence()
+    would output as candidate probes.
+
+    Args:
+        seq: sequence as a string, bytes, or np.array, which must be at
+            least probe_length long
+        probe_length: number of bp in a candidate probe
+        probe_stride: candidate probes are separated by this number of bp
+        min_n_string_length: windows that would contain strings of this
+            number or more N's are discarded and, instead, windows
+            flanking the string are added
+
+    Returns:
+        tuple (starts, is_flanking_n_string) of np.arrays such that
+        seq[starts[i]:(starts[i] + probe_length)] is a candidate probe,
+        and is_flanking_n_string[i] is True iff that probe flanks a
+        string of N's; the windows are in the same order as the probes
+        output by make_candidate_probes_from_sequence()
+    """
+    seq_bytes = twobit.to_bytes_array(seq).tobytes()
+    seq_len = len(seq_bytes)
+    if seq_len < probe_length:
+        raise ValueError("Sequence is smaller than the probe length")
+
+    run_starts, run_ends, ends_n_string = _n_string_windows(
+        seq_bytes, min_n_string_length)
+
+    # Windows at every probe_stride bp, plus a window at the end if there
+    # are bases on the right that would never be covered
+    stride_starts = np.arange(0, seq_len - probe_length + 1, probe_stride,
+                              dtype=np.int64)
+    if seq_len % probe_stride != 0:
+        stride_starts = np.append(stride_starts, seq_len - probe_length)
+
+    # Windows to the left and to the right of each string of N's, in
+    # the order: left of the first string, right of the first string,
+    # left of the second string, etc.
+    flank_starts = np.column_stack(
+        (run_starts - probe_length, run_ends)).ravel()
+    flank_is_valid = np.column_stack(
+        (run_starts - probe_length >= 0,
+         run_ends + probe_length <= seq_len)).ravel()
+    flank_starts = flank_starts[flank_is_valid].astype(np.int64)
+
+    starts = np.concatenate((stride_starts, flank_starts))
+    is_flanking_n_string = np.zeros(len(starts), dtype=bool)
+    is_flanking_n_string[len(stride_starts):] = True
+
+    # Discard windows that contain a string of min_n_string_length N's;
+    # such a string is in [start, start + probe_length) iff it ends in
+    # (start + min_n_string_length - 1, start + probe_length]
+    if min_n_string_length <= probe_length:
+        num_n_strings = (ends_n_string[starts + probe_length] -
+                         ends_n_string[starts + min_n_string_length - 1])
+        has_no_n_string = num_n_strings == 0
+        starts = starts[has_no_n_string]
+        is_flanking_n_string = is_flanking_n_string[has_no_n_string]
+
+    return (starts, is_flanking_n_string)
+
+
+def _candidate_probe_windows_with_small_seqs(seq_bytes,
+                                             probe_length,
+                                             probe_stride,
+                                             min_n_string_length=2,
+                                             allow_small_seqs=None):
+    """Find the windows of candidate probes, allowing small sequences.
+
+    Args:
+        seq_bytes: sequence as bytes
+        probe_length/probe_stride/min_n_string_length/allow_small_seqs:
+            see make_candidate_probes_from_sequence()
+
+    Returns:
+        tuple (starts, lengths, is_flanking_n_string) of np.arrays such
+        that seq_bytes[starts[i]:(starts[i] + lengths[i])] is a candidate
+        probe, in the order output by make_candidate_probes_from_sequence()
+    """
+    if len(seq_bytes) < probe_length:
+        if allow_small_seqs:
+            if len(seq_bytes) < allow_small_seqs:
+                raise ValueError(("Allowing sequences smaller than the probe "
+                                  "length (" + str(probe_length) + "), but "
+                                  "input sequence is smaller than minimum "
+                                  "allowed length"))
+            else:
+                if b'N' * min_n_string_length in seq_bytes:
+                    raise Exception(("Only possible probe from input "
+                                     "sequence has too long a stretch of N's"))
+                else:
+                    # Make a probe equal to this sequence
+                    return (np.zeros(1, dtype=np.int64),
+                            np.full(1, len(seq_bytes), dtype=np.int64),
+                            np.zeros(1, dtype=bool))
+        else:
+            raise ValueError(("An input sequence is smaller than the probe "
+                              "length (" + str(probe_length) + "); try "
+                              "setting --small-seq-skip"))
+
+    starts, is_flanking_n_string = candidate_probe_windows(
+        seq_bytes, probe_length, probe_stride,
+        min_n_string_length=min_n_string_length)
+    lengths = np.full(len(starts), probe_length, dtype=np.int64)
+    return (starts, lengths, is_flanking_n_string)
+
+
+def _probes_from_windows(seq_bytes, starts, lengths, is_flanking_n_string):
+    """Build a probe.Probe for each window of a sequence.
+
+    Args:
+        seq_bytes: sequence as bytes
+        starts/lengths/is_flanking_n_string: np.arrays as output by
+            _candidate_probe_windows_with_small_seqs()
+
+    Returns:
+        list of instances of probe.Probe
+    """
+    probes = []
+    for start, length, is_flanking in zip(starts.tolist(), lengths.tolist(),
+                                          is_flanking_n_string.tolist()):
+        p = probe.Probe(seq_bytes[start:(start + length)])
+        p.is_flanking_n_string = is_flanking
+        probes += [p]
+    return probes
+
+
 def make_candidate_probes_from_sequence(seq,
                                         probe_length,
                                         probe_stride,
@@ -44,84 +221,16 @@ def make_candidate_probes_from_sequence(seq,
     Returns:
         list of candidate probes as instances of probe.Probe
     """
-    n_string_query = re.compile('(N{' + str(min_n_string_length) + ',})')
-
-    if len(seq) < probe_length:
-        if allow_small_seqs:
-            if len(seq) < allow_small_seqs:
-                raise ValueError(("Allowing sequences smaller than the probe "
-                                  "length (" + str(probe_length) + "), but "
-                                  "input sequence is smaller than minimum "
-                                  "allowed length"))
-            else:
-                if n_string_query.search(seq):
-                    raise Exception(("Only possible probe from input "
-                                     "sequence has too long a stretch of N's"))
-                else:
-                    # Make a probe equal to this sequence
-                    return [probe.Probe.from_str(seq)]
-        else:
-            raise ValueError(("An input sequence is smaller than the probe "
-                              "length (" + str(probe_length) + "); try "
-                              "setting --small-seq-skip"))
-
-    if isinstance(seq, np.ndarray):
-        seq = ''.join(seq)
-
-    # Make a probe based on the subsequence seq[start:end].
-    # Namely, if that subsequence contains no string of N's, then it
-    # is a probe to be added and the probe is returned in a single-
-    # valued list. Otherwise, an empty list is returned.
-    def add_probe_from_subsequence(start, end,
-                                   is_flanking_n_string=False):
-        subseq = seq[start:end]
-        probes = []
-
-        # Search for strings of min_n_string_length or more N's in subseq
-        # and only add a probe if there is not such a string
-        if not n_string_query.search(subseq):
-            # There's no string of N's, so this subsequence is a valid
-            # probe
-            probes += [subseq]
-
-        # Convert the probes from a Python list of Python strings to a
-        # list of probe.Probe
-        probes = [probe.Probe.from_str(p) for p in probes]
-        for p in probes:
-            p.is_flanking_n_string = is_flanking_n_string
-
-        return probes
-
-    # Populate a list of probes
-    probes = []
-    for start in np.arange(0, len(seq), probe_stride):
-        if start + probe_length > len(seq):
-            break
-        probes += add_probe_from_subsequence(start, start + probe_length)
-
-    if len(seq) % probe_stride != 0:
-        # There are bases on the right that were never covered, so add
-        # another probe for this
-        probes += add_probe_from_subsequence(len(seq) - probe_length,
-                                             len(seq))
-
-    # Add probes flanking each string of N's. Specifically, add a probe
-    # to the left of a string and to the right. The called function
-    # must check that the flanking probe does not contain a string of
-    # N's before adding. (Don't recursively chase flanking probes.)
-    for match in n_string_query.finditer(seq):
-        if match.start() - probe_length >= 0:
-            # Add the left flanking probe for match
-            probes += add_probe_from_subsequence(match.start() - probe_length,
-                                                 match.start(),
-                                                 is_flanking_n_string=True)
-        if match.end() + probe_length <= len(seq):
-            # Add the right flanking probe for match
-            probes += add_probe_from_subsequence(match.end(),
-                                                 match.end() + probe_length,
-                                                 is_flanking_n_string=True)
+    seq_bytes = twobit.to_bytes_array(seq).tobytes()
+    starts, lengths, is_flanking_n_string = \
+        _candidate_probe_windows_with_small_seqs(
+            seq_bytes, probe_length, probe_stride,
+            min_n_string_length=min_n_string_length,
+            allow_small_seqs=allow_small_seqs)
 
-    return probes
+    # Only now build a probe.Probe for each window
+    return _probes_from_windows(seq_bytes, starts, lengths,
+                                is_flanking_n_string)
 
 
 def make_candidate_probes_from_sequences(
@@ -180,3 +289,101 @@ def make_candidate_probes_from_sequences(
             allow_small_seqs=allow_small_seqs)
 
     return probes
+
+
+def make_unique_candidate_probes_from_genomes(
+        genomes,
+        probe_length,
+        probe_stride,
+        min_n_string_length=2,
+        allow_small_seqs=None,
+        seq_length_to_skip=None):
+    """Generate a list of distinct candidate probes from genomes.
+
+    This gives the same output as generating the candidate probes of each
+    genome's sequences (with make_candidate_probes_from_sequences()) and
+    then passing them all through filter.DuplicateFilter, which keeps the
+    first occurrence of each distinct probe. But a probe.Probe is only
+    built for each distinct candidate probe. The windows of the candidate
+    probes are first found in each sequence and fingerprinted (see
+    catch.utils.fingerprint) directly from the sequence; the first
+    occurrence of each fingerprint is then found, and a second pass over
+    the sequences builds probes for those windows and checks that each
+    other window is identical to the probe with its fingerprint.
+
+    The sequences of the genomes are read twice, one genome at a time,
+    so genomes whose sequences are read only when needed (e.g.,
+    genome.LazyGenome) are not all held in memory.
+
+    Args:
+        genomes: list of genome.Genome
+        probe_length/probe_stride/min_n_string_length/allow_small_seqs/
+            seq_length_to_skip: see make_candidate_probes_from_sequences()
+
+    Returns:
+        list of candidate probes as instances of probe.Probe
+    """
+    def windows_of_seqs(log_skipped):
+        # Yield, for each sequence to use, its bytes and windows
+        for g in genomes:
+            for seq in g.seqs:
+                if (seq_length_to_skip is not None and
+                        len(seq) <= seq_length_to_skip):
+                    if log_skipped:
+                        logger.info(("Not designing candidate probes for a "
+                            "sequence with length %d, since it is <= %d"),
+                            len(seq), seq_length_to_skip)
+                    continue
+                seq_bytes = twobit.to_bytes_array(seq).tobytes()
+                yield (seq_bytes, _candidate_probe_windows_with_small_seqs(
+                    seq_bytes, probe_length, probe_stride,
+                    min_n_string_length=min_n_string_length,
+                    allow_small_seqs=allow_small_seqs))
+
+    # Fingerprint every window, in order across the sequences; windows are
+    # at most probe_length long, so the fingerprints are comparable
+    fingerprints = []
+    for seq_bytes, (starts, lengths, _) in windows_of_seqs(True):
+        fingerprints += [fingerprint.fingerprint_windows(
+            np.frombuffer(seq_bytes, dtype=np.uint8), starts, lengths,
+            max_length=probe_length)]
+    if len(fingerprints) == 0:
+        return []
+    first = fingerprint.first_occurrences(np.concatenate(fingerprints))
+    num_windows = len(first)
+    del fingerprints
+
+    # The first occurrences, in order, are the windows to build probes
+    # for; the probe of the window with index first_ind[j] is probes[j]
+    first_ind = np.flatnonzero(first == np.arange(num_windows))
+    probes = []
+    offset = 0
+    for seq_bytes, (starts, lengths, is_flanking_n_string) in \
+            windows_of_seqs(False):
+        seq_first = first[offset:(offset + len(starts))]
+        is_first = seq_first == np.arange(offset, offset + len(starts))
+        offset += len(starts)
+        probes += _probes_from_windows(seq_bytes, starts[is_first],
+                                       lengths[is_first],
+                                       is_flanking_n_string[is_first])
+
+        # Check that each other window is identical to the (already
+        # built) probe of the first window with its fingerprint
+        probe_ind = np.searchsorted(first_ind, seq_first[~is_first])
+        for start, length, j in zip(starts[~is_first].tolist(),
+                                    lengths[~is_first].tolist(),
+                                    probe_ind.tolist()):
+            if seq_bytes[start:(start + length)] != probes[j].seq_bytes:
+                # Two different windows have the same fingerprint; fall
+                # back to building every probe and removing duplicates
+                # with a dict
+                logger.debug(("Fingerprints of candidate probes collide; "
+                              "removing duplicates with a dict"))
+                all_probes = []
+                for seq_bytes, windows in windows_of_seqs(False):
+                    all_probes += _probes_from_windows(seq_bytes, *windows)
+                return list(OrderedDict.fromkeys(all_probes))
+
+    logger.debug(("Found %d distinct candidate probes among %d windows"),
+                 len(probes), num_windows)
+    return probes
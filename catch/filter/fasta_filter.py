@@ -8,13 +8,68 @@ the order of the sequences in the FASTA file; i.e., the input
 probes are re-arranged to match their order in the file.
 """
 
-from collections import OrderedDict
+import logging
+
+import numpy as np
 
 from catch.filter.base_filter import BaseFilter
+from catch.utils import fingerprint
 from catch.utils import seq_io
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
+logger = logging.getLogger(__name__)
+
+
+def _position_of_probes_in_seqs(seqs, seqs_pos, probes):
+    """Find where probes are among sequences, using fingerprints.
+
+    The sequences and probes are fingerprinted together (see
+    catch.utils.fingerprint), so that each probe is matched to the first
+    sequence with its fingerprint. Matches are verified, and if two
+    different sequences have the same fingerprint this falls back to a
+    dict.
+
+    Args:
+        seqs: list of sequences (as bytes)
+        seqs_pos: list giving the position of each sequence in seqs
+        probes: list of probe.Probe
+
+    Returns:
+        np.int64 array giving, for each probe, the position of a sequence
+        equal to it (the largest, if there are more than one), or -1 if
+        there is none
+    """
+    # Sequences longer than every probe cannot be equal to one, and
+    # would make the rows that are fingerprinted wide
+    max_probe_len = max((len(p.seq_bytes) for p in probes), default=0)
+    keep = [i for i, seq in enumerate(seqs) if len(seq) <= max_probe_len]
+    seqs = [seqs[i] for i in keep]
+    seqs_pos = np.array([seqs_pos[i] for i in keep], dtype=np.int64)
+
+    all_seqs = seqs + [p.seq_bytes for p in probes]
+    lengths = np.array([len(s) for s in all_seqs], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    buf = np.frombuffer(b''.join(all_seqs), dtype=np.uint8)
+    first = fingerprint.first_occurrences(
+        fingerprint.fingerprint_windows(buf, starts, lengths))
+
+    if all(all_seqs[i] == all_seqs[j]
+           for i, j in enumerate(first.tolist()) if i != j):
+        # The sequences come first, so a probe equal to one of them is
+        # matched to it
+        pos_by_first = np.full(len(all_seqs), -1, dtype=np.int64)
+        np.maximum.at(pos_by_first, first[:len(seqs)], seqs_pos)
+        return pos_by_first[first[len(seqs):]]
+
+    logger.debug(("Fingerprints of sequences collide; matching probes "
+                  "with a dict"))
+    pos_by_seq = {}
+    for seq, pos in zip(seqs, seqs_pos.tolist()):
+        pos_by_seq[seq] = pos
+    return np.array([pos_by_seq.get(p.seq_bytes, -1) for p in probes],
+                    dtype=np.int64)
+
 
 class FastaFilter(BaseFilter):
     """Filter that selects only probes equal to a sequence in a FASTA file.
@@ -38,28 +93,24 @@ class FastaFilter(BaseFilter):
         # Read the FASTA file
         fasta = seq_io.read_fasta(self.fasta_path)
 
-        # Construct a set of the sequences from the file
-        seqs_to_keep = {}
+        # Select the sequences from the file to keep, along with their
+        # position in the file
+        seqs_to_keep = []
+        seqs_pos = []
         for i, (header, seq) in enumerate(fasta.items()):
             if self.skip_reverse_complements:
                 if "reverse complement" not in header:
-                    seqs_to_keep[seq] = i
+                    seqs_to_keep += [seq.encode()]
+                    seqs_pos += [i]
             else:
-                seqs_to_keep[seq] = i
-
-        # Construct a list of tuples of the form
-        # (probe's position in fasta file, probe)
-        filtered = []
-        for probe in input:
-            if probe.seq_str in seqs_to_keep:
-                order_in_file = seqs_to_keep[probe.seq_str]
-                filtered += [(order_in_file, probe)]
-
-        # Sort the filtered probes by their order
-        filtered.sort()
-
-        # Remove ordering information from the filtered list
-        for i, (order_in_file, probe) in enumerate(filtered):
-            filtered[i] = probe
+                seqs_to_keep += [seq.encode()]
+                seqs_pos += [i]
 
-        return filtered
+        # Select the probes equal to a sequence to keep, and sort them
+        # by their sequence's position in the file
+        input = list(input)
+        probe_pos = _position_of_probes_in_seqs(seqs_to_keep, seqs_pos,
+                                                input)
+        selected = np.flatnonzero(probe_pos >= 0)
+        selected = selected[np.argsort(probe_pos[selected], kind='stable')]
+        return [input[i] for i in selected]
@@ -7,14 +7,127 @@ should indeed be a near-duplicate as defined by the given criteria.
 """
 
 from collections import defaultdict
+import logging
 import math
+import multiprocessing
 import operator
 
+import numpy as np
+
 from catch.filter.base_filter import BaseFilter
+from catch.utils import fix_spawn_behavior
 from catch.utils import lsh
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
+logger = logging.getLogger(__name__)
+
+
+def set_max_num_processes_for_near_duplicate_filter(max_num_processes=8):
+    """Set the maximum number of processes to use for finding near-duplicates.
+
+    Args:
+        max_num_processes: an int (>= 1) specifying the maximum number of
+            processes to use in a multiprocessing.Pool when finding
+            near-duplicates in parallel; it uses min(the number of CPUs
+            in the system, max_num_processes) processes
+    """
+    global _ndf_max_num_processes
+    _ndf_max_num_processes = max_num_processes
+set_max_num_processes_for_near_duplicate_filter()
+
+
+# Only verify every pair of points in a bucket with at most this many
+# points; larger buckets (e.g., from conserved regions) would take
+# quadratic time and memory, so their points are instead compared only
+# against the probes that are included (see _filter_parallel())
+_MAX_BUCKET_SIZE_TO_PAIR = 100
+
+
+def _dists(p, others, dist_fn, batch_dist_fn):
+    """Compute the distances between a point and many others.
+
+    Args:
+        p: point
+        others: list of points
+        dist_fn: function giving the distance between two points
+        batch_dist_fn: if not None, function f(a, bs) giving the
+            distances between a and many points bs at once
+
+    Returns:
+        list of distances between p and each point in others
+    """
+    if batch_dist_fn is not None:
+        return batch_dist_fn(p, others)
+    return [dist_fn(p, q) for q in others]
+
+
+# Define variables and functions to use in a multiprocessing Pool for
+# finding pairs of near-duplicates; these must be top-level in the module,
+# and the variables are set before the pool is created so that processes
+# share them (without copying) rather than receive them in each task
+global _ndf_points
+global _ndf_signatures
+global _ndf_shards
+global _ndf_dist_thres
+global _ndf_dist_fn
+global _ndf_batch_dist_fn
+def _find_near_duplicate_pairs(j, shard):
+    """Find near-duplicate pairs among the points in a shard of a hash table.
+
+    Args:
+        j: index of a hash table
+        shard: index of a shard; the shard consists of the points whose
+            key in table j is assigned to it by _ndf_shards[j]
+
+    Returns:
+        tuple (a, b, large_members, large_sizes) of np.arrays such that
+        points a[i] and b[i] (with a[i] < b[i]) collide in table j and
+        are within _ndf_dist_thres of each other, for the buckets with at
+        most _MAX_BUCKET_SIZE_TO_PAIR points; the points of each larger
+        bucket, whose pairs are not verified, are given by consecutive
+        runs of large_members with lengths large_sizes
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    in_shard = np.flatnonzero(_ndf_shards[j] == shard)
+    if len(in_shard) < 2:
+        return (empty, empty, empty, empty)
+
+    # Construct the part of table j in this shard: group the points by
+    # their key, so that each bucket is a run of consecutive points in
+    # `order`
+    sigs = np.ascontiguousarray(_ndf_signatures[j][in_shard])
+    sigs = sigs.reshape(len(in_shard), -1)
+    rows = sigs.view(np.dtype((np.void, sigs.shape[1] * sigs.itemsize)))
+    _, bucket = np.unique(rows.ravel(), return_inverse=True)
+    bucket = bucket.ravel()
+    order = np.argsort(bucket, kind='stable')
+    bucket_starts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+    bucket_ends = np.append(bucket_starts[1:], len(order))
+
+    a, b = [], []
+    large_members, large_sizes = [empty], []
+    for start, end in zip(bucket_starts.tolist(), bucket_ends.tolist()):
+        if end - start < 2:
+            continue
+        if end - start > _MAX_BUCKET_SIZE_TO_PAIR:
+            large_members += [in_shard[order[start:end]]]
+            large_sizes += [end - start]
+            continue
+        members = in_shard[order[start:end]].tolist()
+        for x in range(len(members) - 1):
+            p = members[x]
+            others = members[(x + 1):]
+            dists = _dists(_ndf_points[p], [_ndf_points[q] for q in others],
+                           _ndf_dist_fn, _ndf_batch_dist_fn)
+            for q, dist in zip(others, dists):
+                if dist <= _ndf_dist_thres:
+                    a += [min(p, q)]
+                    b += [max(p, q)]
+    return (np.array(a, dtype=np.int64), np.array(b, dtype=np.int64),
+            np.concatenate(large_members).astype(np.int64),
+            np.array(large_sizes, dtype=np.int64))
+
 
 class NearDuplicateFilter(BaseFilter):
     """Filter that removes near-duplicates using LSH.
@@ -29,7 +142,8 @@ class NearDuplicateFilter(BaseFilter):
     duplicate filter should *not* be run before this.
     """
 
-    def __init__(self, k, reporting_prob=0.80):
+    def __init__(self, k, reporting_prob=0.80, use_parallel=False,
+                 num_processes=None):
         """
         Args:
             k: number of hash functions to draw from a family of
@@ -40,9 +154,22 @@ class NearDuplicateFilter(BaseFilter):
                 multiple hash functions (each of which is a concatenation
                 of k functions drawn from the family) to achieve this
                 probability
+            use_parallel: if True, find all pairs of near-duplicates
+                with a multiprocessing Pool, with each hash table sharded
+                by key across processes, and then select probes from the
+                resulting graph of near-duplicates; otherwise, query each
+                probe's near-duplicates serially
+            num_processes: number of processes to use when use_parallel
+                is True; if None, this determines a number
         """
         self.k = k
         self.reporting_prob = reporting_prob
+        self.use_parallel = use_parallel
+        self.num_processes = num_processes
+
+        # Subclasses may set this to a function f(a, bs) that computes
+        # the distances between a and many probes bs at once
+        self.batch_dist_fn = None
 
     def _filter(self, input):
         """Filter with an arbitrary LSH family.
@@ -65,14 +192,23 @@ class NearDuplicateFilter(BaseFilter):
             sorted(occurrences.items(), key=operator.itemgetter(1),
                    reverse=True)]
 
+        if self.use_parallel:
+            return self._filter_parallel(input_sorted)
+
         # Remove exact duplicates from the input
         input = list(set(input))
 
         # Construct a collection of hash tables for looking up
         # near neighbors of each probe
         nnl = lsh.NearNeighborLookup(self.lsh_family, self.k, self.dist_thres,
-            self.dist_fn, self.reporting_prob)
-        nnl.add(input)
+            self.dist_fn, self.reporting_prob,
+            batch_dist_fn=self.batch_dist_fn)
+        # Evaluate the hash functions on all probes at once, if the
+        # family supports it, and reuse the values for the queries below
+        signatures = nnl.signatures(input)
+        nnl.add(input, signatures)
+        if signatures is not None:
+            input_idx = {p: i for i, p in enumerate(input)}
 
         # Iterate through all probes in order; for each p, remove others
         # that are near-duplicates (neighbors) of p. Since we iterate
@@ -91,7 +227,12 @@ class NearDuplicateFilter(BaseFilter):
 
             # Include p in the output and exclude all near-duplicates of it
             to_include.add(p)
-            for near_dup in nnl.query(p):
+            if signatures is not None:
+                i = input_idx[p]
+                p_signatures = [S[i] for S in signatures]
+            else:
+                p_signatures = None
+            for near_dup in nnl.query(p, p_signatures):
                 if near_dup not in to_include:
                     to_exclude.add(near_dup)
 
@@ -102,6 +243,156 @@ class NearDuplicateFilter(BaseFilter):
 
         return list(to_include)
 
+    def _filter_parallel(self, input_sorted):
+        """Filter by finding all pairs of near-duplicates in parallel.
+
+        This draws the same hash functions as the serial approach (for
+        the same random seed), so its output is the same set of probes.
+        Pairs are verified in parallel only within buckets of at most
+        _MAX_BUCKET_SIZE_TO_PAIR probes. As in the serial approach, each
+        probe in a larger bucket is compared only against the probes
+        that are included, and only if it is not already excluded.
+
+        Args:
+            input_sorted: list of distinct probes, sorted in descending
+                order by multiplicity
+
+        Returns:
+            subset of input_sorted, in the same order
+        """
+        global _ndf_points
+        global _ndf_signatures
+        global _ndf_shards
+        global _ndf_dist_thres
+        global _ndf_dist_fn
+        global _ndf_batch_dist_fn
+        global _ndf_max_num_processes
+
+        n = len(input_sorted)
+        nnl = lsh.NearNeighborLookup(self.lsh_family, self.k, self.dist_thres,
+            self.dist_fn, self.reporting_prob)
+        signatures = nnl.signatures(input_sorted)
+        if signatures is None:
+            raise ValueError(("The LSH family must support evaluating hash "
+                "functions in bulk to find near-duplicates in parallel"))
+
+        num_processes = self.num_processes
+        if num_processes is None:
+            num_processes = min(multiprocessing.cpu_count(),
+                                _ndf_max_num_processes)
+        if multiprocessing.current_process().daemon:
+            # This is already running in a pool (e.g., when filtering over
+            # groupings in parallel), whose processes cannot have children
+            num_processes = 1
+        num_shards = 4 * num_processes
+
+        # Assign each key, in each table, to a shard based on a hash of
+        # the key; all points in one bucket are in the same shard
+        shards = []
+        for S in signatures:
+            S = np.ascontiguousarray(S).reshape(n, -1)
+            key_bytes = S.view(np.uint8).reshape(n, -1).astype(np.uint64)
+            h = np.zeros(n, dtype=np.uint64)
+            for col in range(key_bytes.shape[1]):
+                h = h * np.uint64(1099511628211) + key_bytes[:, col]
+            shards += [(h % np.uint64(num_shards)).astype(np.int64)]
+
+        # Set the variables that processes in the pool use; this must
+        # happen before the pool is created
+        _ndf_points = input_sorted
+        _ndf_signatures = signatures
+        _ndf_shards = shards
+        _ndf_dist_thres = self.dist_thres
+        _ndf_dist_fn = self.dist_fn
+        _ndf_batch_dist_fn = self.batch_dist_fn
+
+        logger.debug(("Finding near-duplicates among %d probes in %d hash "
+            "tables with %d processes"), n, nnl.num_tables, num_processes)
+        pool_args = [(j, shard) for j in range(nnl.num_tables)
+                     for shard in range(num_shards)]
+        if num_processes == 1:
+            pool_out = [_find_near_duplicate_pairs(j, shard)
+                        for j, shard in pool_args]
+        else:
+            fix_spawn_behavior.fix_spawn_behavior()
+            pool = multiprocessing.Pool(num_processes)
+            try:
+                pool_out = pool.starmap(_find_near_duplicate_pairs,
+                                        pool_args)
+                pool.close()
+            finally:
+                # Stop the workers even if finding pairs failed or was
+                # interrupted
+                pool.terminate()
+                pool.join()
+
+        _ndf_points = None
+        _ndf_signatures = None
+        _ndf_shards = None
+
+        # Construct a graph of near-duplicates, in which each probe's
+        # neighbors are neighbor_ind[neighbor_offsets[i]:
+        # neighbor_offsets[i+1]]; a pair may have been found in more than
+        # one table
+        empty = np.zeros(0, dtype=np.int64)
+        a = np.concatenate([x[0] for x in pool_out] + [empty])
+        b = np.concatenate([x[1] for x in pool_out] + [empty])
+        pairs = np.unique(a * n + b)
+        a, b = pairs // n, pairs % n
+        src = np.concatenate((a, b))
+        dst = np.concatenate((b, a))
+        order = np.argsort(src, kind='stable')
+        neighbor_ind = dst[order]
+        neighbor_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=neighbor_offsets[1:])
+
+        # Index the large buckets, whose pairs were not verified: bucket t
+        # is large_members[large_offsets[t]:large_offsets[t+1]], and the
+        # large buckets containing probe i are probe_buckets[
+        # probe_bucket_offsets[i]:probe_bucket_offsets[i+1]]
+        large_members = np.concatenate([x[2] for x in pool_out] + [empty])
+        large_sizes = np.concatenate([x[3] for x in pool_out] + [empty])
+        large_offsets = np.zeros(len(large_sizes) + 1, dtype=np.int64)
+        np.cumsum(large_sizes, out=large_offsets[1:])
+        member_bucket = np.repeat(np.arange(len(large_sizes)), large_sizes)
+        probe_buckets = member_bucket[np.argsort(large_members,
+                                                 kind='stable')]
+        probe_bucket_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(large_members, minlength=n),
+                  out=probe_bucket_offsets[1:])
+        if len(large_sizes) > 0:
+            logger.debug(("Comparing probes in %d large buckets only "
+                "against included probes"), len(large_sizes))
+
+        # Iterate through all probes in order; for each, exclude its
+        # near-duplicates that are not already included (as in the
+        # serial approach)
+        included = np.zeros(n, dtype=bool)
+        excluded = np.zeros(n, dtype=bool)
+        for i in range(n):
+            if excluded[i]:
+                continue
+            included[i] = True
+            neighbors = neighbor_ind[neighbor_offsets[i]:
+                                     neighbor_offsets[i + 1]]
+            excluded[neighbors[~included[neighbors]]] = True
+
+            for t in probe_buckets[probe_bucket_offsets[i]:
+                                   probe_bucket_offsets[i + 1]]:
+                # Every probe before i is already included or excluded,
+                # so only compare i against later ones not yet excluded
+                members = large_members[large_offsets[t]:
+                                        large_offsets[t + 1]]
+                members = members[(members > i) & ~excluded[members]]
+                if len(members) == 0:
+                    continue
+                dists = np.asarray(_dists(input_sorted[i],
+                    [input_sorted[q] for q in members.tolist()],
+                    self.dist_fn, self.batch_dist_fn))
+                excluded[members[dists <= self.dist_thres]] = True
+
+        return [p for p, inc in zip(input_sorted, included) if inc]
+
 
 # Keep top-level in module so it can be pickled
 def hamming_dist(a, b):
@@ -112,7 +403,7 @@ class NearDuplicateFilterWithHammingDistance(NearDuplicateFilter):
     """Filter that removes near-duplicates according to Hamming distance.
     """
 
-    def __init__(self, dist_thres, probe_length):
+    def __init__(self, dist_thres, probe_length, use_parallel=False):
         """
         Args:
             dist_thres: only call two probes near-duplicates if their
@@ -123,12 +414,15 @@ class NearDuplicateFilterWithHammingDistance(NearDuplicateFilter):
                 candidate probes further apart than this value are not
                 collapsed as near-duplicates
             probe_length: length of probes
+            use_parallel: if True, find near-duplicates with a
+                multiprocessing Pool (see NearDuplicateFilter)
         """
-        super().__init__(k=20)
+        super().__init__(k=20, use_parallel=use_parallel)
         self.lsh_family = lsh.HammingDistanceFamily(probe_length)
         self.dist_thres = dist_thres
 
         self.dist_fn = hamming_dist
+        self.batch_dist_fn = lsh.hamming_dists
 
     def _filter(self, input):
         """Filter with LSH using family that works with Hamming distance.
@@ -160,7 +454,7 @@ class NearDuplicateFilterWithMinHash(NearDuplicateFilter):
     """Filter that removes near-duplicates using MinHash.
     """
 
-    def __init__(self, dist_thres, kmer_size=10):
+    def __init__(self, dist_thres, kmer_size=10, use_parallel=False):
         """
         Args:
             dist_thres: only call two probes near-duplicates if their
@@ -170,10 +464,11 @@ class NearDuplicateFilterWithMinHash(NearDuplicateFilter):
                 the overlap of those k-mers
             kmer_size: the length of each k-mer to use with MinHash; note
                 that this is *not* the same as self.k
+            use_parallel: if True, find near-duplicates with a
+                multiprocessing Pool (see NearDuplicateFilter)
         """
-        super().__init__(k=3)
-        self.lsh_family = lsh.MinHashFamily(kmer_size,
-                use_fast_str_hash=True) # safe as long as not parallelized
+        super().__init__(k=3, use_parallel=use_parallel)
+        self.lsh_family = lsh.MinHashFamily(kmer_size)
         self.dist_thres = dist_thres
 
         self.dist_fn = jaccard_dist_fn(kmer_size)
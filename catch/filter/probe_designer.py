@@ -22,7 +22,8 @@ class ProbeDesigner:
     def __init__(self, genomes, filters, probe_length,
             probe_stride, allow_small_seqs=None, seq_length_to_skip=None,
             cluster_threshold=None, cluster_merge_after=None,
-            cluster_method=None, cluster_fragment_length=None):
+            cluster_method=None, cluster_fragment_length=None,
+            unique_candidates=False):
         """
         Args:
             genomes: list [g_1, g_2, g_m] of m groupings of genomes, where
@@ -63,6 +64,11 @@ class ProbeDesigner:
             cluster_fragment_length: if set, break genomes into fragments of
                 this length and cluster these fragments rather than the whole
                 sequences
+            unique_candidates: if True, only generate the first occurrence
+                of each distinct candidate probe within a group (as
+                filter.DuplicateFilter would), without building a probe for
+                each duplicate (see candidate_probes.
+                make_unique_candidate_probes_from_genomes())
         """
         self.genomes = genomes
         self.filters = filters
@@ -74,6 +80,7 @@ class ProbeDesigner:
         self.cluster_merge_after = cluster_merge_after
         self.cluster_method = cluster_method
         self.cluster_fragment_length = cluster_fragment_length
+        self.unique_candidates = unique_candidates
 
     def _cluster_genomes(self):
         """Cluster genomes by nucleotide similarity using MinHash signatures.
@@ -249,14 +256,22 @@ class ProbeDesigner:
         logger.info("Building candidate probes from target sequences")
         candidates = []
         for genomes_from_group in genomes:
-            candidates_for_group = []
-            for g in genomes_from_group:
-                candidates_for_group += candidate_probes.\
-                    make_candidate_probes_from_sequences(
-                        g.seqs, probe_length=self.probe_length,
+            if self.unique_candidates:
+                candidates_for_group = candidate_probes.\
+                    make_unique_candidate_probes_from_genomes(
+                        genomes_from_group, probe_length=self.probe_length,
                         probe_stride=self.probe_stride,
                         allow_small_seqs=self.allow_small_seqs,
                         seq_length_to_skip=self.seq_length_to_skip)
+            else:
+                candidates_for_group = []
+                for g in genomes_from_group:
+                    candidates_for_group += candidate_probes.\
+                        make_candidate_probes_from_sequences(
+                            g.seqs, probe_length=self.probe_length,
+                            probe_stride=self.probe_stride,
+                            allow_small_seqs=self.allow_small_seqs,
+                            seq_length_to_skip=self.seq_length_to_skip)
             if len(candidates_for_group) == 0:
                 # There are no candidate probes, possibly because all input
                 # sequences in genomes were skipped
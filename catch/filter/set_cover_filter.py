@@ -42,19 +42,24 @@ considering the longest common substring with some number of
 mismatches between a sequence and a probe.
 """
 
+from array import array
 from collections import defaultdict
+from collections import deque
 import gc
 import logging
 import multiprocessing
 import os
 import pickle
 import re
+import shutil
 import tempfile
 
+import numpy as np
+
 from catch.filter.base_filter import BaseFilter
 from catch import probe
 from catch.utils import dynamic_load
-from catch.utils import interval
+from catch.utils import kmer_index
 from catch.utils import seq_io
 from catch.utils import set_cover
 
@@ -79,13 +84,17 @@ def set_max_num_processes_for_set_cover_instances(max_num_processes=8):
 set_max_num_processes_for_set_cover_instances()
 
 
-def _pickle_set_cover_input(sets, costs, universe_p, ranks):
-    """Save input to a set cover instance to a temporary file.
+def _save_set_cover_input(sets, costs, universe_p, ranks):
+    """Save input to a set cover instance to a temporary directory.
+
+    The sets are saved as flat arrays (see set_cover.ColumnarSets), which
+    are fast to write and can be memory-mapped when read; the remaining
+    input is pickled.
 
     Args:
         sets: sets input to set_cover.approx_multiuniverse for a full
             instance of set cover (i.e., covering target genomes across
-            all groupings)
+            all groupings), as an instance of set_cover.ColumnarSets
         costs: costs input to set_cover.approx_multiuniverse for a full
             instance of set cover (i.e., contains costs for probes that
             come from all target genomes across all groupings)
@@ -97,21 +106,20 @@ def _pickle_set_cover_input(sets, costs, universe_p, ranks):
             come from all target genomes across all groupings)
 
     Returns:
-        path to named temporary file
+        path to temporary directory
     """
-    d = {'sets': sets,
-            'costs': costs,
+    td_name = tempfile.mkdtemp()
+    sets.save(os.path.join(td_name, 'sets'))
+    d = {'costs': costs,
             'universe_p': universe_p,
             'ranks': ranks}
-    tf_name = None
-    with tempfile.NamedTemporaryFile(delete=False) as tf:
-        pickle.dump(d, tf)
-        tf.flush()
-        tf_name = tf.name
-    return tf_name
+    with open(os.path.join(td_name, 'input.pkl'), 'wb') as f:
+        pickle.dump(d, f)
+    return td_name
 
 
-def _compute_set_cover(sets, costs, universe_p, ranks, logger_prefix=""):
+def _compute_set_cover(sets, costs, universe_p, ranks, use_lazy_greedy=False,
+                       use_bitmap_universes=False, logger_prefix=""):
     """Compute set cover approximation(s) for one or more instances.
 
     Args:
@@ -127,6 +135,10 @@ def _compute_set_cover(sets, costs, universe_p, ranks, logger_prefix=""):
         ranks: ranks input to set_cover.approx_multiuniverse for a full
             instance of set cover (i.e., contains ranks for probes that
             come from all target genomes across all groupings)
+        use_lazy_greedy: use_lazy_greedy input to
+            set_cover.approx_multiuniverse
+        use_bitmap_universes: use_bitmap_universes input to
+            set_cover.approx_multiuniverse
         logger_prefix: prefix to use before log messages
 
     Returns:
@@ -139,19 +151,27 @@ def _compute_set_cover(sets, costs, universe_p, ranks, logger_prefix=""):
         universe_p=universe_p,
         ranks=ranks,
         use_intervalsets=True,
+        use_lazy_greedy=use_lazy_greedy,
+        use_bitmap_universes=use_bitmap_universes,
         logger_prefix=logger_prefix)
     return set_ids_in_cover
 
 
-def _compute_set_cover_from_saved_input(tf_name, group_i):
+def _compute_set_cover_from_saved_input(tf_name, group_i,
+                                        use_lazy_greedy=False,
+                                        use_bitmap_universes=False):
     """Read input to set cover instance, solve it, and delete the input.
 
-    This removes the temporary file passed as tf_name.
+    This removes the temporary directory passed as tf_name.
 
     Args:
-        tf_name: path to temporary file containing input to a set cover
-            instance, as saved by _pickle_set_cover_input()
+        tf_name: path to temporary directory containing input to a set
+            cover instance, as saved by _save_set_cover_input()
         group_i: index (0-based) of grouping of genomes
+        use_lazy_greedy: use_lazy_greedy input to
+            set_cover.approx_multiuniverse
+        use_bitmap_universes: use_bitmap_universes input to
+            set_cover.approx_multiuniverse
 
     Returns:
         set ids (corresponding to indices in the sets input) that give
@@ -163,14 +183,16 @@ def _compute_set_cover_from_saved_input(tf_name, group_i):
     logger.info((f"{logger_prefix}Approximating the solution to a set cover "
                  f"instance across a grouping of genomes"))
 
-    # Read input data and delete the file
-    with open(tf_name, 'rb') as tf:
+    # Read input data; memory-map the sets rather than reading them
+    with open(os.path.join(tf_name, 'input.pkl'), 'rb') as tf:
         d = pickle.load(tf)
-    os.remove(tf_name)
+    sets = set_cover.ColumnarSets.load(os.path.join(tf_name, 'sets'))
 
     # Solve instance
     set_ids_in_cover = _compute_set_cover(
-            d['sets'], d['costs'], d['universe_p'], d['ranks'],
+            sets, d['costs'], d['universe_p'], d['ranks'],
+            use_lazy_greedy=use_lazy_greedy,
+            use_bitmap_universes=use_bitmap_universes,
             logger_prefix=logger_prefix)
 
     # Warn when less-than-ideal probes are chosen (i.e., probes
@@ -185,9 +207,11 @@ def _compute_set_cover_from_saved_input(tf_name, group_i):
                        ('' if num_bad_probes == 1 else 's'))
 
     # d could be large and is no longer needed, so make sure it gets
-    # garbage collected
+    # garbage collected; then delete the input
     del d
+    del sets
     gc.collect()
+    shutil.rmtree(tf_name)
 
     return set_ids_in_cover
 
@@ -210,7 +234,9 @@ class SetCoverFilter(BaseFilter):
                  coverage=1.0,
                  cover_extension=0,
                  kmer_probe_map_k=20,
-                 kmer_probe_map_use_native_dict=False):
+                 kmer_probe_map_use_native_dict=False,
+                 use_lazy_greedy=False,
+                 use_bitmap_universes=False):
         """
         Args:
             mismatches/lcf_thres: consider a probe to hybridize to a sequence
@@ -254,7 +280,9 @@ class SetCoverFilter(BaseFilter):
                 with the identification option enabled (default is False)
             avoided_genomes: list of paths to FASTA files of genomes
                 that should be avoided (i.e., probes are penalized by the
-                amount they cover these genomes).
+                amount they cover these genomes); a path can also be to
+                an index of genomes built with kmer_index.build(), which
+                is queried with the candidate probes rather than scanned
             coverage: either a float in [0,1] or an int > 1. When it is a
                 float in [0,1], it determines the fraction of each of the
                 target genomes that must be covered by the selected probes.
@@ -284,6 +312,17 @@ class SetCoverFilter(BaseFilter):
                 types that are more suited for sharing across processes;
                 depending on the input this can result in considerably
                 more memory use but may give an improvement in runtime
+            use_lazy_greedy: when True, solve set cover instances with
+                the lazy greedy approach (see
+                set_cover.approx_multiuniverse()), which can be much faster
+                when there are many candidate probes; it selects the same
+                probes except possibly among ones that are equally good
+            use_bitmap_universes: when True, solve set cover instances
+                with the uncovered bases of each target genome stored in a
+                bitmap (see interval.IntervalBitmap) rather than in a
+                list of intervals; this speeds up computing the number of
+                uncovered bases that each candidate probe covers, at the
+                cost of 1 byte of memory per base of the target genomes
         """
         if custom_cover_range_fn is not None:
             # Use a custom function to determine whether a probe hybridizes
@@ -347,6 +386,8 @@ class SetCoverFilter(BaseFilter):
         self.cover_extension = cover_extension
         self.kmer_probe_map_k = kmer_probe_map_k
         self.kmer_probe_map_use_native_dict = kmer_probe_map_use_native_dict
+        self.use_lazy_greedy = use_lazy_greedy
+        self.use_bitmap_universes = use_bitmap_universes
 
         # Mark that probes can must be grouped by their
         #   target genome groupings
@@ -371,7 +412,8 @@ class SetCoverFilter(BaseFilter):
             target_genomes: list target genomes
 
         Returns:
-            a dict mapping set_ids (from 0 through
+            an instance of set_cover.ColumnarSets, which acts as a dict
+            mapping set_ids (from 0 through
             len(candidate_probes)-1) to dicts, where the dict for a
             particular set_id maps universe_ids to sets. set_id
             corresponds to a candidate probe in candidate_probes and
@@ -384,41 +426,113 @@ class SetCoverFilter(BaseFilter):
             sets[set_id][universe_id] contains just one interval, then that
             interval is stored directly as a tuple -- not in an instance
             of interval.IntervalSet -- to save space and it should be
-            coverted to an interval.IntervalSet when needed.)
+            coverted to an interval.IntervalSet when needed.) The
+            intervals are stored in flat arrays rather than as Python
+            objects, to save space.
         """
         # Check if there are no candidate probes; this could happen, e.g.,
         #   if there is one short target sequence that has a string of Ns
         # In this case, kmer_probe_map will be empty, leading to errors,
-        #   so avoid that by simply returning an empty dict
+        #   so avoid that by simply returning empty sets
         if len(candidate_probes) == 0:
-            return dict()
+            return set_cover.ColumnarSets.from_intervals(0, [], [], [], [])
 
         logger.info("Building map from k-mers to probes")
-        kmer_probe_map = probe.SharedKmerProbeMap.construct(
-            probe.construct_kmer_probe_map_to_find_probe_covers(
+        kmer_probe_map = \
+            probe.construct_kmer_probe_map_for_probe_finding_pool(
                 candidate_probes,
                 self.mismatches,
                 self.lcf_thres,
                 min_k=self.kmer_probe_map_k,
                 k=self.kmer_probe_map_k)
-        )
         probe.open_probe_finding_pool(kmer_probe_map,
                                       self.cover_range_fn)
 
+        sets, _ = self._find_sets_in_target_genomes(candidate_probes,
+                                                    target_genomes)
+
+        probe.close_probe_finding_pool()
+        del kmer_probe_map
+        gc.collect()
+
+        return sets
+
+    def _find_sets_in_target_genomes(self, candidate_probes, target_genomes,
+                                     fused=False):
+        """Scan target genomes to find the sets to use in set cover.
+
+        A probe finding pool must be open. When fused is False, the pool
+        should determine coverage with self.cover_range_fn. When fused is
+        True, it should determine coverage with the tuple
+        (self.cover_range_tolerant_fn, self.cover_range_fn) so that the
+        scan also finds tolerant covers (see _make_sets_and_ranks_fused());
+        the covers in reverse complements are then found too if
+        self.identify is True.
+
+        Args:
+            candidate_probes: list of candidate probes
+            target_genomes: list target genomes
+
+        Returns:
+            tuple (sets, tolerant_bp_covered) where sets is as returned by
+            _make_sets() and, when fused is True and self.identify is
+            True, tolerant_bp_covered is a dict mapping each candidate
+            probe to the number of bp it covers (in a tolerant way) in
+            target_genomes and their reverse complements, for only the
+            probes that cover at least one bp (otherwise it is None)
+        """
+        rc_too = fused and self.identify
+        tolerant_bp_covered = defaultdict(int) if rc_too else None
+
         probe_id = {}
-        sets = {}
         for id, p in enumerate(candidate_probes):
             probe_id[p] = id
-            sets[id] = {}
 
-        for j, gnm in enumerate(target_genomes):
+        # Collect every interval covered by a probe as a row in flat
+        # arrays, which take much less space than Python objects
+        interval_set_ids = array('q')
+        interval_universe_ids = array('q')
+        interval_starts = array('q')
+        interval_ends = array('q')
+
+        # Track, in order, the genomes whose sequences have been given to
+        # the scan and the lengths of their sequences
+        genomes_scanned = deque()
+        def sequences():
+            for j, gnm in enumerate(target_genomes):
+                gnm_seqs = gnm.seqs
+                genomes_scanned.append((j, [len(s) for s in gnm_seqs]))
+                yield from gnm_seqs
+
+        # Scan the sequences of all target genomes together, which lets
+        # processes each scan many short genomes at a time; each iteration
+        # takes the ranges in the first sequence of a genome, and those in
+        # the genome's other sequences are taken with next()
+        all_probe_cover_ranges = probe.find_probe_covers_in_sequences(
+            sequences(), rc_too=rc_too)
+        for probe_cover_ranges in all_probe_cover_ranges:
+            j, seq_lens = genomes_scanned.popleft()
             logger.info(("Computing coverage in target genome %d (of %d)"),
                         j+1, len(target_genomes))
             universe_id = (j)
             length_so_far = 0
-            for sequence in gnm.seqs:
-                probe_cover_ranges = probe.find_probe_covers_in_sequence(
-                    sequence)
+            for seq_idx, seq_len in enumerate(seq_lens):
+                if seq_idx > 0:
+                    probe_cover_ranges = next(all_probe_cover_ranges)
+                if fused:
+                    # Separate the tolerant covers, in sequence and in its
+                    # reverse complement, from the strict covers in
+                    # sequence
+                    strands = probe_cover_ranges if rc_too else \
+                        (probe_cover_ranges,)
+                    probe_cover_ranges = strands[0][1]
+                    if rc_too:
+                        for tolerant_probe_cover_ranges, _ in strands:
+                            for p, cover_ranges in \
+                                    tolerant_probe_cover_ranges.items():
+                                for cover_range in cover_ranges:
+                                    tolerant_bp_covered[p] += \
+                                        cover_range[1] - cover_range[0]
                 # Add the bases of sequence that are covered by all the
                 # probes into sets with universe_id equal to (j)
                 for p, cover_ranges in probe_cover_ranges.items():
@@ -428,46 +542,52 @@ class SetCoverFilter(BaseFilter):
                         # by self.cover_extension
                         cover_start = max(0,
                             cover_range[0] - self.cover_extension)
-                        cover_end = min(len(sequence),
+                        cover_end = min(seq_len,
                             cover_range[1] + self.cover_extension)
                         # The endpoints of the cover give positions in
                         # just this sequence (chromosome), so adding the
                         # lengths of all the sequences previously iterated
                         # (length_so_far) onto them gives unique
                         # integer positions in the genome gnm
-                        adjusted_cover = (cover_start + length_so_far,
-                                          cover_end + length_so_far)
-                        if universe_id not in sets[set_id]:
-                            # Since a list has a lot of overhead and most
-                            # probes align to just one interval, simply
-                            # store that interval alone (not in a list)
-                            sets[set_id][universe_id] = adjusted_cover
-                        else:
-                            prev_cover = sets[set_id][universe_id]
-                            if isinstance(prev_cover, tuple):
-                                # This probe now aligns to two intervals in
-                                # this universe/genome, so store them in
-                                # a list
-                                sets[set_id][universe_id] = [prev_cover]
-                            sets[set_id][universe_id].append(adjusted_cover)
-                length_so_far += len(sequence)
-
-        probe.close_probe_finding_pool()
-        del kmer_probe_map
-        gc.collect()
+                        interval_set_ids.append(set_id)
+                        interval_universe_ids.append(universe_id)
+                        interval_starts.append(cover_start + length_so_far)
+                        interval_ends.append(cover_end + length_so_far)
+                length_so_far += seq_len
+
+        # Sort and merge the intervals of each set in each universe, and
+        # store them compactly
+        sets = set_cover.ColumnarSets.from_intervals(len(candidate_probes),
+            np.frombuffer(interval_set_ids, dtype=np.int64),
+            np.frombuffer(interval_universe_ids, dtype=np.int64),
+            np.frombuffer(interval_starts, dtype=np.int64),
+            np.frombuffer(interval_ends, dtype=np.int64))
+
+        if tolerant_bp_covered is not None:
+            tolerant_bp_covered = dict(tolerant_bp_covered)
+        return (sets, tolerant_bp_covered)
+
+    def _check_probe_finding_pool_is_tolerant(self):
+        """Check that the probe finding pool uses the tolerant function.
 
-        # Make an IntervalSet out of the intervals of each set. But if
-        # there is just one interval in a set, then save space by leaving
-        # that entry as a tuple.
-        for set_id in sets.keys():
-            for universe_id in sets[set_id].keys():
-                intervals = sets[set_id][universe_id]
-                if not isinstance(intervals, tuple):
-                    sets[set_id][universe_id] = interval.IntervalSet(intervals)
-                # Else, there is just one interval in this set; leave it
-                # stored directly as a tuple
+        Raises:
+            RuntimeError if the probe finding pool was not created with
+            self.cover_range_tolerant_fn (or with a tuple of functions
+            whose first is self.cover_range_tolerant_fn)
 
-        return sets
+        Returns:
+            True iff the pool was created with a tuple of functions
+        """
+        pool_fn = probe._pfp_cover_range_for_probe_in_subsequence_fn
+        fused = isinstance(pool_fn, tuple)
+        if fused:
+            pool_fn = pool_fn[0]
+        if pool_fn != self.cover_range_tolerant_fn:
+            raise RuntimeError(("A tolerant coverage computation was "
+                                "called but the probe finding pool was "
+                                "not created using "
+                                "self.cover_range_tolerant_fn"))
+        return fused
 
     def _compute_tolerant_bp_covered_within_sequence(self,
                                                      sequence,
@@ -478,8 +598,10 @@ class SetCoverFilter(BaseFilter):
         and that pool should have been created using
         self.cover_range_tolerant_fn. That is, probe.open_probe_finding_pool()
         should have been called with the cover_range_for_probe_in_subsequence_fn
-        argument equal to self.cover_range_tolerant_fn. The input probes
-        are values in the kmer_probe_map argument that was passed to
+        argument equal to self.cover_range_tolerant_fn (or to a tuple whose
+        first function is self.cover_range_tolerant_fn, as in
+        _make_sets_and_ranks_fused()). The input probes are values in the
+        kmer_probe_map argument that was passed to
         probe.open_probe_finding_pool().
 
         Uses self.coverage_range_tolerant_fn for determining coverage (i.e.,
@@ -502,34 +624,56 @@ class SetCoverFilter(BaseFilter):
             one bp; candidate probes that do not cover any bp are not
             included as keys in the returned dict
         """
-        if probe._pfp_cover_range_for_probe_in_subsequence_fn != \
-                self.cover_range_tolerant_fn:
-            raise RuntimeError(("_compute_tolerant_bp_covered_within_"
-                                "subsequence() was called but the probe "
-                                "finding pool was not created using "
-                                "self.cover_range_tolerant_fn"))
-
-        reverse_complement = [False]
-        if rc_too:
-            reverse_complement += [True]
-        rc_map = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
+        fused = self._check_probe_finding_pool_is_tolerant()
+
+        # With rc_too, the covers in sequence and in its reverse
+        # complement are found together (in a single scan of sequence if
+        # the probe finding pool indexed canonical k-mers)
+        probe_cover_ranges = probe.find_probe_covers_in_sequence(sequence,
+            rc_too=rc_too)
+        if not rc_too:
+            probe_cover_ranges = (probe_cover_ranges,)
+        if fused:
+            # Only use the covers according to self.cover_range_tolerant_fn
+            probe_cover_ranges = [strand_probe_cover_ranges[0]
+                                  for strand_probe_cover_ranges
+                                  in probe_cover_ranges]
 
         num_bp_covered = defaultdict(int)
 
-        for rc in reverse_complement:
-            if rc:
-                sequence = ''.join([rc_map.get(b, b) for b in sequence[::-1]])
-            probe_cover_ranges = probe.find_probe_covers_in_sequence(sequence)
-
-            all_cover_ranges = []
-            for p, cover_ranges in probe_cover_ranges.items():
+        for strand_probe_cover_ranges in probe_cover_ranges:
+            for p, cover_ranges in strand_probe_cover_ranges.items():
                 for cover_range in cover_ranges:
                     num_bp_covered[p] += cover_range[1] - cover_range[0]
 
         return dict(num_bp_covered)
 
+    def _find_probes_hitting_genomes(self, genomes):
+        """Find the probes that hit any of a collection of genomes.
+
+        A probe finding pool must be open, as in
+        _compute_tolerant_bp_covered_within_sequence(). A probe hits a
+        genome if it covers at least one bp of the genome, or of its
+        reverse complement, in a tolerant way. Rather than computing the
+        number of bp each probe covers, this stops aligning a probe once
+        it is found to hit one genome (see
+        probe.find_probes_hitting_sequences()).
+
+        Args:
+            genomes: list of instances of genome.Genome
+
+        Returns:
+            set of the input probes (values in the kmer_probe_map passed
+            to probe.open_probe_finding_pool()) that hit at least one
+            genome in genomes
+        """
+        self._check_probe_finding_pool_is_tolerant()
+
+        sequences = (sequence for gnm in genomes for sequence in gnm.seqs)
+        return probe.find_probes_hitting_sequences(sequences, rc_too=True)
+
     def _count_num_groupings_hit(self, candidate_probes,
-            target_genomes_grouped):
+            target_genomes_grouped, bp_covered_in_groupings=None):
         """Compute number of genome groupings hit by each candidate probe.
 
         A probe is said to "hit" a grouping of target genomes if it covers
@@ -541,29 +685,37 @@ class SetCoverFilter(BaseFilter):
         Args:
             candidate_probes: list of candidate probes
             target_genomes_grouped: list of groups of target genomes
+            bp_covered_in_groupings: dict mapping indices of groupings
+                to dicts that give, for each candidate probe, the number
+                of bp it covers (in a tolerant way) in the grouping and
+                the reverse complements of its genomes; these groupings
+                are not scanned again. If None, no groupings have been
+                scanned
 
         Returns:
             dict mapping each candidate probe to the number of target
             genome groupings it hits
         """
+        if bp_covered_in_groupings is None:
+            bp_covered_in_groupings = {}
+
         num_groupings_hit = {p: 0 for p in candidate_probes}
         for i, genomes_from_group in enumerate(target_genomes_grouped):
-            logger.info(("Computing coverage in grouping %d (of %d) to "
-                         "count number of groupings hit"), i + 1,
-                        len(target_genomes_grouped))
-            num_bp_covered_in_grouping = defaultdict(int)
-            for j, gnm in enumerate(genomes_from_group):
-                for sequence in gnm.seqs:
-                    # Count hits in both sequence and its reverse complement
-                    num_bp = self._compute_tolerant_bp_covered_within_sequence(
-                        sequence, rc_too=True)
-                    for p in num_bp.keys():
-                        num_bp_covered_in_grouping[p] += num_bp[p]
-            # If a probe covers at least one bp in this grouping (i),
-            # then it hits this grouping
-            for p in num_bp_covered_in_grouping.keys():
-                if num_bp_covered_in_grouping[p] >= 1:
-                    num_groupings_hit[p] += 1
+            if i in bp_covered_in_groupings:
+                # The coverage in this grouping was already computed;
+                # if a probe covers at least one bp in this grouping (i),
+                # then it hits this grouping
+                probes_hit = [p for p, num_bp in
+                              bp_covered_in_groupings[i].items()
+                              if num_bp >= 1]
+            else:
+                logger.info(("Finding probes that hit grouping %d (of %d) "
+                             "to count number of groupings hit"), i + 1,
+                            len(target_genomes_grouped))
+                probes_hit = self._find_probes_hitting_genomes(
+                    genomes_from_group)
+            for p in probes_hit:
+                num_groupings_hit[p] += 1
 
         # Check that each candidate probe hits at least one grouping
         for p, hit in num_groupings_hit.items():
@@ -588,6 +740,11 @@ class SetCoverFilter(BaseFilter):
         by a probe, so that both an avoided genome and its reverse
         complement are avoided.
 
+        When an avoided genome is given as an index of its k-mers (see
+        kmer_index), the candidate probes are looked up in the index
+        rather than the genome being scanned, if the probe finding pool
+        permits it (see probe.can_count_bp_covered_in_kmer_index()).
+
         Args:
             candidate_probes: list of candidate probes
 
@@ -598,10 +755,28 @@ class SetCoverFilter(BaseFilter):
         """
         total_num_bp = {p: 0 for p in candidate_probes}
         for fasta_path in self.avoided_genomes:
-            # Use a generator to read the FASTA to avoid loading too much
-            # into memory (e.g., only store one chromosome of the human
-            # genome at a time)
-            for sequence in seq_io.iterate_fasta(fasta_path):
+            if kmer_index.is_index(fasta_path):
+                index = kmer_index.GenomeKmerIndex(fasta_path)
+                if probe.can_count_bp_covered_in_kmer_index(index):
+                    logger.info(("Computing coverage across avoided "
+                                 "genomes by querying the index %s"),
+                                fasta_path)
+                    num_bp = probe.count_bp_covered_in_kmer_index(index)
+                    for p in num_bp.keys():
+                        total_num_bp[p] += num_bp[p]
+                    continue
+                logger.warning(("Unable to query the index %s with the "
+                                "candidate probes (its k-mer length may "
+                                "differ from that of the map from k-mers "
+                                "to probes); scanning its sequences "
+                                "instead"), fasta_path)
+                sequences = index.iterate_sequences()
+            else:
+                # Use a generator to read the FASTA to avoid loading too
+                # much into memory (e.g., only store one chromosome of the
+                # human genome at a time)
+                sequences = seq_io.iterate_fasta(fasta_path)
+            for sequence in sequences:
                 logger.info(("Computing coverage across an avoided "
                              "sequence"))
                 # Blacklist both sequence and its reverse complement
@@ -671,19 +846,50 @@ class SetCoverFilter(BaseFilter):
                                    len(self.avoided_genomes) > 0)
         if need_probe_finding_pool:
             logger.info("Building map from k-mers to probes")
-            kmer_probe_map = probe.SharedKmerProbeMap.construct(
-                probe.construct_kmer_probe_map_to_find_probe_covers(
+            kmer_probe_map = \
+                probe.construct_kmer_probe_map_for_probe_finding_pool(
                     candidate_probes,
                     self.mismatches_tolerant,
                     self.lcf_thres_tolerant,
                     min_k=self.kmer_probe_map_k,
-                    k=self.kmer_probe_map_k)
-            )
+                    k=self.kmer_probe_map_k,
+                    use_native_dict=self.kmer_probe_map_use_native_dict)
+            # The candidate probes are typically few relative to the
+            # genomes scanned here (e.g., avoided genomes), so most k-mers
+            # of the genomes can be ruled out with a Bloom filter
             probe.open_probe_finding_pool(
                 kmer_probe_map,
                 self.cover_range_tolerant_fn,
-                use_native_dict=self.kmer_probe_map_use_native_dict)
+                use_native_dict=self.kmer_probe_map_use_native_dict,
+                canonical_kmers=True,
+                use_bloom_filter=True)
 
+        ranks = self._compute_ranks(candidate_probes, target_genomes_grouped)
+
+        if need_probe_finding_pool:
+            probe.close_probe_finding_pool()
+            del kmer_probe_map
+            gc.collect()
+
+        return ranks
+
+    def _compute_ranks(self, candidate_probes, target_genomes_grouped,
+                       bp_covered_in_groupings=None):
+        """Compute a rank for each candidate probe to use in set cover.
+
+        This does the work of _make_ranks(). If self.identify is True or
+        there are avoided genomes, a probe finding pool must be open and
+        determine coverage with self.cover_range_tolerant_fn (see
+        _compute_tolerant_bp_covered_within_sequence()).
+
+        Args:
+            candidate_probes: list of candidate probes
+            target_genomes_grouped: list of groups of target genomes
+            bp_covered_in_groupings: see _count_num_groupings_hit()
+
+        Returns:
+            dict as returned by _make_ranks()
+        """
         if self.identify:
             # Find the number of target genome groupings (e.g., species)
             # that each probe "hits". (A probe "hits" a grouping if it
@@ -694,7 +900,7 @@ class SetCoverFilter(BaseFilter):
             # for identification and their ranks are equal to the number
             # of groupings they hit.
             num_groupings_hit = self._count_num_groupings_hit(candidate_probes,
-                    target_genomes_grouped)
+                    target_genomes_grouped, bp_covered_in_groupings)
             rank_val = {
                 p: (0, hit)
                 for p, hit in num_groupings_hit.items()
@@ -715,11 +921,6 @@ class SetCoverFilter(BaseFilter):
             if bp > 0:
                 rank_val[p] = (1, bp)
 
-        if need_probe_finding_pool:
-            probe.close_probe_finding_pool()
-            del kmer_probe_map
-            gc.collect()
-
         # Convert the ranks, specified as tuples, into ranks from 0
         # upward. The probe(s) with the smallest tuple rank get(s)
         # rank 0, the probe(s) with the next smallest tuple rank get(s)
@@ -734,6 +935,93 @@ class SetCoverFilter(BaseFilter):
 
         return ranks
 
+    def _can_fuse_scans(self):
+        """Determine whether one scan can find strict and tolerant covers.
+
+        The strict covers (with self.cover_range_fn) and tolerant covers
+        (with self.cover_range_tolerant_fn) can be found in the same scan
+        if a probe that covers an alignment strictly must also cover it
+        tolerantly. That is known to be true when both functions use the
+        default model of hybridization and the tolerant parameters are at
+        least as tolerant as the strict ones. Fusing the scans is only
+        useful if tolerant covers are needed, namely for identification
+        or avoided genomes.
+
+        Returns:
+            True iff _make_sets_and_ranks_fused() can be used
+        """
+        if not self.identify and len(self.avoided_genomes) == 0:
+            return False
+        params = getattr(self.cover_range_fn, 'cover_params', None)
+        params_tolerant = getattr(self.cover_range_tolerant_fn,
+                                  'cover_params', None)
+        if params is None or params_tolerant is None:
+            return False
+        model, mismatches, lcf_thres, island = params
+        (model_tolerant, mismatches_tolerant, lcf_thres_tolerant,
+            island_tolerant) = params_tolerant
+        return (model == 'longest_common_substring' and
+                model_tolerant == 'longest_common_substring' and
+                mismatches <= mismatches_tolerant and
+                lcf_thres >= lcf_thres_tolerant and
+                island >= island_tolerant)
+
+    def _make_sets_and_ranks_fused(self, candidate_probes, target_genomes,
+            group_i, target_genomes_grouped):
+        """Return the sets and ranks to use in set cover from one pool.
+
+        This gives the same output as _make_sets() and _make_ranks(), but
+        it builds one map from k-mers to probes (with the tolerant
+        parameters, which finds the candidate alignments for both) and
+        opens one probe finding pool that evaluates both
+        self.cover_range_tolerant_fn and self.cover_range_fn on each
+        candidate alignment. The target genomes of grouping group_i are
+        then scanned once to find both the sets and, for identification,
+        the tolerant coverage in that grouping. _can_fuse_scans() must
+        be True.
+
+        Args:
+            candidate_probes: list of candidate probes
+            target_genomes: list target genomes of grouping group_i
+            group_i: index of the grouping in target_genomes_grouped
+                whose candidate probes are candidate_probes
+            target_genomes_grouped: list of groups of target genomes
+
+        Returns:
+            tuple (sets, ranks) as returned by _make_sets() and
+            _make_ranks()
+        """
+        logger.info("Building map from k-mers to probes")
+        kmer_probe_map = \
+            probe.construct_kmer_probe_map_for_probe_finding_pool(
+                candidate_probes,
+                self.mismatches_tolerant,
+                self.lcf_thres_tolerant,
+                min_k=self.kmer_probe_map_k,
+                k=self.kmer_probe_map_k,
+                use_native_dict=self.kmer_probe_map_use_native_dict)
+        probe.open_probe_finding_pool(
+            kmer_probe_map,
+            (self.cover_range_tolerant_fn, self.cover_range_fn),
+            use_native_dict=self.kmer_probe_map_use_native_dict,
+            canonical_kmers=True,
+            use_bloom_filter=True)
+
+        sets, tolerant_bp_covered = self._find_sets_in_target_genomes(
+            candidate_probes, target_genomes, fused=True)
+        if tolerant_bp_covered is not None:
+            bp_covered_in_groupings = {group_i: tolerant_bp_covered}
+        else:
+            bp_covered_in_groupings = {}
+        ranks = self._compute_ranks(candidate_probes, target_genomes_grouped,
+                                    bp_covered_in_groupings)
+
+        probe.close_probe_finding_pool()
+        del kmer_probe_map
+        gc.collect()
+
+        return (sets, ranks)
+
     def _make_costs(self, candidate_probes):
         """Return a cost for each candidate probe to use in set cover.
 
@@ -791,7 +1079,7 @@ class SetCoverFilter(BaseFilter):
                 universe_p[(j)] = float(desired_coverage) / gnm.size()
         return universe_p
 
-    def _construct_and_pickle_set_cover_input(self, possible_probes_grouped,
+    def _construct_and_save_set_cover_input(self, possible_probes_grouped,
             target_genomes_grouped):
         """Construct inputs to set cover instances (one per grouping).
 
@@ -809,9 +1097,9 @@ class SetCoverFilter(BaseFilter):
                 would be a list of the target genomes of species i.
 
         Returns:
-            list [(tf_i, group_i)] where tf_i is a path to a temporary file
-            containing the input for a set cover instance and group_i is a
-            0-based index for the grouping
+            list [(tf_i, group_i)] where tf_i is a path to a temporary
+            directory containing the input for a set cover instance and
+            group_i is a 0-based index for the grouping
         """
         paths = []
         for group_i, (possible_probes, target_genomes) in enumerate(zip(
@@ -819,12 +1107,23 @@ class SetCoverFilter(BaseFilter):
             # Ensure that the input is a list
             possible_probes = list(possible_probes)
 
-            logger.info("Building set cover sets input (group %d of %d)",
-                    group_i+1, len(possible_probes_grouped))
-            sets = self._make_sets(possible_probes, target_genomes)
-            logger.info("Building set cover ranks input (group %d of %d)",
-                    group_i+1, len(possible_probes_grouped))
-            ranks = self._make_ranks(possible_probes, target_genomes_grouped)
+            if self._can_fuse_scans() and len(possible_probes) > 0:
+                # Find the sets and ranks from one scan of the target
+                # genomes
+                logger.info(("Building set cover sets and ranks input "
+                             "(group %d of %d)"), group_i+1,
+                        len(possible_probes_grouped))
+                sets, ranks = self._make_sets_and_ranks_fused(
+                    possible_probes, target_genomes, group_i,
+                    target_genomes_grouped)
+            else:
+                logger.info("Building set cover sets input (group %d of %d)",
+                        group_i+1, len(possible_probes_grouped))
+                sets = self._make_sets(possible_probes, target_genomes)
+                logger.info("Building set cover ranks input (group %d of %d)",
+                        group_i+1, len(possible_probes_grouped))
+                ranks = self._make_ranks(possible_probes,
+                                         target_genomes_grouped)
             logger.info("Building set cover costs input (group %d of %d)",
                     group_i+1, len(possible_probes_grouped))
             costs = self._make_costs(possible_probes)
@@ -832,8 +1131,8 @@ class SetCoverFilter(BaseFilter):
                     group_i+1, len(possible_probes_grouped))
             universe_p = self._make_universe_p(target_genomes)
 
-            # Pickle the input
-            tf_name = _pickle_set_cover_input(sets, costs, universe_p, ranks)
+            # Save the input
+            tf_name = _save_set_cover_input(sets, costs, universe_p, ranks)
 
             # Since the input can be large, make sure it is garbage collected
             del sets
@@ -852,8 +1151,8 @@ class SetCoverFilter(BaseFilter):
 
         Args:
             input_paths: list [(tf_i, group_i)] where tf_i is a path to a
-                temporary file containing the input for a set cover instance
-                and group_i is a 0-based index for the grouping
+                temporary directory containing the input for a set cover
+                instance and group_i is a 0-based index for the grouping
             possible_probes_grouped: list [p_1, p_2, ..., p_m] of m groupings 
                 of genomes, where each p_i is a collection of probes for
                 group i
@@ -887,7 +1186,9 @@ class SetCoverFilter(BaseFilter):
             key=lambda y: y[1], reverse=True)]
 
         # Construct args to _compute_set_cover_from_saved_input()
-        pool_args = [(tf_name_for_group[i], i) for i in groups_ordered]
+        pool_args = [(tf_name_for_group[i], i, self.use_lazy_greedy,
+                      self.use_bitmap_universes)
+                     for i in groups_ordered]
 
         # Run the pool, giving 1 instance (chunksize=1) at a time
         pool_out = pool.starmap(_compute_set_cover_from_saved_input, pool_args,
@@ -911,7 +1212,7 @@ class SetCoverFilter(BaseFilter):
         # Construct and save set cover input; functions within this are
         #   already parallelized
         logger.info("Building set cover inputs for %d groups", len(input))
-        input_paths = self._construct_and_pickle_set_cover_input(
+        input_paths = self._construct_and_save_set_cover_input(
                 input, target_genomes_grouped)
 
         # Parallelize solving set cover instances across groupings
@@ -1,11 +1,18 @@
 """Tests for candidate_probes module.
 """
 
+from collections import OrderedDict
 import logging
 import pathlib
+import random
 import unittest
 
+import numpy as np
+
+from catch import genome
 from catch.filter import candidate_probes
+from catch.filter import duplicate_filter
+from catch.utils import fingerprint
 from catch.utils import seq_io
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
@@ -79,6 +86,37 @@ class TestCandidateProbesOnContrivedInput(unittest.TestCase):
             p, ['ATCGNC', 'TCGNCG'] + ['ATCGNC', 'TCGNCG', 'TCGATA', 'TCGATA',
                                        'CGATAT'])
 
+    def test_windows(self):
+        starts, is_flanking = candidate_probes.candidate_probe_windows(
+            'ATCGNCGNNTCGATAT',
+            probe_length=6,
+            probe_stride=3,
+            min_n_string_length=2)
+        self.assertEqual(list(starts), [0, 9, 10, 1, 9])
+        self.assertEqual(list(is_flanking),
+                         [False, False, False, True, True])
+
+    def test_windows_match_probes(self):
+        seq = 'NNATCGNNNCGATNCGANNNNATTAGCNNTCGATATN'
+        for probe_length in [3, 4, 7]:
+            for probe_stride in [1, 2, 5]:
+                for min_n_string_length in [1, 2, 3]:
+                    starts, is_flanking = \
+                        candidate_probes.candidate_probe_windows(
+                            seq, probe_length, probe_stride,
+                            min_n_string_length=min_n_string_length)
+                    p = candidate_probes.make_candidate_probes_from_sequence(
+                        seq, probe_length, probe_stride,
+                        min_n_string_length=min_n_string_length)
+                    self.assertEqual(
+                        [x.seq_str for x in p],
+                        [seq[i:(i + probe_length)] for i in starts])
+                    self.assertEqual([x.is_flanking_n_string for x in p],
+                                     list(is_flanking))
+                    for x in p:
+                        self.assertNotIn('N' * min_n_string_length,
+                                         x.seq_str)
+
     def test_small_seqs(self):
         """Test sequences smaller than the probe length.
         """
@@ -130,6 +168,77 @@ class TestCandidateProbesOnContrivedInput(unittest.TestCase):
         logging.disable(logging.NOTSET)
 
 
+class TestUniqueCandidateProbes(unittest.TestCase):
+    """Tests make_unique_candidate_probes_from_genomes.
+
+    These compare the output against passing all the candidate probes
+    through a DuplicateFilter.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        random.seed(1)
+        region = ''.join(random.choice('ACGT') for _ in range(300))
+        self.genomes = []
+        for _ in range(5):
+            seqs = []
+            for _ in range(random.randint(1, 3)):
+                # Give the sequences of genomes shared regions, with some
+                # mutations and N's
+                seq = list(region[random.randint(0, 50):
+                                  random.randint(200, 300)])
+                for j in random.sample(range(len(seq)), 5):
+                    seq[j] = random.choice('ACGTN')
+                seqs += [''.join(seq)]
+            seqs += ['ACGTNACG']
+            self.genomes += [genome.Genome.from_chrs(OrderedDict(
+                ('chr' + str(j), seq) for j, seq in enumerate(seqs)))]
+
+    def expected(self, **kwargs):
+        probes = []
+        for g in self.genomes:
+            probes += candidate_probes.make_candidate_probes_from_sequences(
+                g.seqs, **kwargs)
+        return duplicate_filter.DuplicateFilter().filter(probes)
+
+    def compare(self, **kwargs):
+        expected = self.expected(**kwargs)
+        found = candidate_probes.make_unique_candidate_probes_from_genomes(
+            self.genomes, **kwargs)
+        self.assertEqual(found, expected)
+        self.assertEqual([p.is_flanking_n_string for p in found],
+                         [p.is_flanking_n_string for p in expected])
+        self.assertEqual(len(set(found)), len(found))
+        return found
+
+    def test_same_as_duplicate_filter(self):
+        for probe_length, probe_stride in [(20, 5), (30, 1), (17, 10)]:
+            self.compare(probe_length=probe_length,
+                         probe_stride=probe_stride,
+                         allow_small_seqs=8)
+            self.compare(probe_length=probe_length,
+                         probe_stride=probe_stride,
+                         seq_length_to_skip=8)
+
+    def test_fingerprint_collisions(self):
+        # Make every window have the same fingerprint, so the output must
+        # come from comparing the probes directly
+        orig_fingerprint_windows = fingerprint.fingerprint_windows
+        fingerprint.fingerprint_windows = \
+            lambda buf, starts, lengths, max_length=None: np.zeros(
+                len(starts), dtype=np.uint64)
+        try:
+            self.compare(probe_length=20, probe_stride=5, allow_small_seqs=8)
+        finally:
+            fingerprint.fingerprint_windows = orig_fingerprint_windows
+
+    def tearDown(self):
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
 class TestCandidateProbesOnEbolaZaire(unittest.TestCase):
     """Tests the candidate probes from the Ebola Zaire (w/ 2014) dataset.
     """
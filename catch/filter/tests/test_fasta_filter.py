@@ -2,11 +2,15 @@
 """
 
 import logging
+import random
 import tempfile
 import unittest
 
+import numpy as np
+
 from catch.filter import fasta_filter as ff
 from catch import probe
+from catch.utils import fingerprint
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
@@ -65,6 +69,40 @@ class TestFastaFilter(unittest.TestCase):
 
         fasta_file.close()
 
+    def test_same_as_dict(self):
+        # Compare against matching probes to the file's sequences with a
+        # dict, including repeated sequences and fingerprint collisions
+        random.seed(1)
+        seqs = [''.join(random.choice('ACGT')
+                        for _ in range(random.randint(3, 8)))
+                for _ in range(200)]
+        fasta_file = tempfile.NamedTemporaryFile(mode='w')
+        for i, seq in enumerate(seqs[:100] + seqs[:10] + ['A' * 1000]):
+            fasta_file.write(">seq%d\n%s\n" % (i, seq))
+        fasta_file.seek(0)
+        input_probes = [probe.Probe.from_str(s) for s in seqs * 2]
+
+        pos_by_seq = {}
+        for i, seq in enumerate(seqs[:100] + seqs[:10]):
+            pos_by_seq[seq] = i
+        expected = sorted([p for p in input_probes
+                           if p.seq_str in pos_by_seq],
+                          key=lambda p: pos_by_seq[p.seq_str])
+
+        fasta_filter = ff.FastaFilter(fasta_file.name)
+        self.assertEqual(fasta_filter.filter(input_probes), expected)
+
+        orig_fingerprint_windows = fingerprint.fingerprint_windows
+        fingerprint.fingerprint_windows = \
+            lambda buf, starts, lengths, max_length=None: np.zeros(
+                len(starts), dtype=np.uint64)
+        try:
+            self.assertEqual(fasta_filter.filter(input_probes), expected)
+        finally:
+            fingerprint.fingerprint_windows = orig_fingerprint_windows
+
+        fasta_file.close()
+
     def tearDown(self):
         # Re-enable logging 
         logging.disable(logging.NOTSET)
@@ -127,6 +127,46 @@ class TestNearDuplicateFilterWithHammingDistance(unittest.TestCase):
                                  output_probes[i][1].seq_str in group_cluster1))
 
 
+    def test_parallel_same_as_serial(self):
+        # Make probes that form many clusters of near-duplicates
+        random.seed(1)
+        input = []
+        for _ in range(50):
+            s = ''.join(random.choice('ACGT') for _ in range(30))
+            for _ in range(5):
+                t = list(s)
+                for i in random.sample(range(30), random.randint(0, 4)):
+                    t[i] = random.choice('ACGT')
+                input += [''.join(t)]
+        input_probes = [probe.Probe.from_str(s) for s in input]
+
+        outputs = []
+        for use_parallel, num_processes in [(False, None), (True, 1),
+                                            (True, 2), (True, 4)]:
+            # Set the seed so that the hash functions are the same
+            random.seed(0)
+            f = ndf.NearDuplicateFilterWithHammingDistance(3, 30,
+                use_parallel=use_parallel)
+            f.num_processes = num_processes
+            outputs += [set(f.filter(input_probes))]
+        self.assertLess(len(outputs[0]), len(set(input_probes)))
+        for output in outputs[1:]:
+            self.assertEqual(output, outputs[0])
+
+        # Compare probes in buckets with more than 2 probes only against
+        # included probes, rather than verifying all pairs
+        orig_max_bucket_size = ndf._MAX_BUCKET_SIZE_TO_PAIR
+        ndf._MAX_BUCKET_SIZE_TO_PAIR = 2
+        try:
+            for num_processes in [1, 2]:
+                random.seed(0)
+                f = ndf.NearDuplicateFilterWithHammingDistance(3, 30,
+                    use_parallel=True)
+                f.num_processes = num_processes
+                self.assertEqual(set(f.filter(input_probes)), outputs[0])
+        finally:
+            ndf._MAX_BUCKET_SIZE_TO_PAIR = orig_max_bucket_size
+
 class TestNearDuplicateFilterWithMinHash(unittest.TestCase):
     """Tests output of near duplicate filter using MinHash.
     """
@@ -272,3 +312,39 @@ class TestNearDuplicateFilterWithMinHash(unittest.TestCase):
                                 (output_probes[i][0].seq_str in group_cluster2 and
                                  output_probes[i][1].seq_str in group_cluster1))
 
+    def test_parallel_same_as_serial(self):
+        # Make probes that form many clusters of near-duplicates
+        random.seed(1)
+        input = []
+        for _ in range(50):
+            s = ''.join(random.choice('ACGT') for _ in range(40))
+            for _ in range(5):
+                shift = random.randint(0, 5)
+                input += [s[shift:(shift + 30)]]
+        input_probes = [probe.Probe.from_str(s) for s in input]
+
+        outputs = []
+        for use_parallel, num_processes in [(False, None), (True, 1),
+                                            (True, 2), (True, 4)]:
+            # Set the seed so that the hash functions are the same
+            random.seed(0)
+            f = ndf.NearDuplicateFilterWithMinHash(0.6, 10,
+                use_parallel=use_parallel)
+            f.num_processes = num_processes
+            outputs += [set(f.filter(input_probes))]
+        self.assertLess(len(outputs[0]), len(set(input_probes)))
+        for output in outputs[1:]:
+            self.assertEqual(output, outputs[0])
+
+        # Compare probes in buckets with more than 2 probes only against
+        # included probes, rather than verifying all pairs
+        orig_max_bucket_size = ndf._MAX_BUCKET_SIZE_TO_PAIR
+        ndf._MAX_BUCKET_SIZE_TO_PAIR = 2
+        try:
+            random.seed(0)
+            f = ndf.NearDuplicateFilterWithMinHash(0.6, 10,
+                use_parallel=True)
+            f.num_processes = 2
+            self.assertEqual(set(f.filter(input_probes)), outputs[0])
+        finally:
+            ndf._MAX_BUCKET_SIZE_TO_PAIR = orig_max_bucket_size
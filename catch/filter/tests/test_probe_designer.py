@@ -95,6 +95,23 @@ class TestProbeDesigner(unittest.TestCase):
         self.assertCountEqual(pb.candidate_probes, desired_candidate_probes)
         self.assertCountEqual(pb.final_probes, desired_final_probes)
 
+    def test_two_groupings_with_unique_candidates(self):
+        """Tests two groupings of input sequences, building only the
+        distinct candidate probes of each grouping.
+        """
+        seqs = [[genome.Genome.from_one_seq('A' * 200),
+                 genome.Genome.from_one_seq('B' * 150)],
+                [genome.Genome.from_one_seq('C' * 300)]]
+        desired_candidate_probes = ['A' * 100, 'B' * 100, 'C' * 100]
+        desired_candidate_probes = \
+            [probe.Probe.from_str(s) for s in desired_candidate_probes]
+        df = duplicate_filter.DuplicateFilter()
+        pb = probe_designer.ProbeDesigner(seqs, [df], probe_length=100,
+            probe_stride=50, unique_candidates=True)
+        pb.design()
+        self.assertEqual(pb.candidate_probes, desired_candidate_probes)
+        self.assertCountEqual(pb.final_probes, desired_candidate_probes)
+
     def test_with_small_sequences(self):
         """A test with a duplicate filter and input sequences that are smaller
         than the probe length.
@@ -11,6 +11,7 @@ from catch.filter import set_cover_filter as scf
 from catch import genome
 from catch import probe
 from catch.utils import interval
+from catch.utils import kmer_index
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
@@ -31,7 +32,9 @@ class TestSetCoverFilter(unittest.TestCase):
                               cover_extension=0,
                               identify=False,
                               avoided_genomes=[],
-                              force_num_processes=None):
+                              force_num_processes=None,
+                              use_lazy_greedy=False,
+                              use_bitmap_universes=False):
         input_probes_grouped = []
         for input_group in input:
             i = [probe.Probe.from_str(s) for s in input_group]
@@ -46,7 +49,9 @@ class TestSetCoverFilter(unittest.TestCase):
             lcf_thres_tolerant=lcf_thres_tolerant,
             identify=identify,
             avoided_genomes=avoided_genomes,
-            kmer_probe_map_k=3)
+            kmer_probe_map_k=3,
+            use_lazy_greedy=use_lazy_greedy,
+            use_bitmap_universes=use_bitmap_universes)
         if force_num_processes is not None:
             f._force_num_processes = force_num_processes
         output_probes = f.filter(input_probes_grouped, target_genomes_grouped,
@@ -92,7 +97,8 @@ class TestSetCoverFilter(unittest.TestCase):
 
     def run_full_coverage_check_for_target_genomes(self,
             target_genomes_grouped, check_must_have=True,
-            force_num_processes=None):
+            force_num_processes=None, use_lazy_greedy=False,
+            use_bitmap_universes=False):
         input = []
         for genomes_from_group in target_genomes_grouped:
             input_group = []
@@ -102,7 +108,9 @@ class TestSetCoverFilter(unittest.TestCase):
             input += [input_group]
         f, output = self.get_filter_and_output(
             6, 0, target_genomes_grouped, input, 1.0,
-            force_num_processes=force_num_processes)
+            force_num_processes=force_num_processes,
+            use_lazy_greedy=use_lazy_greedy,
+            use_bitmap_universes=use_bitmap_universes)
         # output must have probes in must_have_output
         if check_must_have:
             must_have_output = ['OPQRST', 'UVWXYZ', 'FEDCBA', 'ABCDEF', 'ZYXWVF']
@@ -140,6 +148,22 @@ class TestSetCoverFilter(unittest.TestCase):
             self.run_full_coverage_check_for_target_genomes(target_genomes,
                     force_num_processes=np)
 
+    def test_full_coverage_one_group_lazy_greedy(self):
+        target_genomes = [['ABCDEFGHIJKLMNOPQRSTUVWXYZABCDEF',
+                           'ZYXWVFGHIJWUTSOPQRSTFEDCBAZYXWVF']]
+        target_genomes = self.convert_target_genomes(target_genomes)
+        for np in [None, 1, 2]:
+            self.run_full_coverage_check_for_target_genomes(target_genomes,
+                    force_num_processes=np, use_lazy_greedy=True)
+
+    def test_full_coverage_one_group_bitmap_universes(self):
+        target_genomes = [['ABCDEFGHIJKLMNOPQRSTUVWXYZABCDEF',
+                           'ZYXWVFGHIJWUTSOPQRSTFEDCBAZYXWVF']]
+        target_genomes = self.convert_target_genomes(target_genomes)
+        for np in [None, 1, 2]:
+            self.run_full_coverage_check_for_target_genomes(target_genomes,
+                    force_num_processes=np, use_bitmap_universes=True)
+
     def get_6bp_probes(self, target_genomes_grouped,
                        cover=1.0,
                        cover_extension=0,
@@ -450,6 +474,52 @@ class TestSetCoverFilter(unittest.TestCase):
 
         bl_file.close()
 
+    def test_avoid_genomes_in_index(self):
+        bl_file = tempfile.NamedTemporaryFile(mode='w')
+        bl_file.write(">n/a 1\n")
+        bl_file.write("AAAAAAAAATCGGGAAAAAAAA\n")
+        bl_file.write(">n/a 2\n")
+        bl_file.write("AAAAGGGGGGAAAACCCGATAAAAAA\n")
+        bl_file.seek(0)
+        index_dir = tempfile.TemporaryDirectory()
+        index_path = os.path.join(index_dir.name, 'index')
+        kmer_index.build([bl_file.name], index_path, k=3)
+
+        target_genomes = [['ATCGGGXXIJKXGGGGGGXTUXWXYXATCGGG',
+                           'ATCGGGGHIJKLGGGGGGSTUVWXYZATCGGG']]
+        target_genomes = self.convert_target_genomes(target_genomes)
+        f, probes = self.get_6bp_probes(target_genomes,
+                                        cover=6,
+                                        identify=False,
+                                        avoided_genomes=[index_path])
+        self.assertNotIn(probe.Probe.from_str('ATCGGG'), probes)
+        self.assertNotIn(probe.Probe.from_str('GGGGGG'), probes)
+
+        # Check that querying the index gives the same number of avoided
+        # bp as scanning the FASTA file
+        candidate_probes = [probe.Probe.from_str(s) for s in
+                            ['ATCGGG', 'GGGGGG', 'CCCGAT', 'GATAAA',
+                             'MNOPQR', 'AAAAAC']]
+        kmer_probe_map = probe.SharedKmerProbeMap.construct(
+            probe.construct_kmer_probe_map_to_find_probe_covers(
+                candidate_probes, f.mismatches_tolerant,
+                f.lcf_thres_tolerant, min_k=3, k=3))
+        probe.open_probe_finding_pool(kmer_probe_map,
+                                      f.cover_range_tolerant_fn,
+                                      canonical_kmers=True)
+        f.avoided_genomes = [bl_file.name]
+        bp_from_fasta = f._count_avoided_bp_covered(candidate_probes)
+        f.avoided_genomes = [index_path]
+        bp_from_index = f._count_avoided_bp_covered(candidate_probes)
+        probe.close_probe_finding_pool()
+        self.assertEqual(bp_from_index, bp_from_fasta)
+        # ATCGGG is in the first genome and the reverse complement of the
+        # second
+        self.assertEqual(bp_from_index[probe.Probe.from_str('ATCGGG')], 12)
+
+        bl_file.close()
+        index_dir.cleanup()
+
     def test_avoid_two_genomes_one_file(self):
         bl_file = tempfile.NamedTemporaryFile(mode='w')
         bl_file.write(">n/a 1\n")
@@ -542,6 +612,88 @@ class TestSetCoverFilter(unittest.TestCase):
 
         bl_file.close()
 
+    def test_fused_scan_same_sets_and_ranks(self):
+        bl_file = tempfile.NamedTemporaryFile(mode='w')
+        bl_file.write(">n/a\n")
+        bl_file.write("AAAAAAAAAAATCGGGATCGGGAAAAA\n")
+        bl_file.seek(0)
+
+        target_genomes = [['ABCDEFGGGGGGCCCCCCATCCGG'],
+                          ['ABCDEFATCGGGATCGGGXXX',
+                           'ATCGGGBCDEFGGGGGCCCCCATCGGGYYY']]
+        target_genomes = self.convert_target_genomes(target_genomes)
+        for identify in [False, True]:
+            f = scf.SetCoverFilter(
+                mismatches=0,
+                lcf_thres=6,
+                mismatches_tolerant=1,
+                lcf_thres_tolerant=5,
+                identify=identify,
+                avoided_genomes=[bl_file.name],
+                kmer_probe_map_k=3)
+            self.assertTrue(f._can_fuse_scans())
+            for group_i, genomes_from_group in enumerate(target_genomes):
+                candidate_probes = list(OrderedDict.fromkeys(
+                    probe.Probe.from_str(seq[i:(i + 6)])
+                    for tg in genomes_from_group for seq in tg.seqs
+                    for i in range(len(seq) - 6 + 1)))
+                sets = f._make_sets(candidate_probes, genomes_from_group)
+                ranks = f._make_ranks(candidate_probes, target_genomes)
+                sets_fused, ranks_fused = f._make_sets_and_ranks_fused(
+                    candidate_probes, genomes_from_group, group_i,
+                    target_genomes)
+                self.assertEqual({i: dict(sets[i]) for i in sets},
+                                 {i: dict(sets_fused[i]) for i in sets_fused})
+                self.assertEqual(ranks, ranks_fused)
+
+        # The scans cannot be fused if the tolerant parameters are
+        # stricter than the others
+        f = scf.SetCoverFilter(mismatches=1, lcf_thres=5,
+                               mismatches_tolerant=0, lcf_thres_tolerant=6,
+                               identify=True)
+        self.assertFalse(f._can_fuse_scans())
+
+        bl_file.close()
+
+    def test_count_num_groupings_hit(self):
+        target_genomes = [['ABCDEFXXIJKXMNOPQRXTATXAYABCDEFATAXATXYZX',
+                           'ABCDEFGHIJKLMNOPQRSTUVWXYZABCDEF'],
+                          ['ATATATABCDEFATATATATATATATXYZXYZ'],
+                          ['ATCGGGGHIJKLMNOPQRSTUVWXYZATCGGG']]
+        target_genomes = self.convert_target_genomes(target_genomes)
+        candidate_probes = list(OrderedDict.fromkeys(
+            probe.Probe.from_str(seq[i:(i + 6)])
+            for genomes_from_group in target_genomes
+            for tg in genomes_from_group for seq in tg.seqs
+            for i in range(len(seq) - 6 + 1)))
+        f = scf.SetCoverFilter(mismatches=0, lcf_thres=6,
+                               mismatches_tolerant=1, lcf_thres_tolerant=5,
+                               identify=True, kmer_probe_map_k=3)
+
+        kmer_probe_map = probe.SharedKmerProbeMap.construct(
+            probe.construct_kmer_probe_map_to_find_probe_covers(
+                candidate_probes, 1, 5, min_k=3, k=3))
+        probe.open_probe_finding_pool(kmer_probe_map,
+                                      f.cover_range_tolerant_fn)
+        num_groupings_hit = f._count_num_groupings_hit(candidate_probes,
+                                                       target_genomes)
+        # Count the groupings hit from the number of bp each probe covers
+        expected = {p: 0 for p in candidate_probes}
+        for genomes_from_group in target_genomes:
+            probes_hit = set()
+            for tg in genomes_from_group:
+                for seq in tg.seqs:
+                    num_bp = f._compute_tolerant_bp_covered_within_sequence(
+                        seq)
+                    probes_hit.update(p for p in num_bp if num_bp[p] >= 1)
+            for p in probes_hit:
+                expected[p] += 1
+        probe.close_probe_finding_pool()
+
+        self.assertEqual(num_groupings_hit, expected)
+        self.assertEqual(num_groupings_hit[probe.Probe.from_str('ABCDEF')],
+                         2)
+
     def test_full_coverage_two_groups(self):
         target_genomes = [['ABCDEFGHIJKLMNOPQRSTUVWXYZABCDEF'],
                           ['ZYXWVFGHIJWUTSOPQRSTFEDCBAZYXWVF']]
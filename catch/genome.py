@@ -141,3 +141,44 @@ class Genome:
         if not isinstance(seq, str):
             raise TypeError("seq must be a string")
         return Genome([seq])
+
+
+class LazyGenome(Genome):
+    """Genome, with one sequence, whose sequence is read only when needed.
+
+    The sequence is not held in memory. Rather, it is read from a source
+    -- e.g., an index of a FASTA file (seq_io.IndexedFasta) -- each time
+    self.seqs is accessed, so iterating over many LazyGenomes holds only
+    one of their sequences in memory at a time. Otherwise, this behaves
+    like a Genome constructed with Genome.from_one_seq().
+    """
+
+    def __init__(self, source, record):
+        """
+        Args:
+            source: object with methods seq(i) and seq_len(i) that give
+                the sequence (as a string) and length of record i -- e.g.,
+                an instance of seq_io.IndexedFasta
+            record: index of the sequence of this genome in source
+        """
+        self.source = source
+        self.record = record
+        self.chrs = None
+
+        self.hash_cached = None
+        self.size_cached = source.seq_len(record)
+        self.size_unambig_cached = None
+
+    @property
+    def seqs(self):
+        """Read the sequence of this genome.
+
+        Returns:
+            list containing the one sequence of this genome
+        """
+        return [self.source.seq(self.record)]
+
+    def divided_into_chrs(self):
+        """Return if the genome is broken into more than one chromosome.
+        """
+        return False
@@ -11,46 +11,132 @@ import hashlib
 import logging
 import multiprocessing
 from multiprocessing import sharedctypes
+import os
+import shutil
 
 import numpy as np
 
+from catch.utils import bloom_filter
 from catch.utils import fix_spawn_behavior
 from catch.utils import interval
 from catch.utils import longest_common_substring
 from catch.utils import timeout
+from catch.utils import twobit
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
 logger = logging.getLogger(__name__)
 
 
-# Probe.__init__ needs to set
-#   self.kmers_rand_choices = defaultdict(lambda: defaultdict(set))
-# to have a defaultdict of defaultdicts. That is the easier
-# way to initialize the variable, but it cannot be pickled because
-# of the lambda function. Using:
-#   self.kmers_rand_choices = defaultdict(defaultdict_set)
+# Probe.kmers_rand_choices needs to be a defaultdict of defaultdicts.
+# The easier way to initialize it,
+#   defaultdict(lambda: defaultdict(set))
+# cannot be pickled because of the lambda function. Using:
+#   defaultdict(defaultdict_set)
 # instead will be able to be pickled.
 def defaultdict_set():
     return defaultdict(set)
 
 
+# Table for complementing bases in a bytes sequence; bases other than
+# 'A', 'T', 'C', and 'G' (e.g., 'N') are their own complement
+_RC_TABLE = bytes.maketrans(b'ATCG', b'TAGC')
+_RC_STR_TABLE = str.maketrans('ATCG', 'TAGC')
+
+
+def reverse_complement_sequence(sequence):
+    """Take the reverse complement of a sequence.
+
+    Args:
+        sequence: sequence as a string
+
+    Returns:
+        reverse complement of sequence, as a string; bases other than 'A',
+        'T', 'C', and 'G' are kept as they are
+    """
+    return sequence[::-1].translate(_RC_STR_TABLE)
+
+
+def _seq_to_bytes(seq):
+    """Convert a sequence to bytes holding the ASCII value of each base.
+
+    Args:
+        seq: sequence as a Python string, bytes, or np.array in any form
+            accepted by twobit.to_bytes_array()
+
+    Returns:
+        bytes
+    """
+    if isinstance(seq, str):
+        return seq.encode('ascii')
+    if isinstance(seq, bytes):
+        return seq
+    return twobit.to_bytes_array(seq).tobytes()
+
+
 class Probe:
     """Immutable sequence representing a probe/bait.
+
+    There can be many millions of candidate probes, so each one is kept
+    compact: the sequence is stored once, as bytes giving the ASCII value
+    of each base (1 byte per base), and the caches of k-mers used by
+    shares_some_kmers() are only created when they are first needed.
+    The sequence is available as a np.array (self.seq) or Python string
+    (self.seq_str), but these are constructed on each access.
     """
 
+    __slots__ = ('_seq', 'is_flanking_n_string', 'header',
+                 '_kmers', '_kmers_rand_choices')
+
     def __init__(self, seq):
         """
         Args:
-            seq: np.array representing the sequence of a probe
+            seq: sequence of the probe, as a np.array of single
+                characters, a uint8 np.array of ASCII values, bytes, or
+                a Python string
         """
-        self.seq = seq
-        self.seq_str = ''.join(seq)
+        self._seq = _seq_to_bytes(seq)
         self.is_flanking_n_string = False
         self.header = None
 
-        self.kmers = defaultdict(set)
-        self.kmers_rand_choices = defaultdict(defaultdict_set)
+        self._kmers = None
+        self._kmers_rand_choices = None
+
+    @property
+    def seq(self):
+        """np.array of the single characters in the sequence."""
+        # Widen each byte to a UCS-4 code point, which is how NumPy
+        # stores 'U1' characters
+        return self.seq_uint8.astype(np.uint32).view('U1')
+
+    @property
+    def seq_uint8(self):
+        """Read-only np.array of the ASCII value of each base."""
+        return np.frombuffer(self._seq, dtype=np.uint8)
+
+    @property
+    def seq_bytes(self):
+        """Sequence as bytes."""
+        return self._seq
+
+    @property
+    def seq_str(self):
+        """Sequence as a Python string."""
+        return self._seq.decode('ascii')
+
+    @property
+    def kmers(self):
+        """dict mapping k to the set of k-mers in this probe."""
+        if self._kmers is None:
+            self._kmers = defaultdict(set)
+        return self._kmers
+
+    @property
+    def kmers_rand_choices(self):
+        """dict mapping k and a number of k-mers to randomly chosen k-mers."""
+        if self._kmers_rand_choices is None:
+            self._kmers_rand_choices = defaultdict(defaultdict_set)
+        return self._kmers_rand_choices
 
     def mismatches(self, other):
         """Count number of mismatches with other.
@@ -76,16 +162,18 @@ class Probe:
             number of mismatches between self and 'other' after 'other' is
             shifted by 'offset' bp
         """
-        if len(self.seq) != len(other.seq):
+        if len(self._seq) != len(other._seq):
             raise ValueError("Sequences must be of same length")
-        if abs(offset) >= len(other.seq):
+        if abs(offset) >= len(other._seq):
             raise ValueError("Invalid offset value " + str(offset))
+        seq = self.seq_uint8
+        other_seq = other.seq_uint8
         if offset == 0:
-            return np.sum(self.seq != other.seq)
+            return np.count_nonzero(seq != other_seq)
         elif offset < 0:
-            return np.sum(self.seq[:offset] != other.seq[-offset:])
+            return np.count_nonzero(seq[:offset] != other_seq[-offset:])
         else:
-            return np.sum(self.seq[offset:] != other.seq[:-offset])
+            return np.count_nonzero(seq[offset:] != other_seq[:-offset])
 
     def min_mismatches_within_shift(self, other, max_shift):
         """Compute minimum number of mismatches while shifting.
@@ -115,7 +203,8 @@ class Probe:
             length of the longest common substring with at most k
             mismatches between self and other
         """
-        l, _, _ = longest_common_substring.k_lcf(self.seq, other.seq, k)
+        l, _, _ = longest_common_substring.k_lcf(self.seq_str,
+                                                 other.seq_str, k)
         return l
 
     def reverse_complement(self):
@@ -124,13 +213,7 @@ class Probe:
         Returns:
             a Probe that is the reverse complement of this probe
         """
-        rc_map = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
-        # Using rc_map.get(b, b) ensures that this can process bases
-        # like 'N'. It returns the base itself (e.g., 'N') if it is
-        # not either 'A', 'T', 'C', or 'G'.
-        rc_seq = np.array([rc_map.get(b, b) for b in self.seq[::-1]],
-                          dtype='U1')
-        return Probe(rc_seq)
+        return Probe(self._seq[::-1].translate(_RC_TABLE))
 
     def with_prepended_str(self, s):
         """Create a probe with 's' prepended to this probe.
@@ -141,9 +224,7 @@ class Probe:
         Returns:
             a Probe with 's' prepended to the sequence of this probe
         """
-        s_seq = np.fromiter(s, dtype='U1')
-        new_seq = np.concatenate([s_seq, self.seq])
-        return Probe(new_seq)
+        return Probe(_seq_to_bytes(s) + self._seq)
 
     def with_appended_str(self, s):
         """Create a probe with 's' appended to this probe.
@@ -154,9 +235,7 @@ class Probe:
         Returns:
             a Probe with 's' appended to the sequence of this probe
         """
-        s_seq = np.fromiter(s, dtype='U1')
-        new_seq = np.concatenate([self.seq, s_seq])
-        return Probe(new_seq)
+        return Probe(self._seq + _seq_to_bytes(s))
 
     def construct_kmers(self, k, include_positions=False):
         """Return a list of k-mers in this probe.
@@ -172,14 +251,12 @@ class Probe:
             is ordered according to the positions of the k-mers in the
             probe
         """
-        kmers = []
-        for i in range(len(self.seq) - k + 1):
-            kmer = self.seq_str[i:(i + k)]
-            if include_positions:
-                kmers += [(kmer, i)]
-            else:
-                kmers += [kmer]
-        return kmers
+        seq_str = self.seq_str
+        num_kmers = len(seq_str) - k + 1
+        if include_positions:
+            return [(seq_str[i:(i + k)], i) for i in range(num_kmers)]
+        else:
+            return [seq_str[i:(i + k)] for i in range(num_kmers)]
 
     def shares_some_kmers(self, other,
                           k=20,
@@ -287,14 +364,16 @@ class Probe:
                 return False
         else:
             rand_kmer_positions = np.random.randint(0,
-                                                    len(self.seq) - k + 1,
+                                                    len(self._seq) - k + 1,
                                                     num_kmers_to_test)
+            seq_str = self.seq_str
+            other_seq_str = other.seq_str
             for n in range(num_kmers_to_test):
                 # Read a random k-mer from self and explicitly test for
                 # its presence in other
                 rand_kmer_pos = rand_kmer_positions[n]
-                rand_kmer = self.seq_str[rand_kmer_pos:(rand_kmer_pos + k)]
-                if rand_kmer in other.seq_str:
+                rand_kmer = seq_str[rand_kmer_pos:(rand_kmer_pos + k)]
+                if rand_kmer in other_seq_str:
                     return rand_kmer if return_kmer else True
             return False
 
@@ -319,20 +398,22 @@ class Probe:
         Returns:
             a (probably) unique identifier for this probe, as a string
         """
-        return hashlib.sha224(self.seq_str.encode()).hexdigest()[-length:]
+        return hashlib.sha224(self._seq).hexdigest()[-length:]
 
     def __hash__(self):
-        return hash(self.seq_str)
+        return hash(self._seq)
 
     def __eq__(self, other):
-        return isinstance(other, Probe) and \
-            np.array_equal(self.seq, other.seq)
+        return isinstance(other, Probe) and self._seq == other._seq
 
     def __len__(self):
-        return len(self.seq)
+        return len(self._seq)
 
     def __getitem__(self, i):
-        return self.seq_str[i]
+        # Index the stored bytes rather than decoding the whole sequence
+        if isinstance(i, slice):
+            return self._seq[i].decode('ascii')
+        return chr(self._seq[i])
 
     def __str__(self):
         return self.seq_str
@@ -350,7 +431,7 @@ class Probe:
         Returns:
             instance of Probe, whose sequence is seq_str
         """
-        return Probe(np.fromiter(seq_str, dtype='U1'))
+        return Probe(seq_str)
 
 
 def _construct_rand_kmer_probe_map(probes,
@@ -384,7 +465,7 @@ def _construct_rand_kmer_probe_map(probes,
     """
     kmer_probe_map = defaultdict(set)
     for probe in probes:
-        if k > len(probe.seq):
+        if k > len(probe):
             raise ValueError("k is larger than the length of a probe")
         kmers = probe.construct_kmers(k, include_positions)
         if include_positions:
@@ -465,9 +546,9 @@ def _construct_pigeonholed_kmer_probe_map(probes,
     # Find the probe length
     if len(probes) == 0:
         return {}
-    probe_length = len(probes[0].seq)
+    probe_length = len(probes[0])
     for p in probes:
-        if len(p.seq) != probe_length:
+        if len(p) != probe_length:
             raise ValueError("All probes must have the same length")
 
     if mismatches == 0:
@@ -494,7 +575,7 @@ def _construct_pigeonholed_kmer_probe_map(probes,
     kmer_probe_map = defaultdict(set)
     for p in probes:
         kmers = p.construct_kmers(k, include_positions)
-        for i in range(0, len(p.seq), k):
+        for i in range(0, len(p), k):
             if include_positions:
                 kmer, pos = kmers[i]
                 kmer_probe_map[kmer].add((p, pos))
@@ -552,10 +633,10 @@ def construct_kmer_probe_map_to_find_probe_covers(probes,
     # Find the probe length
     if len(probes) == 0:
         return {}
-    probe_length = len(probes[0].seq)
+    probe_length = len(probes[0])
     probe_lengths_differ = False
     for p in probes:
-        if len(p.seq) != probe_length:
+        if len(p) != probe_length:
             probe_lengths_differ = True
             break
 
@@ -651,16 +732,20 @@ class SharedKmerProbeMap:
         self.probe_seqs_to_probe = probe_seqs_to_probe
         self.native_dict = native_dict
 
-    def get(self, kmer):
+    def get(self, kmer, include_probe_seqs_ind=False):
         """Get the value in kmer_probe_map for the given kmer.
 
         Args:
             kmer: k-mer (string) to lookup
+            include_probe_seqs_ind: when True, also give the index of each
+                probe sequence in self.probe_seqs
 
         Returns:
             list of tuples (seq, pos) where seq is the sequence (string) of
             a probe that contains kmer and pos is the position of kmer in
-            the sequence; returns None if kmer is not found as a key
+            the sequence (or, if include_probe_seqs_ind is True, tuples
+            (seq, pos, ind) where ind is the index of seq in
+            self.probe_seqs); returns None if kmer is not found as a key
         """
         # The kmers in self.keys are sorted, so do a binary search to
         # find kmer
@@ -676,7 +761,10 @@ class SharedKmerProbeMap:
         while i < len(self.keys) and self.keys[i] == kmer_bytes:
             seq = self.probe_seqs[self.probe_seqs_ind[i]].decode()
             pos = self.probe_pos[i]
-            matches += [(seq, pos)]
+            if include_probe_seqs_ind:
+                matches += [(seq, pos, self.probe_seqs_ind[i])]
+            else:
+                matches += [(seq, pos)]
             i += 1
         return matches
 
@@ -762,6 +850,394 @@ class SharedKmerProbeMap:
         return SharedKmerProbeMap(keys, probe_seqs_ind, probe_pos, probe_seqs,
                                   k, probe_seqs_to_probe, native_dict)
 
+    def construct_bloom_filter(self, bits_per_kmer=10):
+        """Construct a Bloom filter of the k-mers in this map.
+
+        The filter holds the value (see twobit.kmer_value()) of each k-mer
+        that can be encoded. It can rule out, with a vectorized check of
+        many k-mers at once, most k-mers of a sequence that are not keys
+        before they are looked up one at a time. Like the other arrays in
+        this map, its bits are allocated with
+        multiprocessing.sharedctypes.RawArray so that they can be shared
+        with processes.
+
+        Args:
+            bits_per_kmer: number of bits of the filter for each distinct
+                k-mer (see bloom_filter.BloomFilter.with_capacity())
+
+        Returns:
+            instance of bloom_filter.BloomFilter
+        """
+        # Encode the distinct k-mers all at once by concatenating them;
+        # the value of the i'th k-mer is then the value of the k-mer at
+        # position i*k of the concatenation
+        kmers = set(self.keys)
+        codes = twobit.encode(b''.join(kmers))
+        values, valid = twobit.kmer_values(codes, self.k)
+        values = values[::self.k][valid[::self.k]]
+
+        # Size the filter, and then move its (empty) bits into shared
+        # memory before filling them in
+        bf = bloom_filter.BloomFilter.with_capacity(len(values),
+            bits_per_value=bits_per_kmer)
+        words = multiprocessing.sharedctypes.RawArray(ctypes.c_uint64,
+                                                      len(bf.words))
+        bf = bloom_filter.BloomFilter(np.frombuffer(words, dtype=np.uint64),
+                                      bf.num_hashes)
+        bf.add(values)
+        return bf
+
+
+def _lookup_in_sorted_keys(keys, values):
+    """Find the entries in a sorted array of keys for many values at once.
+
+    Args:
+        keys: sorted np.array
+        values: np.array of values to look up in keys
+
+    Returns:
+        tuple (query_ind, key_ind) of np.array such that, for each t,
+        values[query_ind[t]] is equal to keys[key_ind[t]]; there is one
+        entry for every such pair, and pairs are ordered by query_ind
+    """
+    left = np.searchsorted(keys, values, side='left')
+    right = np.searchsorted(keys, values, side='right')
+    counts = right - left
+    query_ind = np.repeat(np.arange(len(values)), counts)
+    # For each query with c matches, produce left, left+1, ...,
+    # left+c-1 by offsetting a running index by where that query's
+    # matches begin
+    match_starts = np.cumsum(counts) - counts
+    key_ind = (np.repeat(left - match_starts, counts) +
+               np.arange(len(query_ind)))
+    return (query_ind, key_ind)
+
+
+class EncodedKmerProbeMap:
+    """A read-only kmer_probe_map whose k-mers are encoded as integers.
+
+    This stores the same information as SharedKmerProbeMap, but in NumPy
+    arrays: each k-mer is represented by a 64-bit integer (see
+    catch.utils.twobit) rather than by a string. This makes it possible
+    to look up all the k-mers in a sequence at once, with a single call
+    to np.searchsorted, rather than looking them up one at a time. As with
+    SharedKmerProbeMap, the arrays are not modified after construction, so
+    they can be shared with forked processes without being copied.
+
+    When k <= twobit.MAX_EXACT_K, the integer for a k-mer is exact. When k
+    is larger, it is a hash and a match must be verified against the probe
+    sequence (see self.hashed).
+
+    K-mers containing a base other than 'A', 'C', 'G', or 'T' cannot be
+    encoded. These are few (e.g., from a probe with an ambiguous base), so
+    they are stored separately, keyed by their string, in self.ambiguous;
+    a k-mer of a sequence that cannot be encoded is looked up there (see
+    lookup_ambiguous()). Together, the two give the same matches as
+    SharedKmerProbeMap, including a probe whose k-mer has an ambiguous
+    base that appears in the same place in the sequence.
+    """
+
+    def __init__(self, keys, probe_seqs_ind, probe_pos, probe_seqs,
+            probe_seqs_offsets, k, probes, ambiguous=None):
+        """
+        Args:
+            keys: np.uint64 array of the encoded k-mers, in sorted order;
+                as in SharedKmerProbeMap, the same k-mer appears once for
+                every (probe, position) that contains it
+            probe_seqs_ind: np.uint32 array such that probe_seqs_ind[i]
+                gives the index of a probe containing the k-mer keys[i]
+            probe_pos: np.uint32 array such that probe_pos[i] gives the
+                position of the k-mer keys[i] in that probe
+            probe_seqs: np.uint8 array of the ASCII values of all probe
+                sequences, concatenated
+            probe_seqs_offsets: np.int64 array such that the sequence of
+                probe j is probe_seqs[probe_seqs_offsets[j]:
+                probe_seqs_offsets[j+1]]
+            k: length of the k-mers (as an int)
+            probes: list such that probes[j] is the instance of
+                probe.Probe for probe j
+            ambiguous: dict mapping each k-mer (string) that cannot be
+                encoded to a list of tuples (j, pos) such that the k-mer
+                appears at position pos of probe j; if None, there are
+                no such k-mers
+        """
+        self.keys = keys
+        self.probe_seqs_ind = probe_seqs_ind
+        self.probe_pos = probe_pos
+        self.probe_seqs = probe_seqs
+        self.probe_seqs_offsets = probe_seqs_offsets
+        self.k = k
+        self.hashed = k > twobit.MAX_EXACT_K
+        self.probes = probes
+        if ambiguous is None:
+            ambiguous = {}
+        self.ambiguous = ambiguous
+
+    def probe_seq_str(self, j):
+        """Return the sequence of probe j as a string.
+
+        Args:
+            j: index of a probe
+
+        Returns:
+            sequence (as a string) of probe j
+        """
+        start = self.probe_seqs_offsets[j]
+        end = self.probe_seqs_offsets[j + 1]
+        return self.probe_seqs[start:end].tobytes().decode()
+
+    def lookup(self, values):
+        """Find the entries in this map for many encoded k-mers at once.
+
+        Args:
+            values: np.uint64 array of encoded k-mers
+
+        Returns:
+            tuple (query_ind, key_ind) of np.array such that, for each t,
+            the k-mer values[query_ind[t]] is equal to keys[key_ind[t]];
+            there is one entry for every such pair, and pairs are ordered
+            by query_ind
+        """
+        return _lookup_in_sorted_keys(self.keys, values)
+
+    def lookup_ambiguous(self, sequence, positions):
+        """Find the entries in this map for k-mers that cannot be encoded.
+
+        Args:
+            sequence: sequence (as a string)
+            positions: positions in sequence of k-mers that cannot be
+                encoded, in sorted order
+
+        Returns:
+            tuple (hit_pos, probe_seqs_ind, probe_pos) of np.int64 arrays
+            such that, for each t, the k-mer at position hit_pos[t] of
+            sequence is at position probe_pos[t] of the probe with index
+            probe_seqs_ind[t]; the entries are ordered by hit_pos
+        """
+        hits = []
+        if self.ambiguous:
+            for i in positions:
+                for j, pos in self.ambiguous.get(sequence[i:(i + self.k)],
+                                                 []):
+                    hits += [(i, j, pos)]
+        hits = np.array(hits, dtype=np.int64).reshape(-1, 3)
+        return (hits[:, 0], hits[:, 1], hits[:, 2])
+
+    def to_kmer_probe_map(self):
+        """Give the information in this map as a kmer_probe_map dict.
+
+        Returns:
+            dict mapping each k-mer (string) to a list of tuples (probe,
+            pos) such that the k-mer appears at position pos of probe (an
+            instance of probe.Probe), as output by the function
+            probe.construct_kmer_probe_map_to_find_probe_covers
+        """
+        probe_seqs = [self.probe_seq_str(j) for j in range(len(self.probes))]
+        kmer_probe_map = defaultdict(list)
+        for j, pos in zip(np.asarray(self.probe_seqs_ind).tolist(),
+                          np.asarray(self.probe_pos).tolist()):
+            kmer = probe_seqs[j][pos:(pos + self.k)]
+            kmer_probe_map[kmer].append((self.probes[j], pos))
+        for kmer, kmer_alignments in self.ambiguous.items():
+            for j, pos in kmer_alignments:
+                kmer_probe_map[kmer].append((self.probes[j], pos))
+        return dict(kmer_probe_map)
+
+    def canonical_index(self):
+        """Index the k-mers in this map by their canonical form.
+
+        The canonical form of a k-mer is the smaller of its value and the
+        value of its reverse complement. A k-mer in a sequence and a k-mer
+        in this map share a canonical form if and only if the map's k-mer
+        is equal either to the sequence's k-mer or to its reverse
+        complement. Which one it is can be told by comparing the strand
+        (whether the k-mer is its canonical form) of the two, so a single
+        lookup finds hits on both strands of the sequence.
+
+        Returns:
+            tuple (canonical_keys, key_ind, strands) of np.arrays, sorted
+            by canonical_keys, such that, for each t, canonical_keys[t]
+            is the canonical form of keys[key_ind[t]] and strands[t] is
+            True iff keys[key_ind[t]] is not its canonical form
+
+        Raises:
+            ValueError if the k-mers are hashed (self.hashed is True), in
+            which case their reverse complements cannot be computed from
+            their values
+        """
+        if self.hashed:
+            raise ValueError(("Cannot index canonical k-mers when k-mers "
+                              "are hashed"))
+        rc_keys = twobit.reverse_complement_values(self.keys, self.k)
+        canonical_keys = np.minimum(self.keys, rc_keys)
+        key_ind = np.argsort(canonical_keys, kind='stable').astype(np.uint32)
+        strands = rc_keys[key_ind] < self.keys[key_ind]
+        return (canonical_keys[key_ind], key_ind, strands)
+
+    # Names of the arrays that are saved to, and loaded from, a directory
+    _ARRAY_NAMES = ['keys', 'probe_seqs_ind', 'probe_pos', 'probe_seqs',
+                    'probe_seqs_offsets']
+
+    # Names of the arrays that store self.ambiguous in a saved directory;
+    # the k-mers are concatenated, one per (probe, position)
+    _AMBIGUOUS_ARRAY_NAMES = ['ambiguous_kmers', 'ambiguous_probe_seqs_ind',
+                              'ambiguous_probe_pos']
+
+    def save(self, path):
+        """Save this map to a directory.
+
+        Each array is saved as a .npy file so that it can later be loaded
+        with memory-mapping (see load()). The directory is written under a
+        temporary name and then renamed, so a partially written map is
+        never loaded.
+
+        Args:
+            path: path to a directory to create
+        """
+        tmp_path = path + '.tmp.' + str(os.getpid())
+        os.makedirs(tmp_path)
+        for name in EncodedKmerProbeMap._ARRAY_NAMES:
+            np.save(os.path.join(tmp_path, name + '.npy'),
+                    getattr(self, name))
+        np.save(os.path.join(tmp_path, 'k.npy'), np.array([self.k]))
+        ambiguous_entries = [(kmer, j, pos)
+                             for kmer, kmer_alignments in
+                             sorted(self.ambiguous.items())
+                             for j, pos in kmer_alignments]
+        ambiguous_arrays = [
+            twobit.to_bytes_array(''.join(kmer for kmer, _, _ in
+                                          ambiguous_entries)),
+            np.array([j for _, j, _ in ambiguous_entries], dtype=np.uint32),
+            np.array([pos for _, _, pos in ambiguous_entries],
+                     dtype=np.uint32)]
+        for name, arr in zip(EncodedKmerProbeMap._AMBIGUOUS_ARRAY_NAMES,
+                             ambiguous_arrays):
+            np.save(os.path.join(tmp_path, name + '.npy'), arr)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process may have saved the same map to path
+            # in the meantime; keep that one
+            shutil.rmtree(tmp_path)
+
+    @staticmethod
+    def load(path, probes):
+        """Load a map that was saved to a directory.
+
+        The arrays are memory-mapped (read-only) rather than read into
+        memory. Processes that read the same map, including across runs,
+        therefore share its pages through the OS page cache.
+
+        Args:
+            path: path to a directory written by save()
+            probes: collection of probe.Probe that includes all the probes
+                in the saved map
+
+        Returns:
+            instance of EncodedKmerProbeMap
+
+        Raises:
+            ValueError if a probe in the saved map is not in probes
+        """
+        arrays = {name: np.load(os.path.join(path, name + '.npy'),
+                                mmap_mode='r')
+                  for name in EncodedKmerProbeMap._ARRAY_NAMES}
+        k = int(np.load(os.path.join(path, 'k.npy'))[0])
+        ambiguous_kmers, ambiguous_probe_seqs_ind, ambiguous_probe_pos = \
+            [np.load(os.path.join(path, name + '.npy'))
+             for name in EncodedKmerProbeMap._AMBIGUOUS_ARRAY_NAMES]
+        ambiguous_kmers = ambiguous_kmers.tobytes().decode()
+        ambiguous = defaultdict(list)
+        for t, (j, pos) in enumerate(zip(ambiguous_probe_seqs_ind.tolist(),
+                                         ambiguous_probe_pos.tolist())):
+            ambiguous[ambiguous_kmers[(t * k):((t + 1) * k)]].append(
+                (j, pos))
+        kmer_probe_map = EncodedKmerProbeMap(k=k, probes=None,
+                                             ambiguous=dict(ambiguous),
+                                             **arrays)
+
+        seq_to_probe = {p.seq_str: p for p in probes}
+        kmer_probe_map.probes = []
+        for j in range(len(kmer_probe_map.probe_seqs_offsets) - 1):
+            seq = kmer_probe_map.probe_seq_str(j)
+            if seq not in seq_to_probe:
+                raise ValueError(("Saved kmer_probe_map contains a probe "
+                                  "that was not given"))
+            kmer_probe_map.probes += [seq_to_probe[seq]]
+        return kmer_probe_map
+
+    @staticmethod
+    def construct(kmer_probe_map):
+        """Construct an EncodedKmerProbeMap from a kmer_probe_map.
+
+        Args:
+            kmer_probe_map: either a dict as output by the function
+                probe.construct_kmer_probe_map_to_find_probe_covers (with
+                positions) or an instance of SharedKmerProbeMap
+
+        Returns:
+            instance of EncodedKmerProbeMap that stores the same information
+            as kmer_probe_map
+
+        Raises:
+            ValueError if k-mers have different lengths or the kmer_probe_map
+            does not include positions
+        """
+        if isinstance(kmer_probe_map, SharedKmerProbeMap):
+            seq_to_probe = kmer_probe_map.probe_seqs_to_probe
+            alignments = kmer_probe_map.native_dict
+        else:
+            seq_to_probe = {}
+            alignments = defaultdict(list)
+            for kmer, kmer_alignments in kmer_probe_map.items():
+                for v in kmer_alignments:
+                    if not isinstance(v, tuple):
+                        raise ValueError(("Given kmer_probe_map must include "
+                                          "kmer positions"))
+                    p, pos = v
+                    seq_to_probe[p.seq_str] = p
+                    alignments[kmer].append((p.seq_str, pos))
+        if len(alignments) == 0:
+            raise ValueError(("kmer_probe_map is empty"))
+
+        ks = set(len(kmer) for kmer in alignments.keys())
+        if len(ks) != 1:
+            raise ValueError("Inconsistent kmer lengths in kmer_probe_map")
+        k = ks.pop()
+
+        # Assign an index to each probe sequence
+        probe_seqs_list = list(seq_to_probe.keys())
+        probe_index = {seq: j for j, seq in enumerate(probe_seqs_list)}
+        probes = [seq_to_probe[seq] for seq in probe_seqs_list]
+        probe_seqs_offsets = np.zeros(len(probe_seqs_list) + 1,
+                                      dtype=np.int64)
+        np.cumsum([len(seq) for seq in probe_seqs_list],
+                  out=probe_seqs_offsets[1:])
+        probe_seqs = twobit.to_bytes_array(''.join(probe_seqs_list)).copy()
+
+        # Encode the k-mers, setting aside ones with unencodable bases
+        keys, probe_seqs_ind, probe_pos = [], [], []
+        ambiguous = defaultdict(list)
+        for kmer, kmer_alignments in alignments.items():
+            value = twobit.kmer_value(kmer)
+            if value is None:
+                for seq, pos in kmer_alignments:
+                    ambiguous[kmer].append((probe_index[seq], pos))
+                continue
+            for seq, pos in kmer_alignments:
+                keys += [value]
+                probe_seqs_ind += [probe_index[seq]]
+                probe_pos += [pos]
+        keys = np.array(keys, dtype=np.uint64)
+        probe_seqs_ind = np.array(probe_seqs_ind, dtype=np.uint32)
+        probe_pos = np.array(probe_pos, dtype=np.uint32)
+
+        order = np.argsort(keys, kind='stable')
+        return EncodedKmerProbeMap(keys[order], probe_seqs_ind[order],
+                                   probe_pos[order], probe_seqs,
+                                   probe_seqs_offsets, k, probes,
+                                   ambiguous=dict(ambiguous))
+
 
 def set_max_num_processes_for_probe_finding_pools(max_num_processes=8):
     """Set the maximum number of processes to use in a probe finding pool.
@@ -779,10 +1255,140 @@ def set_max_num_processes_for_probe_finding_pools(max_num_processes=8):
 set_max_num_processes_for_probe_finding_pools()
 
 
+def set_kmer_probe_map_dir(kmer_probe_map_dir=None):
+    """Set a directory in which to save and reuse kmer_probe_maps.
+
+    Args:
+        kmer_probe_map_dir: path to a directory; when set,
+            construct_kmer_probe_map_for_probe_finding_pool() saves the maps
+            it constructs here and, when a map for the same probes and
+            parameters is already saved, loads it rather than constructing
+            it again. When None, maps are always constructed in memory.
+    """
+    global _kmer_probe_map_dir
+    _kmer_probe_map_dir = kmer_probe_map_dir
+set_kmer_probe_map_dir()
+
+
+def set_use_vectorized_scan(use_vectorized_scan=False):
+    """Set whether probe finding pools use a vectorized scan by default.
+
+    Args:
+        use_vectorized_scan: value of use_vectorized_scan to use in
+            open_probe_finding_pool() when it is not given (see that
+            function); it is ignored for pools that use a native dict
+    """
+    global _use_vectorized_scan
+    _use_vectorized_scan = use_vectorized_scan
+set_use_vectorized_scan()
+
+
+def set_cover_cache(cover_cache=None):
+    """Set a cache in which to save and reuse the ranges that probes cover.
+
+    Args:
+        cover_cache: instance of cover_cache.CoverCache; when set,
+            find_probe_covers_in_sequence() reads the ranges that the
+            probes in the open pool cover in a sequence from this cache,
+            if present, and otherwise saves them to it. Only pools whose
+            function determining coverage describes its parameters (i.e.,
+            has a 'cover_params' attribute, as the function returned by
+            probe_covers_sequence_by_longest_common_substring() does) use
+            the cache. When None, covers are always computed. The entry
+            for a sequence holds the covers of every probe already
+            scanned with it, identified by a hash of the probe's
+            sequence, whatever pool it was in; a pool only scans the
+            sequence with its probes that are not yet in the entry (e.g.,
+            probes added since an earlier run), and adds their covers.
+    """
+    global _cover_cache
+    _cover_cache = cover_cache
+set_cover_cache()
+
+
+# Version of the format in which EncodedKmerProbeMap.save() writes a map;
+# it is part of the key of a saved map so that maps saved in an earlier
+# format are not loaded
+_KMER_PROBE_MAP_FORMAT_VERSION = 2
+
+
+def _kmer_probe_map_key(probes, mismatches, lcf_thres, min_k, k):
+    """Compute a key identifying a kmer_probe_map by its inputs.
+
+    Args:
+        probes/mismatches/lcf_thres/min_k/k: arguments to
+            construct_kmer_probe_map_to_find_probe_covers()
+
+    Returns:
+        hex digest (string) of a hash of the probe set and parameters
+    """
+    h = hashlib.sha224()
+    h.update(str((_KMER_PROBE_MAP_FORMAT_VERSION, mismatches, lcf_thres,
+                  min_k, k)).encode())
+    for seq in sorted(set(p.seq_str for p in probes)):
+        h.update(seq.encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def construct_kmer_probe_map_for_probe_finding_pool(probes,
+                                                    mismatches,
+                                                    lcf_thres,
+                                                    min_k=20,
+                                                    k=20,
+                                                    use_native_dict=False):
+    """Construct a kmer_probe_map to give to open_probe_finding_pool().
+
+    If a directory was set with set_kmer_probe_map_dir() (and
+    use_native_dict is False), this returns an EncodedKmerProbeMap whose
+    arrays are memory-mapped from a file in that directory; the file is
+    keyed by a hash of the probes and the parameters, so it is constructed
+    only the first time it is needed. Note that, when the map is
+    constructed with the random approach (see
+    construct_kmer_probe_map_to_find_probe_covers()), a saved map reflects
+    the random choices made when it was first constructed. Whether or not
+    the scan is vectorized (see use_vectorized_scan in
+    open_probe_finding_pool()), the pool reads the memory-mapped arrays
+    directly, so the processes share them through the OS page cache.
+
+    Otherwise, this constructs a SharedKmerProbeMap.
+
+    Args:
+        probes/mismatches/lcf_thres/min_k/k: see
+            construct_kmer_probe_map_to_find_probe_covers()
+        use_native_dict: whether the map will be used with
+            use_native_dict=True in open_probe_finding_pool(), which
+            requires a SharedKmerProbeMap
+
+    Returns:
+        instance of SharedKmerProbeMap or EncodedKmerProbeMap
+    """
+    global _kmer_probe_map_dir
+
+    def construct():
+        return construct_kmer_probe_map_to_find_probe_covers(
+            probes, mismatches, lcf_thres, min_k=min_k, k=k)
+
+    if _kmer_probe_map_dir is None or use_native_dict:
+        return SharedKmerProbeMap.construct(construct())
+
+    key = _kmer_probe_map_key(probes, mismatches, lcf_thres, min_k, k)
+    path = os.path.join(_kmer_probe_map_dir, key)
+    if os.path.isdir(path):
+        logger.debug("Loading saved kmer_probe_map from %s", path)
+    else:
+        os.makedirs(_kmer_probe_map_dir, exist_ok=True)
+        EncodedKmerProbeMap.construct(construct()).save(path)
+    return EncodedKmerProbeMap.load(path, probes)
+
+
 def open_probe_finding_pool(kmer_probe_map,
                             cover_range_for_probe_in_subsequence_fn,
                             num_processes=None,
-                            use_native_dict=False):
+                            use_native_dict=False,
+                            use_vectorized_scan=None,
+                            canonical_kmers=False,
+                            use_bloom_filter=False):
     """Open a pool for calling find_probe_covers_in_sequence().
 
     The variables to share with the processes (e.g., kmer_probe_map.keys)
@@ -797,12 +1403,24 @@ def open_probe_finding_pool(kmer_probe_map,
     prefixed with '_pfp'.
 
     Args:
-        kmer_probe_map: instance of SharedKmerProbeMap
+        kmer_probe_map: instance of SharedKmerProbeMap or
+            EncodedKmerProbeMap; a SharedKmerProbeMap is encoded for a
+            vectorized scan, and an EncodedKmerProbeMap is scanned as it
+            is (its arrays, which may be memory-mapped, are read directly)
+            unless use_native_dict is True
         cover_range_for_probe_in_subsequence_fn: function that
             determines whether a probe "covers" a part of a subsequence
             of sequence; if it returns None, there is no coverage;
             otherwise it returns the range of the subsequence covered
-            by the probe
+            by the probe. This can also be a tuple of such functions,
+            ordered so that each is at least as strict as the one before
+            it (i.e., it only finds that a probe covers an alignment if
+            the one before it does too). Then one scan finds the covers
+            according to every function: each function is evaluated on
+            the candidate alignments that the one before it covers, and
+            the output gives covers for each function (see
+            find_probe_covers_in_sequence()). kmer_probe_map should be
+            constructed for the first, most tolerant, function.
         num_processes: number of processes/workers to have in the pool;
             if None, uses min(the number of CPUs in the system,
             _pfp_max_num_processes)
@@ -812,16 +1430,42 @@ def open_probe_finding_pool(kmer_probe_map,
             result in considerably more memory use (see SharedKmerProbeMap
             for an explanation of why) but may provide an improvement
             in runtime
+        use_vectorized_scan: scan sequences by encoding all of their
+            k-mers as integers and looking them up at once in an
+            EncodedKmerProbeMap (constructed from kmer_probe_map if it is
+            a SharedKmerProbeMap), rather than looking up one k-mer
+            string at a time; this finds the same covers and is generally
+            considerably faster. If None, uses the value set with
+            set_use_vectorized_scan(), unless use_native_dict is True
+        canonical_kmers: also index the k-mers in kmer_probe_map by their
+            canonical form (see EncodedKmerProbeMap.canonical_index()) so
+            that, when covers are found in both a sequence and its reverse
+            complement (with rc_too=True), the sequence is scanned only
+            once; this only has an effect with a vectorized scan and
+            when k-mers are not hashed (k <= twobit.MAX_EXACT_K), and
+            otherwise the reverse complement is scanned separately
+        use_bloom_filter: construct a Bloom filter of the k-mers in
+            kmer_probe_map (see SharedKmerProbeMap.construct_bloom_filter())
+            and, when scanning a sequence, only look up its k-mers that
+            the filter does not rule out; this is useful when most k-mers
+            of the sequences are not in kmer_probe_map (e.g., when the
+            probes are few relative to the sequences, as when scanning
+            avoided genomes), and only has an effect when kmer_probe_map
+            is a SharedKmerProbeMap and the scan is not vectorized (the k-mers
+            of a block are otherwise already looked up all at once)
 
     Raises:
         RuntimeError if the pool is already open; only one pool may be
         open at a time
+        ValueError if both use_native_dict and use_vectorized_scan are
+        True
     """
     global _pfp_is_open
     global _pfp_max_num_processes
     global _pfp_pool
     global _pfp_work_was_submitted
     global _pfp_cover_range_for_probe_in_subsequence_fn
+    global _pfp_cover_range_fns
     global _pfp_kmer_probe_map_keys
     global _pfp_kmer_probe_map_probe_seqs_ind
     global _pfp_kmer_probe_map_probe_pos
@@ -830,6 +1474,24 @@ def open_probe_finding_pool(kmer_probe_map,
     global _pfp_kmer_probe_map_k
     global _pfp_kmer_probe_map_native
     global _pfp_kmer_probe_map_use_native
+    global _pfp_kmer_probe_map_probe_seqs_offsets
+    global _pfp_kmer_probe_map_hashed
+    global _pfp_kmer_probe_map_ambiguous
+    global _pfp_kmer_probe_map_canonical_keys
+    global _pfp_kmer_probe_map_canonical_key_ind
+    global _pfp_kmer_probe_map_canonical_strands
+    global _pfp_kmer_probe_map_bloom_filter
+    global _pfp_kmer_probe_map_is_encoded
+    global _pfp_use_vectorized_scan
+    global _pfp_cover_cache_key
+    global _pfp_cover_cache_probes
+    global _pfp_cover_cache_probe_index
+    global _pfp_cover_cache_probe_hashes
+    global _pfp_cover_cache_probe_hash_order
+    global _pfp_active_probes
+    global _pfp_first_hit_only
+    global _pfp_scan_active_only
+    global _pfp_encoded_kmer_probe_map
 
     try:
         if _pfp_is_open:
@@ -837,6 +1499,28 @@ def open_probe_finding_pool(kmer_probe_map,
     except NameError:
         pass
 
+    if use_vectorized_scan is None:
+        use_vectorized_scan = _use_vectorized_scan and not use_native_dict
+    if use_native_dict and use_vectorized_scan:
+        raise ValueError(("Cannot use both a native dict and a vectorized "
+                          "scan"))
+    # Keep the map, encoded, for count_bp_covered_in_kmer_index(); this is
+    # only used by the main process and, if the map is not already
+    # encoded, is only constructed (after the pool is created) when needed
+    # An encoded map (e.g., one loaded, memory-mapped, from a directory) is
+    # scanned as it is, without a vectorized scan too: the scan then looks
+    # up the k-mers of a block in its arrays and aligns hits one at a time
+    encoded_kmer_probe_map = None
+    if isinstance(kmer_probe_map, EncodedKmerProbeMap):
+        encoded_kmer_probe_map = kmer_probe_map
+        if use_native_dict:
+            kmer_probe_map = SharedKmerProbeMap.construct(
+                kmer_probe_map.to_kmer_probe_map())
+    elif use_vectorized_scan:
+        kmer_probe_map = EncodedKmerProbeMap.construct(kmer_probe_map)
+        encoded_kmer_probe_map = kmer_probe_map
+    is_encoded = isinstance(kmer_probe_map, EncodedKmerProbeMap)
+
     fix_spawn_behavior.fix_spawn_behavior()
 
     if num_processes is None:
@@ -850,6 +1534,10 @@ def open_probe_finding_pool(kmer_probe_map,
 
     _pfp_cover_range_for_probe_in_subsequence_fn = \
         cover_range_for_probe_in_subsequence_fn
+    if isinstance(cover_range_for_probe_in_subsequence_fn, tuple):
+        _pfp_cover_range_fns = cover_range_for_probe_in_subsequence_fn
+    else:
+        _pfp_cover_range_fns = (cover_range_for_probe_in_subsequence_fn,)
 
     # Rather than saving kmer_probe_map directly, save pointers to individual
     # variables and have the function a process executes reconstruct an
@@ -863,11 +1551,99 @@ def open_probe_finding_pool(kmer_probe_map,
     _pfp_kmer_probe_map_probe_seqs_ind = kmer_probe_map.probe_seqs_ind
     _pfp_kmer_probe_map_probe_pos = kmer_probe_map.probe_pos
     _pfp_kmer_probe_map_probe_seqs = kmer_probe_map.probe_seqs
-    _pfp_kmer_probe_map_probe_seqs_to_probe = \
-        kmer_probe_map.probe_seqs_to_probe
     _pfp_kmer_probe_map_k = kmer_probe_map.k
-    _pfp_kmer_probe_map_native = kmer_probe_map.native_dict
     _pfp_kmer_probe_map_use_native = use_native_dict
+    _pfp_use_vectorized_scan = use_vectorized_scan
+    _pfp_kmer_probe_map_is_encoded = is_encoded
+    if is_encoded:
+        # Probes are identified by their index in kmer_probe_map.probes
+        _pfp_kmer_probe_map_probe_seqs_to_probe = kmer_probe_map.probes
+        _pfp_kmer_probe_map_probe_seqs_offsets = \
+            kmer_probe_map.probe_seqs_offsets
+        _pfp_kmer_probe_map_hashed = kmer_probe_map.hashed
+        _pfp_kmer_probe_map_ambiguous = kmer_probe_map.ambiguous
+        _pfp_kmer_probe_map_native = None
+    else:
+        _pfp_kmer_probe_map_probe_seqs_to_probe = \
+            kmer_probe_map.probe_seqs_to_probe
+        _pfp_kmer_probe_map_probe_seqs_offsets = None
+        _pfp_kmer_probe_map_hashed = None
+        _pfp_kmer_probe_map_ambiguous = None
+        _pfp_kmer_probe_map_native = kmer_probe_map.native_dict
+
+    if canonical_kmers and use_vectorized_scan and not kmer_probe_map.hashed:
+        _pfp_kmer_probe_map_canonical_keys, \
+            _pfp_kmer_probe_map_canonical_key_ind, \
+            _pfp_kmer_probe_map_canonical_strands = \
+            kmer_probe_map.canonical_index()
+    else:
+        _pfp_kmer_probe_map_canonical_keys = None
+        _pfp_kmer_probe_map_canonical_key_ind = None
+        _pfp_kmer_probe_map_canonical_strands = None
+
+    if use_bloom_filter and not is_encoded:
+        _pfp_kmer_probe_map_bloom_filter = \
+            kmer_probe_map.construct_bloom_filter()
+    else:
+        _pfp_kmer_probe_map_bloom_filter = None
+
+    # Allocate, in shared memory, a flag for each probe (indexed as in the
+    # scan) that says whether it is still active; in a scan with
+    # find_probes_hitting_sequences(), processes clear the flag of a probe
+    # once they find it covers part of a sequence and then stop aligning
+    # it, and all processes see the cleared flags. The flags also restrict
+    # a scan to the probes whose covers are not cached, when
+    # _pfp_scan_active_only is set
+    if is_encoded:
+        num_probes = len(kmer_probe_map.probes)
+    else:
+        num_probes = len(kmer_probe_map.probe_seqs)
+    _pfp_active_probes = multiprocessing.sharedctypes.RawArray(
+        ctypes.c_uint8, max(num_probes, 1))
+    _pfp_first_hit_only = multiprocessing.sharedctypes.RawValue(
+        ctypes.c_bool, False)
+    _pfp_scan_active_only = multiprocessing.sharedctypes.RawValue(
+        ctypes.c_bool, False)
+
+    _pfp_encoded_kmer_probe_map = encoded_kmer_probe_map
+
+    # If covers can be cached, save the part of the key for cache entries
+    # that is determined by the parameters of this pool, and a hash of each
+    # probe (indexed as in the scan) that identifies it in cache entries.
+    # The key does not include how sequences are scanned, since every scan
+    # finds the same covers, nor the probes, since the covers of a probe
+    # do not depend on the other probes
+    cover_params = [getattr(fn, 'cover_params', None)
+                    for fn in _pfp_cover_range_fns]
+    if any(params is None for params in cover_params):
+        cover_params = None
+    elif len(cover_params) == 1:
+        cover_params = cover_params[0]
+    else:
+        cover_params = tuple(cover_params)
+    if _cover_cache is not None and cover_params is not None:
+        if is_encoded:
+            _pfp_cover_cache_probes = list(kmer_probe_map.probes)
+        else:
+            _pfp_cover_cache_probes = [
+                kmer_probe_map.probe_seqs_to_probe[probe_seq.decode()]
+                for probe_seq in kmer_probe_map.probe_seqs]
+        _pfp_cover_cache_probe_index = {p: i for i, p in
+                                        enumerate(_pfp_cover_cache_probes)}
+        _pfp_cover_cache_probe_hashes = np.array(
+            [_cover_cache_probe_hash(p) for p in _pfp_cover_cache_probes],
+            dtype=np.uint64)
+        _pfp_cover_cache_probe_hash_order = np.argsort(
+            _pfp_cover_cache_probe_hashes)
+        h = hashlib.sha224()
+        h.update(str((cover_params, kmer_probe_map.k)).encode())
+        _pfp_cover_cache_key = h.hexdigest()
+    else:
+        _pfp_cover_cache_probes = None
+        _pfp_cover_cache_probe_index = None
+        _pfp_cover_cache_probe_hashes = None
+        _pfp_cover_cache_probe_hash_order = None
+        _pfp_cover_cache_key = None
 
     # Note that the pool must be created at the very end of this function
     # because the only global variables shared with processes in this
@@ -909,6 +1685,7 @@ def close_probe_finding_pool():
     global _pfp_pool
     global _pfp_work_was_submitted
     global _pfp_cover_range_for_probe_in_subsequence_fn
+    global _pfp_cover_range_fns
     global _pfp_kmer_probe_map_keys
     global _pfp_kmer_probe_map_probe_seqs_ind
     global _pfp_kmer_probe_map_probe_pos
@@ -917,6 +1694,24 @@ def close_probe_finding_pool():
     global _pfp_kmer_probe_map_k
     global _pfp_kmer_probe_map_native
     global _pfp_kmer_probe_map_use_native
+    global _pfp_kmer_probe_map_probe_seqs_offsets
+    global _pfp_kmer_probe_map_hashed
+    global _pfp_kmer_probe_map_ambiguous
+    global _pfp_kmer_probe_map_canonical_keys
+    global _pfp_kmer_probe_map_canonical_key_ind
+    global _pfp_kmer_probe_map_canonical_strands
+    global _pfp_kmer_probe_map_bloom_filter
+    global _pfp_kmer_probe_map_is_encoded
+    global _pfp_use_vectorized_scan
+    global _pfp_cover_cache_key
+    global _pfp_cover_cache_probes
+    global _pfp_cover_cache_probe_index
+    global _pfp_cover_cache_probe_hashes
+    global _pfp_cover_cache_probe_hash_order
+    global _pfp_active_probes
+    global _pfp_first_hit_only
+    global _pfp_scan_active_only
+    global _pfp_encoded_kmer_probe_map
 
     pfp_is_open = False
     try:
@@ -930,6 +1725,7 @@ def close_probe_finding_pool():
     logger.debug("Closing the probe finding pool of processes")
 
     del _pfp_cover_range_for_probe_in_subsequence_fn
+    del _pfp_cover_range_fns
 
     del _pfp_kmer_probe_map_keys
     del _pfp_kmer_probe_map_probe_seqs_ind
@@ -939,6 +1735,24 @@ def close_probe_finding_pool():
     del _pfp_kmer_probe_map_k
     del _pfp_kmer_probe_map_native
     del _pfp_kmer_probe_map_use_native
+    del _pfp_kmer_probe_map_probe_seqs_offsets
+    del _pfp_kmer_probe_map_hashed
+    del _pfp_kmer_probe_map_ambiguous
+    del _pfp_kmer_probe_map_canonical_keys
+    del _pfp_kmer_probe_map_canonical_key_ind
+    del _pfp_kmer_probe_map_canonical_strands
+    del _pfp_kmer_probe_map_bloom_filter
+    del _pfp_kmer_probe_map_is_encoded
+    del _pfp_use_vectorized_scan
+    del _pfp_cover_cache_key
+    del _pfp_cover_cache_probes
+    del _pfp_cover_cache_probe_index
+    del _pfp_cover_cache_probe_hashes
+    del _pfp_cover_cache_probe_hash_order
+    del _pfp_active_probes
+    del _pfp_first_hit_only
+    del _pfp_scan_active_only
+    del _pfp_encoded_kmer_probe_map
 
     _pfp_pool.close()
 
@@ -1005,6 +1819,85 @@ def close_probe_finding_pool():
     logger.debug("Successfully closed the probe finding pool")
 
 
+def _cover_ranges_for_probe_at_kmer(probe_seq_full, pos, sequence, i, k):
+    """Determine the range of sequence covered by a probe at a shared k-mer.
+
+    The probe is aligned to sequence such that its k-mer at pos lines up
+    with the k-mer of sequence at i. The probe is trimmed if it extends
+    past either end of sequence.
+
+    Args:
+        probe_seq_full: sequence of the probe as an np.array of dtype 'U1'
+        pos: position in the probe of the shared k-mer
+        sequence: sequence (as a string) being scanned
+        i: position in sequence of the shared k-mer
+        k: length of the shared k-mer
+
+    Returns:
+        list giving, for each function in _pfp_cover_range_fns, None if
+        the probe does not cover the aligned region according to that
+        function, or otherwise a tuple (start, end) giving the covered
+        range relative to sequence; a function is not called (and gives
+        None) if the one before it gives None
+    """
+    global _pfp_cover_range_fns
+
+    subseq_left = max(0, i - pos)
+    subseq_right = min(len(sequence), i - pos + len(probe_seq_full))
+    subsequence = sequence[subseq_left:subseq_right]
+    if i - pos < 0:
+        # An edge case where probe is cutoff on left end because it
+        # extends further left than where sequence begins
+        probe_seq = probe_seq_full[-(i - pos):]
+        # Shift kmer_start left from pos to determine its new
+        # position in probe_seq (equivalently its position in
+        # subsequence, which is i)
+        kmer_start = pos + (i - pos)
+    elif i - pos + len(probe_seq_full) > len(sequence):
+        # An edge case where probe is cutoff on right end because it
+        # extends further right than where sequence ends
+        probe_seq = probe_seq_full[:-(i - pos + len(probe_seq_full) -
+                                    len(sequence))]
+        kmer_start = pos
+    else:
+        probe_seq = probe_seq_full
+        kmer_start = pos
+
+    cover_ranges = [None for _ in _pfp_cover_range_fns]
+    for t, fn in enumerate(_pfp_cover_range_fns):
+        cover_range = fn(probe_seq, subsequence, kmer_start,
+                         kmer_start + k, len(probe_seq_full), len(sequence))
+        if cover_range is None:
+            break
+        cover_start, cover_end = cover_range
+        # cover_start and cover_end are relative to subsequence, so
+        # adjust these to be relative to sequence
+        cover_ranges[t] = (cover_start + subseq_left,
+                           cover_end + subseq_left)
+    return cover_ranges
+
+
+def _active_probes_in_scan():
+    """Give the flags of the probes to align in a scan by the pool.
+
+    Returns:
+        tuple (active_probes, clear_found) where active_probes is an
+        np.uint8 array giving a flag for each probe (indexed as in the
+        scan), such that probes whose flag is 0 are not aligned, or None
+        if every probe is aligned; and clear_found is True iff the flag of
+        a probe should be cleared once it is found to cover a range (in a
+        scan with find_probes_hitting_sequences())
+    """
+    global _pfp_active_probes
+    global _pfp_first_hit_only
+    global _pfp_scan_active_only
+
+    if _pfp_first_hit_only.value or _pfp_scan_active_only.value:
+        return (np.frombuffer(_pfp_active_probes, dtype=np.uint8),
+                bool(_pfp_first_hit_only.value))
+    return (None, False)
+
+
 def _find_probe_covers_in_subsequence(bounds,
                                       sequence,
                                       merge_overlapping=True):
@@ -1013,6 +1906,23 @@ def _find_probe_covers_in_subsequence(bounds,
     Scans through a subsequence of sequence, as specified by bounds, and
     looks for probes that cover a range of the subsequence.
 
+    Probes whose flag in _pfp_active_probes is cleared are not aligned
+    (see _active_probes_in_scan()); in a scan with
+    find_probes_hitting_sequences(), the flag of a probe is cleared once
+    it is found to cover a range.
+
+    If the pool has a Bloom filter of the k-mers in its kmer_probe_map
+    (_pfp_kmer_probe_map_bloom_filter), the k-mers of the subsequence are
+    encoded and checked against it a block at a time, and only those that
+    it does not rule out are looked up.
+
+    If the pool's kmer_probe_map is an EncodedKmerProbeMap (e.g., one
+    loaded, memory-mapped, from a directory), the k-mers of each block
+    are encoded and looked up in its sorted keys directly (see
+    _encoded_kmer_hits_in_block()), and each hit is then aligned as
+    here; the cover ranges are then keyed by probe index rather than by
+    probe sequence.
+
     Args:
         bounds: tuple of the form (start, end); scan through each k-mer
             in sequence beginning with the k-mer whose first base is
@@ -1026,22 +1936,36 @@ def _find_probe_covers_in_subsequence(bounds,
             probe covers two regions that overlap)
 
     Returns:
-        dict mapping probe sequences (as strings) to the set of ranges
-        (each range is a tuple of the form (start, end)) that each probe
+        list with one element (for the one strand scanned), which is
+        a list giving, for each function in _pfp_cover_range_fns, a dict
+        mapping probe sequences (as strings) to the set of ranges (each
+        range is a tuple of the form (start, end)) that each probe
         "covers" in the scanned subsequence
     """
+    global _pfp_cover_range_fns
+
     if bounds is None:
-        return {}
+        return [[{} for _ in _pfp_cover_range_fns]]
 
-    global _pfp_cover_range_for_probe_in_subsequence_fn
     global _pfp_kmer_probe_map_keys
     global _pfp_kmer_probe_map_probe_seqs_ind
     global _pfp_kmer_probe_map_probe_pos
     global _pfp_kmer_probe_map_probe_seqs
     global _pfp_kmer_probe_map_k
     global _pfp_kmer_probe_map_use_native
+    global _pfp_kmer_probe_map_bloom_filter
+    global _pfp_kmer_probe_map_is_encoded
 
-    if _pfp_kmer_probe_map_use_native:
+    active_probes, clear_found = _active_probes_in_scan()
+
+    if _pfp_kmer_probe_map_is_encoded:
+        return [_find_probe_covers_in_subsequence_with_encoded_map(bounds,
+            sequence, merge_overlapping, active_probes,
+            clear_found=clear_found)]
+
+    if _pfp_kmer_probe_map_use_native and active_probes is None:
+        # (When only some probes are aligned, the shared map is used
+        # because it gives indices of probes in _pfp_active_probes)
         global _pfp_kmer_probe_map_native
         shared_kmer_probe_map = _pfp_kmer_probe_map_native
     else:
@@ -1058,69 +1982,551 @@ def _find_probe_covers_in_subsequence(bounds,
     # add that range, as a tuple, to the probe's entry in
     # subseq_probe_cover_ranges
     start, end = bounds
-    subseq_probe_cover_ranges = defaultdict(list)
-    for i in range(start, end):
-        kmer = sequence[i:(i + k)]
-        # Find the probes with this kmer (with the potential to miss
-        # some probes due to false negatives)
-        probes_to_align = shared_kmer_probe_map.get(kmer)
-        if probes_to_align is None:
-            # No probes (from kmer_probe_map) share this kmer
-            continue
-        for probe_seq_str, pos in probes_to_align:
-            # kmer appears in probe at position pos. So align probe
-            # to sequence at i-pos and see how much of the subsequence
-            # starting here the probe covers.
-            probe_seq_full = np.fromiter(probe_seq_str, dtype='U1')
-            subseq_left = max(0, i - pos)
-            subseq_right = min(len(sequence), i - pos + len(probe_seq_full))
-            subsequence = sequence[subseq_left:subseq_right]
-            if i - pos < 0:
-                # An edge case where probe is cutoff on left end because it
-                # extends further left than where sequence begins
-                probe_seq = probe_seq_full[-(i - pos):]
-                # Shift kmer_start left from pos to determine its new
-                # position in probe_seq (equivalently its position in
-                # subsequence, which is i)
-                kmer_start = pos + (i - pos)
-            elif i - pos + len(probe_seq_full) > len(sequence):
-                # An edge case where probe is cutoff on right end because it
-                # extends further right than where sequence ends
-                probe_seq = probe_seq_full[:-(i - pos + len(probe_seq_full) -
-                                            len(sequence))]
-                kmer_start = pos
+    all_subseq_probe_cover_ranges = [defaultdict(list)
+                                     for _ in _pfp_cover_range_fns]
+    bloom = _pfp_kmer_probe_map_bloom_filter
+    for block_start in range(start, end, _VECTORIZED_SCAN_BLOCK_SIZE):
+        block_end = min(end, block_start + _VECTORIZED_SCAN_BLOCK_SIZE)
+        if bloom is None:
+            positions = range(block_start, block_end)
+        else:
+            # Only look up the k-mers that may be in the map; k-mers that
+            # cannot be encoded (e.g., with an ambiguous base) are not in
+            # the filter, and are looked up regardless
+            codes = twobit.encode(sequence[block_start:(block_end + k - 1)])
+            values, valid = twobit.kmer_values(codes, k)
+            may_be_present = ~valid
+            may_be_present[valid] = bloom.contains(values[valid])
+            positions = (np.flatnonzero(may_be_present) +
+                         block_start).tolist()
+        for i in positions:
+            kmer = sequence[i:(i + k)]
+            # Find the probes with this kmer (with the potential to miss
+            # some probes due to false negatives)
+            if active_probes is not None:
+                probes_to_align = shared_kmer_probe_map.get(kmer,
+                    include_probe_seqs_ind=True)
             else:
-                probe_seq = probe_seq_full
-                kmer_start = pos
-            cover_range = \
-                _pfp_cover_range_for_probe_in_subsequence_fn(
-                    probe_seq, subsequence, kmer_start, kmer_start + k,
-                    len(probe_seq_full), len(sequence))
-            if cover_range is None:
-                # probe does not meet the threshold for covering this
-                # subsequence
+                probes_to_align = shared_kmer_probe_map.get(kmer)
+            if probes_to_align is None:
+                # No probes (from kmer_probe_map) share this kmer
                 continue
-            cover_start, cover_end = cover_range
-            # cover_start and cover_end are relative to subsequence, so
-            # adjust these to be relative to sequence
-            cover_start += subseq_left
-            cover_end += subseq_left
-            subseq_probe_cover_ranges[probe_seq_str].append(
-                (cover_start, cover_end))
+            for probe_to_align in probes_to_align:
+                probe_seq_str, pos = probe_to_align[0], probe_to_align[1]
+                if (active_probes is not None and
+                        not active_probes[probe_to_align[2]]):
+                    # This probe is not aligned (e.g., it was already
+                    # found to cover a range)
+                    continue
+                # kmer appears in probe at position pos. So align probe
+                # to sequence at i-pos and see how much of the subsequence
+                # starting here the probe covers.
+                probe_seq_full = np.fromiter(probe_seq_str, dtype='U1')
+                cover_ranges = _cover_ranges_for_probe_at_kmer(
+                    probe_seq_full, pos, sequence, i, k)
+                if clear_found and cover_ranges[0] is not None:
+                    active_probes[probe_to_align[2]] = 0
+                for cover_range, subseq_probe_cover_ranges in zip(
+                        cover_ranges, all_subseq_probe_cover_ranges):
+                    if cover_range is None:
+                        # probe does not meet the threshold for covering
+                        # this subsequence
+                        break
+                    cover_start, cover_end = cover_range
+                    subseq_probe_cover_ranges[probe_seq_str].append(
+                        (cover_start, cover_end))
+                    if merge_overlapping:
+                        # Save some memory in each process by merging
+                        # cover ranges, since many found by this method
+                        # will overlap (This is not necessary because all
+                        # the cover ranges for each probe will be merged
+                        # across processes at the end of
+                        # find_probe_covers_in_sequence(), but it can save
+                        # considerable memory before that final merge.)
+                        subseq_probe_cover_ranges[probe_seq_str] = \
+                            interval.merge_overlapping(
+                                subseq_probe_cover_ranges[probe_seq_str])
+    return [[dict(d) for d in all_subseq_probe_cover_ranges]]
+
+
+# Number of k-mers to encode and look up at once when scanning with
+# _find_probe_covers_in_subsequence_vectorized() (or to check against a
+# Bloom filter in _find_probe_covers_in_subsequence()); this bounds the
+# memory used by the temporary arrays in each process
+_VECTORIZED_SCAN_BLOCK_SIZE = 2**20
+
+
+def _encoded_kmer_hits_in_block(kmer_probe_map, sequence, block_start,
+                                block_end):
+    """Find the entries of an EncodedKmerProbeMap for a block of k-mers.
+
+    Args:
+        kmer_probe_map: instance of EncodedKmerProbeMap
+        sequence: sequence (as a string)
+        block_start/block_end: look up the k-mers of sequence whose first
+            base is in [block_start, block_end)
+
+    Returns:
+        tuple (hit_pos, hit_probe_ind, hit_probe_pos) of np.arrays such
+        that, for each t, the k-mer at position hit_pos[t] of sequence is
+        at position hit_probe_pos[t] of the probe with index
+        hit_probe_ind[t]; the entries are ordered by hit_pos. When the
+        k-mers are hashed, an entry may be a collision of unequal k-mers.
+    """
+    k = kmer_probe_map.k
+    codes = twobit.encode(sequence[block_start:(block_end + k - 1)])
+    values, valid = twobit.kmer_values(codes, k)
+    valid_pos = np.flatnonzero(valid)
+    query_ind, key_ind = kmer_probe_map.lookup(values[valid_pos])
+    hit_pos = valid_pos[query_ind] + block_start
+    hit_probe_ind = kmer_probe_map.probe_seqs_ind[key_ind]
+    hit_probe_pos = kmer_probe_map.probe_pos[key_ind]
+
+    invalid_pos = np.flatnonzero(~valid) + block_start
+    if kmer_probe_map.ambiguous and len(invalid_pos) > 0:
+        # Add the hits of k-mers that cannot be encoded, keeping the hits
+        # ordered by position
+        ambiguous_hits = kmer_probe_map.lookup_ambiguous(
+            sequence, invalid_pos.tolist())
+        if len(ambiguous_hits[0]) > 0:
+            hit_pos, hit_probe_ind, hit_probe_pos = [
+                np.concatenate((a.astype(np.int64), b))
+                for a, b in zip((hit_pos, hit_probe_ind, hit_probe_pos),
+                                ambiguous_hits)]
+            order = np.argsort(hit_pos, kind='stable')
+            hit_pos, hit_probe_ind, hit_probe_pos = (
+                hit_pos[order], hit_probe_ind[order], hit_probe_pos[order])
+    return (hit_pos, hit_probe_ind, hit_probe_pos)
+
+
+def _find_probe_covers_in_subsequence_with_encoded_map(bounds, sequence,
+        merge_overlapping, active_probes, clear_found=True):
+    """Scan a subsequence with the pool's EncodedKmerProbeMap.
+
+    This is used by _find_probe_covers_in_subsequence() when the pool's
+    kmer_probe_map is encoded but the scan is not vectorized. It looks up
+    the k-mers of a block at a time in the map's arrays, which are read
+    as they are (possibly memory-mapped), and aligns each hit with
+    _cover_ranges_for_probe_at_kmer().
+
+    Args:
+        bounds/sequence/merge_overlapping: see
+            _find_probe_covers_in_subsequence()
+        active_probes: if set, np.uint8 array giving a flag for each
+            probe; hits of probes whose flag is 0 are skipped
+        clear_found: when True (and active_probes is set), the flag of a
+            probe is set to 0 once it is found to cover a range
+
+    Returns:
+        list giving, for each function in _pfp_cover_range_fns, a dict
+        mapping probe indices (in the EncodedKmerProbeMap) to the ranges
+        that each probe covers in the scanned subsequence
+    """
+    global _pfp_cover_range_fns
+    global _pfp_kmer_probe_map_keys
+    global _pfp_kmer_probe_map_probe_seqs_ind
+    global _pfp_kmer_probe_map_probe_pos
+    global _pfp_kmer_probe_map_probe_seqs
+    global _pfp_kmer_probe_map_probe_seqs_offsets
+    global _pfp_kmer_probe_map_k
+    global _pfp_kmer_probe_map_ambiguous
+
+    kmer_probe_map = EncodedKmerProbeMap(
+        _pfp_kmer_probe_map_keys,
+        _pfp_kmer_probe_map_probe_seqs_ind,
+        _pfp_kmer_probe_map_probe_pos,
+        _pfp_kmer_probe_map_probe_seqs,
+        _pfp_kmer_probe_map_probe_seqs_offsets,
+        _pfp_kmer_probe_map_k,
+        None,
+        ambiguous=_pfp_kmer_probe_map_ambiguous)
+    k = kmer_probe_map.k
+
+    all_subseq_probe_cover_ranges = [defaultdict(list)
+                                     for _ in _pfp_cover_range_fns]
+    # Memoize the sequence of each probe (as a string and as an np.array)
+    # since a probe is often hit many times
+    probe_seqs = {}
+    start, end = bounds
+    for block_start in range(start, end, _VECTORIZED_SCAN_BLOCK_SIZE):
+        block_end = min(end, block_start + _VECTORIZED_SCAN_BLOCK_SIZE)
+        hits = _encoded_kmer_hits_in_block(kmer_probe_map, sequence,
+                                           block_start, block_end)
+        for i, probe_ind, pos in zip(*[a.tolist() for a in hits]):
+            if active_probes is not None and not active_probes[probe_ind]:
+                # This probe is not aligned (e.g., it was already found
+                # to cover a range)
+                continue
+            if probe_ind not in probe_seqs:
+                probe_seq_str = kmer_probe_map.probe_seq_str(probe_ind)
+                probe_seqs[probe_ind] = (probe_seq_str,
+                    np.fromiter(probe_seq_str, dtype='U1'))
+            probe_seq_str, probe_seq_full = probe_seqs[probe_ind]
+            if (kmer_probe_map.hashed and
+                    sequence[i:(i + k)] != probe_seq_str[pos:(pos + k)]):
+                # The hashed k-mers collide, but are not equal
+                continue
+            cover_ranges = _cover_ranges_for_probe_at_kmer(
+                probe_seq_full, pos, sequence, i, k)
+            if clear_found and active_probes is not None and \
+                    cover_ranges[0] is not None:
+                active_probes[probe_ind] = 0
+            for cover_range, subseq_probe_cover_ranges in zip(
+                    cover_ranges, all_subseq_probe_cover_ranges):
+                if cover_range is None:
+                    break
+                subseq_probe_cover_ranges[probe_ind].append(cover_range)
+
+        if merge_overlapping:
+            # Save memory by merging cover ranges after each block
+            for subseq_probe_cover_ranges in all_subseq_probe_cover_ranges:
+                for probe_ind in subseq_probe_cover_ranges.keys():
+                    subseq_probe_cover_ranges[probe_ind] = interval.\
+                        merge_overlapping(
+                            subseq_probe_cover_ranges[probe_ind])
+    return [dict(d) for d in all_subseq_probe_cover_ranges]
+
+
+def _find_probe_covers_in_subsequence_vectorized(bounds,
+                                                 sequence,
+                                                 merge_overlapping=True,
+                                                 rc_too=False):
+    """Helper function for find_probe_covers_in_sequence().
+
+    This performs the same scan as _find_probe_covers_in_subsequence(), but
+    rather than looking up one k-mer at a time, it encodes all the k-mers in
+    a block of the subsequence as integers and looks them up together in the
+    arrays of an EncodedKmerProbeMap. The few k-mers that cannot be encoded
+    (e.g., with an ambiguous base) are looked up by their string. Only
+    positions with a hit are then aligned and checked for coverage.
+
+    When rc_too is True, the pool must have indexed canonical k-mers (see
+    open_probe_finding_pool()). Then each k-mer of the subsequence is
+    looked up once, by its canonical form, and a hit is aligned to the
+    sequence if the probe shares the k-mer itself and to the reverse
+    complement of the sequence if the probe shares its reverse complement.
+
+    As in _find_probe_covers_in_subsequence(), hits of probes whose flag
+    in _pfp_active_probes is cleared are not aligned.
+
+    Args:
+        bounds: tuple of the form (start, end); scan through each k-mer
+            in sequence beginning with the k-mer whose first base is
+            at start and ending with the k-mer whose first base is at
+            end-1
+        sequence: sequence (as a string) in which to find ranges that
+            probes cover
+        merge_overlapping: when True, merges overlapping ranges into
+            a single range; when False, intervals returned may be
+            overlapping
+        rc_too: when True, also find ranges covered in the reverse
+            complement of sequence by probes sharing a k-mer with the
+            reverse complement of the scanned subsequence
+
+    Returns:
+        list giving, for sequence and then (if rc_too is True) its reverse
+        complement, a list giving, for each function in
+        _pfp_cover_range_fns, a dict mapping probe indices (in the
+        EncodedKmerProbeMap) to the set of ranges (each range is a tuple
+        of the form (start, end)) that each probe "covers" in the scanned
+        subsequence
+    """
+    global _pfp_cover_range_fns
+
+    num_strands = 2 if rc_too else 1
+    if bounds is None:
+        return [[{} for _ in _pfp_cover_range_fns]
+                for _ in range(num_strands)]
+
+    global _pfp_kmer_probe_map_keys
+    global _pfp_kmer_probe_map_probe_seqs_ind
+    global _pfp_kmer_probe_map_probe_pos
+    global _pfp_kmer_probe_map_probe_seqs
+    global _pfp_kmer_probe_map_probe_seqs_offsets
+    global _pfp_kmer_probe_map_k
+    global _pfp_kmer_probe_map_hashed
+    global _pfp_kmer_probe_map_ambiguous
+    global _pfp_kmer_probe_map_canonical_keys
+    global _pfp_kmer_probe_map_canonical_key_ind
+    global _pfp_kmer_probe_map_canonical_strands
+
+    active_probes, clear_found = _active_probes_in_scan()
+
+    kmer_probe_map = EncodedKmerProbeMap(
+        _pfp_kmer_probe_map_keys,
+        _pfp_kmer_probe_map_probe_seqs_ind,
+        _pfp_kmer_probe_map_probe_pos,
+        _pfp_kmer_probe_map_probe_seqs,
+        _pfp_kmer_probe_map_probe_seqs_offsets,
+        _pfp_kmer_probe_map_k,
+        None,
+        ambiguous=_pfp_kmer_probe_map_ambiguous)
+    k = _pfp_kmer_probe_map_k
+
+    # Each strand that is scanned is given by a tuple (sequence, bytes of
+    # sequence, cover ranges found in it according to each function)
+    strand_seqs = [sequence]
+    if rc_too:
+        strand_seqs += [reverse_complement_sequence(sequence)]
+    strands = [[strand_seq, None,
+                [defaultdict(list) for _ in _pfp_cover_range_fns]]
+               for strand_seq in strand_seqs]
+
+    # If the functions determining coverage can score many hits at once
+    # (e.g., as returned by
+    # probe_covers_sequence_by_longest_common_substring()), use them;
+    # otherwise, call them on each hit
+    cover_range_fns_vectorized = [getattr(fn, 'vectorized', None)
+                                  for fn in _pfp_cover_range_fns]
+    score_in_bulk = all(fn is not None for fn in cover_range_fns_vectorized)
+    if score_in_bulk:
+        for strand in strands:
+            strand[1] = twobit.to_bytes_array(strand[0])
+
+    # Memoize the sequence of each probe (as a string and as an np.array)
+    # since a probe is often hit many times
+    probe_seqs = {}
+
+    start, end = bounds
+    for block_start in range(start, end, _VECTORIZED_SCAN_BLOCK_SIZE):
+        block_end = min(end, block_start + _VECTORIZED_SCAN_BLOCK_SIZE)
+        codes = twobit.encode(sequence[block_start:(block_end + k - 1)])
+        values, valid = twobit.kmer_values(codes, k)
+        valid_pos = np.flatnonzero(valid)
+        values = values[valid_pos]
+        # K-mers that cannot be encoded are looked up by their string
+        invalid_pos = np.flatnonzero(~valid) + block_start
+
+        if rc_too:
+            # Look up each k-mer by its canonical form; a hit is on the
+            # same strand as the sequence if the k-mer in the sequence and
+            # in the probe are on the same strand (relative to their
+            # canonical forms), and is on the reverse complement
+            # otherwise; a palindromic k-mer is on both
+            rc_values = twobit.reverse_complement_values(values, k)
+            canonical_values = np.minimum(values, rc_values)
+            query_ind, canonical_ind = _lookup_in_sorted_keys(
+                _pfp_kmer_probe_map_canonical_keys, canonical_values)
+            key_ind = _pfp_kmer_probe_map_canonical_key_ind[canonical_ind]
+            seq_strands = rc_values[query_ind] < values[query_ind]
+            same_strand = (_pfp_kmer_probe_map_canonical_strands[
+                canonical_ind] == seq_strands)
+            palindromic = rc_values[query_ind] == values[query_ind]
+            hit_pos = valid_pos[query_ind] + block_start
+            # A k-mer at position i in sequence is at position
+            # len(sequence) - k - i in its reverse complement
+            hits_by_strand = [
+                (hit_pos[same_strand], key_ind[same_strand]),
+                (len(sequence) - k - hit_pos[~same_strand | palindromic],
+                 key_ind[~same_strand | palindromic])]
+            invalid_pos_by_strand = [invalid_pos,
+                                     len(sequence) - k - invalid_pos[::-1]]
+        else:
+            query_ind, key_ind = kmer_probe_map.lookup(values)
+            hits_by_strand = [(valid_pos[query_ind] + block_start, key_ind)]
+            invalid_pos_by_strand = [invalid_pos]
+
+        for (strand_seq, strand_seq_bytes, all_subseq_probe_cover_ranges), \
+                (hit_pos, key_ind), strand_invalid_pos in zip(
+                strands, hits_by_strand, invalid_pos_by_strand):
+            hit_probe_ind = kmer_probe_map.probe_seqs_ind[key_ind]
+            hit_probe_pos = kmer_probe_map.probe_pos[key_ind]
+            if kmer_probe_map.ambiguous and len(strand_invalid_pos) > 0:
+                # Add the hits of k-mers that cannot be encoded, keeping
+                # the hits ordered by position
+                ambiguous_hits = kmer_probe_map.lookup_ambiguous(
+                    strand_seq, strand_invalid_pos.tolist())
+                if len(ambiguous_hits[0]) > 0:
+                    hit_pos, hit_probe_ind, hit_probe_pos = [
+                        np.concatenate((a.astype(np.int64), b))
+                        for a, b in zip((hit_pos, hit_probe_ind,
+                                         hit_probe_pos), ambiguous_hits)]
+                    order = np.argsort(hit_pos, kind='stable')
+                    hit_pos, hit_probe_ind, hit_probe_pos = (
+                        hit_pos[order], hit_probe_ind[order],
+                        hit_probe_pos[order])
+
+            if score_in_bulk:
+                # Score all hits in this block in bulk
+                fn_covers = _cover_ranges_for_hits_vectorized(
+                    kmer_probe_map, strand_seq_bytes, hit_pos,
+                    hit_probe_ind, hit_probe_pos, cover_range_fns_vectorized,
+                    active_probes=active_probes, clear_found=clear_found)
+                for (hit_probe_ind, cover_starts, cover_ends), \
+                        subseq_probe_cover_ranges in zip(
+                        fn_covers, all_subseq_probe_cover_ranges):
+                    for probe_ind, cover_start, cover_end in zip(
+                            hit_probe_ind.tolist(), cover_starts.tolist(),
+                            cover_ends.tolist()):
+                        subseq_probe_cover_ranges[probe_ind].append(
+                            (cover_start, cover_end))
+            else:
+                for i, probe_ind, pos in zip(hit_pos.tolist(),
+                                             hit_probe_ind.tolist(),
+                                             hit_probe_pos.tolist()):
+                    if (active_probes is not None and
+                            not active_probes[probe_ind]):
+                        # This probe is not aligned (e.g., it was already
+                        # found to cover a range)
+                        continue
+                    if probe_ind not in probe_seqs:
+                        probe_seq_str = kmer_probe_map.probe_seq_str(
+                            probe_ind)
+                        probe_seqs[probe_ind] = (probe_seq_str,
+                            np.fromiter(probe_seq_str, dtype='U1'))
+                    probe_seq_str, probe_seq_full = probe_seqs[probe_ind]
+                    if (kmer_probe_map.hashed and
+                            strand_seq[i:(i + k)] !=
+                            probe_seq_str[pos:(pos + k)]):
+                        # The hashed k-mers collide, but are not equal
+                        continue
+                    cover_ranges = _cover_ranges_for_probe_at_kmer(
+                        probe_seq_full, pos, strand_seq, i, k)
+                    if clear_found and cover_ranges[0] is not None:
+                        active_probes[probe_ind] = 0
+                    for cover_range, subseq_probe_cover_ranges in zip(
+                            cover_ranges, all_subseq_probe_cover_ranges):
+                        if cover_range is None:
+                            break
+                        subseq_probe_cover_ranges[probe_ind].append(
+                            cover_range)
+
             if merge_overlapping:
-                # Save some memory in each process by merging cover ranges,
-                # since many found by this method will overlap
-                # (This is not necessary because all the cover ranges for
-                # each probe will be merged across processes at the end of
-                # find_probe_covers_in_sequence(), but it can save
-                # considerable memory before that final merge.)
-                subseq_probe_cover_ranges[probe_seq_str] = interval.\
-                    merge_overlapping(subseq_probe_cover_ranges[probe_seq_str])
-    return dict(subseq_probe_cover_ranges)
+                # Save memory by merging cover ranges after each block
+                for subseq_probe_cover_ranges in \
+                        all_subseq_probe_cover_ranges:
+                    for probe_ind in subseq_probe_cover_ranges.keys():
+                        subseq_probe_cover_ranges[probe_ind] = interval.\
+                            merge_overlapping(
+                                subseq_probe_cover_ranges[probe_ind])
+
+    return [[dict(d) for d in strand[2]] for strand in strands]
+
+
+# Number of k-mers of a kmer_probe_map to look up at once in a k-mer index
+# in count_bp_covered_in_kmer_index()
+_KMER_INDEX_LOOKUP_SIZE = 2**16
+
+
+# Number of hits to align and score at once in
+# _cover_ranges_for_hits_vectorized(); this bounds the size of the
+# temporary matrices, which have one row per hit
+_VECTORIZED_SCORE_BATCH_SIZE = 2**14
+
+
+def _cover_ranges_for_hits_vectorized(kmer_probe_map, seq_bytes, hit_pos,
+                                      hit_probe_ind, hit_probe_pos,
+                                      cover_range_fns_vectorized,
+                                      active_probes=None, clear_found=True):
+    """Determine the ranges covered by probes at many shared k-mers at once.
+
+    This does, for all hits, what _cover_ranges_for_probe_at_kmer() does for
+    one: each row of a matrix holds a probe and, aligned with it, the part
+    of the sequence around where its k-mer was found. Columns that fall
+    past either end of the sequence are cut from the row.
+
+    Args:
+        kmer_probe_map: instance of EncodedKmerProbeMap
+        seq_bytes: np.uint8 array of the ASCII values of the sequence
+        hit_pos: array giving, for each hit, the position of the shared
+            k-mer in the sequence
+        hit_probe_ind: array giving, for each hit, the index of the probe
+            in kmer_probe_map
+        hit_probe_pos: array giving, for each hit, the position of the
+            shared k-mer in the probe
+        cover_range_fns_vectorized: list of functions that score rows of
+            aligned probes and sequence in bulk (see
+            probe_covers_sequence_by_longest_common_substring()); each
+            function only scores the rows that the one before it covers
+        active_probes: if set, np.uint8 array giving a flag for each
+            probe; hits of probes whose flag is 0 are skipped
+        clear_found: when True (and active_probes is set), the flag of a
+            probe is set to 0 (after each batch of hits) once it is found
+            to cover a range according to the first function
+
+    Returns:
+        list giving, for each function in cover_range_fns_vectorized, a
+        tuple (probe_ind, cover_start, cover_end) of arrays with one entry
+        per hit that covers the sequence, giving the index of the probe
+        and the range (relative to the sequence) that it covers
+    """
+    k = kmer_probe_map.k
+    offsets = kmer_probe_map.probe_seqs_offsets
+    probe_seqs = kmer_probe_map.probe_seqs
+    max_probe_len = int(np.max(np.diff(offsets)))
+    cols = np.arange(max_probe_len)
+
+    fn_covers = [([], [], []) for _ in cover_range_fns_vectorized]
+    for batch_start in range(0, len(hit_pos), _VECTORIZED_SCORE_BATCH_SIZE):
+        batch = slice(batch_start, batch_start + _VECTORIZED_SCORE_BATCH_SIZE)
+        probe_ind = hit_probe_ind[batch]
+        pos = hit_probe_pos[batch].astype(np.int64)
+        batch_hit_pos = hit_pos[batch]
+        if active_probes is not None:
+            # Skip hits of probes that are not aligned (e.g., that were
+            # already found to cover a range)
+            active = active_probes[probe_ind] != 0
+            probe_ind, pos, batch_hit_pos = (probe_ind[active], pos[active],
+                                             batch_hit_pos[active])
+        probe_lens = offsets[probe_ind + 1] - offsets[probe_ind]
+        # The column j of a row corresponds to position j of the probe
+        # and position window_start + j of the sequence
+        window_start = batch_hit_pos - pos
+        starts = np.maximum(0, -window_start)
+        ends = np.minimum(probe_lens, len(seq_bytes) - window_start)
+
+        # Fill in the matrices; entries outside of [starts, ends) are
+        # filled with arbitrary bases, and are ignored
+        probe_mat = probe_seqs[np.minimum(
+            offsets[probe_ind][:, np.newaxis] + cols, len(probe_seqs) - 1)]
+        seq_mat = seq_bytes[np.clip(window_start[:, np.newaxis] + cols, 0,
+                                    len(seq_bytes) - 1)]
+
+        if kmer_probe_map.hashed:
+            # Discard hits whose hashed k-mers collide but are not equal
+            anchor_cols = pos[:, np.newaxis] + np.arange(k)
+            rows = np.arange(len(pos))[:, np.newaxis]
+            equal = np.all(probe_mat[rows, anchor_cols] ==
+                           seq_mat[rows, anchor_cols], axis=1)
+            probe_ind, pos, probe_lens, window_start, starts, ends = (
+                probe_ind[equal], pos[equal], probe_lens[equal],
+                window_start[equal], starts[equal], ends[equal])
+            probe_mat, seq_mat = probe_mat[equal], seq_mat[equal]
+
+        for t, (fn, (probe_ind_covered, cover_starts, cover_ends)) in \
+                enumerate(zip(cover_range_fns_vectorized, fn_covers)):
+            if len(probe_ind) == 0:
+                # No rows are left to score
+                covered = np.zeros(0, dtype=bool)
+                start, end = pos, pos
+            else:
+                covered, start, end = fn(
+                    probe_mat, seq_mat, pos, pos + k, starts, ends,
+                    probe_lens, len(seq_bytes))
+            probe_ind_covered += [probe_ind[covered]]
+            cover_starts += [window_start[covered] + start[covered]]
+            cover_ends += [window_start[covered] + end[covered]]
+            if clear_found and active_probes is not None and t == 0:
+                active_probes[probe_ind[covered]] = 0
+
+            # Only score, with the next function, the rows covered by
+            # this one
+            probe_ind, pos, probe_lens, window_start, starts, ends = (
+                probe_ind[covered], pos[covered], probe_lens[covered],
+                window_start[covered], starts[covered], ends[covered])
+            probe_mat, seq_mat = probe_mat[covered], seq_mat[covered]
+
+    if len(hit_pos) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return [(empty, empty, empty) for _ in cover_range_fns_vectorized]
+    return [(np.concatenate(probe_ind_covered), np.concatenate(cover_starts),
+             np.concatenate(cover_ends))
+            for probe_ind_covered, cover_starts, cover_ends in fn_covers]
 
 
 def find_probe_covers_in_sequence(sequence,
-                                  merge_overlapping=True):
+                                  merge_overlapping=True,
+                                  rc_too=False):
     """Find ranges in sequence that a collection of probes cover.
 
     This uses multiple processes to scan through sequence in parallel.
@@ -1167,6 +2573,15 @@ def find_probe_covers_in_sequence(sequence,
     where num_kmers_per_probe is a parameter used when constructing
     kmer_probe_map.
 
+    If a cover cache was set with set_cover_cache(), the output may be
+    read from it rather than computed (see set_cover_cache()).
+
+    When rc_too is True, this also finds the ranges that the probes cover
+    in the reverse complement of sequence. If the pool indexed canonical
+    k-mers (see open_probe_finding_pool()), both are found in a single
+    scan of sequence; otherwise, the reverse complement is scanned
+    separately.
+
     Args:
         sequence: sequence (as a string) in which to find ranges that
             probes cover
@@ -1174,21 +2589,47 @@ def find_probe_covers_in_sequence(sequence,
             a single range and returns the ranges in sorted order; when
             False, intervals returned may be overlapping (e.g., if a
             probe covers two regions that overlap)
+        rc_too: when True, also find ranges covered in the reverse
+            complement of sequence
 
     Returns:
         dict mapping probes to the set of ranges (each range is a tuple
-        of the form (start, end)) that each probe "covers"
+        of the form (start, end)) that each probe "covers"; or, if the
+        pool was opened with a tuple of functions to determine coverage,
+        a tuple with one such dict per function. If rc_too is True, this
+        returns a tuple of two of these, the second giving ranges in the
+        reverse complement of sequence (relative to the start of the
+        reverse complement)
 
     Raises:
         RuntimeError if a pool for finding probes is not open; a pool
         must be opened prior to calling this function by calling
         open_probe_finding_pool()
     """
+    _check_probe_finding_pool_is_open()
+
+    keys = _cover_cache_keys(sequence, merge_overlapping, rc_too)
+    cached = _get_cover_ranges_from_cache(keys)
+    probes_to_scan = None if cached is None else cached[1]
+    if probes_to_scan is not None and not probes_to_scan.any():
+        # The covers of every probe are cached
+        probe_cover_ranges = cached[2]
+    else:
+        probe_cover_ranges = _add_cached_cover_ranges(cached,
+            _find_probe_covers_in_sequence(sequence, merge_overlapping,
+                rc_too=rc_too, probes_to_scan=probes_to_scan))
+        _put_cover_ranges_in_cache(keys, cached, probes_to_scan,
+                                   probe_cover_ranges)
+    return _shape_probe_cover_ranges(probe_cover_ranges)
+
+
+def _check_probe_finding_pool_is_open():
+    """Check that a probe finding pool is open.
+
+    Raises:
+        RuntimeError if a pool for finding probes is not open
+    """
     global _pfp_is_open
-    global _pfp_pool
-    global _pfp_work_was_submitted
-    global _pfp_kmer_probe_map_probe_seqs_to_probe
-    global _pfp_kmer_probe_map_k
 
     pfp_is_open = False
     try:
@@ -1199,6 +2640,897 @@ def find_probe_covers_in_sequence(sequence,
     if not pfp_is_open:
         raise RuntimeError("Probe finding pool is not open")
 
+
+def _cover_cache_key(sequence, merge_overlapping, rc=False, fn_index=0):
+    """Determine the key of the covers in a sequence in the cover cache.
+
+    Args:
+        sequence: sequence (as a string) in which to find ranges that
+            probes cover
+        merge_overlapping: see find_probe_covers_in_sequence()
+        rc: when True, give the key of the covers in the reverse
+            complement of sequence
+        fn_index: index of the function, among those that the pool
+            determines coverage with, that gives the covers
+
+    Returns:
+        key (string), or None if covers are not cached
+    """
+    global _pfp_cover_cache_key
+
+    if _cover_cache is None or _pfp_cover_cache_key is None:
+        return None
+    h = hashlib.sha224()
+    h.update(_pfp_cover_cache_key.encode())
+    h.update(str(merge_overlapping).encode())
+    if rc:
+        h.update(b'rc')
+    if fn_index > 0:
+        h.update(('fn%d' % fn_index).encode())
+    h.update(sequence.encode())
+    return h.hexdigest()
+
+
+def _cover_cache_keys(sequence, merge_overlapping, rc_too):
+    """Determine the keys of the covers to find in a sequence.
+
+    Args:
+        sequence: sequence (as a string) in which to find ranges that
+            probes cover
+        merge_overlapping/rc_too: see find_probe_covers_in_sequence()
+
+    Returns:
+        list giving, for each strand to scan, a list of keys (see
+        _cover_cache_key()) with one for each function that the pool
+        determines coverage with; or None if covers are not cached
+    """
+    global _pfp_cover_cache_key
+    global _pfp_cover_range_fns
+
+    if _cover_cache is None or _pfp_cover_cache_key is None:
+        return None
+    strands = [False, True] if rc_too else [False]
+    return [[_cover_cache_key(sequence, merge_overlapping, rc=rc,
+                              fn_index=t)
+             for t in range(len(_pfp_cover_range_fns))]
+            for rc in strands]
+
+
+def _cover_cache_probe_hash(p):
+    """Hash a probe to identify it in entries of the cover cache.
+
+    Args:
+        p: probe
+
+    Returns:
+        64-bit integer hash of the sequence of p
+    """
+    return int.from_bytes(hashlib.sha224(p.seq_str.encode()).digest()[:8],
+                          'little')
+
+
+def _get_cover_ranges_from_cache(keys):
+    """Read the covers in a sequence from the cover cache.
+
+    The probes of the pool whose covers are in every entry (i.e., that
+    were already scanned with the sequence) need not be scanned again.
+
+    Args:
+        keys: output of _cover_cache_keys()
+
+    Returns:
+        tuple (entries, probes_to_scan, probe_cover_ranges) where entries
+        gives the entries read for keys (None where there is none),
+        probes_to_scan is an np.array of bools giving, for each probe of
+        the pool (indexed as in the scan), whether its covers are missing
+        from any entry, and probe_cover_ranges gives the covers of the
+        other probes in the form output by
+        _find_probe_covers_in_sequence(); or None if covers are not cached
+    """
+    global _pfp_cover_cache_probes
+    global _pfp_cover_cache_probe_hashes
+
+    if keys is None:
+        return None
+    entries = [[_cover_cache.get(key) for key in strand_keys]
+               for strand_keys in keys]
+    scanned = np.ones(len(_pfp_cover_cache_probes), dtype=bool)
+    for strand_entries in entries:
+        for entry in strand_entries:
+            if entry is None:
+                scanned[:] = False
+            else:
+                scanned &= np.isin(_pfp_cover_cache_probe_hashes, entry[0])
+    probe_cover_ranges = [[_cover_ranges_from_cache_entry(entry, scanned)
+                           for entry in strand_entries]
+                          for strand_entries in entries]
+    return (entries, ~scanned, probe_cover_ranges)
+
+
+def _add_cached_cover_ranges(cached, probe_cover_ranges):
+    """Add covers read from the cover cache to covers found by a scan.
+
+    Args:
+        cached: output of _get_cover_ranges_from_cache()
+        probe_cover_ranges: output of _find_probe_covers_in_sequence()
+
+    Returns:
+        probe_cover_ranges, with the covers in cached of probes that
+        were not scanned added
+    """
+    if cached is None:
+        return probe_cover_ranges
+    combined = []
+    for strand_cached, strand_scanned in zip(cached[2], probe_cover_ranges):
+        combined += [[]]
+        for fn_cached, fn_scanned in zip(strand_cached, strand_scanned):
+            fn_combined = dict(fn_cached)
+            fn_combined.update(fn_scanned)
+            combined[-1] += [fn_combined]
+    return combined
+
+
+def _put_cover_ranges_in_cache(keys, cached, probes_scanned,
+                               probe_cover_ranges):
+    """Save the covers in a sequence to the cover cache.
+
+    Each entry is updated with the covers of the probes that were
+    scanned, which replace any covers of those probes it already holds;
+    the covers of other probes it holds are kept.
+
+    Args:
+        keys: output of _cover_cache_keys()
+        cached: output of _get_cover_ranges_from_cache()
+        probes_scanned: np.array of bools giving, for each probe of the
+            pool (indexed as in the scan), whether it was scanned
+        probe_cover_ranges: output of _find_probe_covers_in_sequence(),
+            giving covers of (at least) the probes scanned
+    """
+    global _pfp_first_hit_only
+    global _pfp_cover_cache_probe_hashes
+
+    if keys is None or _pfp_first_hit_only.value:
+        # Covers found by find_probes_hitting_sequences() are incomplete,
+        # so do not cache them
+        return
+    if not probes_scanned.any():
+        # Nothing new was found
+        return
+    scanned_hashes = _pfp_cover_cache_probe_hashes[probes_scanned]
+    for strand_keys, strand_entries, strand_probe_cover_ranges in zip(
+            keys, cached[0], probe_cover_ranges):
+        for key, entry, fn_probe_cover_ranges in zip(
+                strand_keys, strand_entries, strand_probe_cover_ranges):
+            probe_hashes, probe_ind, starts, ends = \
+                _cover_ranges_to_cache_entry(fn_probe_cover_ranges,
+                                             probes_scanned)
+            if entry is not None:
+                # Keep the covers of probes in the entry that were not
+                # scanned; the indices of their hashes shift down as the
+                # hashes of scanned probes are removed
+                old_hashes, old_ind, old_starts, old_ends = entry
+                keep_hash = ~np.isin(old_hashes, scanned_hashes)
+                new_hash_ind = np.cumsum(keep_hash) - 1
+                keep = keep_hash[old_ind]
+                probe_ind = np.concatenate((
+                    new_hash_ind[old_ind[keep]],
+                    probe_ind + np.count_nonzero(keep_hash)))
+                probe_hashes = np.concatenate((old_hashes[keep_hash],
+                                               probe_hashes))
+                starts = np.concatenate((old_starts[keep], starts))
+                ends = np.concatenate((old_ends[keep], ends))
+            _cover_cache.put(key, probe_hashes.astype(np.uint64),
+                             probe_ind.astype(np.uint32),
+                             starts.astype(np.int64), ends.astype(np.int64))
+
+
+def _shape_probe_cover_ranges(probe_cover_ranges):
+    """Give covers in the form output by find_probe_covers_in_sequence().
+
+    Args:
+        probe_cover_ranges: output of _find_probe_covers_in_sequence()
+
+    Returns:
+        output of find_probe_covers_in_sequence()
+    """
+    strands = [tuple(strand_probe_cover_ranges)
+               if len(strand_probe_cover_ranges) > 1
+               else strand_probe_cover_ranges[0]
+               for strand_probe_cover_ranges in probe_cover_ranges]
+    if len(strands) > 1:
+        return tuple(strands)
+    return strands[0]
+
+
+# A sequence is scanned by splitting it across the processes in the probe
+# finding pool if each process would scan at least this many bases;
+# shorter sequences are scanned whole, with many in each task
+_MIN_BASES_PER_SCAN_TASK = 2**16
+
+# Maximum number of bases of sequences that
+# find_probe_covers_in_sequences() holds and scans at a time
+_MAX_BASES_PER_SCAN_WINDOW = 2**26
+
+
+def find_probe_covers_in_sequences(sequences, merge_overlapping=True,
+                                   rc_too=False):
+    """Find ranges that a collection of probes cover in many sequences.
+
+    This gives the same output as calling find_probe_covers_in_sequence()
+    on each sequence, but chooses how to parallelize according to the
+    lengths of the sequences. Long sequences are each split across the
+    processes in the pool, as in find_probe_covers_in_sequence(). Short
+    sequences (e.g., many short viral genomes), for which splitting would
+    give each process too little work to be worth sending it, are instead
+    scanned whole: they are batched, with many in each task, and the tasks
+    are distributed with imap_unordered(). The number of bases in each
+    batch adapts to the total length of the sequences, so that there are
+    several tasks for each process.
+
+    sequences is consumed lazily, a window of sequences at a time.
+
+    Args:
+        sequences: iterable of sequences (as strings) in which to find
+            ranges that probes cover
+        merge_overlapping/rc_too: see find_probe_covers_in_sequence()
+
+    Yields:
+        for each sequence in sequences, in order, the output of
+        find_probe_covers_in_sequence()
+
+    Raises:
+        RuntimeError if a pool for finding probes is not open; a pool
+        must be opened prior to calling this function by calling
+        open_probe_finding_pool()
+    """
+    global _pfp_pool
+
+    _check_probe_finding_pool_is_open()
+
+    window = []
+    window_num_bases = 0
+    for sequence in sequences:
+        window += [sequence]
+        window_num_bases += len(sequence)
+        if window_num_bases >= _MAX_BASES_PER_SCAN_WINDOW:
+            for probe_cover_ranges in _find_probe_covers_in_sequence_window(
+                    window, merge_overlapping, rc_too):
+                yield _shape_probe_cover_ranges(probe_cover_ranges)
+            window = []
+            window_num_bases = 0
+    for probe_cover_ranges in _find_probe_covers_in_sequence_window(window,
+            merge_overlapping, rc_too):
+        yield _shape_probe_cover_ranges(probe_cover_ranges)
+
+
+def find_probes_hitting_sequences(sequences, rc_too=False):
+    """Find the probes that cover part of any of many sequences.
+
+    This gives the same probes as taking those with at least one range in
+    the output of find_probe_covers_in_sequences(), but it exits early:
+    once a probe is found to cover a range, the processes in the pool stop
+    aligning that probe to the sequences (see _pfp_active_probes), so the
+    scan gets cheaper as probes are found. When all probes are found, the
+    sequences not yet read from sequences are not scanned.
+
+    If the pool determines coverage with a tuple of functions, this uses
+    the first.
+
+    Args:
+        sequences: iterable of sequences (as strings)
+        rc_too: when True, also find the probes that cover part of the
+            reverse complements of the sequences
+
+    Returns:
+        set of probes (values in the kmer_probe_map passed to
+        open_probe_finding_pool()) that cover at least one range
+
+    Raises:
+        RuntimeError if a pool for finding probes is not open
+    """
+    global _pfp_active_probes
+    global _pfp_first_hit_only
+    global _pfp_cover_range_fns
+    global _pfp_kmer_probe_map_probe_seqs_to_probe
+    global _pfp_kmer_probe_map_is_encoded
+
+    _check_probe_finding_pool_is_open()
+
+    active_probes = np.frombuffer(_pfp_active_probes, dtype=np.uint8)
+    active_probes[:] = 1
+    _pfp_first_hit_only.value = True
+    probes_hit = set()
+    try:
+        for probe_cover_ranges in find_probe_covers_in_sequences(sequences,
+                merge_overlapping=False, rc_too=rc_too):
+            strands = probe_cover_ranges if rc_too else (probe_cover_ranges,)
+            for strand_probe_cover_ranges in strands:
+                if len(_pfp_cover_range_fns) > 1:
+                    strand_probe_cover_ranges = strand_probe_cover_ranges[0]
+                probes_hit.update(p for p, cover_ranges in
+                                  strand_probe_cover_ranges.items()
+                                  if len(cover_ranges) > 0)
+            if not active_probes.any():
+                # Every probe was found to cover a range (possibly in
+                # sequences whose output is not yet given), so there is
+                # no need to scan further
+                if _pfp_kmer_probe_map_is_encoded:
+                    probes_hit = set(_pfp_kmer_probe_map_probe_seqs_to_probe)
+                else:
+                    probes_hit = set(
+                        _pfp_kmer_probe_map_probe_seqs_to_probe.values())
+                break
+    finally:
+        _pfp_first_hit_only.value = False
+    return probes_hit
+
+
+def _probe_finding_pool_encoded_kmer_probe_map():
+    """Give the kmer_probe_map of the probe finding pool, encoded.
+
+    Returns:
+        instance of EncodedKmerProbeMap storing the kmer_probe_map passed
+        to open_probe_finding_pool(); if that map was not already
+        encoded, it is constructed the first time this is called for a
+        pool that does not use a vectorized scan
+    """
+    global _pfp_encoded_kmer_probe_map
+    global _pfp_kmer_probe_map_keys
+    global _pfp_kmer_probe_map_probe_seqs_ind
+    global _pfp_kmer_probe_map_probe_pos
+    global _pfp_kmer_probe_map_probe_seqs
+    global _pfp_kmer_probe_map_k
+    global _pfp_kmer_probe_map_probe_seqs_to_probe
+    global _pfp_kmer_probe_map_native
+
+    if _pfp_encoded_kmer_probe_map is None:
+        _pfp_encoded_kmer_probe_map = EncodedKmerProbeMap.construct(
+            SharedKmerProbeMap(_pfp_kmer_probe_map_keys,
+                               _pfp_kmer_probe_map_probe_seqs_ind,
+                               _pfp_kmer_probe_map_probe_pos,
+                               _pfp_kmer_probe_map_probe_seqs,
+                               _pfp_kmer_probe_map_k,
+                               _pfp_kmer_probe_map_probe_seqs_to_probe,
+                               _pfp_kmer_probe_map_native))
+    return _pfp_encoded_kmer_probe_map
+
+
+def can_count_bp_covered_in_kmer_index(kmer_index):
+    """Determine whether count_bp_covered_in_kmer_index() can be used.
+
+    That requires that the function determining coverage in the probe
+    finding pool (the first, if there is a tuple of them) can score hits
+    in bulk, and that the k-mers of the pool's kmer_probe_map have the
+    same length as those in the index.
+
+    Args:
+        kmer_index: instance of kmer_index.GenomeKmerIndex
+
+    Returns:
+        True iff count_bp_covered_in_kmer_index() can be called with
+        kmer_index
+
+    Raises:
+        RuntimeError if a pool for finding probes is not open
+    """
+    global _pfp_cover_range_fns
+    global _pfp_kmer_probe_map_k
+
+    _check_probe_finding_pool_is_open()
+
+    return (getattr(_pfp_cover_range_fns[0], 'vectorized', None) is not None
+            and _pfp_kmer_probe_map_k == kmer_index.k)
+
+
+def count_bp_covered_in_kmer_index(kmer_index):
+    """Count the bp that probes cover in the genomes of a k-mer index.
+
+    This gives the same counts as summing, over every sequence in the
+    index, the lengths of the (merged) ranges that each probe covers in
+    the sequence and its reverse complement, according to the output of
+    find_probe_covers_in_sequence() with rc_too=True. But rather than
+    scanning the sequences, it looks up the k-mers of the probes in the
+    index, which gives every position at which a probe shares a k-mer
+    with a sequence (on either strand), and aligns each probe only at
+    those positions; the cost therefore scales with the number of probes
+    rather than with the size of the sequences. The alignments are scored
+    in bulk, in this process, with the function determining coverage in
+    the probe finding pool (the first, if there is a tuple of them).
+
+    Args:
+        kmer_index: instance of kmer_index.GenomeKmerIndex; see
+            can_count_bp_covered_in_kmer_index() for requirements
+
+    Returns:
+        dict mapping each probe (value in the kmer_probe_map passed to
+        open_probe_finding_pool()) that covers at least one bp to the
+        total number of bp it covers in the sequences and their reverse
+        complements
+
+    Raises:
+        RuntimeError if a pool for finding probes is not open
+        ValueError if can_count_bp_covered_in_kmer_index() is False
+    """
+    global _pfp_cover_range_fns
+
+    if not can_count_bp_covered_in_kmer_index(kmer_index):
+        raise ValueError(("The probe finding pool cannot count coverage "
+                          "with this k-mer index"))
+
+    kmer_probe_map = _probe_finding_pool_encoded_kmer_probe_map()
+    cover_range_fn_vectorized = _pfp_cover_range_fns[0].vectorized
+    k = kmer_index.k
+
+    # Find every occurrence, on either strand, of every k-mer in the map;
+    # as in _find_probe_covers_in_subsequence_vectorized(), a hit is on
+    # the same strand as a sequence if the k-mer in the probe and in the
+    # sequence are on the same strand (relative to their canonical
+    # forms), and is on the reverse complement otherwise
+    canonical_keys, key_ind, key_strands = kmer_probe_map.canonical_index()
+    palindromic = (twobit.reverse_complement_values(canonical_keys, k) ==
+                   canonical_keys)
+    hit_probe_ind, hit_probe_pos, hit_pos, hit_rc = [], [], [], []
+    for start in range(0, len(canonical_keys), _KMER_INDEX_LOOKUP_SIZE):
+        chunk = slice(start, start + _KMER_INDEX_LOOKUP_SIZE)
+        query_ind, index_ind = kmer_index.lookup(canonical_keys[chunk])
+        pos = np.asarray(kmer_index.pos[index_ind])
+        same_strand = (np.asarray(kmer_index.strands[index_ind]) ==
+                       key_strands[chunk][query_ind])
+        rc = ~same_strand | palindromic[chunk][query_ind]
+        # A palindromic k-mer is on both strands
+        both = same_strand & rc
+        chunk_key_ind = key_ind[chunk][query_ind]
+        chunk_key_ind = np.concatenate((chunk_key_ind, chunk_key_ind[both]))
+        hit_probe_ind += [kmer_probe_map.probe_seqs_ind[chunk_key_ind]]
+        hit_probe_pos += [kmer_probe_map.probe_pos[chunk_key_ind]]
+        hit_pos += [pos, pos[both]]
+        hit_rc += [rc, np.zeros(np.count_nonzero(both), dtype=bool)]
+    if kmer_probe_map.ambiguous:
+        # The index holds k-mers that cannot be encoded in a side table,
+        # so look those up separately
+        ambiguous_hits = _find_ambiguous_kmers_in_kmer_index(
+            kmer_probe_map, kmer_index)
+        for hits, ambiguous_hit in zip((hit_probe_ind, hit_probe_pos,
+                                        hit_pos, hit_rc), ambiguous_hits):
+            hits += [ambiguous_hit]
+    hit_probe_ind = np.concatenate(hit_probe_ind).astype(np.int64)
+    hit_probe_pos = np.concatenate(hit_probe_pos).astype(np.int64)
+    hit_pos = np.concatenate(hit_pos)
+    hit_rc = np.concatenate(hit_rc)
+
+    # Align and score the hits one sequence (and strand) at a time
+    hit_seq = kmer_index.seq_index(hit_pos)
+    order = np.lexsort((hit_rc, hit_seq))
+    hit_probe_ind, hit_probe_pos, hit_pos, hit_rc, hit_seq = (
+        hit_probe_ind[order], hit_probe_pos[order], hit_pos[order],
+        hit_rc[order], hit_seq[order])
+    group_starts = np.flatnonzero(np.concatenate(
+        ([True], (hit_seq[1:] != hit_seq[:-1]) |
+         (hit_rc[1:] != hit_rc[:-1]))))
+    group_ends = np.append(group_starts[1:], len(hit_seq))
+    covered_probe_ind, covered_group, cover_starts, cover_ends = \
+        [], [], [], []
+    seq_j, seq_bytes = None, None
+    for group, (group_start, group_end) in enumerate(zip(group_starts,
+                                                         group_ends)):
+        j = int(hit_seq[group_start])
+        rc = bool(hit_rc[group_start])
+        if j != seq_j:
+            seq_j, seq_bytes = j, np.asarray(kmer_index.seq_bytes(j))
+        pos = hit_pos[group_start:group_end] - kmer_index.seq_offsets[j]
+        if rc:
+            # A k-mer at position i in a sequence is at position
+            # len(sequence) - k - i in its reverse complement
+            strand_seq_bytes = np.frombuffer(
+                seq_bytes[::-1].tobytes().translate(_RC_TABLE),
+                dtype=np.uint8)
+            pos = len(seq_bytes) - k - pos
+        else:
+            strand_seq_bytes = seq_bytes
+        (probe_ind, starts, ends), = _cover_ranges_for_hits_vectorized(
+            kmer_probe_map, strand_seq_bytes, pos,
+            hit_probe_ind[group_start:group_end],
+            hit_probe_pos[group_start:group_end],
+            [cover_range_fn_vectorized])
+        covered_probe_ind += [probe_ind.astype(np.int64)]
+        covered_group += [np.full(len(probe_ind), group, dtype=np.int64)]
+        cover_starts += [starts.astype(np.int64)]
+        cover_ends += [ends.astype(np.int64)]
+    if len(covered_probe_ind) == 0:
+        return {}
+    covered_probe_ind = np.concatenate(covered_probe_ind)
+    covered_group = np.concatenate(covered_group)
+    cover_starts = np.concatenate(cover_starts)
+    cover_ends = np.concatenate(cover_ends)
+
+    # Compute the length of the union of the ranges that each probe covers
+    # in each sequence (and strand): sort the ranges, and shift each
+    # (probe, group) into its own stretch of coordinates so that a running
+    # maximum of the ends gives, for each range, the end of the union of
+    # the ranges before it
+    order = np.lexsort((cover_starts, covered_group, covered_probe_ind))
+    covered_probe_ind, covered_group, cover_starts, cover_ends = (
+        covered_probe_ind[order], covered_group[order], cover_starts[order],
+        cover_ends[order])
+    new_run = np.concatenate(([True],
+        (covered_probe_ind[1:] != covered_probe_ind[:-1]) |
+        (covered_group[1:] != covered_group[:-1])))
+    shift = (np.cumsum(new_run) - 1) * (int(np.max(cover_ends)) + 1)
+    shifted_starts = cover_starts + shift
+    shifted_ends = cover_ends + shift
+    prev_ends = np.concatenate(([0], np.maximum.accumulate(
+        shifted_ends)[:-1]))
+    prev_ends[new_run] = shifted_starts[new_run]
+    num_bp = np.maximum(0, shifted_ends -
+                        np.maximum(shifted_starts, prev_ends))
+    num_bp_by_probe = np.bincount(covered_probe_ind, weights=num_bp,
+                                  minlength=len(kmer_probe_map.probes))
+    return {kmer_probe_map.probes[j]: int(num_bp_by_probe[j])
+            for j in np.flatnonzero(num_bp_by_probe)}
+
+
+def _find_ambiguous_kmers_in_kmer_index(kmer_probe_map, kmer_index):
+    """Find where k-mers of a map that cannot be encoded are in an index.
+
+    The index stores the uppercase k-mers of its sequences that cannot be
+    encoded in a side table (see kmer_index.GenomeKmerIndex), so each
+    k-mer of kmer_probe_map.ambiguous, and its reverse complement, is
+    looked up there. (Probes are uppercase, so a k-mer with a lowercase
+    base cannot be equal to one of theirs.)
+
+    Args:
+        kmer_probe_map: instance of EncodedKmerProbeMap
+        kmer_index: instance of kmer_index.GenomeKmerIndex
+
+    Returns:
+        tuple (probe_ind, probe_pos, pos, rc) of np.arrays with one entry
+        per hit, giving the index of the probe, the position of the k-mer
+        in the probe, the position of the k-mer in the concatenated
+        sequences, and whether the probe shares the reverse complement of
+        the k-mer (i.e., the hit is on the reverse complement)
+    """
+    kmers = list(kmer_probe_map.ambiguous.keys())
+    rc_kmers = [reverse_complement_sequence(kmer) for kmer in kmers]
+    query_ind, index_ind = kmer_index.lookup_ambiguous(kmers + rc_kmers)
+    pos = np.asarray(kmer_index.ambiguous_pos[index_ind])
+
+    # A sequence k-mer equal to the reverse complement of a k-mer in
+    # kmer_probe_map is a hit on the reverse complement
+    hits = []
+    for q, p in zip(query_ind.tolist(), pos.tolist()):
+        rc = q >= len(kmers)
+        for probe_ind, probe_pos in kmer_probe_map.ambiguous[
+                kmers[q % len(kmers)]]:
+            hits += [(probe_ind, probe_pos, p, rc)]
+
+    hits = np.array(hits, dtype=np.int64).reshape(-1, 4)
+    return (hits[:, 0], hits[:, 1], hits[:, 2], hits[:, 3].astype(bool))
+
+
+def _find_probe_covers_in_sequence_window(sequences, merge_overlapping,
+                                          rc_too=False):
+    """Helper function for find_probe_covers_in_sequences().
+
+    Args:
+        sequences: list of sequences (as strings)
+        merge_overlapping/rc_too: see find_probe_covers_in_sequence()
+
+    Returns:
+        list giving, for each sequence in sequences, the output of
+        _find_probe_covers_in_sequence()
+    """
+    global _pfp_pool
+    global _pfp_work_was_submitted
+
+    num_processes = _pfp_pool._processes
+    min_len_to_split = num_processes * _MIN_BASES_PER_SCAN_TASK
+
+    results = [None for _ in range(len(sequences))]
+    keys = [None for _ in range(len(sequences))]
+    cached = [None for _ in range(len(sequences))]
+    probes_to_scan = [None for _ in range(len(sequences))]
+    to_scan_whole = []
+    for idx, sequence in enumerate(sequences):
+        keys[idx] = _cover_cache_keys(sequence, merge_overlapping, rc_too)
+        cached[idx] = _get_cover_ranges_from_cache(keys[idx])
+        if cached[idx] is not None:
+            probes_to_scan[idx] = cached[idx][1]
+            if not probes_to_scan[idx].any():
+                # The covers of every probe are cached
+                results[idx] = cached[idx][2]
+                continue
+        if len(sequence) >= min_len_to_split:
+            results[idx] = _find_probe_covers_in_sequence(sequence,
+                merge_overlapping, rc_too=rc_too,
+                probes_to_scan=probes_to_scan[idx])
+        else:
+            to_scan_whole += [idx]
+
+    if len(to_scan_whole) > 0:
+        # Group the sequences to scan whole into batches, aiming for
+        # several batches per process (to balance the load) but enough
+        # bases in each to be worth sending to a process
+        num_bases = sum(len(sequences[idx]) for idx in to_scan_whole)
+        batch_num_bases = max(_MIN_BASES_PER_SCAN_TASK,
+                              num_bases // (4 * num_processes))
+        batches = [[]]
+        curr_batch_num_bases = 0
+        for idx in to_scan_whole:
+            if curr_batch_num_bases >= batch_num_bases:
+                batches += [[]]
+                curr_batch_num_bases = 0
+            batches[-1] += [(idx, sequences[idx])]
+            curr_batch_num_bases += len(sequences[idx])
+
+        # All the batches are scanned with the probes that are not
+        # cached for any of their sequences
+        if any(probes_to_scan[idx] is None for idx in to_scan_whole):
+            batch_probes_to_scan = None
+        else:
+            batch_probes_to_scan = np.logical_or.reduce(
+                [probes_to_scan[idx] for idx in to_scan_whole])
+            for idx in to_scan_whole:
+                probes_to_scan[idx] = batch_probes_to_scan
+
+        scan_batch = partial(_find_probe_covers_in_sequence_batch,
+                             merge_overlapping=merge_overlapping,
+                             rc_too=rc_too)
+        _set_probes_to_scan(batch_probes_to_scan)
+        try:
+            _pfp_work_was_submitted = True
+            for batch_out in _pfp_pool.imap_unordered(scan_batch, batches):
+                for idx, subseq_probe_cover_ranges in batch_out:
+                    results[idx] = _merge_scan_outputs(
+                        [subseq_probe_cover_ranges], merge_overlapping,
+                        rc_too)
+        except KeyboardInterrupt:
+            # Some results were not computed, so do not cache any
+            _pfp_pool.terminate()
+            _pfp_pool.join()
+            raise
+        finally:
+            _set_probes_to_scan(None)
+
+    for idx in range(len(sequences)):
+        if probes_to_scan[idx] is not None and \
+                not probes_to_scan[idx].any():
+            # results[idx] was read from the cache
+            continue
+        results[idx] = _add_cached_cover_ranges(cached[idx], results[idx])
+        _put_cover_ranges_in_cache(keys[idx], cached[idx],
+                                   probes_to_scan[idx], results[idx])
+    return results
+
+
+def _find_probe_covers_in_sequence_batch(batch, merge_overlapping,
+                                         rc_too=False):
+    """Scan whole sequences in one process of the probe finding pool.
+
+    Args:
+        batch: list of tuples (idx, sequence)
+        merge_overlapping/rc_too: see find_probe_covers_in_sequence()
+
+    Returns:
+        list of tuples (idx, d) where d is the output of
+        _scan_subsequence() on all of sequence
+    """
+    global _pfp_kmer_probe_map_k
+
+    k = _pfp_kmer_probe_map_k
+
+    active_probes, _ = _active_probes_in_scan()
+
+    batch_out = []
+    for idx, sequence in batch:
+        if active_probes is not None and not active_probes.any():
+            # No probe is aligned (e.g., every probe was already found to
+            # cover a range; see find_probes_hitting_sequences()), so
+            # skip the scan
+            batch_out += [(idx, _empty_scan_output(rc_too))]
+            continue
+        if len(sequence) < k:
+            # See _find_probe_covers_in_sequence() for this special case
+            batch_out += [(idx, _empty_scan_output(rc_too))]
+            continue
+        batch_out += [(idx, _scan_subsequence((0, len(sequence) - k + 1),
+                                              sequence, merge_overlapping,
+                                              rc_too))]
+    return batch_out
+
+
+def _scan_subsequence(bounds, sequence, merge_overlapping, rc_too):
+    """Scan part of a sequence in one process of the probe finding pool.
+
+    This calls the scanning helper function for the pool (e.g.,
+    _find_probe_covers_in_subsequence()). When rc_too is True and the pool
+    did not index canonical k-mers, it also scans, separately, the part of
+    the reverse complement of sequence that corresponds to bounds.
+
+    Args:
+        bounds: tuple (start, end) giving the positions of the first
+            bases of the k-mers to scan in sequence, or None to scan
+            nothing
+        sequence: sequence (as a string) in which to find ranges that
+            probes cover
+        merge_overlapping/rc_too: see find_probe_covers_in_sequence()
+
+    Returns:
+        list giving, for sequence and then (if rc_too is True) its reverse
+        complement, a list giving, for each function in
+        _pfp_cover_range_fns, the cover ranges found by the scanning
+        helper function
+    """
+    global _pfp_kmer_probe_map_k
+    global _pfp_kmer_probe_map_canonical_keys
+    global _pfp_use_vectorized_scan
+
+    if _pfp_use_vectorized_scan:
+        scan_fn = _find_probe_covers_in_subsequence_vectorized
+    else:
+        scan_fn = _find_probe_covers_in_subsequence
+
+    if not rc_too:
+        return scan_fn(bounds, sequence, merge_overlapping=merge_overlapping)
+    if _pfp_kmer_probe_map_canonical_keys is not None:
+        return scan_fn(bounds, sequence, merge_overlapping=merge_overlapping,
+                       rc_too=True)
+
+    if bounds is None:
+        rc_bounds = None
+    else:
+        # The k-mer at position i in sequence is at position
+        # len(sequence) - k - i in its reverse complement
+        start, end = bounds
+        rc_end = len(sequence) - _pfp_kmer_probe_map_k + 1
+        rc_bounds = (rc_end - end, rc_end - start)
+    return (scan_fn(bounds, sequence, merge_overlapping=merge_overlapping) +
+            scan_fn(rc_bounds, reverse_complement_sequence(sequence),
+                    merge_overlapping=merge_overlapping))
+
+
+def _empty_scan_output(rc_too):
+    """Give the output of _scan_subsequence() when nothing is covered.
+
+    Args:
+        rc_too: see find_probe_covers_in_sequence()
+
+    Returns:
+        output of _scan_subsequence() with no cover ranges
+    """
+    global _pfp_cover_range_fns
+
+    num_strands = 2 if rc_too else 1
+    return [[{} for _ in _pfp_cover_range_fns] for _ in range(num_strands)]
+
+
+def _cover_ranges_to_cache_entry(probe_cover_ranges, probes_scanned):
+    """Convert cover ranges to compact arrays for a cover cache.
+
+    Args:
+        probe_cover_ranges: dict as returned by
+            find_probe_covers_in_sequence()
+        probes_scanned: np.array of bools giving, for each probe of the
+            pool (indexed as in the scan), whether to convert its covers
+
+    Returns:
+        tuple (probe_hashes, probe_ind, starts, ends) of np.arrays, where
+        probe_hashes gives the hashes of the probes in probes_scanned and
+        probe_ind gives indices in probe_hashes
+    """
+    global _pfp_cover_cache_probe_index
+    global _pfp_cover_cache_probe_hashes
+
+    # Give each probe scanned its index among those probes
+    hash_ind = np.cumsum(probes_scanned) - 1
+    probe_ind, starts, ends = [], [], []
+    for p, cover_ranges in probe_cover_ranges.items():
+        i = _pfp_cover_cache_probe_index[p]
+        if not probes_scanned[i]:
+            continue
+        for start, end in cover_ranges:
+            probe_ind += [hash_ind[i]]
+            starts += [start]
+            ends += [end]
+    return (_pfp_cover_cache_probe_hashes[probes_scanned],
+            np.array(probe_ind, dtype=np.uint32),
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64))
+
+
+def _cover_ranges_from_cache_entry(entry, probes):
+    """Convert compact arrays from a cover cache back to cover ranges.
+
+    Args:
+        entry: tuple (probe_hashes, probe_ind, starts, ends), as returned
+            by _cover_ranges_to_cache_entry(), or None
+        probes: np.array of bools giving, for each probe of the pool
+            (indexed as in the scan), whether to give its covers
+
+    Returns:
+        dict as returned by find_probe_covers_in_sequence(), with the
+        covers in entry of the probes in probes
+    """
+    global _pfp_cover_cache_probes
+    global _pfp_cover_cache_probe_hashes
+    global _pfp_cover_cache_probe_hash_order
+
+    if entry is None:
+        return {}
+    probe_hashes, probe_ind, starts, ends = entry
+
+    # Find the probe of the pool (indexed as in the scan) with each hash
+    # in the entry, or -1 if there is none
+    order = _pfp_cover_cache_probe_hash_order
+    sorted_hashes = _pfp_cover_cache_probe_hashes[order]
+    pos = np.minimum(np.searchsorted(sorted_hashes, probe_hashes),
+                     max(len(order) - 1, 0))
+    if len(order) > 0:
+        pool_ind = np.where(sorted_hashes[pos] == probe_hashes, order[pos],
+                            -1)
+    else:
+        pool_ind = np.full(len(probe_hashes), -1)
+
+    range_pool_ind = pool_ind[probe_ind]
+    keep = range_pool_ind >= 0
+    keep[keep] = probes[range_pool_ind[keep]]
+    probe_cover_ranges = defaultdict(list)
+    for i, start, end in zip(range_pool_ind[keep].tolist(),
+                             starts[keep].tolist(), ends[keep].tolist()):
+        probe_cover_ranges[_pfp_cover_cache_probes[i]].append((start, end))
+    return dict(probe_cover_ranges)
+
+
+def _set_probes_to_scan(probes_to_scan):
+    """Restrict the scans by the probe finding pool to some probes.
+
+    This has no effect in a scan with find_probes_hitting_sequences(),
+    which uses the flags of _pfp_active_probes itself.
+
+    Args:
+        probes_to_scan: np.array of bools giving, for each probe (indexed
+            as in the scan), whether to align it; or None to align every
+            probe
+    """
+    global _pfp_active_probes
+    global _pfp_first_hit_only
+    global _pfp_scan_active_only
+
+    if _pfp_first_hit_only.value:
+        return
+    if probes_to_scan is None or probes_to_scan.all():
+        _pfp_scan_active_only.value = False
+    else:
+        active_probes = np.frombuffer(_pfp_active_probes, dtype=np.uint8)
+        active_probes[:len(probes_to_scan)] = probes_to_scan
+        _pfp_scan_active_only.value = True
+
+
+def _find_probe_covers_in_sequence(sequence, merge_overlapping,
+                                   rc_too=False, probes_to_scan=None):
+    """Scan sequence with the probe finding pool.
+
+    This does the work of find_probe_covers_in_sequence(), without
+    consulting a cover cache.
+
+    Args:
+        sequence: sequence (as a string) in which to find ranges that
+            probes cover
+        merge_overlapping/rc_too: see find_probe_covers_in_sequence()
+        probes_to_scan: if set, np.array of bools giving, for each probe
+            (indexed as in the scan), whether to align it (see
+            _set_probes_to_scan()); the output only has covers of these
+
+    Returns:
+        list giving, for sequence and then (if rc_too is True) its reverse
+        complement, a list giving, for each function that the pool
+        determines coverage with, a dict mapping probes to the ranges
+        that each covers (see find_probe_covers_in_sequence())
+    """
+    global _pfp_pool
+    global _pfp_work_was_submitted
+    global _pfp_kmer_probe_map_probe_seqs_to_probe
+    global _pfp_kmer_probe_map_k
+
     k = _pfp_kmer_probe_map_k
 
     if len(sequence) < k:
@@ -1209,15 +3541,16 @@ def find_probe_covers_in_sequence(sequence,
         # sufficiently large such that len(sequence) < k
         # In this case, do not attempt to cover the sequence -- i.e., return
         # an indication that no probes cover it
-        return {}
+        return _empty_scan_output(rc_too)
 
     # Setup a function that the processes can execute; do this using
     # functools.partial so that the created function (scan_subsequence)
     # takes just the argument 'bounds' and all the other arguments to
-    # _find_probe_covers_in_subsequence are filled in
-    scan_subsequence = partial(_find_probe_covers_in_subsequence,
+    # _scan_subsequence are filled in
+    scan_subsequence = partial(_scan_subsequence,
                                sequence=sequence,
-                               merge_overlapping=merge_overlapping)
+                               merge_overlapping=merge_overlapping,
+                               rc_too=rc_too)
 
     # Create bounds for each process
     # The first num_processes-1 processes should be given bounds
@@ -1237,6 +3570,7 @@ def find_probe_covers_in_sequence(sequence,
         bounds_by_process += [None]
 
     # Run the processes
+    _set_probes_to_scan(probes_to_scan)
     try:
         _pfp_work_was_submitted = True
         all_subseq_probe_cover_ranges = _pfp_pool.map(scan_subsequence,
@@ -1244,10 +3578,49 @@ def find_probe_covers_in_sequence(sequence,
     except KeyboardInterrupt:
         _pfp_pool.terminate()
         _pfp_pool.join()
+        raise
+    finally:
+        _set_probes_to_scan(None)
+
+    return _merge_scan_outputs(all_subseq_probe_cover_ranges,
+                               merge_overlapping, rc_too)
+
+
+def _merge_scan_outputs(scan_outputs, merge_overlapping, rc_too):
+    """Merge the outputs of _scan_subsequence() on parts of a sequence.
+
+    Args:
+        scan_outputs: list of outputs of _scan_subsequence()
+        merge_overlapping/rc_too: see find_probe_covers_in_sequence()
+
+    Returns:
+        output of _find_probe_covers_in_sequence()
+    """
+    num_strands = 2 if rc_too else 1
+    return [[_merge_probe_cover_ranges(fn_outputs, merge_overlapping)
+             for fn_outputs in zip(*[scan_output[strand]
+                                     for scan_output in scan_outputs])]
+            for strand in range(num_strands)]
+
+
+def _merge_probe_cover_ranges(all_subseq_probe_cover_ranges,
+                              merge_overlapping):
+    """Merge the cover ranges found by scanning parts of a sequence.
+
+    Args:
+        all_subseq_probe_cover_ranges: list of outputs of the scanning
+            helper function (e.g., _find_probe_covers_in_subsequence())
+        merge_overlapping: see find_probe_covers_in_sequence()
+
+    Returns:
+        dict as returned by find_probe_covers_in_sequence()
+    """
+    global _pfp_kmer_probe_map_probe_seqs_to_probe
 
     # Merge the outputs from the different processes. Namely:
     # all_subseq_probe_cover_ranges is a list of dicts, where each
-    # dict is keyed on probe sequences and has values that are lists.
+    # dict is keyed on probe sequences (or, with a vectorized scan, probe
+    # indices) and has values that are lists.
     # Merge these to create one dict, keyed on probes, by concatenating
     # all the lists (across the dicts) for each probe.
     probe_cover_ranges = defaultdict(list)
@@ -1343,4 +3716,39 @@ def probe_covers_sequence_by_longest_common_substring(mismatches,
 
         return (start, start + l)
 
+    def lcf_vectorized(probe_seqs, sequences, kmer_starts, kmer_ends,
+                       starts, ends, full_probe_lens, full_sequence_len):
+        # Like lcf, but for many aligned (probe, sequence) windows at once;
+        # probe_seqs and sequences are 2D arrays whose rows are aligned,
+        # each row is cut to the columns [starts, ends), and the anchors
+        # are given in column coordinates. Returns (covered, cover_starts,
+        # cover_ends), where covered is a mask of the rows that lcf would
+        # not return None for and the ranges are in column coordinates.
+        l, start = longest_common_substring.k_lcf_around_anchors(
+            probe_seqs, sequences, kmer_starts, kmer_ends, mismatches,
+            start=starts, end=ends)
+        covered = l >= np.minimum(np.minimum(lcf_thres, full_probe_lens),
+                                  full_sequence_len)
+
+        if island_of_exact_match > 0:
+            if mismatches == 0:
+                exact_match_l = l
+            else:
+                exact_match_l, _ = \
+                    longest_common_substring.k_lcf_around_anchors(
+                        probe_seqs, sequences, kmer_starts, kmer_ends, 0,
+                        start=starts, end=ends)
+            covered &= exact_match_l >= island_of_exact_match
+
+        return (covered, start, start + l)
+
+    # Let callers that scan many hits at once (namely, with a vectorized
+    # scan in find_probe_covers_in_sequence()) score them in bulk
+    lcf.vectorized = lcf_vectorized
+
+    # Describe what determines the output of lcf, so that its output can
+    # be cached (see set_cover_cache())
+    lcf.cover_params = ('longest_common_substring', int(mismatches),
+                        int(lcf_thres), int(island_of_exact_match))
+
     return lcf
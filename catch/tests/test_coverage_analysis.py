@@ -3,8 +3,13 @@
 
 from collections import OrderedDict
 import logging
+import os
+import random
+import tempfile
 import unittest
 
+import numpy as np
+
 from catch import coverage_analysis as ca
 from catch import genome
 from catch import probe
@@ -134,6 +139,10 @@ class TestAnalyzerWithTwoTargetGenomes(unittest.TestCase):
         self.assertEqual(self.analyzer.average_coverage[1][0][True][1],
                          0. / 12)
 
+    def sliding_coverage_dict(self, i, j, rc):
+        positions, coverage = self.analyzer.sliding_coverage[i][j][rc]
+        return dict(zip(positions, coverage))
+
     def test_sliding_coverage(self):
         """Check the calculation of a coverage across sliding windows.
 
@@ -158,7 +167,7 @@ class TestAnalyzerWithTwoTargetGenomes(unittest.TestCase):
         #      3     6     9     12    15   18   20
         expected = {3: 8/6., 6: 8/6., 9: 4/6., 12: 2/6., 15: 5/6.,
                     18: 9/6., 20: 9/6.}
-        self.assertEqual(self.analyzer.sliding_coverage[0][0][False],
+        self.assertEqual(self.sliding_coverage_dict(0, 0, False),
                          expected)
         # in reverse complement, coverage across the bases is (underneath
         # is average across a 6 bp window, sliding by 3 bp):
@@ -169,7 +178,7 @@ class TestAnalyzerWithTwoTargetGenomes(unittest.TestCase):
         #      3     6     9     12    15   18   20
         expected = {3: 0, 6: 1/2., 9: 1, 12: 5/6., 15: 1, 18: 8/6.,
                     20: 8/6.}
-        self.assertEqual(self.analyzer.sliding_coverage[0][0][True],
+        self.assertEqual(self.sliding_coverage_dict(0, 0, True),
                          expected)
 
         # genome_b
@@ -184,7 +193,7 @@ class TestAnalyzerWithTwoTargetGenomes(unittest.TestCase):
         # chromosomes; it's an artifact of the fact that the chromosomes
         # are concatenated for this analysis.)
         expected = {3: 0, 6: 1/6., 9: 4/6., 11: 1}
-        self.assertEqual(self.analyzer.sliding_coverage[1][0][False],
+        self.assertEqual(self.sliding_coverage_dict(1, 0, False),
                          expected)
         # in reverse complement, coverage across the bases is (underneath
         # is average across a 6 bp window, sliding by 3 bp):
@@ -197,9 +206,66 @@ class TestAnalyzerWithTwoTargetGenomes(unittest.TestCase):
         # chromosomes; it's an artifact of the fact that the chromosomes
         # are concatenated for this analysis.)
         expected = {3: 0, 6: 0, 9: 0, 11: 0}
-        self.assertEqual(self.analyzer.sliding_coverage[1][0][True],
+        self.assertEqual(self.sliding_coverage_dict(1, 0, True),
                          expected)
 
+    def test_run_streaming(self):
+        """Check that streaming gives the same results as run().
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tsv_fn = os.path.join(tmp_dir, 'analysis.tsv')
+            sliding_fn = os.path.join(tmp_dir, 'sliding.tsv')
+            self.analyzer.write_data_matrix_as_tsv(tsv_fn)
+            self.analyzer.write_sliding_window_coverage(sliding_fn)
+            with open(tsv_fn) as f:
+                expected_tsv = f.read()
+            with open(sliding_fn) as f:
+                expected_sliding = f.read()
+            expected_bp_covered = self.analyzer.bp_covered
+            expected_average_coverage = self.analyzer.average_coverage
+            expected_probe_map_counts = self.analyzer.probe_map_counts
+
+            self.analyzer.run_streaming(analysis_tsv_fn=tsv_fn,
+                                        sliding_window_coverage_fn=sliding_fn,
+                                        window_length=6, window_stride=3)
+            with open(tsv_fn) as f:
+                self.assertEqual(f.read(), expected_tsv)
+            with open(sliding_fn) as f:
+                self.assertEqual(f.read(), expected_sliding)
+        self.assertEqual(self.analyzer.bp_covered, expected_bp_covered)
+        self.assertEqual(self.analyzer.average_coverage,
+                         expected_average_coverage)
+        self.assertEqual(self.analyzer.probe_map_counts,
+                         expected_probe_map_counts)
+
+    def test_canonical_kmer_scan(self):
+        """Check that scanning once for both strands gives the same covers.
+
+        With a vectorized scan over a saved kmer_probe_map, this finds the
+        covers in a genome and its reverse complement in one pass.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            probe.set_kmer_probe_map_dir(tmp_dir)
+            probe.set_use_vectorized_scan(True)
+            try:
+                analyzer = ca.Analyzer(self.analyzer.probes,
+                    mismatches=0,
+                    lcf_thres=6,
+                    target_genomes=self.analyzer.target_genomes,
+                    target_genomes_names=["g_a", "g_b"],
+                    kmer_probe_map_k=3)
+                analyzer.run(window_length=6, window_stride=3)
+            finally:
+                probe.set_kmer_probe_map_dir()
+                probe.set_use_vectorized_scan()
+        for i in [0, 1]:
+            for rc in [False, True]:
+                self.assertCountEqual(
+                    analyzer.target_covers[i][0][rc],
+                    self.analyzer.target_covers[i][0][rc])
+        self.assertEqual(analyzer.probe_map_counts,
+                         self.analyzer.probe_map_counts)
+
     def test_data_matrix_string(self):
         """Test the data matrix generated.
         """
@@ -331,3 +397,40 @@ class TestAnalyzerCoversWithoutReverseComplement(unittest.TestCase):
     def tearDown(self):
         # Re-enable logging
         logging.disable(logging.NOTSET)
+
+
+class TestSlidingCoverage(unittest.TestCase):
+    """Tests the _sliding_coverage function.
+    """
+
+    def test_random_covers(self):
+        random.seed(1)
+        for genome_length in [1, 5, 37, 100]:
+            covers = []
+            for _ in range(random.randint(0, 30)):
+                start = random.randint(0, genome_length - 1)
+                end = random.randint(start + 1, genome_length)
+                covers += [(start, end)]
+            # Count the depth at each base directly
+            depth = np.zeros(genome_length)
+            for start, end in covers:
+                depth[start:end] += 1
+
+            for window_length, window_stride in [(6, 3), (10, 10), (4, 7)]:
+                positions, coverage = ca._sliding_coverage(covers,
+                    genome_length, window_length, window_stride)
+                expected_positions = []
+                expected_coverage = []
+                for window_start in range(0, genome_length, window_stride):
+                    window_end = window_start + window_length
+                    if window_end > genome_length:
+                        window_end = genome_length
+                        window_start = max(0, window_end - window_length)
+                    middle = window_start + window_length / 2
+                    if middle in expected_positions:
+                        continue
+                    expected_positions += [middle]
+                    expected_coverage += [
+                        np.average(depth[window_start:window_end])]
+                self.assertEqual(list(positions), expected_positions)
+                np.testing.assert_allclose(coverage, expected_coverage)
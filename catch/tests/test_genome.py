@@ -107,3 +107,53 @@ class TestGenome(unittest.TestCase):
                 OrderedDict([("chr1-0", 'ATC'), ("chr1-1", 'GTT'), ("chr1-2", 'AA'),
                              ("chr2-0", 'AAT'), ("chr2-1", 'TCC'), ("chr2-2", 'GGG')]))
         self.assertEqual(broken, expected_genome)
+
+
+class TestLazyGenome(unittest.TestCase):
+    """Tests methods in the LazyGenome class.
+    """
+
+    class ListSource:
+        """Source of sequences for a LazyGenome that counts reads.
+        """
+        def __init__(self, seqs):
+            self._seqs = seqs
+            self.num_reads = 0
+
+        def seq(self, i):
+            self.num_reads += 1
+            return self._seqs[i]
+
+        def seq_len(self, i):
+            return len(self._seqs[i])
+
+    def setUp(self):
+        self.source = TestLazyGenome.ListSource(['ATCGCNGAT', 'TTAGCA'])
+
+    def test_seqs(self):
+        g = genome.LazyGenome(self.source, 1)
+        self.assertEqual(self.source.num_reads, 0)
+        self.assertEqual(g.seqs, ['TTAGCA'])
+        self.assertEqual(self.source.num_reads, 1)
+        self.assertFalse(g.divided_into_chrs())
+
+    def test_size(self):
+        g = genome.LazyGenome(self.source, 0)
+        # Determining the size should not read the sequence
+        self.assertEqual(g.size(), 9)
+        self.assertEqual(self.source.num_reads, 0)
+        self.assertEqual(g.size(only_unambig=True), 8)
+
+    def test_equals_and_hash(self):
+        g = genome.LazyGenome(self.source, 0)
+        self.assertEqual(g, genome.Genome.from_one_seq('ATCGCNGAT'))
+        self.assertEqual(genome.Genome.from_one_seq('ATCGCNGAT'), g)
+        self.assertEqual(hash(g),
+                         hash(genome.Genome.from_one_seq('ATCGCNGAT')))
+        self.assertNotEqual(g, genome.LazyGenome(self.source, 1))
+
+    def test_break_into_fragments(self):
+        g = genome.LazyGenome(self.source, 1)
+        expected_genome = genome.Genome.from_chrs(
+                OrderedDict([('0', 'TTAG'), ('1', 'CA')]))
+        self.assertEqual(g.break_into_fragments(4), expected_genome)
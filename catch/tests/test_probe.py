@@ -4,12 +4,18 @@
 from collections import defaultdict
 import logging
 import multiprocessing
+import os
+import pickle
+import tempfile
 import time
 import unittest
 
 import numpy as np
 
 from catch import probe
+from catch.utils import cover_cache
+from catch.utils import kmer_index
+from catch.utils import twobit
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
@@ -43,6 +49,40 @@ class TestProbe(unittest.TestCase):
                                                 'G', 'C', 'G', 'G', 'A', 'T',
                                                 'C', 'G']))
 
+    def test_construct_from_other_types(self):
+        """Test that a probe can be constructed from any sequence type.
+        """
+        seq_str = 'ATCGTCGCGGATCG'
+        for seq in [seq_str, seq_str.encode(),
+                    np.array(list(seq_str), dtype='U1'),
+                    np.frombuffer(seq_str.encode(), dtype=np.uint8)]:
+            p = probe.Probe(seq)
+            self.assertEqual(p, self.a)
+            self.assertEqual(p.seq_str, seq_str)
+            self.assertEqual(len(p), 14)
+            self.assertEqual(p[3], 'G')
+            self.assertEqual(p[-1], 'G')
+            self.assertEqual(p[2:6], 'CGTC')
+            self.assertEqual(p[::-1], seq_str[::-1])
+
+    def test_compact_storage(self):
+        """Test that a probe does not store per-instance dicts or arrays.
+        """
+        self.assertFalse(hasattr(self.a, '__dict__'))
+        np.testing.assert_array_equal(self.a.seq_uint8,
+                                      np.frombuffer(b'ATCGTCGCGGATCG',
+                                                    dtype=np.uint8))
+
+    def test_pickle(self):
+        """Test that a probe, with its attributes, can be pickled.
+        """
+        self.a.header = 'probe_a'
+        self.a.shares_some_kmers(self.d, k=5)
+        a_unpickled = pickle.loads(pickle.dumps(self.a))
+        self.assertEqual(a_unpickled, self.a)
+        self.assertEqual(a_unpickled.header, 'probe_a')
+        self.assertEqual(a_unpickled.kmers[5], self.a.kmers[5])
+
     def test_mismatches(self):
         """Test mismatches method.
         """
@@ -78,6 +118,10 @@ class TestProbe(unittest.TestCase):
         a_rc_desired = probe.Probe.from_str('CGATCCGCGACGAT')
         self.assertEqual(a_rc, a_rc_desired)
 
+        b_rc = self.b.reverse_complement()
+        b_rc_desired = probe.Probe.from_str('CNATACGCGAGGAT')
+        self.assertEqual(b_rc, b_rc_desired)
+
     def test_with_prepended_str(self):
         """Test with_prepended_str method.
         """
@@ -374,6 +418,24 @@ class TestSharedKmerProbeMap(unittest.TestCase):
         self.assertIsNone(shared_kmer_map.get('MNO'))
         self.assertEqual(shared_kmer_map.k, 3)
 
+    def test_bloom_filter(self):
+        np.random.seed(1)
+        probes = [probe.Probe.from_str(s) for s in
+                  ['ACGTTGCANACGT', 'GGGCCCAAATTT', 'ACGTRGCAACGTTT']]
+        kmer_map = probe._construct_rand_kmer_probe_map(probes,
+                                                        k=4,
+                                                        num_kmers_per_probe=50,
+                                                        include_positions=True)
+        shared_kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        bf = shared_kmer_map.construct_bloom_filter()
+        values = [twobit.kmer_value(kmer) for kmer in kmer_map.keys()]
+        values = np.array([v for v in values if v is not None],
+                          dtype=np.uint64)
+        self.assertTrue(bf.contains(values).all())
+        # Most k-mers that are not in the map are ruled out
+        others = np.setdiff1d(np.arange(4**4, dtype=np.uint64), values)
+        self.assertLess(np.mean(bf.contains(others)), 0.1)
+
     def test_pigeonholed_kmer_map(self):
         a = probe.Probe.from_str('ABCDEFGH')
         b = probe.Probe.from_str('ZYXWVUAB')
@@ -407,6 +469,185 @@ class TestSharedKmerProbeMap(unittest.TestCase):
         logging.disable(logging.NOTSET)
 
 
+class TestEncodedKmerProbeMap(unittest.TestCase):
+    """Tests EncodedKmerProbeMap class and saving/loading it.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def lookup(self, kmer_map, kmer):
+        _, key_ind = kmer_map.lookup(
+            np.array([twobit.kmer_value(kmer)], dtype=np.uint64))
+        return [(kmer_map.probe_seq_str(kmer_map.probe_seqs_ind[i]),
+                 kmer_map.probe_pos[i]) for i in key_ind]
+
+    def test_construct(self):
+        a = probe.Probe.from_str('ACGTAACC')
+        b = probe.Probe.from_str('TTGTAANC')
+        kmer_map = probe._construct_rand_kmer_probe_map([a, b], k=3,
+            num_kmers_per_probe=50, include_positions=True)
+        encoded_kmer_map = probe.EncodedKmerProbeMap.construct(kmer_map)
+        self.assertEqual(encoded_kmer_map.k, 3)
+        self.assertFalse(encoded_kmer_map.hashed)
+        self.assertCountEqual(self.lookup(encoded_kmer_map, 'GTA'),
+                              [(a.seq_str, 2), (b.seq_str, 2)])
+        self.assertCountEqual(self.lookup(encoded_kmer_map, 'TAA'),
+                              [(a.seq_str, 3), (b.seq_str, 3)])
+        self.assertCountEqual(self.lookup(encoded_kmer_map, 'AAC'),
+                              [(a.seq_str, 4)])
+        self.assertEqual(self.lookup(encoded_kmer_map, 'CCC'), [])
+        # K-mers with 'N' are not encoded, but are stored by their string
+        self.assertEqual(len(encoded_kmer_map.keys),
+                         sum(len(v) for kmer, v in kmer_map.items()
+                             if 'N' not in kmer))
+        b_ind = encoded_kmer_map.probes.index(b)
+        self.assertEqual(encoded_kmer_map.ambiguous['ANC'], [(b_ind, 5)])
+        self.assertEqual(encoded_kmer_map.ambiguous['AAN'], [(b_ind, 4)])
+        self.assertEqual(len(encoded_kmer_map.ambiguous), 2)
+        hit_pos, probe_seqs_ind, probe_pos = \
+            encoded_kmer_map.lookup_ambiguous('GAANCNCT', [1, 2, 3, 4])
+        self.assertEqual(hit_pos.tolist(), [1, 2])
+        self.assertEqual(probe_seqs_ind.tolist(), [b_ind, b_ind])
+        self.assertEqual(probe_pos.tolist(), [4, 5])
+
+    def test_save_and_load(self):
+        np.random.seed(1)
+        probes = [probe.Probe.from_str(s)
+                  for s in ['ACGTAACCGG', 'TTGTAACCGA', 'GGGGACGTAC',
+                            'GGNACCTTAN']]
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            probes, 0, 5, min_k=4, k=4)
+        encoded_kmer_map = probe.EncodedKmerProbeMap.construct(kmer_map)
+        path = os.path.join(self.tmp_dir.name, 'map')
+        encoded_kmer_map.save(path)
+        loaded = probe.EncodedKmerProbeMap.load(path, probes)
+        self.assertIsInstance(loaded.keys, np.memmap)
+        self.assertEqual(loaded.k, encoded_kmer_map.k)
+        for name in ['keys', 'probe_seqs_ind', 'probe_pos', 'probe_seqs',
+                     'probe_seqs_offsets']:
+            np.testing.assert_array_equal(getattr(loaded, name),
+                                          getattr(encoded_kmer_map, name))
+        self.assertEqual(loaded.probes, encoded_kmer_map.probes)
+        self.assertGreater(len(encoded_kmer_map.ambiguous), 0)
+        self.assertEqual(loaded.ambiguous, encoded_kmer_map.ambiguous)
+
+        # Loading requires all the probes
+        with self.assertRaises(ValueError):
+            probe.EncodedKmerProbeMap.load(path, probes[:2])
+
+    def test_canonical_index(self):
+        a = probe.Probe.from_str('ACGTAACC')
+        b = probe.Probe.from_str('GGTTACGT')
+        kmer_map = probe._construct_rand_kmer_probe_map([a, b], k=4,
+            num_kmers_per_probe=50, include_positions=True)
+        encoded_kmer_map = probe.EncodedKmerProbeMap.construct(kmer_map)
+        canonical_keys, key_ind, strands = \
+            encoded_kmer_map.canonical_index()
+        self.assertEqual(len(canonical_keys), len(encoded_kmer_map.keys))
+        self.assertTrue(np.all(np.diff(canonical_keys.astype(float)) >= 0))
+        for canonical_key, i, strand in zip(canonical_keys, key_ind,
+                                            strands):
+            probe_seq = encoded_kmer_map.probe_seq_str(
+                encoded_kmer_map.probe_seqs_ind[i])
+            pos = encoded_kmer_map.probe_pos[i]
+            kmer = probe_seq[pos:(pos + 4)]
+            rc_kmer = probe.reverse_complement_sequence(kmer)
+            self.assertEqual(canonical_key,
+                             min(twobit.kmer_value(kmer),
+                                 twobit.kmer_value(rc_kmer)))
+            self.assertEqual(strand, rc_kmer < kmer)
+
+        # b is the reverse complement of a, so every canonical k-mer
+        # (except the palindromic ACGT) is on both strands
+        kmer_strands = defaultdict(set)
+        for canonical_key, strand in zip(canonical_keys, strands):
+            kmer_strands[canonical_key].add(strand)
+        acgt = twobit.kmer_value('ACGT')
+        self.assertEqual(kmer_strands.pop(acgt), {False})
+        for canonical_key in kmer_strands:
+            self.assertEqual(kmer_strands[canonical_key], {False, True})
+
+        # Hashed k-mers cannot be indexed by their canonical form
+        kmer_map = probe._construct_rand_kmer_probe_map(
+            [probe.Probe.from_str('A' * 40)], k=33, num_kmers_per_probe=5,
+            include_positions=True)
+        with self.assertRaises(ValueError):
+            probe.EncodedKmerProbeMap.construct(kmer_map).canonical_index()
+
+    def test_to_kmer_probe_map(self):
+        probes = [probe.Probe.from_str(s)
+                  for s in ['AACCGGTT', 'CCCGGGTT', 'GGNACCTT']]
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            probes, 0, 8, min_k=4, k=4)
+        encoded = probe.EncodedKmerProbeMap.construct(kmer_map)
+        decoded = encoded.to_kmer_probe_map()
+        self.assertCountEqual(decoded.keys(), kmer_map.keys())
+        for kmer in kmer_map.keys():
+            self.assertCountEqual(decoded[kmer], kmer_map[kmer])
+
+    def test_construct_for_pool_with_dir(self):
+        np.random.seed(1)
+        sequence = 'ACGTAACCGGTTAAACCCGGGTTTACGTAACCGGTT'
+        probes = [probe.Probe.from_str(s)
+                  for s in ['AACCGGTT', 'CCCGGGTT', 'GGGGGGGG']]
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+
+        probe.set_kmer_probe_map_dir(self.tmp_dir.name)
+        try:
+            kmer_map = probe.construct_kmer_probe_map_for_probe_finding_pool(
+                probes, 0, 8, min_k=8, k=8)
+            self.assertIsInstance(kmer_map, probe.EncodedKmerProbeMap)
+            self.assertEqual(len(os.listdir(self.tmp_dir.name)), 1)
+
+            # The second time, the map should be loaded rather than saved
+            # again
+            kmer_map_loaded = \
+                probe.construct_kmer_probe_map_for_probe_finding_pool(
+                    list(reversed(probes)), 0, 8, min_k=8, k=8)
+            self.assertEqual(len(os.listdir(self.tmp_dir.name)), 1)
+            np.testing.assert_array_equal(kmer_map_loaded.keys,
+                                          kmer_map.keys)
+
+            # Different parameters give a different map
+            probe.construct_kmer_probe_map_for_probe_finding_pool(
+                probes, 0, 8, min_k=4, k=4)
+            self.assertEqual(len(os.listdir(self.tmp_dir.name)), 2)
+
+            # A native dict needs a SharedKmerProbeMap
+            self.assertIsInstance(
+                probe.construct_kmer_probe_map_for_probe_finding_pool(
+                    probes, 0, 8, min_k=8, k=8, use_native_dict=True),
+                probe.SharedKmerProbeMap)
+
+            # A loaded map does not determine the scan (by default, the
+            # scan is not vectorized), and either scan reads the loaded
+            # arrays directly rather than copying them
+            for use_vectorized_scan in [None, False, True]:
+                probe.open_probe_finding_pool(kmer_map_loaded, f, 2,
+                    use_vectorized_scan=use_vectorized_scan)
+                self.assertEqual(probe._pfp_use_vectorized_scan,
+                                 bool(use_vectorized_scan))
+                self.assertIs(probe._pfp_kmer_probe_map_keys,
+                              kmer_map_loaded.keys)
+                found = probe.find_probe_covers_in_sequence(sequence)
+                probe.close_probe_finding_pool()
+                self.assertCountEqual(found[probes[0]], [(4, 12), (28, 36)])
+                self.assertCountEqual(found[probes[1]], [(15, 23)])
+                self.assertFalse(probes[2] in found)
+        finally:
+            probe.set_kmer_probe_map_dir()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
 class TestProbeCoversSequenceByLongestCommonSubstring(unittest.TestCase):
     """Tests probe_covers_sequence_by_longest_common_substring function.
     """
@@ -822,9 +1063,24 @@ class TestFindProbeCoversInSequence(unittest.TestCase):
         self.run_random(1, 1500000, 2500000, 30000,
                         lcf_thres=100, seed=4, use_native_dict=True)
 
+    def test_random_small_genome_vectorized_scan(self):
+        for k in [20, 10]:
+            self.run_random(100, 15000, 25000, 300,
+                kmer_probe_map_k=k, seed=1, use_vectorized_scan=True)
+
+    def test_random_large_genome_vectorized_scan(self):
+        self.run_random(1, 1500000, 2500000, 30000,
+                        lcf_thres=100, seed=4, use_vectorized_scan=True)
+
+    def test_random_small_genome_bloom_filter(self):
+        for k in [20, 10]:
+            self.run_random(20, 15000, 25000, 300,
+                kmer_probe_map_k=k, seed=1, use_bloom_filter=True)
+
     def run_random(self, n, genome_min, genome_max, num_probes,
                    probe_length=100, lcf_thres=None, kmer_probe_map_k=20,
-                   seed=1, n_workers=2, use_native_dict=False):
+                   seed=1, n_workers=2, use_native_dict=False,
+                   use_vectorized_scan=False, use_bloom_filter=False):
         """Run tests with a randomly generated sequence.
 
         Repeatedly runs tests in which a sequence is randomly generated,
@@ -849,6 +1105,10 @@ class TestFindProbeCoversInSequence(unittest.TestCase):
             n_workers: number of workers to have in a probe finding pool
             use_native_dict: have the probe finding pool use a native Python
                 dict
+            use_vectorized_scan: have the probe finding pool scan with
+                encoded k-mers
+            use_bloom_filter: have the probe finding pool check k-mers
+                against a Bloom filter before looking them up
         """
         np.random.seed(seed)
         fixed_lcf_thres = lcf_thres
@@ -904,7 +1164,9 @@ class TestFindProbeCoversInSequence(unittest.TestCase):
             f = probe.probe_covers_sequence_by_longest_common_substring(
                 3, lcf_thres)
             probe.open_probe_finding_pool(kmer_map, f, n_workers,
-                                          use_native_dict=use_native_dict)
+                use_native_dict=use_native_dict,
+                use_vectorized_scan=use_vectorized_scan,
+                use_bloom_filter=use_bloom_filter)
             found = probe.find_probe_covers_in_sequence(sequence)
             probe.close_probe_finding_pool()
             # Check that this didn't find any extraneous probes and that
@@ -943,3 +1205,914 @@ class TestFindProbeCoversInSequence(unittest.TestCase):
     def tearDown(self):
         # Re-enable logging
         logging.disable(logging.NOTSET)
+
+
+class TestFindProbeCoversInSequenceVectorized(unittest.TestCase):
+    """Tests find_probe_covers_in_sequence function with a vectorized scan.
+
+    These compare the output against the scan that looks up one k-mer at
+    a time.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+    def find_covers(self, sequence, probes, mismatches, lcf_thres,
+                    use_vectorized_scan, n_workers=2, merge_overlapping=True,
+                    island_of_exact_match=0, score_in_bulk=True,
+                    encode_map=False, **kwargs):
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            probes, mismatches, lcf_thres, **kwargs)
+        if encode_map:
+            kmer_map = probe.EncodedKmerProbeMap.construct(kmer_map)
+        else:
+            kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        f = probe.probe_covers_sequence_by_longest_common_substring(
+            mismatches, lcf_thres, island_of_exact_match)
+        if not score_in_bulk:
+            # Hide the vectorized version of f
+            f_single = f
+            def f(*args):
+                return f_single(*args)
+        probe.open_probe_finding_pool(kmer_map, f, n_workers,
+            use_vectorized_scan=use_vectorized_scan)
+        found = probe.find_probe_covers_in_sequence(
+            sequence, merge_overlapping=merge_overlapping)
+        probe.close_probe_finding_pool()
+        return found
+
+    def compare(self, sequence, probes, mismatches, lcf_thres, **kwargs):
+        expected = self.find_covers(sequence, probes, mismatches, lcf_thres,
+                                    False, **kwargs)
+        found = self.find_covers(sequence, probes, mismatches, lcf_thres,
+                                 True, **kwargs)
+        self.assertEqual(found, expected)
+        # An encoded map should also give the same output when the scan is
+        # not vectorized
+        found_encoded = self.find_covers(sequence, probes, mismatches,
+                                         lcf_thres, False, encode_map=True,
+                                         **kwargs)
+        self.assertEqual(found_encoded, expected)
+        return found
+
+    def test_simple(self):
+        np.random.seed(1)
+        sequence = 'ACGTAACCGGTTAAACCCGGGTTTACGTAACCGGTT'
+        a = probe.Probe.from_str('AACCGGTT')
+        b = probe.Probe.from_str('CCCGGGTT')
+        c = probe.Probe.from_str('GGGGGGGG')
+        found = self.compare(sequence, [a, b, c], 0, 8, min_k=8)
+        self.assertCountEqual(found[a], [(4, 12), (28, 36)])
+        self.assertCountEqual(found[b], [(15, 23)])
+        self.assertFalse(c in found)
+
+    def test_probes_hanging_off_ends(self):
+        np.random.seed(1)
+        sequence = 'CCGGTTAAACCCGGGTTTACGTAACC'
+        a = probe.Probe.from_str('ACGTAACCGGTT')
+        b = probe.Probe.from_str('CGTAACCTTTTT')
+        found = self.compare(sequence, [a, b], 0, 6, min_k=6, k=6)
+        self.assertCountEqual(found[a], [(0, 6), (18, 26)])
+
+    def test_ambiguous_bases_in_sequence(self):
+        np.random.seed(1)
+        sequence = 'AACCGGTTNNNNAACCGGTTAANCCGGTT'
+        a = probe.Probe.from_str('AACCGGTT')
+        found = self.compare(sequence, [a], 0, 8, min_k=4, k=4)
+        self.assertCountEqual(found[a], [(0, 8), (12, 20)])
+
+    def test_ambiguous_bases_in_probe(self):
+        # A probe with an 'N' should be found where the sequence has the
+        # same 'N'
+        np.random.seed(1)
+        sequence = list(np.random.choice(['A', 'C', 'G', 'T'], size=2000))
+        sequence[1000] = 'N'
+        sequence = ''.join(sequence)
+        p = probe.Probe.from_str(sequence[950:1050])
+        q = probe.Probe.from_str(sequence[300:400])
+        found = self.compare(sequence, [p, q], 0, 100)
+        self.assertEqual(found, {p: [(950, 1050)], q: [(300, 400)]})
+        for score_in_bulk in [False, True]:
+            for merge_overlapping in [False, True]:
+                found = self.compare(sequence, [p, q], 0, 100, min_k=10,
+                                     k=10, score_in_bulk=score_in_bulk,
+                                     merge_overlapping=merge_overlapping)
+                self.assertIn(p, found)
+
+    def test_ambiguous_bases_in_probe_with_reverse_complement(self):
+        np.random.seed(1)
+        sequence = list(np.random.choice(['A', 'C', 'G', 'T'], size=2000))
+        sequence[1000] = 'N'
+        sequence = ''.join(sequence)
+        p = probe.Probe.from_str(sequence[950:1050])
+        rc_p = probe.Probe.from_str(
+            probe.reverse_complement_sequence(sequence[1020:1120]))
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            [p, rc_p], 0, 100, min_k=10, k=10)
+        kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 100)
+        founds = []
+        for use_vectorized_scan, canonical_kmers in [(False, False),
+                                                     (True, False),
+                                                     (True, True)]:
+            probe.open_probe_finding_pool(kmer_map, f, 2,
+                use_vectorized_scan=use_vectorized_scan,
+                canonical_kmers=canonical_kmers)
+            founds += [probe.find_probe_covers_in_sequence(sequence,
+                                                           rc_too=True)]
+            probe.close_probe_finding_pool()
+        self.assertEqual(founds[0][0], {p: [(950, 1050)]})
+        self.assertEqual(founds[0][1], {rc_p: [(880, 980)]})
+        self.assertEqual(founds[1], founds[0])
+        self.assertEqual(founds[2], founds[0])
+
+    def test_without_merging(self):
+        np.random.seed(1)
+        sequence = 'AAAAAAAAAAAA'
+        a = probe.Probe.from_str('AAAAAA')
+        self.compare(sequence, [a], 0, 6, min_k=3, k=3,
+                     merge_overlapping=False)
+
+    def test_hashed_kmers(self):
+        # With 0 mismatches, the pigeonholed k-mers are as long as the
+        # probes and are too long to be encoded exactly
+        np.random.seed(1)
+        sequence = ''.join(np.random.choice(['A', 'C', 'G', 'T'], size=2000))
+        probes = [probe.Probe.from_str(sequence[i:(i + 50)])
+                  for i in range(0, 1900, 37)]
+        probes += [probe.Probe.from_str('A' * 50)]
+        found = self.compare(sequence, probes, 0, 50)
+        self.assertEqual(len(found), len(probes) - 1)
+
+    def test_random_with_mismatches(self):
+        np.random.seed(2)
+        sequence = ''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                            size=20000))
+        probes = []
+        for i in np.random.randint(0, 20000 - 100, size=200):
+            probe_seq = list(sequence[i:(i + 100)])
+            for j in np.random.randint(0, 100, size=3):
+                probe_seq[j] = 'A' if probe_seq[j] != 'A' else 'C'
+            probes += [probe.Probe.from_str(''.join(probe_seq))]
+        for n_workers in [1, 3]:
+            self.compare(sequence, probes, 3, 90, n_workers=n_workers,
+                         min_k=10, k=10)
+        self.compare(sequence, probes, 3, 90, min_k=10, k=10,
+                     score_in_bulk=False)
+        self.compare(sequence, probes, 3, 90, min_k=10, k=10,
+                     island_of_exact_match=30)
+
+    def test_native_dict_not_allowed(self):
+        a = probe.Probe.from_str('AACCGGTT')
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            [a], 0, 8, min_k=8)
+        kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        with self.assertRaises(ValueError):
+            probe.open_probe_finding_pool(kmer_map, f, 1,
+                use_native_dict=True, use_vectorized_scan=True)
+
+    def tearDown(self):
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestFindProbeCoversInSequences(unittest.TestCase):
+    """Tests find_probe_covers_in_sequences function.
+
+    These compare the output against calling find_probe_covers_in_sequence
+    on each sequence.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        np.random.seed(1)
+        self.sequences = []
+        for seq_len in [5, 300, 2000, 40, 1000, 7000, 500, 3]:
+            self.sequences += [''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                                        size=seq_len))]
+        long_seq = ''.join(self.sequences)
+        self.probes = []
+        for i in np.random.randint(0, len(long_seq) - 50, size=100):
+            probe_seq = list(long_seq[i:(i + 50)])
+            for j in np.random.randint(0, 50, size=2):
+                probe_seq[j] = 'A' if probe_seq[j] != 'A' else 'C'
+            self.probes += [probe.Probe.from_str(''.join(probe_seq))]
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            self.probes, 2, 40, min_k=10, k=10)
+        self.kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        self.f = probe.probe_covers_sequence_by_longest_common_substring(2, 40)
+
+        # Make some sequences long enough to be split across processes,
+        # and others short enough to be batched
+        self.orig_min_bases = probe._MIN_BASES_PER_SCAN_TASK
+        self.orig_max_window = probe._MAX_BASES_PER_SCAN_WINDOW
+        probe._MIN_BASES_PER_SCAN_TASK = 500
+
+    def compare(self, use_vectorized_scan, merge_overlapping, n_workers):
+        probe.open_probe_finding_pool(self.kmer_map, self.f, n_workers,
+            use_vectorized_scan=use_vectorized_scan)
+        expected = [probe.find_probe_covers_in_sequence(s,
+                        merge_overlapping=merge_overlapping)
+                    for s in self.sequences]
+        found = list(probe.find_probe_covers_in_sequences(
+            iter(self.sequences), merge_overlapping=merge_overlapping))
+        probe.close_probe_finding_pool()
+        self.assertEqual(found, expected)
+        self.assertGreater(sum(len(d) for d in found), 0)
+
+    def test_same_as_each_sequence(self):
+        for use_vectorized_scan in [False, True]:
+            for merge_overlapping in [False, True]:
+                for n_workers in [1, 2, 4]:
+                    self.compare(use_vectorized_scan, merge_overlapping,
+                                 n_workers)
+
+    def test_small_windows(self):
+        probe._MAX_BASES_PER_SCAN_WINDOW = 1000
+        self.compare(True, False, 2)
+
+    def tearDown(self):
+        probe._MIN_BASES_PER_SCAN_TASK = self.orig_min_bases
+        probe._MAX_BASES_PER_SCAN_WINDOW = self.orig_max_window
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestFindProbeCoversInSequenceWithReverseComplement(unittest.TestCase):
+    """Tests find_probe_covers_in_sequence(s) functions with rc_too=True.
+
+    These compare the output against scanning a sequence and its reverse
+    complement separately.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        np.random.seed(1)
+        self.sequences = []
+        for seq_len in [5, 300, 2000, 40, 1000, 7000, 500, 3]:
+            self.sequences += [''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                                        size=seq_len))]
+        # Include ambiguous bases and palindromes
+        self.sequences += ['ACGTAACCGGTTNNNAACCGGTTACGTTAAC' * 10]
+        long_seq = ''.join(self.sequences)
+        self.probes = []
+        for i in np.random.randint(0, len(long_seq) - 50, size=200):
+            probe_seq = list(long_seq[i:(i + 50)])
+            for j in np.random.randint(0, 50, size=2):
+                probe_seq[j] = 'A' if probe_seq[j] != 'A' else 'C'
+            probe_seq = ''.join(probe_seq)
+            if np.random.random() < 0.5:
+                # Make a probe from the reverse complement
+                probe_seq = probe.reverse_complement_sequence(probe_seq)
+            self.probes += [probe.Probe.from_str(probe_seq)]
+        self.f = probe.probe_covers_sequence_by_longest_common_substring(2, 40)
+
+        # Make some sequences long enough to be split across processes,
+        # and others short enough to be batched
+        self.orig_min_bases = probe._MIN_BASES_PER_SCAN_TASK
+        probe._MIN_BASES_PER_SCAN_TASK = 500
+
+    def compare(self, k, use_vectorized_scan, canonical_kmers,
+                merge_overlapping, n_workers):
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            self.probes, 2, 40, min_k=k, k=k)
+        kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        probe.open_probe_finding_pool(kmer_map, self.f, n_workers,
+            use_vectorized_scan=use_vectorized_scan,
+            canonical_kmers=canonical_kmers)
+        expected = [(probe.find_probe_covers_in_sequence(s,
+                        merge_overlapping=merge_overlapping),
+                     probe.find_probe_covers_in_sequence(
+                        probe.reverse_complement_sequence(s),
+                        merge_overlapping=merge_overlapping))
+                    for s in self.sequences]
+        found = [probe.find_probe_covers_in_sequence(s,
+                    merge_overlapping=merge_overlapping, rc_too=True)
+                 for s in self.sequences]
+        found_many = list(probe.find_probe_covers_in_sequences(
+            iter(self.sequences), merge_overlapping=merge_overlapping,
+            rc_too=True))
+        probe.close_probe_finding_pool()
+        self.assertEqual(found, expected)
+        self.assertEqual(found_many, expected)
+        self.assertGreater(sum(len(d_rc) for _, d_rc in found), 0)
+
+    def test_canonical_kmers(self):
+        for merge_overlapping in [False, True]:
+            for n_workers in [1, 3]:
+                self.compare(10, True, True, merge_overlapping, n_workers)
+
+    def test_palindromic_kmers(self):
+        self.compare(6, True, True, False, 2)
+
+    def test_without_canonical_kmers(self):
+        for use_vectorized_scan in [False, True]:
+            self.compare(10, use_vectorized_scan, False, False, 2)
+        # The canonical index has no effect without a vectorized scan
+        self.compare(10, False, True, False, 2)
+
+    def tearDown(self):
+        probe._MIN_BASES_PER_SCAN_TASK = self.orig_min_bases
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestFindProbeCoversInSequenceWithBloomFilter(unittest.TestCase):
+    """Tests find_probe_covers_in_sequence function with a Bloom filter.
+
+    These compare the output against scanning without a Bloom filter,
+    which should be the same.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        np.random.seed(1)
+        self.sequences = []
+        for seq_len in [5, 300, 2000, 40, 1000, 7000, 500, 3]:
+            self.sequences += [''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                                        size=seq_len))]
+        # Include ambiguous and lowercase bases
+        self.sequences += ['ACGTAACCGGTTNNNAACCGGTTACGTTAAC' * 10 +
+                           self.sequences[2][:200].lower() +
+                           self.sequences[2][:200]]
+        long_seq = ''.join(self.sequences).upper()
+        self.probes = []
+        for i in np.random.randint(0, len(long_seq) - 50, size=200):
+            probe_seq = list(long_seq[i:(i + 50)])
+            for j in np.random.randint(0, 50, size=2):
+                probe_seq[j] = 'A' if probe_seq[j] != 'A' else 'C'
+            probe_seq = ''.join(probe_seq)
+            if np.random.random() < 0.5:
+                probe_seq = probe.reverse_complement_sequence(probe_seq)
+            self.probes += [probe.Probe.from_str(probe_seq)]
+        self.f = probe.probe_covers_sequence_by_longest_common_substring(2, 40)
+
+    def compare(self, k, use_native_dict):
+        # Use the same map for both pools, since the k-mers picked from
+        # each probe are random
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            self.probes, 2, 40, min_k=k, k=k)
+        kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        found = []
+        for use_bloom_filter in [False, True]:
+            probe.open_probe_finding_pool(kmer_map, self.f, 2,
+                use_native_dict=use_native_dict,
+                use_bloom_filter=use_bloom_filter)
+            found += [([probe.find_probe_covers_in_sequence(s, rc_too=True)
+                        for s in self.sequences],
+                       probe.find_probes_hitting_sequences(
+                        iter(self.sequences)))]
+            probe.close_probe_finding_pool()
+        self.assertEqual(found[1], found[0])
+        self.assertGreater(len(found[0][1]), 0)
+
+    def test_bloom_filter(self):
+        for k in [10, 40]:
+            self.compare(k, False)
+
+    def test_bloom_filter_with_native_dict(self):
+        self.compare(10, True)
+
+    def tearDown(self):
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestFindProbeCoversInSequenceWithManyCoverFns(unittest.TestCase):
+    """Tests find_probe_covers_in_sequence(s) functions with a pool
+    that evaluates a tuple of cover range functions.
+
+    These compare the output against pools that each evaluate one of the
+    functions.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        np.random.seed(1)
+        self.sequences = []
+        for seq_len in [5, 300, 2000, 40, 1000, 7000, 500, 3]:
+            self.sequences += [''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                                        size=seq_len))]
+        self.sequences += ['ACGTAACCGGTTNNNAACCGGTTACGTTAAC' * 10]
+        long_seq = ''.join(self.sequences)
+        self.probes = []
+        for i in np.random.randint(0, len(long_seq) - 50, size=200):
+            probe_seq = list(long_seq[i:(i + 50)])
+            for j in np.random.randint(0, 50, size=np.random.randint(0, 5)):
+                probe_seq[j] = 'A' if probe_seq[j] != 'A' else 'C'
+            probe_seq = ''.join(probe_seq)
+            if np.random.random() < 0.5:
+                probe_seq = probe.reverse_complement_sequence(probe_seq)
+            self.probes += [probe.Probe.from_str(probe_seq)]
+        self.f_tolerant = \
+            probe.probe_covers_sequence_by_longest_common_substring(3, 30)
+        self.f = probe.probe_covers_sequence_by_longest_common_substring(
+            1, 40)
+
+        # Use the same map for every pool, since the k-mers picked from
+        # each probe are random
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            self.probes, 3, 30, min_k=10, k=10)
+        self.kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+
+        self.orig_min_bases = probe._MIN_BASES_PER_SCAN_TASK
+        probe._MIN_BASES_PER_SCAN_TASK = 500
+
+    def find_covers(self, fn, use_vectorized_scan, rc_too,
+                    merge_overlapping):
+        probe.open_probe_finding_pool(self.kmer_map, fn, 2,
+            use_vectorized_scan=use_vectorized_scan,
+            canonical_kmers=rc_too)
+        found = [probe.find_probe_covers_in_sequence(s,
+                    merge_overlapping=merge_overlapping, rc_too=rc_too)
+                 for s in self.sequences]
+        found_many = list(probe.find_probe_covers_in_sequences(
+            iter(self.sequences), merge_overlapping=merge_overlapping,
+            rc_too=rc_too))
+        probe.close_probe_finding_pool()
+        self.assertEqual(found_many, found)
+        return found
+
+    def compare(self, use_vectorized_scan, rc_too, merge_overlapping):
+        args = (use_vectorized_scan, rc_too, merge_overlapping)
+        found_tolerant = self.find_covers(self.f_tolerant, *args)
+        found_strict = self.find_covers(self.f, *args)
+        found = self.find_covers((self.f_tolerant, self.f), *args)
+        if rc_too:
+            expected = [((t, s), (t_rc, s_rc)) for (t, t_rc), (s, s_rc) in
+                        zip(found_tolerant, found_strict)]
+        else:
+            expected = list(zip(found_tolerant, found_strict))
+        self.assertEqual(found, expected)
+
+        # The functions should not give the same covers
+        self.assertNotEqual(found_tolerant, found_strict)
+
+    def test_without_vectorized_scan(self):
+        self.compare(False, False, False)
+        self.compare(False, True, True)
+
+    def test_with_vectorized_scan(self):
+        for rc_too in [False, True]:
+            for merge_overlapping in [False, True]:
+                self.compare(True, rc_too, merge_overlapping)
+
+    def tearDown(self):
+        probe._MIN_BASES_PER_SCAN_TASK = self.orig_min_bases
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestFindProbesHittingSequences(unittest.TestCase):
+    """Tests find_probes_hitting_sequences function.
+
+    These compare the output against the probes that cover a range in
+    the output of find_probe_covers_in_sequences().
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        np.random.seed(1)
+        self.sequences = []
+        for seq_len in [5, 300, 2000, 40, 1000, 7000, 500, 3]:
+            self.sequences += [''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                                        size=seq_len))]
+        long_seq = ''.join(self.sequences)
+        self.probes = []
+        for i in np.random.randint(0, len(long_seq) - 50, size=200):
+            probe_seq = list(long_seq[i:(i + 50)])
+            for j in np.random.randint(0, 50, size=np.random.randint(0, 8)):
+                probe_seq[j] = 'A' if probe_seq[j] != 'A' else 'C'
+            probe_seq = ''.join(probe_seq)
+            if np.random.random() < 0.5:
+                probe_seq = probe.reverse_complement_sequence(probe_seq)
+            self.probes += [probe.Probe.from_str(probe_seq)]
+        # Include probes that do not hit any sequence
+        for _ in range(10):
+            self.probes += [probe.Probe.from_str(''.join(
+                np.random.choice(['A', 'C', 'G', 'T'], size=50)))]
+        self.f_tolerant = \
+            probe.probe_covers_sequence_by_longest_common_substring(3, 40)
+        self.f = probe.probe_covers_sequence_by_longest_common_substring(
+            1, 45)
+
+        # Use the same map for every pool, since the k-mers picked from
+        # each probe are random
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            self.probes, 3, 40, min_k=10, k=10)
+        self.kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+
+        self.orig_min_bases = probe._MIN_BASES_PER_SCAN_TASK
+        probe._MIN_BASES_PER_SCAN_TASK = 500
+
+    def compare(self, fn, rc_too, use_vectorized_scan=False,
+                use_native_dict=False, encode_map=False):
+        if encode_map:
+            kmer_map = probe.EncodedKmerProbeMap.construct(self.kmer_map)
+        else:
+            kmer_map = self.kmer_map
+        probe.open_probe_finding_pool(kmer_map, fn, 2,
+            use_native_dict=use_native_dict,
+            use_vectorized_scan=use_vectorized_scan,
+            canonical_kmers=rc_too)
+        expected = set()
+        for probe_cover_ranges in probe.find_probe_covers_in_sequences(
+                iter(self.sequences), rc_too=rc_too):
+            strands = probe_cover_ranges if rc_too else (probe_cover_ranges,)
+            for strand_probe_cover_ranges in strands:
+                if isinstance(fn, tuple):
+                    strand_probe_cover_ranges = strand_probe_cover_ranges[0]
+                expected.update(strand_probe_cover_ranges.keys())
+        found = probe.find_probes_hitting_sequences(iter(self.sequences),
+                                                    rc_too=rc_too)
+        # Finding probes again should give the same output
+        found_again = probe.find_probes_hitting_sequences(
+            iter(self.sequences), rc_too=rc_too)
+        # A scan for covers afterward should not skip any probes
+        expected_again = set()
+        for probe_cover_ranges in probe.find_probe_covers_in_sequences(
+                iter(self.sequences), rc_too=rc_too):
+            strands = probe_cover_ranges if rc_too else (probe_cover_ranges,)
+            for strand_probe_cover_ranges in strands:
+                if isinstance(fn, tuple):
+                    strand_probe_cover_ranges = strand_probe_cover_ranges[0]
+                expected_again.update(strand_probe_cover_ranges.keys())
+        probe.close_probe_finding_pool()
+
+        self.assertEqual(found, expected)
+        self.assertEqual(found_again, expected)
+        self.assertEqual(expected_again, expected)
+        self.assertGreater(len(found), 0)
+        self.assertLess(len(found), len(set(self.probes)))
+
+    def test_without_vectorized_scan(self):
+        for rc_too in [False, True]:
+            self.compare(self.f_tolerant, rc_too)
+        self.compare(self.f_tolerant, True, use_native_dict=True)
+
+    def test_with_vectorized_scan(self):
+        for rc_too in [False, True]:
+            self.compare(self.f_tolerant, rc_too, use_vectorized_scan=True)
+
+    def test_with_encoded_map(self):
+        for rc_too in [False, True]:
+            self.compare(self.f_tolerant, rc_too, encode_map=True)
+
+    def test_many_cover_fns(self):
+        for use_vectorized_scan in [False, True]:
+            self.compare((self.f_tolerant, self.f), True,
+                         use_vectorized_scan=use_vectorized_scan)
+
+    def test_all_probes_hit(self):
+        # Every probe is found in the first sequence, so the rest need
+        # not be scanned
+        probes = self.probes[:20]
+        sequences = [''.join(p.seq_str for p in probes)] + self.sequences
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            probes, 3, 40, min_k=10, k=10)
+        kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+        for use_vectorized_scan in [False, True]:
+            probe.open_probe_finding_pool(kmer_map, self.f_tolerant, 2,
+                use_vectorized_scan=use_vectorized_scan)
+            found = probe.find_probes_hitting_sequences(iter(sequences))
+            probe.close_probe_finding_pool()
+            self.assertEqual(found, set(probes))
+
+    def tearDown(self):
+        probe._MIN_BASES_PER_SCAN_TASK = self.orig_min_bases
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestCountBpCoveredInKmerIndex(unittest.TestCase):
+    """Tests count_bp_covered_in_kmer_index function.
+
+    These compare the output against the number of bp covered in the
+    output of find_probe_covers_in_sequences().
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        np.random.seed(1)
+        self.sequences = []
+        for seq_len in [5, 300, 2000, 40, 1000, 7000, 500, 3]:
+            self.sequences += [''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                                        size=seq_len))]
+        # Include a repeated stretch, a palindrome, and bases that cannot
+        # be encoded
+        self.sequences += [self.sequences[1][:120] * 3 + 'ACGTTAACGT' +
+                           'N' * 5 + self.sequences[2][:100].lower() +
+                           self.sequences[2][:100]]
+        long_seq = ''.join(self.sequences)
+        self.probes = []
+        for i in np.random.randint(0, len(long_seq) - 50, size=200):
+            probe_seq = list(long_seq[i:(i + 50)].upper())
+            for j in np.random.randint(0, 50, size=np.random.randint(0, 8)):
+                probe_seq[j] = 'A' if probe_seq[j] != 'A' else 'C'
+            probe_seq = ''.join(probe_seq)
+            if np.random.random() < 0.5:
+                probe_seq = probe.reverse_complement_sequence(probe_seq)
+            self.probes += [probe.Probe.from_str(probe_seq)]
+        # Include a sequence in which every k-mer has an 'N', and probes
+        # from it (on each strand) that can only be found by k-mers that
+        # cannot be encoded
+        n_seq = list(np.random.choice(['A', 'C', 'G', 'T'], size=300))
+        n_seq[::8] = ['N'] * len(n_seq[::8])
+        n_seq = ''.join(n_seq)
+        self.sequences += [n_seq]
+        self.n_probes = [probe.Probe.from_str(n_seq[50:100]),
+                         probe.Probe.from_str(
+                             probe.reverse_complement_sequence(
+                                 n_seq[150:200]))]
+        self.probes += self.n_probes
+        self.f_tolerant = \
+            probe.probe_covers_sequence_by_longest_common_substring(3, 40)
+        self.f = probe.probe_covers_sequence_by_longest_common_substring(
+            1, 45)
+
+        # Use the same map for every pool, since the k-mers picked from
+        # each probe are random
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            self.probes, 3, 40, min_k=10, k=10)
+        self.kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        fasta_path = os.path.join(self.tmp_dir.name, 'genomes.fasta')
+        with open(fasta_path, 'w') as f:
+            for i, seq in enumerate(self.sequences):
+                f.write('>genome_%d\n%s\n' % (i, seq))
+        self.index_path = os.path.join(self.tmp_dir.name, 'index')
+        kmer_index.build([fasta_path], self.index_path, k=10)
+
+    def compare(self, fn, use_vectorized_scan=False):
+        index = kmer_index.GenomeKmerIndex(self.index_path)
+        probe.open_probe_finding_pool(self.kmer_map, fn, 2,
+            use_vectorized_scan=use_vectorized_scan,
+            canonical_kmers=True)
+        expected = defaultdict(int)
+        for probe_cover_ranges in probe.find_probe_covers_in_sequences(
+                iter(self.sequences), rc_too=True):
+            for strand_probe_cover_ranges in probe_cover_ranges:
+                if isinstance(fn, tuple):
+                    strand_probe_cover_ranges = strand_probe_cover_ranges[0]
+                for p, cover_ranges in strand_probe_cover_ranges.items():
+                    for start, end in cover_ranges:
+                        expected[p] += end - start
+        self.assertTrue(probe.can_count_bp_covered_in_kmer_index(index))
+        found = probe.count_bp_covered_in_kmer_index(index)
+        probe.close_probe_finding_pool()
+
+        self.assertEqual(found, dict(expected))
+        self.assertGreater(len(found), 0)
+        for p in self.n_probes:
+            self.assertGreaterEqual(found[p], 50)
+
+    def test_without_vectorized_scan(self):
+        self.compare(self.f_tolerant)
+
+    def test_with_vectorized_scan(self):
+        self.compare(self.f_tolerant, use_vectorized_scan=True)
+
+    def test_many_cover_fns(self):
+        self.compare((self.f_tolerant, self.f))
+
+    def test_unusable_index(self):
+        index = kmer_index.GenomeKmerIndex(self.index_path)
+
+        # The k-mers in the map have a different length than in the index
+        kmer_map = probe.SharedKmerProbeMap.construct(
+            probe.construct_kmer_probe_map_to_find_probe_covers(
+                self.probes, 3, 40, min_k=12, k=12))
+        probe.open_probe_finding_pool(kmer_map, self.f_tolerant, 2)
+        self.assertFalse(probe.can_count_bp_covered_in_kmer_index(index))
+        with self.assertRaises(ValueError):
+            probe.count_bp_covered_in_kmer_index(index)
+        probe.close_probe_finding_pool()
+
+        # The function determining coverage cannot score hits in bulk
+        def fn(probe_seq, sequence, kmer_start, kmer_end, full_probe_len,
+               full_sequence_len):
+            return None
+        probe.open_probe_finding_pool(self.kmer_map, fn, 2)
+        self.assertFalse(probe.can_count_bp_covered_in_kmer_index(index))
+        probe.close_probe_finding_pool()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestFindProbeCoversInSequenceWithCoverCache(unittest.TestCase):
+    """Tests find_probe_covers_in_sequence function with a cover cache.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        probe.set_cover_cache(cover_cache.CoverCache(self.tmp_dir.name))
+
+        np.random.seed(1)
+        self.sequence = 'ACGTAACCGGTTAAACCCGGGTTTACGTAACCGGTT'
+        self.probes = [probe.Probe.from_str(s)
+                       for s in ['AACCGGTT', 'CCCGGGTT', 'GGGGGGGG']]
+        kmer_map = probe.construct_kmer_probe_map_to_find_probe_covers(
+            self.probes, 0, 8, min_k=8)
+        self.kmer_map = probe.SharedKmerProbeMap.construct(kmer_map)
+
+    def num_entries(self):
+        return len(os.listdir(self.tmp_dir.name))
+
+    def find_covers(self, f, sequence):
+        probe.open_probe_finding_pool(self.kmer_map, f, 2)
+        found = probe.find_probe_covers_in_sequence(sequence)
+        probe.close_probe_finding_pool()
+        return found
+
+    def test_reuse(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        found = self.find_covers(f, self.sequence)
+        self.assertEqual(self.num_entries(), 1)
+        self.assertCountEqual(found[self.probes[0]], [(4, 12), (28, 36)])
+        self.assertCountEqual(found[self.probes[1]], [(15, 23)])
+
+        # Read from the cache, without calling a function to determine
+        # coverage
+        def f_cached(*args):
+            raise Exception("Covers should be read from the cache")
+        f_cached.cover_params = f.cover_params
+        self.assertEqual(self.find_covers(f_cached, self.sequence), found)
+        self.assertEqual(self.num_entries(), 1)
+
+        # A different sequence or different parameters give a new entry
+        self.find_covers(f, self.sequence[:20])
+        self.assertEqual(self.num_entries(), 2)
+        f2 = probe.probe_covers_sequence_by_longest_common_substring(1, 8)
+        self.find_covers(f2, self.sequence)
+        self.assertEqual(self.num_entries(), 3)
+
+    def test_reuse_with_other_probes(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        sequences = [self.sequence, self.sequence[:20]]
+        probes_all = self.probes + [probe.Probe.from_str('TTACGTAA')]
+        kmer_map_all = probe.SharedKmerProbeMap.construct(
+            probe.construct_kmer_probe_map_to_find_probe_covers(
+                probes_all, 0, 8, min_k=8))
+
+        # Find the covers of all the probes without a cache
+        probe.set_cover_cache()
+        probe.open_probe_finding_pool(kmer_map_all, f, 2)
+        expected = list(probe.find_probe_covers_in_sequences(sequences))
+        probe.close_probe_finding_pool()
+        probe.set_cover_cache(cover_cache.CoverCache(self.tmp_dir.name))
+
+        # Cache the covers of a subset of the probes
+        for sequence in sequences:
+            self.find_covers(f, sequence)
+        self.assertEqual(self.num_entries(), 2)
+
+        # Only the probes not yet scanned are aligned, and their covers
+        # are added to the entries
+        def f_checking(probe_seq, *args):
+            if ''.join(probe_seq) in [p.seq_str for p in self.probes]:
+                raise Exception("Covers should be read from the cache")
+            return f(probe_seq, *args)
+        f_checking.cover_params = f.cover_params
+        for use_vectorized_scan in [False, True]:
+            probe.open_probe_finding_pool(kmer_map_all, f_checking, 2,
+                use_vectorized_scan=use_vectorized_scan)
+            self.assertEqual(probe.find_probe_covers_in_sequence(
+                self.sequence), expected[0])
+            self.assertEqual(list(probe.find_probe_covers_in_sequences(
+                sequences)), expected)
+            probe.close_probe_finding_pool()
+            self.assertEqual(self.num_entries(), 2)
+
+        # Covers of all the probes are now read from the cache, as are
+        # those of the subset alone
+        def f_cached(*args):
+            raise Exception("Covers should be read from the cache")
+        f_cached.cover_params = f.cover_params
+        probe.open_probe_finding_pool(kmer_map_all, f_cached, 2)
+        self.assertEqual(list(probe.find_probe_covers_in_sequences(
+            sequences)), expected)
+        probe.close_probe_finding_pool()
+        self.assertEqual(self.find_covers(f_cached, self.sequence),
+                         {p: cover_ranges
+                          for p, cover_ranges in expected[0].items()
+                          if p in self.probes})
+
+    def test_reuse_across_scans(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        found = self.find_covers(f, self.sequence)
+        self.assertEqual(self.num_entries(), 1)
+
+        # Both scans find the same covers, so a vectorized scan reads the
+        # entry written by the other
+        def f_cached(*args):
+            raise Exception("Covers should be read from the cache")
+        f_cached.cover_params = f.cover_params
+        probe.open_probe_finding_pool(self.kmer_map, f_cached, 2,
+                                      use_vectorized_scan=True)
+        self.assertEqual(probe.find_probe_covers_in_sequence(self.sequence),
+                         found)
+        probe.close_probe_finding_pool()
+        self.assertEqual(self.num_entries(), 1)
+
+    def test_many_sequences(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        found = self.find_covers(f, self.sequence)
+        self.assertEqual(self.num_entries(), 1)
+
+        def f_cached(*args):
+            raise Exception("Covers should be read from the cache")
+        f_cached.cover_params = f.cover_params
+        probe.open_probe_finding_pool(self.kmer_map, f_cached, 2)
+        found_many = list(probe.find_probe_covers_in_sequences(
+            [self.sequence, self.sequence]))
+        probe.close_probe_finding_pool()
+        self.assertEqual(found_many, [found, found])
+        self.assertEqual(self.num_entries(), 1)
+
+    def test_interrupted_scan(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        probe.open_probe_finding_pool(self.kmer_map, f, 2)
+        def imap_unordered_interrupted(*args, **kwargs):
+            raise KeyboardInterrupt()
+        probe._pfp_pool.imap_unordered = imap_unordered_interrupted
+        with self.assertRaises(KeyboardInterrupt):
+            list(probe.find_probe_covers_in_sequences(
+                [self.sequence, self.sequence[:20]]))
+        probe.close_probe_finding_pool()
+
+        # No covers were computed, so none should be cached
+        self.assertEqual(self.num_entries(), 0)
+
+    def test_interrupted_scan_of_one_sequence(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        probe.open_probe_finding_pool(self.kmer_map, f, 2)
+        def map_interrupted(*args, **kwargs):
+            raise KeyboardInterrupt()
+        probe._pfp_pool.map = map_interrupted
+        with self.assertRaises(KeyboardInterrupt):
+            probe.find_probe_covers_in_sequence(self.sequence)
+        probe.close_probe_finding_pool()
+        self.assertEqual(self.num_entries(), 0)
+
+    def test_reverse_complement(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        probe.open_probe_finding_pool(self.kmer_map, f, 2)
+        found = probe.find_probe_covers_in_sequence(self.sequence,
+                                                    rc_too=True)
+        probe.close_probe_finding_pool()
+        # There is an entry for each strand
+        self.assertEqual(self.num_entries(), 2)
+        self.assertCountEqual(found[0][self.probes[0]], [(4, 12), (28, 36)])
+        self.assertCountEqual(found[1][self.probes[0]], [(0, 8), (24, 32)])
+
+        def f_cached(*args):
+            raise Exception("Covers should be read from the cache")
+        f_cached.cover_params = f.cover_params
+        probe.open_probe_finding_pool(self.kmer_map, f_cached, 2)
+        self.assertEqual(probe.find_probe_covers_in_sequence(self.sequence,
+            rc_too=True), found)
+        self.assertEqual(probe.find_probe_covers_in_sequence(self.sequence),
+                         found[0])
+        probe.close_probe_finding_pool()
+        self.assertEqual(self.num_entries(), 2)
+
+    def test_custom_fn_not_cached(self):
+        f = probe.probe_covers_sequence_by_longest_common_substring(0, 8)
+        def custom_f(*args):
+            return f(*args)
+        found = self.find_covers(custom_f, self.sequence)
+        self.assertCountEqual(found[self.probes[0]], [(4, 12), (28, 36)])
+        self.assertEqual(self.num_entries(), 0)
+
+    def tearDown(self):
+        probe.set_cover_cache()
+        self.tmp_dir.cleanup()
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
@@ -0,0 +1,180 @@
+"""A compact, vectorized Bloom filter of 64-bit integers.
+
+The integers are typically encoded k-mers (see catch.utils.twobit). A
+Bloom filter answers whether an integer may be in a set: it never gives
+a false negative, and gives a false positive with a small probability
+that depends on the number of bits per integer. It is much smaller than
+the set itself, so it can quickly rule out most integers that are not
+in a large, sorted array (e.g., one that is memory-mapped) before that
+array is searched.
+
+This is a blocked Bloom filter: all of the bits for an integer are in
+one block of 512 bits (a cache line), so checking an integer reads just
+one block. Integers are added and checked many at a time with NumPy.
+"""
+
+import numpy as np
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# Number of 64-bit words in a block; 8 words is 512 bits
+_WORDS_PER_BLOCK = 8
+
+# Number of bits needed to choose a bit in a block
+_BITS_PER_BLOCK_LOG2 = 9
+
+# Constants of the splitmix64 finalizer, used to mix integers into hashes
+_MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+_MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9),
+                    np.uint64(0x94D049BB133111EB))
+
+# Number of integers to add or check at a time; this bounds the memory
+# used by the temporary arrays
+_CHUNK_SIZE = 2**20
+
+
+def _mix(values):
+    """Mix 64-bit integers so that their bits are close to uniform.
+
+    Args:
+        values: np.uint64 array
+
+    Returns:
+        np.uint64 array of the mixed values
+    """
+    h = values.astype(np.uint64, copy=True)
+    h ^= h >> _MIX_SHIFTS[0]
+    h *= _MIX_MULTIPLIERS[0]
+    h ^= h >> _MIX_SHIFTS[1]
+    h *= _MIX_MULTIPLIERS[1]
+    h ^= h >> _MIX_SHIFTS[2]
+    return h
+
+
+class BloomFilter:
+    """A blocked Bloom filter of 64-bit integers.
+    """
+
+    def __init__(self, words, num_hashes):
+        """
+        Args:
+            words: np.uint64 array holding the bits of the filter; its
+                length must be a power of 2 that is a multiple of 8
+                (the number of words in a block)
+            num_hashes: number of bits set for each integer (1 through 7)
+        """
+        num_blocks = len(words) // _WORDS_PER_BLOCK
+        if (num_blocks == 0 or num_blocks & (num_blocks - 1) != 0 or
+                len(words) % _WORDS_PER_BLOCK != 0):
+            raise ValueError(("The number of words must be a power of 2 "
+                              "that is at least %d") % _WORDS_PER_BLOCK)
+        if not 1 <= num_hashes <= 64 // _BITS_PER_BLOCK_LOG2:
+            raise ValueError("num_hashes must be between 1 and %d" %
+                             (64 // _BITS_PER_BLOCK_LOG2))
+        self.words = words
+        self.num_hashes = num_hashes
+        self._block_mask = np.uint64(num_blocks - 1)
+
+    @staticmethod
+    def with_capacity(num_values, bits_per_value=10):
+        """Construct an empty filter sized for a number of integers.
+
+        Args:
+            num_values: number of integers expected to be added
+            bits_per_value: number of bits of the filter for each integer;
+                with 10, the false positive rate is about 1%
+
+        Returns:
+            instance of BloomFilter
+        """
+        num_bits = max(1, int(num_values * bits_per_value))
+        num_blocks = 1
+        while num_blocks * _WORDS_PER_BLOCK * 64 < num_bits:
+            num_blocks *= 2
+        # The optimal number of bits to set per integer is
+        # ln(2) * (bits per integer)
+        actual_bits_per_value = (num_blocks * _WORDS_PER_BLOCK * 64 /
+                                 max(num_values, 1))
+        num_hashes = int(round(np.log(2) * actual_bits_per_value))
+        num_hashes = min(max(num_hashes, 1), 64 // _BITS_PER_BLOCK_LOG2)
+        words = np.zeros(num_blocks * _WORDS_PER_BLOCK, dtype=np.uint64)
+        return BloomFilter(words, num_hashes)
+
+    def _word_and_bit_positions(self, values):
+        """Find the bits that represent integers.
+
+        Args:
+            values: np.uint64 array of integers
+
+        Returns:
+            tuple (word_ind, bits) of np.uint64 arrays of shape
+            (len(values), self.num_hashes) such that the j'th bit for
+            values[i] is the bit bits[i, j] (a mask) in the word
+            self.words[word_ind[i, j]]
+        """
+        h = _mix(values)
+        block = h & self._block_mask
+        # Use the other bits of a second hash to choose bits in the block
+        h2 = _mix(h)
+        shifts = (np.arange(self.num_hashes, dtype=np.uint64) *
+                  np.uint64(_BITS_PER_BLOCK_LOG2))
+        bit_in_block = ((h2[:, np.newaxis] >> shifts) &
+                        np.uint64(2**_BITS_PER_BLOCK_LOG2 - 1))
+        word_ind = (block[:, np.newaxis] * np.uint64(_WORDS_PER_BLOCK) +
+                    (bit_in_block >> np.uint64(6)))
+        bits = np.uint64(1) << (bit_in_block & np.uint64(63))
+        return (word_ind, bits)
+
+    def add(self, values):
+        """Add integers to the filter.
+
+        Args:
+            values: np.uint64 array of integers
+        """
+        for start in range(0, len(values), _CHUNK_SIZE):
+            word_ind, bits = self._word_and_bit_positions(
+                np.asarray(values[start:(start + _CHUNK_SIZE)]))
+            np.bitwise_or.at(self.words, word_ind.ravel(), bits.ravel())
+
+    def contains(self, values):
+        """Check whether integers may be in the filter.
+
+        Args:
+            values: np.uint64 array of integers
+
+        Returns:
+            np.array of dtype bool whose i'th entry is False if values[i]
+            was certainly not added, and True if it may have been
+        """
+        found = np.zeros(len(values), dtype=bool)
+        for start in range(0, len(values), _CHUNK_SIZE):
+            end = min(start + _CHUNK_SIZE, len(values))
+            word_ind, bits = self._word_and_bit_positions(
+                np.asarray(values[start:end]))
+            found[start:end] = np.all((self.words[word_ind] & bits) != 0,
+                                      axis=1)
+        return found
+
+    def save(self, path):
+        """Save the filter to a file.
+
+        Args:
+            path: path to a .npy file to write
+        """
+        np.save(path, np.append(self.words, np.uint64(self.num_hashes)))
+
+    @staticmethod
+    def load(path, mmap=True):
+        """Load a filter that was saved to a file.
+
+        Args:
+            path: path to a file written by save()
+            mmap: if True, memory-map the filter (read-only) rather than
+                reading it into memory
+
+        Returns:
+            instance of BloomFilter
+        """
+        words = np.load(path, mmap_mode='r' if mmap else None)
+        return BloomFilter(words[:-1], int(words[-1]))
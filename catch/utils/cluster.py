@@ -11,6 +11,7 @@ import ctypes
 from collections import defaultdict
 import logging
 import multiprocessing
+from multiprocessing import shared_memory
 from multiprocessing import sharedctypes
 import operator
 
@@ -111,9 +112,9 @@ def create_condensed_dist_matrix(n, dist_fn, num_processes=None):
     processes call dist_fn will cause some memory copying: the function  refers
     to objects, which have reference counters that will be incremented (a
     write), and for subprocesses Unix performs a copy-on-write. This might
-    cause a slowdown, but could be avoided in the future by copying the
-    MinHash signatures into multiprocessing sharedtypes and having the distance
-    function refer directly to these.
+    cause a slowdown; for MinHash signatures,
+    cluster_hierarchically_with_minhash() avoids it by storing the signatures
+    in shared memory.
 
     Args:
         n: number of elements whose pairwise distances to store in the
@@ -355,10 +356,433 @@ def find_connected_components(n, dist_fn, threshold,
     return connected_components
 
 
+def _minhash_keys(signatures):
+    """Make the values in each MinHash signature distinct.
+
+    A signature can contain a hash value more than once (e.g., if the
+    sequence is short). This replaces the o'th occurrence of a value v
+    with v*N + o, where N is the signature length; this preserves the
+    sorted order, and comparing two signatures of keys as sets is the
+    same as comparing the signatures as sorted multisets.
+
+    Args:
+        signatures: np.array of shape (n, N) whose rows are MinHash
+            signatures, each in sorted order
+
+    Returns:
+        np.array of dtype uint64 and shape (n, N) giving the keys
+    """
+    n, N = signatures.shape
+    pos = np.broadcast_to(np.arange(N), (n, N))
+    is_first = np.ones((n, N), dtype=bool)
+    is_first[:, 1:] = signatures[:, 1:] != signatures[:, :-1]
+    first_pos = np.maximum.accumulate(np.where(is_first, pos, 0), axis=1)
+    occurrence = (pos - first_pos).astype(np.uint64)
+    return signatures.astype(np.uint64) * np.uint64(N) + occurrence
+
+
+# Maximum number of elements in the arrays used when estimating
+# distances between one signature and many others
+_DIST_BATCH_ELEMENTS = 2**22
+
+
+def _jaccard_dists(keys, i, js):
+    """Estimate Jaccard distances between one signature and others.
+
+    This gives the same values as lsh.MinHashFamily.estimate_jaccard_dist():
+    of the N smallest values in the union of two signatures, it finds
+    the fraction that are in both.
+
+    Args:
+        keys: output of _minhash_keys()
+        i: index of a signature
+        js: np.array of indices of signatures
+
+    Returns:
+        np.array d of floats such that d[x] is the estimated Jaccard
+        distance between signatures i and js[x]
+    """
+    N = keys.shape[1]
+    dists = np.empty(len(js))
+    batch_size = max(1, _DIST_BATCH_ELEMENTS // (2 * N))
+    for start in range(0, len(js), batch_size):
+        js_batch = js[start:(start + batch_size)]
+        merged = np.concatenate(
+            (np.broadcast_to(keys[i], (len(js_batch), N)), keys[js_batch]),
+            axis=1)
+        merged.sort(axis=1)
+        # A key in both signatures appears twice, consecutively; mark the
+        # second occurrence, and give each key its position in the union
+        in_both = np.zeros(merged.shape, dtype=bool)
+        in_both[:, 1:] = merged[:, 1:] == merged[:, :-1]
+        union_pos = np.arange(2 * N) - np.cumsum(in_both, axis=1)
+        intersect_count = np.count_nonzero(in_both & (union_pos < N), axis=1)
+        dists[start:(start + batch_size)] = 1.0 - intersect_count / N
+    return dists
+
+
+def _candidate_buckets(keys, threshold):
+    """Find groups of signatures that may be within a distance threshold.
+
+    If the estimated Jaccard distance between two signatures is
+    <= threshold, they share at least t keys (for some t determined by
+    threshold) and, therefore, they share a key among the first N-t+1
+    keys of each (a 'prefix filter'). So every such pair of signatures
+    is in a common bucket, where a bucket holds the signatures that have
+    a particular key in their prefix. This makes it unnecessary to
+    consider all pairs.
+
+    Args:
+        keys: output of _minhash_keys()
+        threshold: Jaccard distance threshold
+
+    Returns:
+        list of np.arrays, each a sorted bucket of >= 2 signature indices
+    """
+    n, N = keys.shape
+    # Find the smallest number t of shared keys such that two
+    # signatures sharing t keys are within threshold
+    within = 1.0 - np.arange(N + 1) / N <= threshold
+    if not within.any():
+        return []
+    t = int(np.argmax(within))
+    if t == 0:
+        # Every pair is within threshold
+        return [np.arange(n)]
+    prefix_len = N - t + 1
+
+    prefix_keys = keys[:, :prefix_len].ravel()
+    prefix_idx = np.repeat(np.arange(n), prefix_len)
+    order = np.argsort(prefix_keys, kind='stable')
+    prefix_keys = prefix_keys[order]
+    prefix_idx = prefix_idx[order]
+    is_bucket_start = np.ones(len(prefix_keys), dtype=bool)
+    is_bucket_start[1:] = prefix_keys[1:] != prefix_keys[:-1]
+    bucket_starts = np.flatnonzero(is_bucket_start)
+    bucket_ends = np.append(bucket_starts[1:], len(prefix_keys))
+    return [prefix_idx[start:end]
+            for start, end in zip(bucket_starts.tolist(), bucket_ends.tolist())
+            if end - start >= 2]
+
+
+def _minhash_component_labels(keys, threshold):
+    """Label the connected components among MinHash signatures.
+
+    Two signatures are adjacent if their estimated Jaccard distance is
+    <= threshold. This only considers pairs of signatures in a common
+    bucket, given by _candidate_buckets(), and joins components with a
+    union-find (by size) structure. Pairs already in the same component
+    are not compared.
+
+    Args:
+        keys: output of _minhash_keys()
+        threshold: Jaccard distance threshold
+
+    Returns:
+        np.array c such that c[i] == c[j] iff signatures i and j are in
+        the same connected component
+    """
+    n = keys.shape[0]
+    comp = np.arange(n)
+    comp_members = [[i] for i in range(n)]
+
+    def union(i, j):
+        ci, cj = comp[i], comp[j]
+        if ci == cj:
+            return
+        if len(comp_members[ci]) < len(comp_members[cj]):
+            ci, cj = cj, ci
+        comp[comp_members[cj]] = ci
+        comp_members[ci].extend(comp_members[cj])
+        comp_members[cj] = None
+
+    buckets = _candidate_buckets(keys, threshold)
+    logger.debug(("Finding adjacent signatures in %d buckets"), len(buckets))
+    for bucket in buckets:
+        for x in range(len(bucket) - 1):
+            others = bucket[(x + 1):]
+            others = others[comp[others] != comp[bucket[x]]]
+            if len(others) == 0:
+                if (comp[bucket[x:]] == comp[bucket[x]]).all():
+                    # Everything else in the bucket is already in the
+                    # same component
+                    break
+                continue
+            dists = _jaccard_dists(keys, bucket[x], others)
+            for j in others[dists <= threshold].tolist():
+                union(bucket[x], j)
+    return comp
+
+
+def _components_from_labels(labels):
+    """Group indices by a component label.
+
+    Args:
+        labels: np.array of component labels
+
+    Returns:
+        list c such that c[i] is a sorted list of the indices in the i'th
+        component, and c is in sorted order by decreasing component size
+    """
+    order = np.argsort(labels, kind='stable')
+    starts = np.flatnonzero(np.diff(labels[order], prepend=-1))
+    components = np.split(order, starts[1:])
+    components = [c.tolist() for c in components if len(c) > 0]
+    components.sort(key=len, reverse=True)
+    return components
+
+
+def find_connected_components_with_minhash(signatures, threshold):
+    """Determine connected components among MinHash signatures.
+
+    This gives the same components as find_connected_components() with a
+    distance function that estimates Jaccard distance between signatures
+    (and without the early stopping heuristic), but it only computes
+    distances between pairs of signatures that share a hash value near
+    their start; see _candidate_buckets(). It does not store a distance
+    matrix.
+
+    Args:
+        signatures: np.array of shape (n, N) whose rows are MinHash
+            signatures, each in sorted order
+        threshold: consider two signatures to be adjacent if their
+            estimated Jaccard distance is <= this value
+
+    Returns:
+        list c such that c[i] is a sorted collection of all the indices
+        in the i'th connected component/cluster, and c is in sorted order by
+        decreasing cluster size
+    """
+    keys = _minhash_keys(signatures)
+    return _components_from_labels(_minhash_component_labels(keys, threshold))
+
+
+def _fill_in_component_dists(signatures, component, dist_matrix,
+        x_start, x_end):
+    """Fill in rows of a condensed distance matrix of a component.
+
+    Args:
+        signatures: np.array of shape (n, N) whose rows are MinHash
+            signatures, each in sorted order
+        component: np.array of the m indices of signatures in a component
+        dist_matrix: condensed distance matrix of length m(m-1)/2 for the
+            signatures in component
+        x_start, x_end: fill in the entries for pairs (x, y) with
+            x_start <= x < x_end and x < y < m
+    """
+    keys = _minhash_keys(signatures[component])
+    m = len(component)
+    for x in range(x_start, x_end):
+        idx = x*m - x*(x+1)//2
+        dist_matrix[idx:(idx + m - x - 1)] = _jaccard_dists(keys, x,
+            np.arange(x + 1, m))
+
+
+# Define a function to use in a multiprocessing Pool for filling in
+# the distance matrix of a component; this must be top-level in the module.
+# The signatures and the distance matrix are in shared memory, so processes
+# read and write them directly (without copying, or touching Python objects
+# whose reference counts would trigger copy-on-write)
+def _fill_in_component_dists_shared(signatures_name, signatures_shape,
+        component, dist_matrix_name, x_start, x_end):
+    signatures_shm = shared_memory.SharedMemory(name=signatures_name)
+    dist_matrix_shm = shared_memory.SharedMemory(name=dist_matrix_name)
+    m = len(component)
+    signatures = np.ndarray(signatures_shape, dtype=np.uint32,
+        buffer=signatures_shm.buf)
+    dist_matrix = np.ndarray((m*(m-1) // 2,), dtype=np.float32,
+        buffer=dist_matrix_shm.buf)
+    _fill_in_component_dists(signatures, component, dist_matrix,
+        x_start, x_end)
+    del signatures, dist_matrix
+    signatures_shm.close()
+    dist_matrix_shm.close()
+
+
+# Only use a multiprocessing Pool for a component's distance matrix if
+# the component has at least this many signatures
+_MIN_COMPONENT_SIZE_FOR_POOL = 1000
+
+
+def _row_ranges(m, num_ranges):
+    """Divide the rows of a condensed distance matrix into ranges.
+
+    Args:
+        m: number of elements in the distance matrix
+        num_ranges: number of ranges
+
+    Returns:
+        list of tuples (x_start, x_end), each covering about the same
+        number of entries
+    """
+    # Row x has m-x-1 entries, so entries before row x number
+    # x*m - x*(x+1)/2
+    num_entries = m*(m-1) // 2
+    rows = np.arange(m + 1)
+    entries_before = rows*m - rows*(rows+1) // 2
+    bounds = np.searchsorted(entries_before,
+        np.linspace(0, num_entries, num_ranges + 1)[1:-1])
+    bounds = np.unique(np.concatenate(([0], bounds, [m])))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+# Only make a distance matrix for a component if it has at most this
+# many signatures; the matrix has m(m-1)/2 entries for m signatures, so
+# larger components are split into pieces
+_MAX_COMPONENT_SIZE_FOR_DIST_MATRIX = 10000
+
+
+def _split_component(signatures, component, max_size):
+    """Split a component into pieces of similar signatures.
+
+    This sorts the signatures in a component lexicographically, so that
+    signatures sharing their smallest hash values are near each other,
+    and divides them into consecutive pieces of about the same size.
+
+    Args:
+        signatures: np.array of shape (n, N) whose rows are MinHash
+            signatures, each in sorted order
+        component: np.array of the m indices of signatures in a component
+        max_size: maximum number of signatures in a piece
+
+    Returns:
+        list of np.arrays, each giving the sorted indices of signatures
+        in a piece
+    """
+    m = len(component)
+    # np.lexsort() sorts by the last key first, so reverse the columns
+    order = np.lexsort(signatures[component].T[::-1])
+    num_pieces = -(-m // max_size)
+    return [np.sort(component[piece])
+            for piece in np.array_split(order, num_pieces)]
+
+
+def cluster_hierarchically_with_minhash(signatures, threshold,
+        num_processes=None):
+    """Cluster MinHash signatures hierarchically, one component at a time.
+
+    With average linkage, two clusters whose inter-cluster distance is
+    <= threshold must contain two elements within threshold of each other.
+    So every cluster lies within a connected component (as found by
+    find_connected_components_with_minhash()), and this only computes
+    a distance matrix for each component rather than for all signatures.
+    The clusters are the same as those found using a distance matrix of
+    all signatures -- except when a component has more than
+    _MAX_COMPONENT_SIZE_FOR_DIST_MATRIX signatures. Then, to bound the
+    size of the distance matrices, this logs a warning and clusters
+    pieces of the component (see _split_component()) separately, so no
+    cluster spans two pieces.
+
+    For large components, this fills in the distance matrix using a
+    multiprocessing Pool. The signatures are stored in one block of
+    shared memory, as is the distance matrix.
+
+    Args:
+        signatures: np.array of shape (n, N) whose rows are MinHash
+            signatures, each in sorted order
+        threshold: maximum inter-cluster distance to merge clusters (higher
+            results in fewer clusters)
+        num_processes: number of processes to use for the multiprocessing
+            Pool; if not set, this determines a number
+
+    Returns:
+        list c such that c[i] is a collection of the indices in the i'th
+        cluster, in sorted order by descending cluster size
+    """
+    global _cdm_max_num_processes
+    if num_processes is None:
+        num_processes = min(multiprocessing.cpu_count(),
+                            _cdm_max_num_processes)
+
+    signatures = np.ascontiguousarray(signatures, dtype=np.uint32)
+    keys = _minhash_keys(signatures)
+    components = _components_from_labels(
+        _minhash_component_labels(keys, threshold))
+    del keys
+
+    # Split components too large for a distance matrix
+    pieces = []
+    for component in components:
+        if len(component) > _MAX_COMPONENT_SIZE_FOR_DIST_MATRIX:
+            logger.warning(("A connected component has %d signatures, more "
+                "than the %d allowed in a distance matrix; clustering it "
+                "in pieces of similar signatures, so clusters will not "
+                "span pieces"), len(component),
+                _MAX_COMPONENT_SIZE_FOR_DIST_MATRIX)
+            pieces += _split_component(signatures, np.array(component),
+                _MAX_COMPONENT_SIZE_FOR_DIST_MATRIX)
+        else:
+            pieces += [component]
+    components = pieces
+
+    signatures_shm = None
+    clusters = []
+    try:
+        for component in components:
+            if len(component) == 1:
+                clusters += [component]
+                continue
+            logger.debug(("Creating condensed distance matrix of component "
+                "with %d signatures"), len(component))
+            component = np.array(component)
+            m = len(component)
+            dist_matrix_len = m*(m-1) // 2
+            if num_processes == 1 or m < _MIN_COMPONENT_SIZE_FOR_POOL:
+                dist_matrix = np.empty(dist_matrix_len, dtype=np.float32)
+                _fill_in_component_dists(signatures, component,
+                    dist_matrix, 0, m)
+            else:
+                if signatures_shm is None:
+                    # Copy the signatures into shared memory, once
+                    signatures_shm = shared_memory.SharedMemory(
+                        create=True, size=max(1, signatures.nbytes))
+                    np.ndarray(signatures.shape, dtype=np.uint32,
+                        buffer=signatures_shm.buf)[:] = signatures
+                dist_matrix_shm = shared_memory.SharedMemory(create=True,
+                    size=dist_matrix_len * np.dtype(np.float32).itemsize)
+                try:
+                    fix_spawn_behavior.fix_spawn_behavior()
+                    pool_args = [(signatures_shm.name, signatures.shape,
+                                  component, dist_matrix_shm.name,
+                                  x_start, x_end)
+                                 for x_start, x_end in
+                                 _row_ranges(m, num_processes)]
+                    pool = multiprocessing.Pool(num_processes)
+                    pool.starmap(_fill_in_component_dists_shared, pool_args)
+                    pool.close()
+
+                    dist_matrix = np.ndarray((dist_matrix_len,),
+                        dtype=np.float32, buffer=dist_matrix_shm.buf).copy()
+                finally:
+                    dist_matrix_shm.close()
+                    dist_matrix_shm.unlink()
+
+            for c in cluster_hierarchically_from_dist_matrix(dist_matrix,
+                    threshold):
+                clusters += [component[c].tolist()]
+    finally:
+        if signatures_shm is not None:
+            signatures_shm.close()
+            signatures_shm.unlink()
+
+    clusters.sort(key=len, reverse=True)
+    return clusters
+
+
+# Number of sequences whose signatures to produce at a time
+_SIGNATURE_BATCH_SIZE = 1000
+
+
 def cluster_with_minhash_signatures(seqs, k=12, N=100, threshold=0.1,
         cluster_method='simple'):
     """Cluster sequences based on their MinHash signatures.
 
+    This only computes distances between pairs of signatures that might be
+    within the threshold, so it does not need memory or time quadratic in
+    the number of sequences (except within a connected component, up to
+    a limit on the component size, when cluster_method is
+    'hierarchical').
+
     Args:
         seqs: dict mapping sequence header to sequences
         k: k-mer size to use for k-mer hashes (smaller is likely more
@@ -387,40 +811,34 @@ def cluster_with_minhash_signatures(seqs, k=12, N=100, threshold=0.1,
 
     logger.info(("Producing signatures of %d sequences"), num_seqs)
     family = lsh.MinHashFamily(k, N=N)
-    signatures_map = make_signatures_with_minhash(family, seqs)
+    # Construct a single hash function; use the same for all sequences
+    h = family.make_h()
 
-    # Map each sequence header to an index (0-based), and get
-    # the signature for the corresponding index
-    seq_headers = []
-    signatures = []
-    for name, seq in seqs.items():
-        seq_headers += [name]
-        signatures += [signatures_map[name]]
+    # Map each sequence header to an index (0-based), and store
+    # the signature for the corresponding index in a row of a matrix
+    seq_headers = list(seqs.keys())
+    signatures = np.zeros((num_seqs, N), dtype=np.uint32)
+    for start in range(0, num_seqs, _SIGNATURE_BATCH_SIZE):
+        batch_headers = seq_headers[start:(start + _SIGNATURE_BATCH_SIZE)]
+        signatures[start:(start + len(batch_headers))] = family.signatures(
+            [h], [seqs[name] for name in batch_headers]).reshape(
+                len(batch_headers), N)
 
     # Calculate a clustering threshold in terms of Jaccard distance
     jaccard_dist_threshold = _jaccard_dist_from_mash_dist(threshold, k)
 
-    def jaccard_dist(i, j):
-        # Return estimated Jaccard dist between signatures at
-        # index i and index j
-        return family.estimate_jaccard_dist(
-            signatures[i], signatures[j])
-
     if cluster_method == 'simple':
         logger.info(("Clustering %d sequences at Jaccard distance threshold "
                 "of %f based on connected components"), num_seqs,
                 jaccard_dist_threshold)
-        clusters = find_connected_components(num_seqs, jaccard_dist,
+        clusters = find_connected_components_with_minhash(signatures,
                 jaccard_dist_threshold)
     elif cluster_method == 'hierarchical':
-        logger.info(("Creating condensed distance matrix of %d sequences"),
-                num_seqs)
-        dist_matrix = create_condensed_dist_matrix(num_seqs, jaccard_dist)
         logger.info(("Clustering %d sequences at Jaccard distance threshold "
                 "of %f using hierarchical method"), num_seqs,
                 jaccard_dist_threshold)
-        clusters = cluster_hierarchically_from_dist_matrix(dist_matrix,
-            jaccard_dist_threshold)
+        clusters = cluster_hierarchically_with_minhash(signatures,
+                jaccard_dist_threshold)
     else:
         raise ValueError(f"Unknown cluster_method '{cluster_method}'")
 
@@ -0,0 +1,166 @@
+"""Persistent, on-disk cache of the ranges that probes cover in sequences.
+
+Finding the ranges that a collection of probes cover in a sequence (see
+probe.find_probe_covers_in_sequence()) is expensive, and the same probes
+are often mapped to the same sequences many times -- e.g., by several
+filters in one design, or across runs that vary other parameters. This
+stores the result for each (sequence, parameters) key in a file so that
+it can be reused. An entry holds the covers of every probe that has been
+mapped to the sequence, identified by a hash of the probe's sequence,
+along with the hashes of all those probes (including ones that cover
+nothing); so covers are reused for any probe already mapped, whatever
+other probes it was mapped with, and only the probes not yet mapped need
+to be.
+
+Each entry is stored compactly as four arrays -- hashes of the probes
+mapped, and for each cover range the index of its probe's hash, its
+start, and its end -- in a .npz file named by its key. The total size
+of the cache is bounded: when it is exceeded, the least recently used
+entries are removed. Which entries those are, and the total size, are
+tracked in memory; they are read from the directory (ordered by the
+files' modification times, which are updated on each read) only once.
+"""
+
+from collections import OrderedDict
+import logging
+import os
+
+import numpy as np
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+logger = logging.getLogger(__name__)
+
+
+# Default bound on the total size (in bytes) of a cache
+DEFAULT_MAX_SIZE = 4 * 1024**3
+
+
+class CoverCache:
+    """An LRU cache, stored in a directory, of probe cover ranges.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        """
+        Args:
+            path: path to a directory in which to store entries; it is
+                created if it does not exist
+            max_size: bound on the total size (in bytes) of the entries
+        """
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+        # OrderedDict mapping the path of each entry to its size, from
+        # the least to the most recently used, and the sum of the sizes;
+        # these are read from the directory when first needed by
+        # _read_entries()
+        self._entries = None
+        self._total_size = 0
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        """Read the entry with a key.
+
+        Args:
+            key: key (string) of an entry
+
+        Returns:
+            tuple (probe_hashes, probe_ind, starts, ends) of np.arrays,
+            where probe_hashes gives the hashes of the probes mapped and
+            (starts[i], ends[i]) is a cover range of the probe whose hash
+            is probe_hashes[probe_ind[i]]; or None if there is no
+            (readable) entry with the key
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with np.load(entry_path) as data:
+                entry = (data['probe_hashes'], data['probe_ind'],
+                         data['starts'], data['ends'])
+            # Mark the entry as recently used
+            os.utime(entry_path)
+            if self._entries is not None and entry_path in self._entries:
+                self._entries.move_to_end(entry_path)
+            else:
+                # The entry may have been written by another process
+                self._mark_used(entry_path, os.path.getsize(entry_path))
+        except (OSError, ValueError, KeyError):
+            # The entry does not exist, was evicted while being read,
+            # or is not valid
+            return None
+        return entry
+
+    def put(self, key, probe_hashes, probe_ind, starts, ends):
+        """Write an entry, and evict entries if the cache is too large.
+
+        The entry is written under a temporary name and then renamed, so
+        another process never reads a partially written entry.
+
+        Args:
+            key: key (string) of the entry
+            probe_hashes: np.array of the hashes of the probes mapped
+            probe_ind/starts/ends: np.arrays of the same length such that
+                the probe whose hash is probe_hashes[probe_ind[i]] covers
+                the range (starts[i], ends[i])
+        """
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path + '.tmp.' + str(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, probe_hashes=probe_hashes, probe_ind=probe_ind,
+                     starts=starts, ends=ends)
+            size = f.tell()
+        os.replace(tmp_path, entry_path)
+        self._mark_used(entry_path, size)
+        self._evict()
+
+    def _read_entries(self):
+        """Read the entries in the directory, if not already read.
+
+        This is the only time the directory is scanned; afterwards, the
+        entries are tracked as they are read, written, and evicted.
+        """
+        if self._entries is not None:
+            return
+
+        entries = []
+        with os.scandir(self.path) as it:
+            for dir_entry in it:
+                if not dir_entry.name.endswith('.npz'):
+                    continue
+                try:
+                    st = dir_entry.stat()
+                except OSError:
+                    # The entry was removed (e.g., by another process)
+                    continue
+                entries += [(st.st_mtime_ns, st.st_size, dir_entry.path)]
+
+        self._entries = OrderedDict(
+            (entry_path, size) for _, size, entry_path in sorted(entries))
+        self._total_size = sum(self._entries.values())
+
+    def _mark_used(self, entry_path, size):
+        """Track an entry as the most recently used one.
+
+        Args:
+            entry_path: path to the entry
+            size: size (in bytes) of the entry
+        """
+        self._read_entries()
+        self._total_size += size - self._entries.pop(entry_path, 0)
+        self._entries[entry_path] = size
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is not too large.
+        """
+        self._read_entries()
+        while self._total_size > self.max_size and self._entries:
+            entry_path, size = self._entries.popitem(last=False)
+            logger.debug("Evicting cover cache entry %s", entry_path)
+            try:
+                os.remove(entry_path)
+            except OSError:
+                # The entry was removed (e.g., by another process)
+                pass
+            self._total_size -= size
@@ -0,0 +1,125 @@
+"""Functions for finding identical windows of sequences using fingerprints.
+
+Candidate probes are windows of the target sequences, and many of them
+(e.g., from the same region of similar genomes) are identical. Rather than
+building a probe.Probe for every window and deduplicating the probes with
+a Python dict, this reads the windows, a chunk at a time, directly from
+the bytes of the sequences into a NumPy array of 64-bit words, computes a
+64-bit fingerprint of each window with vectorized operations, and sorts
+the fingerprints to find the first occurrence of each. Only those windows
+then need to be built into probes. Two different windows may (rarely)
+have the same fingerprint, so callers should verify that windows with
+equal fingerprints are identical.
+"""
+
+import numpy as np
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# Multiplier used for mixing words into a fingerprint; it is odd so that
+# multiplication is invertible modulo 2^64
+_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+# Number of windows to read into an array at a time
+_CHUNK_SIZE = 2**16
+
+
+def _window_words(buf, starts, lengths, width):
+    """Read windows of a buffer into a 2D array of 64-bit words.
+
+    Each window is padded with NUL bytes to width bytes. Because sequences
+    do not contain NUL bytes, two windows are equal if and only if their
+    rows are equal.
+
+    Args:
+        buf: np.array of dtype uint8 (e.g., the ASCII values of sequences)
+        starts: np.array giving the start of each window in buf
+        lengths: np.array giving the length of each window
+        width: number of bytes in each row (a multiple of 8)
+
+    Returns:
+        np.array of dtype uint64 and shape (len(starts), width/8) whose
+        i'th row holds buf[starts[i]:(starts[i] + lengths[i])]
+    """
+    cols = np.arange(width)
+    in_window = cols < lengths[:, np.newaxis]
+    ind = np.where(in_window, starts[:, np.newaxis] + cols, 0)
+    rows = np.where(in_window, buf[ind], 0).astype(np.uint8)
+    return rows.view('<u8')
+
+
+def _fingerprint_words(words):
+    """Compute a 64-bit fingerprint of each row of words.
+
+    Args:
+        words: np.array of windows, as output by _window_words()
+
+    Returns:
+        np.array of dtype uint64 giving the fingerprint of each row
+    """
+    h = np.zeros(words.shape[0], dtype=np.uint64)
+    shift = np.uint64(29)
+    for j in range(words.shape[1]):
+        h ^= words[:, j]
+        h *= _MULTIPLIER
+        h ^= h >> shift
+    return h
+
+
+def fingerprint_windows(buf, starts, lengths, max_length=None):
+    """Compute a 64-bit fingerprint of each window of a buffer.
+
+    The windows are read a chunk at a time, so this only stores the
+    fingerprints (8 bytes per window) for all of them.
+
+    Args:
+        buf: np.array of dtype uint8, which does not contain NUL bytes
+        starts: np.array giving the start of each window in buf
+        lengths: np.array giving the length of each window
+        max_length: bound on the length of the windows; fingerprints
+            from calls with the same max_length are comparable (e.g.,
+            for windows of different buffers). If None, the length of
+            the longest window, so fingerprints are only comparable
+            within one call
+
+    Returns:
+        np.array of dtype uint64 giving the fingerprint of each window;
+        identical windows have equal fingerprints
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if max_length is None:
+        max_length = int(lengths.max()) if len(lengths) > 0 else 0
+    width = max(-(-max_length // 8), 1) * 8
+    h = np.empty(len(starts), dtype=np.uint64)
+    for start in range(0, len(starts), _CHUNK_SIZE):
+        end = min(start + _CHUNK_SIZE, len(starts))
+        h[start:end] = _fingerprint_words(_window_words(
+            buf, starts[start:end], lengths[start:end], width))
+    return h
+
+
+def first_occurrences(h):
+    """Find, for each fingerprint, the first fingerprint equal to it.
+
+    Args:
+        h: np.array of fingerprints
+
+    Returns:
+        np.array first of dtype int64 such that first[i] is the smallest
+        j with h[j] == h[i]
+    """
+    order = np.argsort(h, kind='stable')
+    h_sorted = h[order]
+    new_group = np.ones(len(h), dtype=bool)
+    new_group[1:] = h_sorted[1:] != h_sorted[:-1]
+    del h_sorted
+
+    # Equal fingerprints are in their input order (the sort is stable), so
+    # the first in each run of them is the first occurrence
+    group_first = order[new_group]
+    first = np.empty(len(h), dtype=np.int64)
+    first[order] = group_first[np.cumsum(new_group) - 1]
+    return first
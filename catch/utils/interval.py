@@ -3,6 +3,8 @@
 
 import bisect
 
+import numpy as np
+
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
 
@@ -285,6 +287,161 @@ class IntervalSet(object):
         return str(self.intervals)
 
 
+class IntervalBitmap(object):
+    """Mutable collection of integers, stored as a bitmap over intervals.
+
+    This is meant to hold the elements of a set cover universe that are
+    not yet covered, when those elements come in contiguous stretches
+    (e.g., positions in a genome). Like an IntervalSet, it is built from
+    intervals (start, end) where start is inclusive and end is exclusive.
+    But rather than merging lists of endpoints, it answers the two
+    operations that set cover needs -- counting the elements that lie in
+    some intervals, and removing the elements in some intervals -- with
+    a bitmap (one NumPy bool per integer in the range spanned) and a
+    Fenwick (binary indexed) tree over blocks of the bitmap. Counting the
+    elements in an interval takes O(log n) time plus the time to scan at
+    most two partial blocks, regardless of how fragmented the
+    collection is.
+
+    This uses 1 byte of memory for every integer between the smallest
+    start and the largest end of the given intervals.
+    """
+
+    # Number of integers in each block of the bitmap whose count is
+    # stored in the Fenwick tree
+    BLOCK_SIZE = 64
+
+    __slots__ = ('offset', 'bits', 'tree', 'num_blocks', 'len_cached')
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals: collection of intervals, each of the form
+                    (start, end) where start is inclusive and end is
+                    exclusive; they may overlap
+        """
+        intervals = list(intervals)
+        if len(intervals) == 0:
+            self.offset = 0
+            span = 0
+        else:
+            self.offset = min(start for start, _ in intervals)
+            span = max(end for _, end in intervals) - self.offset
+        self.bits = np.zeros(max(span, 0), dtype=bool)
+        for start, end in intervals:
+            self.bits[(start - self.offset):(end - self.offset)] = True
+        self.len_cached = int(np.count_nonzero(self.bits))
+
+        # Count the elements in each block and build the Fenwick tree
+        # in linear time. Store the tree in a Python list rather than a
+        # NumPy array because it is only accessed one entry at a time,
+        # which is faster with a list
+        self.num_blocks = -(-len(self.bits) // self.BLOCK_SIZE)
+        if self.num_blocks > 0:
+            block_counts = np.add.reduceat(
+                self.bits,
+                np.arange(0, len(self.bits), self.BLOCK_SIZE),
+                dtype=np.int64)
+        else:
+            block_counts = []
+        self.tree = [0] + [int(c) for c in block_counts]
+        for i in range(1, self.num_blocks + 1):
+            j = i + (i & -i)
+            if j <= self.num_blocks:
+                self.tree[j] += self.tree[i]
+
+    def _blocks_prefix_count(self, num_blocks):
+        """Count the elements in the first num_blocks blocks.
+        """
+        count = 0
+        i = num_blocks
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+    def _blocks_add(self, block, delta):
+        """Add delta to the count of elements in a block.
+        """
+        i = block + 1
+        while i <= self.num_blocks:
+            self.tree[i] += delta
+            i += i & -i
+
+    def _clip(self, start, end):
+        """Convert an interval to (clipped) indices in self.bits.
+        """
+        a = max(start - self.offset, 0)
+        b = min(end - self.offset, len(self.bits))
+        return (a, b)
+
+    def count(self, intervals):
+        """Count the elements that lie in intervals.
+
+        Args:
+            intervals: collection of non-overlapping intervals, each of
+                the form (start, end) -- e.g., the intervals of an
+                IntervalSet
+
+        Returns:
+            number of elements in this collection that are contained in
+            an interval in intervals
+        """
+        B = self.BLOCK_SIZE
+        count = 0
+        for start, end in intervals:
+            a, b = self._clip(start, end)
+            if a >= b:
+                continue
+            # Count whole blocks with the Fenwick tree, and the partial
+            # blocks on either side directly from the bitmap
+            block_a = -(-a // B)
+            block_b = b // B
+            if block_a >= block_b:
+                count += int(np.count_nonzero(self.bits[a:b]))
+            else:
+                count += int(np.count_nonzero(self.bits[a:(block_a * B)]))
+                count += (self._blocks_prefix_count(block_b) -
+                          self._blocks_prefix_count(block_a))
+                count += int(np.count_nonzero(self.bits[(block_b * B):b]))
+        return count
+
+    def remove(self, intervals):
+        """Remove the elements that lie in intervals.
+
+        Args:
+            intervals: collection of intervals, each of the form
+                (start, end)
+
+        Returns:
+            number of elements removed
+        """
+        B = self.BLOCK_SIZE
+        num_removed = 0
+        for start, end in intervals:
+            a, b = self._clip(start, end)
+            if a >= b:
+                continue
+            for block in range(a // B, (b - 1) // B + 1):
+                block_a = max(a, block * B)
+                block_b = min(b, (block + 1) * B)
+                c = int(np.count_nonzero(self.bits[block_a:block_b]))
+                if c > 0:
+                    self._blocks_add(block, -c)
+                    num_removed += c
+            self.bits[a:b] = False
+        self.len_cached -= num_removed
+        return num_removed
+
+    def __len__(self):
+        """Count the number of elements in this collection.
+
+        Returns:
+            number of elements
+        """
+        return self.len_cached
+
+
 def merge_overlapping(intervals):
     """Merge a list of possibly overlapping intervals.
 
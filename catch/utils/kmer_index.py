@@ -0,0 +1,523 @@
+"""Persistent, memory-mapped index of the k-mers in a collection of genomes.
+
+Finding how much of a large genome (e.g., a host genome that probes
+should avoid) is covered by candidate probes requires, with
+probe.find_probe_covers_in_sequence(), scanning every k-mer of the
+genome. That is done for every collection of candidate probes, in every
+design. Instead, this indexes the genome once: it stores, in sorted
+arrays, every k-mer of the genome (encoded with catch.utils.twobit) along
+with where it occurs, as well as a copy of the sequences. The k-mers of
+candidate probes can then be looked up in the index, and each probe
+aligned at just the positions where it shares a k-mer with the genome,
+so that the cost scales with the number of candidate probes rather than
+with the size of the genome.
+
+A k-mer and its reverse complement are stored together, under their
+canonical form (the smaller of the two values), so one lookup finds
+occurrences on both strands of the genome. The arrays are stored in a
+directory as .npy files and memory-mapped when loaded, so an index
+larger than memory can be used, and processes that read the same index
+share its pages through the OS page cache. An index can optionally
+include a Bloom filter of its k-mers (see catch.utils.bloom_filter),
+which is checked before the sorted k-mers are searched; this is useful
+because most k-mers that are looked up are usually not in the genome.
+
+K-mers that cannot be encoded but that a probe could contain (those
+with a degenerate base, such as 'N') are stored separately, as strings,
+in a side table, so that k-mers of probes with such bases can be looked
+up without scanning the sequences. Probes are uppercase, so k-mers with
+a lowercase (e.g., soft-masked) base are not stored anywhere.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from catch.utils import bloom_filter
+from catch.utils import seq_io
+from catch.utils import twobit
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+logger = logging.getLogger(__name__)
+
+
+# Name of the file whose presence marks a directory as an index
+_K_FILENAME = 'k.npy'
+
+# Number of k-mers of a sequence to encode at a time when building an
+# index; this bounds the memory used by the temporary arrays
+_BUILD_BLOCK_SIZE = 2**24
+
+# Bases that can be in a probe; a k-mer that cannot be encoded is only
+# stored if all its bases are among these
+_PROBE_BASES = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def is_index(path):
+    """Determine whether a path is a directory written by build().
+
+    Args:
+        path: path to a file or directory
+
+    Returns:
+        True iff path is a directory containing an index
+    """
+    return os.path.isfile(os.path.join(path, _K_FILENAME))
+
+
+class GenomeKmerIndex:
+    """An index, written by build(), of the k-mers in genomes.
+
+    The index stores:
+      - keys: np.uint64 array, in sorted order, of the canonical form of
+        every k-mer in the sequences, with one entry for each occurrence;
+        k-mers with a base other than 'A', 'C', 'G', or 'T' (including
+        lowercase bases) are not stored
+      - pos: np.int64 array such that the k-mer keys[i] occurs starting
+        at position pos[i] of the concatenated sequences
+      - strands: np.array of dtype bool such that strands[i] is True iff
+        the k-mer at pos[i] is not its canonical form (i.e., its reverse
+        complement is keys[i])
+      - ambiguous_keys: np.array of dtype 'S<k>' of every k-mer in the
+        sequences that cannot be encoded and whose bases are all
+        uppercase (as it appears in the sequence, not in a canonical
+        form), with one entry for each occurrence; it is divided into
+        partitions by a hash of the k-mer (see
+        _ambiguous_kmer_partitions()), and each partition is in sorted
+        order
+      - ambiguous_offsets: np.int64 array such that partition b is
+        ambiguous_keys[ambiguous_offsets[b]:ambiguous_offsets[b+1]]
+      - ambiguous_pos: np.int64 array such that the k-mer
+        ambiguous_keys[i] occurs starting at position ambiguous_pos[i]
+        of the concatenated sequences
+      - seq_offsets: np.int64 array such that sequence j occupies
+        positions [seq_offsets[j], seq_offsets[j+1]) of the concatenated
+        sequences
+    """
+
+    def __init__(self, path, mmap=True):
+        """
+        Args:
+            path: path to a directory written by build()
+            mmap: if True, memory-map the arrays (read-only) rather than
+                reading them into memory
+        """
+        self.path = path
+        self.mmap = mmap
+        self._load()
+
+    def _load(self):
+        mmap_mode = 'r' if self.mmap else None
+        self.k = int(np.load(os.path.join(self.path, _K_FILENAME))[0])
+        self.keys = np.load(os.path.join(self.path, 'keys.npy'),
+                            mmap_mode=mmap_mode)
+        self.pos = np.load(os.path.join(self.path, 'pos.npy'),
+                           mmap_mode=mmap_mode)
+        self.strands = np.load(os.path.join(self.path, 'strands.npy'),
+                               mmap_mode=mmap_mode)
+        self.ambiguous_keys = np.load(
+            os.path.join(self.path, 'ambiguous_keys.npy'),
+            mmap_mode=mmap_mode)
+        self.ambiguous_pos = np.load(
+            os.path.join(self.path, 'ambiguous_pos.npy'),
+            mmap_mode=mmap_mode)
+        self.ambiguous_offsets = np.load(
+            os.path.join(self.path, 'ambiguous_offsets.npy'))
+        with open(os.path.join(self.path, 'fastas.txt')) as f:
+            fasta_dirs = [line.rstrip('\n') for line in f]
+        self.fastas = [seq_io.IndexedFasta(os.path.join(self.path, 'fastas',
+                                                        d))
+                       for d in fasta_dirs]
+        self.seq_offsets = _concatenated_seq_offsets(self.fastas)
+
+        bloom_path = os.path.join(self.path, 'bloom.npy')
+        if os.path.isfile(bloom_path):
+            self.bloom = bloom_filter.BloomFilter.load(bloom_path,
+                                                       mmap=self.mmap)
+        else:
+            self.bloom = None
+
+    def __len__(self):
+        return len(self.seq_offsets) - 1
+
+    def _fasta_and_seq(self, j):
+        """Find where a sequence is stored.
+
+        Args:
+            j: index of a sequence in the concatenated sequences
+
+        Returns:
+            tuple (fasta, i) such that sequence j is sequence i of the
+            instance of seq_io.IndexedFasta fasta
+        """
+        for fasta in self.fastas:
+            if j < len(fasta):
+                return (fasta, j)
+            j -= len(fasta)
+        raise IndexError("Sequence index out of range")
+
+    def seq_bytes(self, j):
+        """Read a sequence as an array.
+
+        Args:
+            j: index of a sequence in the concatenated sequences
+
+        Returns:
+            np.uint8 array of the ASCII values of sequence j
+        """
+        fasta, i = self._fasta_and_seq(j)
+        return fasta.seq_bytes(i)
+
+    def iterate_sequences(self):
+        """Iterate over the sequences in the index.
+
+        As with seq_io.iterate_fasta(), empty sequences are skipped.
+
+        Yields:
+            each sequence (as a string), in the order they were indexed
+        """
+        for fasta in self.fastas:
+            for i in range(len(fasta)):
+                if fasta.seq_len(i) > 0:
+                    yield fasta.seq(i)
+
+    def seq_index(self, pos):
+        """Find the sequences that contain positions.
+
+        Args:
+            pos: np.array of positions in the concatenated sequences
+
+        Returns:
+            np.array giving, for each position, the index of the sequence
+            that contains it
+        """
+        return np.searchsorted(self.seq_offsets, pos, side='right') - 1
+
+    def lookup(self, values):
+        """Find the occurrences of many canonical k-mers at once.
+
+        Args:
+            values: np.uint64 array of canonical k-mers (the smaller of
+                the value of a k-mer and of its reverse complement)
+
+        Returns:
+            tuple (query_ind, index_ind) of np.arrays such that, for each
+            t, values[query_ind[t]] is equal to keys[index_ind[t]]; there
+            is one entry for every such pair, and pairs are ordered by
+            query_ind
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        query_ind = np.arange(len(values))
+        if self.bloom is not None:
+            # Only search the sorted k-mers for the values that may be
+            # present
+            query_ind = query_ind[self.bloom.contains(values)]
+        return _lookup_in_sorted(self.keys, values, query_ind)
+
+    def lookup_ambiguous(self, kmers):
+        """Find the occurrences of k-mers that cannot be encoded.
+
+        Args:
+            kmers: list of k-mers (as strings) of length k, each with a
+                base other than 'A', 'C', 'G', or 'T'
+
+        Returns:
+            tuple (query_ind, index_ind) of np.arrays such that, for each
+            t, kmers[query_ind[t]] is equal to ambiguous_keys[index_ind[t]];
+            there is one entry for every such pair, and pairs are ordered
+            by query_ind
+        """
+        values = np.array([kmer.encode() for kmer in kmers],
+                          dtype=self.ambiguous_keys.dtype)
+        partitions = _ambiguous_kmer_partitions(
+            values, len(self.ambiguous_offsets) - 1)
+
+        # Search for each k-mer in its partition
+        query_ind, index_ind = [], []
+        for b in np.unique(partitions).tolist():
+            start = int(self.ambiguous_offsets[b])
+            end = int(self.ambiguous_offsets[b + 1])
+            b_query_ind, b_index_ind = _lookup_in_sorted(
+                self.ambiguous_keys[start:end], values,
+                np.flatnonzero(partitions == b))
+            query_ind += [b_query_ind]
+            index_ind += [b_index_ind + start]
+        if len(query_ind) == 0:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        query_ind = np.concatenate(query_ind)
+        index_ind = np.concatenate(index_ind)
+        order = np.argsort(query_ind, kind='stable')
+        return (query_ind[order], index_ind[order])
+
+    def __getstate__(self):
+        # Only pickle the path, so that sending this to another process
+        # does not copy the index
+        return {'path': self.path, 'mmap': self.mmap}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.mmap = state['mmap']
+        self._load()
+
+
+def _lookup_in_sorted(keys, values, query_ind):
+    """Find the occurrences of values in a sorted array.
+
+    Args:
+        keys: sorted np.array
+        values: np.array of values to find, with the dtype of keys
+        query_ind: np.array of the indices of values to find
+
+    Returns:
+        tuple (query_ind, index_ind) as output by GenomeKmerIndex.lookup()
+    """
+    lo = np.searchsorted(keys, values[query_ind], side='left')
+    hi = np.searchsorted(keys, values[query_ind], side='right')
+    counts = hi - lo
+    query_ind = np.repeat(query_ind, counts)
+    # Expand each range [lo, hi) into its indices
+    run_starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    index_ind = run_starts + np.arange(len(query_ind))
+    return (query_ind, index_ind)
+
+
+def _concatenated_seq_offsets(fastas):
+    """Compute where each sequence starts when sequences are concatenated.
+
+    Args:
+        fastas: list of instances of seq_io.IndexedFasta
+
+    Returns:
+        np.int64 array such that sequence j (counting across fastas, in
+        order) occupies positions [offsets[j], offsets[j+1])
+    """
+    seq_offsets = [np.zeros(1, dtype=np.int64)]
+    total = 0
+    for fasta in fastas:
+        seq_offsets += [fasta.offsets[1:] + total]
+        total += int(fasta.offsets[-1])
+    return np.concatenate(seq_offsets).astype(np.int64)
+
+
+def _iterate_kmer_blocks(fastas, k):
+    """Encode the k-mers of sequences, a block at a time.
+
+    Args:
+        fastas: list of instances of seq_io.IndexedFasta
+        k: k-mer length
+
+    Yields:
+        tuples (block, block_pos, values, valid) giving a block of a
+        sequence (as an np.uint8 array), the position of the block in the
+        concatenated sequences, and the output of twobit.kmer_values()
+        for the k-mers starting in the block
+    """
+    seq_start = 0
+    for fasta in fastas:
+        for i in range(len(fasta)):
+            seq = fasta.seq_bytes(i)
+            num_kmers = len(seq) - k + 1
+            for block_start in range(0, max(num_kmers, 0),
+                                     _BUILD_BLOCK_SIZE):
+                block_end = min(num_kmers, block_start + _BUILD_BLOCK_SIZE)
+                block = np.asarray(seq[block_start:(block_end + k - 1)])
+                values, valid = twobit.kmer_values(twobit.encode(block), k)
+                yield (block, block_start + seq_start, values, valid)
+            seq_start += len(seq)
+
+
+def _iterate_kmers(fastas, k):
+    """Find the k-mers of sequences to index, a block at a time.
+
+    Args:
+        fastas: list of instances of seq_io.IndexedFasta
+        k: k-mer length
+
+    Yields:
+        tuples (values, pos, strands, ambiguous_kmers, ambiguous_pos) of
+        np.arrays giving the canonical form of each k-mer that can be
+        encoded, its position in the concatenated sequences, and whether
+        it is not its canonical form; and each k-mer that cannot be
+        encoded but whose bases are all in _PROBE_BASES (with dtype
+        'S<k>') and its position in the concatenated sequences
+    """
+    probe_base = np.zeros(256, dtype=bool)
+    probe_base[np.frombuffer(_PROBE_BASES, dtype=np.uint8)] = True
+    for block, block_pos, values, valid in _iterate_kmer_blocks(fastas, k):
+        valid_pos = np.flatnonzero(valid)
+        values = values[valid_pos]
+        rc_values = twobit.reverse_complement_values(values, k)
+
+        # Count, using a cumulative sum, the bases in each k-mer that
+        # cannot be in a probe
+        not_probe_base_cumsum = np.zeros(len(block) + 1, dtype=np.int64)
+        np.cumsum(~probe_base[block], out=not_probe_base_cumsum[1:])
+        ambiguous_pos = np.flatnonzero(~valid & (
+            not_probe_base_cumsum[k:] == not_probe_base_cumsum[:len(valid)]))
+        # Read each k-mer as a row of bytes, and view the rows as strings
+        rows = np.lib.stride_tricks.sliding_window_view(block, k)
+        ambiguous_kmers = np.ascontiguousarray(rows[ambiguous_pos]).view(
+            'S%d' % k).ravel()
+
+        yield (np.minimum(values, rc_values), valid_pos + block_pos,
+               rc_values < values, ambiguous_kmers,
+               ambiguous_pos + block_pos)
+
+
+def _ambiguous_kmer_partitions(kmers, num_partitions):
+    """Assign k-mers that cannot be encoded to partitions.
+
+    Args:
+        kmers: np.array of k-mers with dtype 'S<k>'
+        num_partitions: number of partitions
+
+    Returns:
+        np.int64 array giving the partition of each k-mer, based on a
+        hash of it
+    """
+    rows = kmers.view(np.uint8).reshape(
+        len(kmers), kmers.dtype.itemsize).astype(np.uint64)
+    h = np.zeros(len(kmers), dtype=np.uint64)
+    for col in range(rows.shape[1]):
+        h = h * np.uint64(1099511628211) + rows[:, col]
+    return (h % np.uint64(num_partitions)).astype(np.int64)
+
+
+def build(fasta_paths, path, k=20, num_passes=1, bloom_bits_per_kmer=None):
+    """Build an index of the k-mers in genomes.
+
+    The k-mers are sorted in num_passes passes over the sequences: pass b
+    sorts the k-mers whose canonical forms are in the b'th of num_passes
+    ranges of equal width, and writes them to their place in the index.
+    Memory use is therefore roughly proportional to the number of k-mers
+    divided by num_passes. The k-mers that cannot be encoded (and are
+    stored) are sorted in the same passes: pass b sorts those in the
+    b'th partition by a hash of the k-mer.
+
+    Args:
+        fasta_paths: list of paths to FASTA files (possibly
+            gzip-compressed) of the genomes to index
+        path: path to a directory to create for the index
+        k: k-mer length; must be at most twobit.MAX_EXACT_K
+        num_passes: number of passes over the sequences in which to sort
+            the k-mers
+        bloom_bits_per_kmer: if set, also build a Bloom filter of the
+            k-mers with this many bits per k-mer
+
+    Raises:
+        ValueError if k is too large, or path already exists
+    """
+    if not 1 <= k <= twobit.MAX_EXACT_K:
+        raise ValueError("k must be between 1 and %d" % twobit.MAX_EXACT_K)
+    if os.path.exists(path):
+        raise ValueError("The path %s already exists" % path)
+
+    # Write the index under a temporary name and then rename it, so that
+    # a partially written index is never read
+    tmp_path = path + '.tmp.' + str(os.getpid())
+    os.makedirs(os.path.join(tmp_path, 'fastas'))
+
+    # Copy the sequences; as in seq_io.iterate_fasta(), which is used
+    # to read genomes to avoid, keep gaps and lowercase bases
+    fastas = []
+    for fasta_path in fasta_paths:
+        fastas += [seq_io.index_fasta(fasta_path,
+                                      os.path.join(tmp_path, 'fastas'),
+                                      skip_gaps=False, make_uppercase=False)]
+    with open(os.path.join(tmp_path, 'fastas.txt'), 'w') as f:
+        for fasta in fastas:
+            f.write(os.path.basename(fasta.path) + '\n')
+
+    # Count the k-mers in each range of canonical forms
+    boundaries = np.array([(4**k * b) // num_passes
+                           for b in range(1, num_passes)], dtype=np.uint64)
+    counts = np.zeros(num_passes, dtype=np.int64)
+    ambiguous_counts = np.zeros(num_passes, dtype=np.int64)
+    for values, _, _, ambiguous_kmers, _ in _iterate_kmers(fastas, k):
+        counts += np.bincount(np.searchsorted(boundaries, values,
+                                              side='right'),
+                              minlength=num_passes)
+        ambiguous_counts += np.bincount(_ambiguous_kmer_partitions(
+            ambiguous_kmers, num_passes), minlength=num_passes)
+    num_kmers = int(np.sum(counts))
+    num_ambiguous_kmers = int(np.sum(ambiguous_counts))
+    logger.info(("Indexing %d k-mers, and %d k-mers that cannot be "
+                 "encoded, in %d sequences"), num_kmers,
+                num_ambiguous_kmers, sum(len(fasta) for fasta in fastas))
+
+    keys = np.lib.format.open_memmap(os.path.join(tmp_path, 'keys.npy'),
+        mode='w+', dtype=np.uint64, shape=(num_kmers,))
+    pos = np.lib.format.open_memmap(os.path.join(tmp_path, 'pos.npy'),
+        mode='w+', dtype=np.int64, shape=(num_kmers,))
+    strands = np.lib.format.open_memmap(
+        os.path.join(tmp_path, 'strands.npy'), mode='w+', dtype=bool,
+        shape=(num_kmers,))
+    ambiguous_keys = np.lib.format.open_memmap(
+        os.path.join(tmp_path, 'ambiguous_keys.npy'), mode='w+',
+        dtype='S%d' % k, shape=(num_ambiguous_kmers,))
+    ambiguous_pos = np.lib.format.open_memmap(
+        os.path.join(tmp_path, 'ambiguous_pos.npy'), mode='w+',
+        dtype=np.int64, shape=(num_ambiguous_kmers,))
+    ambiguous_offsets = np.zeros(num_passes + 1, dtype=np.int64)
+    np.cumsum(ambiguous_counts, out=ambiguous_offsets[1:])
+    start = 0
+    for b in range(num_passes):
+        logger.info("Sorting k-mers (pass %d of %d)", b + 1, num_passes)
+        parts, ambiguous_parts = [], []
+        for values, values_pos, values_strands, ambiguous_kmers, \
+                ambiguous_kmers_pos in _iterate_kmers(fastas, k):
+            if num_passes > 1:
+                in_range = np.searchsorted(boundaries, values,
+                                           side='right') == b
+                values, values_pos, values_strands = (values[in_range],
+                    values_pos[in_range], values_strands[in_range])
+                in_partition = _ambiguous_kmer_partitions(
+                    ambiguous_kmers, num_passes) == b
+                ambiguous_kmers, ambiguous_kmers_pos = (
+                    ambiguous_kmers[in_partition],
+                    ambiguous_kmers_pos[in_partition])
+            parts += [(values, values_pos, values_strands)]
+            ambiguous_parts += [(ambiguous_kmers, ambiguous_kmers_pos)]
+        end = start + int(counts[b])
+        if end > start:
+            values = np.concatenate([part[0] for part in parts])
+            order = np.argsort(values, kind='stable')
+            keys[start:end] = values[order]
+            pos[start:end] = np.concatenate([part[1] for part in parts])[order]
+            strands[start:end] = np.concatenate(
+                [part[2] for part in parts])[order]
+        del parts
+        start = end
+        ambiguous_start = ambiguous_offsets[b]
+        ambiguous_end = ambiguous_offsets[b + 1]
+        if ambiguous_end > ambiguous_start:
+            ambiguous_kmers = np.concatenate(
+                [part[0] for part in ambiguous_parts])
+            order = np.argsort(ambiguous_kmers, kind='stable')
+            ambiguous_keys[ambiguous_start:ambiguous_end] = \
+                ambiguous_kmers[order]
+            ambiguous_pos[ambiguous_start:ambiguous_end] = np.concatenate(
+                [part[1] for part in ambiguous_parts])[order]
+        del ambiguous_parts
+    keys.flush()
+    pos.flush()
+    strands.flush()
+    ambiguous_keys.flush()
+    ambiguous_pos.flush()
+    np.save(os.path.join(tmp_path, 'ambiguous_offsets.npy'),
+            ambiguous_offsets)
+    del ambiguous_keys, ambiguous_pos
+
+    if bloom_bits_per_kmer is not None:
+        logger.info("Building a Bloom filter of the k-mers")
+        bloom = bloom_filter.BloomFilter.with_capacity(num_kmers,
+            bits_per_value=bloom_bits_per_kmer)
+        bloom.add(keys)
+        bloom.save(os.path.join(tmp_path, 'bloom.npy'))
+    del keys, pos, strands
+
+    # Write k last, since it marks the directory as an index
+    np.save(os.path.join(tmp_path, _K_FILENAME), np.array([k]))
+    os.rename(tmp_path, path)
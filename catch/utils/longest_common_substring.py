@@ -157,3 +157,102 @@ def k_lcf_around_anchor(a, b, anchor_start, anchor_end, k):
             max_common_substring_start = anchor_start - before_len
 
     return max_common_substring_len, max_common_substring_start
+
+
+def k_lcf_around_anchors(a, b, anchor_start, anchor_end, k,
+                         start=None, end=None):
+    """Compute longest common substrings around anchors for many pairs.
+
+    This computes the same result as k_lcf_around_anchor(), but for all
+    rows of the matrices a and b at once: row r of a is compared against
+    row r of b around the anchor [anchor_start[r], anchor_end[r]).
+
+    Rather than looping over mismatches, it uses a cumulative sum of the
+    mismatches in each row to count, for each i in 0..k, the number of
+    bases before the anchor that are within i mismatches of the anchor
+    (and likewise after the anchor). This runs in O(n*w*k) time for n
+    rows of width w, but all in vectorized operations.
+
+    Args:
+        a: 2D numpy array (e.g., of dtype uint8 giving ASCII values) whose
+            rows are sequences
+        b: 2D numpy array with the same shape as a; row r of b is aligned
+            with row r of a
+        anchor_start/anchor_end: arrays giving, for each row, the bounds
+            of the anchor (end exclusive); it must be true, for each r,
+            that a[r, anchor_start[r]:anchor_end[r]] ==
+            b[r, anchor_start[r]:anchor_end[r]]
+        k: find the longest common substrings with this number of
+            mismatches
+        start/end: if set, arrays giving, for each row, the bounds of the
+            columns to consider (end exclusive); columns outside of these
+            are ignored, as if a and b were cut at these bounds. If None,
+            all columns are considered.
+
+    Returns:
+        a tuple (l, s) of arrays where l[r] is the length of the longest
+        common substring found for row r and s[r] is its starting column
+        (the same in a and b)
+
+    Raises:
+        ValueError if the anchor is different in a and b for any row
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.shape != b.shape or a.ndim != 2:
+        raise ValueError("a and b must be 2D arrays with the same shape")
+    n, w = a.shape
+    rows = np.arange(n)
+    cols = np.arange(w)
+    anchor_start = np.asarray(anchor_start, dtype=np.int64)
+    anchor_end = np.asarray(anchor_end, dtype=np.int64)
+    if start is None:
+        start = np.zeros(n, dtype=np.int64)
+    if end is None:
+        end = np.full(n, w, dtype=np.int64)
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+
+    mismatches = a != b
+    # num_mismatches[r, j] gives the number of mismatches in row r in
+    # columns [0, j)
+    num_mismatches = np.zeros((n, w + 1), dtype=np.int32)
+    np.cumsum(mismatches, axis=1, out=num_mismatches[:, 1:])
+    at_anchor_start = num_mismatches[rows, anchor_start][:, np.newaxis]
+    at_anchor_end = num_mismatches[rows, anchor_end][:, np.newaxis]
+
+    # Check that the anchor is the same in a and b
+    if np.any(at_anchor_end != at_anchor_start):
+        raise ValueError("anchors are different in a and b")
+
+    # For column j before the anchor, give the number of mismatches in
+    # [j, anchor_start); for column j after the anchor, give the number
+    # in [anchor_end, j]
+    mismatches_before = at_anchor_start - num_mismatches[:, :w]
+    mismatches_after = num_mismatches[:, 1:] - at_anchor_end
+    in_before = ((cols >= start[:, np.newaxis]) &
+                 (cols < anchor_start[:, np.newaxis]))
+    in_after = ((cols >= anchor_end[:, np.newaxis]) &
+                (cols < end[:, np.newaxis]))
+
+    # before_len[r, i] gives the number of bases immediately before the
+    # anchor that can be included in a common substring with i mismatches
+    # before the anchor (because the number of mismatches only grows when
+    # moving away from the anchor, these bases are contiguous); after_len
+    # is analogous
+    before_len = np.zeros((n, k + 1), dtype=np.int64)
+    after_len = np.zeros((n, k + 1), dtype=np.int64)
+    for i in range(k + 1):
+        before_len[:, i] = np.sum(in_before & (mismatches_before <= i),
+                                  axis=1)
+        after_len[:, i] = np.sum(in_after & (mismatches_after <= i), axis=1)
+
+    # Consider, for each i, the common substring with i mismatches before
+    # the anchor and k-i after it; as in k_lcf_around_anchor(), choose the
+    # first i that gives the maximum length
+    substring_lens = (before_len + after_len[:, ::-1] +
+                      (anchor_end - anchor_start)[:, np.newaxis])
+    best_i = np.argmax(substring_lens, axis=1)
+    l = substring_lens[rows, best_i]
+    s = anchor_start - before_len[rows, best_i]
+    return l, s
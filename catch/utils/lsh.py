@@ -2,17 +2,118 @@
 """
 
 from collections import defaultdict
-import hashlib
-import heapq
 import logging
 import math
 import random
 
+import numpy as np
+
+from catch.utils import twobit
+
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
 logger = logging.getLogger(__name__)
 
 
+# Prime modulus for the universal hash functions used by MinHash; all
+# hash values are in [0, 2^31 - 1), so they fit in 32 bits and products
+# of two of them fit in 64 bits
+_MINHASH_PRIME = 2**31 - 1
+
+# Multiplier for the polynomial hash of k-mers, and constant for
+# mixing its bits; these are odd so multiplication is invertible
+# modulo 2^64
+_KMER_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_KMER_HASH_MIX = np.uint64(0xFF51AFD7ED558CCD)
+
+# Bound on the number of elements in an intermediate array used when
+# computing MinHash signatures of many sequences
+_MINHASH_BATCH_ELEMENTS = 2**22
+
+
+def _seq_bytes(x):
+    """Convert a sequence (e.g., string or probe) to bytes.
+
+    Args:
+        x: sequence as a Python string, bytes, np.array, or probe.Probe
+
+    Returns:
+        bytes
+    """
+    if hasattr(x, 'seq_bytes'):
+        # x is a probe.Probe
+        return x.seq_bytes
+    if isinstance(x, str):
+        return x.encode('ascii')
+    if isinstance(x, bytes):
+        return x
+    return twobit.to_bytes_array(x).tobytes()
+
+
+def seq_matrix(seqs):
+    """Pack sequences of the same length into a matrix.
+
+    Args:
+        seqs: list of sequences (e.g., strings or probes), all with the
+            same length
+
+    Returns:
+        np.array of dtype uint8 and shape (len(seqs), length of each
+        sequence) whose i'th row holds the ASCII values of seqs[i]
+    """
+    seqs = [_seq_bytes(x) for x in seqs]
+    seq_len = len(seqs[0]) if len(seqs) > 0 else 0
+    return np.frombuffer(b''.join(seqs), dtype=np.uint8).reshape(
+        len(seqs), seq_len)
+
+
+def hamming_dists(q, pts):
+    """Compute the Hamming distance between a sequence and many others.
+
+    Args:
+        q: sequence (e.g., string or probe)
+        pts: list of sequences, each with the same length as q
+
+    Returns:
+        np.array giving the Hamming distance between q and each sequence
+        in pts
+    """
+    q_row = np.frombuffer(_seq_bytes(q), dtype=np.uint8)
+    return np.count_nonzero(seq_matrix(pts) != q_row, axis=1)
+
+
+def kmer_hashes(seqs, kmer_size):
+    """Compute a hash value of every k-mer in sequences of the same length.
+
+    The hash value of a k-mer is a polynomial hash of its bytes, modulo
+    2^64, whose bits are then mixed and reduced modulo _MINHASH_PRIME.
+    It depends only on the k-mer, so it is deterministic across
+    Python processes (unlike hash(..)).
+
+    Args:
+        seqs: list of sequences, each as bytes, all with the same length
+        kmer_size: length of each k-mer
+
+    Returns:
+        np.array of dtype uint64 and shape (len(seqs), number of k-mers in
+        each sequence) giving the hash value of each k-mer, in
+        [0, _MINHASH_PRIME)
+    """
+    seq_len = len(seqs[0])
+    num_kmers = seq_len - kmer_size + 1
+    mat = np.frombuffer(b''.join(seqs), dtype=np.uint8).reshape(
+        len(seqs), seq_len)
+    values = np.zeros((len(seqs), num_kmers), dtype=np.uint64)
+    for j in range(kmer_size):
+        values *= _KMER_HASH_MULTIPLIER
+        values += mat[:, j:(j + num_kmers)]
+    values ^= values >> np.uint64(33)
+    values *= _KMER_HASH_MIX
+    values ^= values >> np.uint64(33)
+    values %= np.uint64(_MINHASH_PRIME)
+    return values
+
+
 class HammingDistanceFamily:
     """An LSH family that works with Hamming distance by sampling bases."""
 
@@ -26,10 +127,27 @@ class HammingDistanceFamily:
             hash function
         """
         i = random.randint(0, self.dim - 1)
-        def h(x):
-            assert len(x) == self.dim
-            return x[i]
-        return h
+        return HammingDistanceFunction(self, i)
+
+    def signatures(self, hs, seqs):
+        """Evaluate many hash functions on many sequences at once.
+
+        The sequences are packed into a matrix with one byte per base, so
+        the hash values are a single gather of its columns.
+
+        Args:
+            hs: list of hash functions output by make_h()
+            seqs: list of sequences (e.g., strings or probes), each of
+                length self.dim
+
+        Returns:
+            np.array S of dtype uint8 and shape (len(seqs), len(hs)) such
+            that S[i][j] is the base (as an ASCII value) that hs[j]
+            samples from seqs[i]
+        """
+        mat = seq_matrix(seqs)
+        assert mat.shape[1] == self.dim
+        return mat[:, [h.i for h in hs]]
 
     def P1(self, dist):
         """Calculate lower bound on probability of collision for nearby sequences.
@@ -45,6 +163,26 @@ class HammingDistanceFamily:
         return 1.0 - float(dist) / float(self.dim)
 
 
+class HammingDistanceFunction:
+    """A hash function, drawn from HammingDistanceFamily, on a sequence.
+
+    It samples the base at one position.
+    """
+
+    def __init__(self, family, i):
+        """
+        Args:
+            family: HammingDistanceFamily object
+            i: position to sample
+        """
+        self.family = family
+        self.i = i
+
+    def __call__(self, x):
+        assert len(x) == self.family.dim
+        return x[self.i]
+
+
 class MinHashFamily:
     """An LSH family that works by taking the minimum permutation of
     k-mers in a string/sequence (MinHash).
@@ -62,10 +200,9 @@ class MinHashFamily:
             N: represent the signature of a sequence using hash values of
                 the N k-mers in the sequence that have the smallest hash
                 values
-            use_fast_str_hash: if True, use a faster (~10x faster) inner
-                hash function for strings (k-mers) that is not deterministic
-                and varies across Python processes; this may not be
-                appropriate if the family is shared across processes
+            use_fast_str_hash: no longer has an effect; k-mers are now
+                always hashed with a fast, vectorized hash function that
+                is deterministic across Python processes
         """
         self.kmer_size = kmer_size
         self.N = N
@@ -88,64 +225,92 @@ class MinHashFamily:
         # on the output of the universal hash function; this upper bound
         # is nice because it is also a prime, so we can simply work
         # modulo (2^31 - 1)
-        p = 2**31 - 1
+        p = _MINHASH_PRIME
         # Let the random hash function be:
         #   (a*x + b) mod p
-        # for random integers a, b (a in [1, p] and b in [0, p])
-        a = random.randint(1, p)
-        b = random.randint(0, p)
-        if self.use_fast_str_hash:
-            def kmer_hash(x):
-                # Hash a k-mer x with the random hash function
-                # hash(..) uses a random seed in Python 3.3+, so its output
-                #   varies across Python processes; thus, this may not be
-                #   suitable if used across processes
-                x_hash = abs(hash(x))
-                return (a * x_hash + b) % p
+        # for random integers a, b (a in [1, p) and b in [0, p))
+        a = random.randint(1, p - 1)
+        b = random.randint(0, p - 1)
+        return MinHashFunction(self, a, b)
+
+    def signatures(self, hs, seqs):
+        """Evaluate many hash functions on many sequences at once.
+
+        This computes the hash values of the k-mers in each sequence once,
+        applies every hash function's permutation to them with one
+        broadcasted operation, and takes minima along rows.
+
+        Args:
+            hs: list of hash functions output by make_h()
+            seqs: list of sequences (e.g., strings or probes)
+
+        Returns:
+            np.array S of dtype uint32 such that S[i][j] is hs[j](seqs[i]):
+            of shape (len(seqs), len(hs)) if self.N == 1, and otherwise
+            of shape (len(seqs), len(hs), self.N)
+        """
+        a = np.array([h.a for h in hs], dtype=np.uint64)
+        b = np.array([h.b for h in hs], dtype=np.uint64)
+        p = np.uint64(_MINHASH_PRIME)
+
+        if self.N == 1:
+            S = np.zeros((len(seqs), len(hs)), dtype=np.uint32)
         else:
-            def kmer_hash(x):
-                # Hash a k-mer x with the random hash function
-                # hashlib.md5(..) gives a deterministic hash value of the k-mer
-                #   but is ~10x slower than hash(..)
-                x_hash = int(hashlib.md5(x.encode('utf-8')).hexdigest(), 16)
-                return (a * x_hash + b) % p
-
-        # TODO Consider only allowing fully unambiguous k-mers to be
-        #   in the signature, as a check below in kmer_hashes()
-
-        def h(s):
-            # For a string/sequence s, have the MinHash function be the minimum
-            # N hashes, in sorted order, over all the k-mers in it
-            assert self.kmer_size <= len(s)
-            if self.kmer_size >= len(s) / 2:
-                logger.warning(("The k-mer size %d is large (> (1/2)x) "
-                    "compared to the size of a sequence to hash (%d), which "
-                    "might make it difficult for MinHash to find similar "
-                    "sequence"), self.kmer_size, len(s))
-            num_kmers = len(s) - self.kmer_size + 1
-            if num_kmers < self.N:
-                logger.warning(("The number of k-mers (%d) in a given "
-                    "sequence is too small to produce a signature of "
-                    "size %d; the MinHash family might provide unreliable "
-                    "distances against the sequence. This might be fine, or "
-                    "specify --small-seq-skip to skip the sequence."),
-                    num_kmers, self.N)
-
-            def kmer_hashes():
-                num_yielded = 0
-                # Keep yielding k-mers until at least self.N
-                #   have been yielded (helpful when s is short)
-                while num_yielded < self.N:
-                    for i in range(num_kmers):
-                        kmer = s[i:(i + self.kmer_size)]
-                        num_yielded += 1
-                        yield kmer_hash(kmer)
-            if self.N == 1:
-                # Speed the special case where self.N == 1
-                return tuple([min(kmer_hashes())])
-            else:
-                return tuple(sorted(heapq.nsmallest(self.N, kmer_hashes())))
-        return h
+            S = np.zeros((len(seqs), len(hs), self.N), dtype=np.uint32)
+
+        # Group the sequences by length, so that the k-mer hash values
+        # of each group form a matrix
+        seqs = [_seq_bytes(x) for x in seqs]
+        idx_with_len = defaultdict(list)
+        for i, x in enumerate(seqs):
+            idx_with_len[len(x)] += [i]
+
+        for seq_len, idx in idx_with_len.items():
+            self._check_seq_len(seq_len)
+            num_kmers = seq_len - self.kmer_size + 1
+            batch_size = max(1,
+                _MINHASH_BATCH_ELEMENTS // (num_kmers * len(hs)))
+            for start in range(0, len(idx), batch_size):
+                batch_idx = idx[start:(start + batch_size)]
+                x = kmer_hashes([seqs[i] for i in batch_idx],
+                                self.kmer_size)
+                # Apply each permutation; the shape is
+                # (sequence, k-mer, hash function)
+                perm = (x[:, :, np.newaxis] * a + b) % p
+                if self.N == 1:
+                    S[batch_idx] = perm.min(axis=1)
+                else:
+                    if num_kmers < self.N:
+                        # Use k-mers repeatedly to fill the signature
+                        # (helpful when the sequence is short)
+                        perm = np.tile(perm,
+                                       (1, -(-self.N // num_kmers), 1))
+                    smallest = np.partition(perm, self.N - 1,
+                                            axis=1)[:, :self.N, :]
+                    smallest.sort(axis=1)
+                    S[batch_idx] = smallest.transpose(0, 2, 1)
+        return S
+
+    def _check_seq_len(self, seq_len):
+        """Check that a sequence is long enough to hash.
+
+        Args:
+            seq_len: length of a sequence to hash
+        """
+        assert self.kmer_size <= seq_len
+        if self.kmer_size >= seq_len / 2:
+            logger.warning(("The k-mer size %d is large (> (1/2)x) "
+                "compared to the size of a sequence to hash (%d), which "
+                "might make it difficult for MinHash to find similar "
+                "sequence"), self.kmer_size, seq_len)
+        num_kmers = seq_len - self.kmer_size + 1
+        if num_kmers < self.N:
+            logger.warning(("The number of k-mers (%d) in a given "
+                "sequence is too small to produce a signature of "
+                "size %d; the MinHash family might provide unreliable "
+                "distances against the sequence. This might be fine, or "
+                "specify --small-seq-skip to skip the sequence."),
+                num_kmers, self.N)
 
     def P1(self, dist):
         """Calculate lower bound on probability of collision for nearby sequences.
@@ -215,6 +380,40 @@ class MinHashFamily:
         return 1.0 - similarity
 
 
+class MinHashFunction:
+    """A hash function, drawn from MinHashFamily, on a sequence.
+
+    For a string/sequence s, the MinHash function is the minimum N hashes,
+    in sorted order, over all the k-mers in it, where each k-mer's hash
+    value is permuted by the universal hash function (a*x + b) mod p.
+    """
+
+    def __init__(self, family, a, b):
+        """
+        Args:
+            family: MinHashFamily object
+            a, b: parameters of the universal hash function
+        """
+        self.family = family
+        self.a = a
+        self.b = b
+
+    def __call__(self, s):
+        """Evaluate the hash function.
+
+        Args:
+            s: sequence (e.g., string or probe)
+
+        Returns:
+            tuple of the N smallest (permuted) k-mer hash values in s, in
+            sorted order
+        """
+        sig = self.family.signatures([self], [s])[0][0]
+        if self.family.N == 1:
+            return (int(sig),)
+        return tuple(sig.tolist())
+
+
 class HashConcatenation:
     """Concatenated hash functions (AND constructions)."""
 
@@ -233,8 +432,39 @@ class HashConcatenation:
             concatenation of the result of the self.k random hash functions
             evaluated at x
         """
+        if hasattr(self.family, 'signatures'):
+            return self.keys(self.signatures([x]))[0]
         return tuple([h(x) for h in self.hs])
 
+    def signatures(self, xs):
+        """Evaluate the random hash functions on many points at once.
+
+        This is only supported if the family can evaluate hash functions
+        in bulk (i.e., has a signatures() method).
+
+        Args:
+            xs: list of points (e.g., probes)
+
+        Returns:
+            np.array whose i'th row holds the result of the self.k random
+            hash functions evaluated at xs[i]
+        """
+        return self.family.signatures(self.hs, xs)
+
+    def keys(self, sigs):
+        """Convert rows of signatures into hashable keys.
+
+        Args:
+            sigs: np.array output by self.signatures(), or a subset of
+                its rows
+
+        Returns:
+            list giving, for each row of sigs, the concatenation of the
+            result of the self.k hash functions as a hashable value
+        """
+        sigs = np.ascontiguousarray(sigs)
+        return [row.tobytes() for row in sigs.reshape(len(sigs), -1)]
+
 
 class NearNeighborLookup:
     """Support for approximate near neighbor lookups.
@@ -243,7 +473,8 @@ class NearNeighborLookup:
     Andoni and Indyk 2008.
     """
 
-    def __init__(self, family, k, dist_thres, dist_fn, reporting_prob):
+    def __init__(self, family, k, dist_thres, dist_fn, reporting_prob,
+                 batch_dist_fn=None):
         """
         This selects a number of hash tables (defined as L in the above
         reference) according to the strategy it outlines: we want any
@@ -261,11 +492,16 @@ class NearNeighborLookup:
                 a and b, to compare against dist_thres
             reporting_prob: report any neighbor of a query with
                 probability at least equal to this
+            batch_dist_fn: if set, function f(a, bs) that calculates the
+                distance between a and each point in the list bs, as an
+                np.array; it is used instead of dist_fn to compare a query
+                against all of the points it collides with at once
         """
         self.family = family
         self.k = k
         self.dist_thres = dist_thres
         self.dist_fn = dist_fn
+        self.batch_dist_fn = batch_dist_fn
 
         P1 = self.family.P1(dist_thres)
         if P1 == 1.0:
@@ -286,24 +522,53 @@ class NearNeighborLookup:
             self.hashtables += [defaultdict(list)]
             self.hashtables_g += [g]
 
-    def add(self, pts):
+    def signatures(self, pts):
+        """Evaluate the hash functions of every table on many points.
+
+        Args:
+            pts: list of points (e.g., probes)
+
+        Returns:
+            list S such that S[j] is an np.array whose i'th row gives the
+            concatenated hash values of pts[i] for hash table j; or None
+            if the family cannot evaluate hash functions in bulk
+        """
+        if not hasattr(self.family, 'signatures'):
+            return None
+        return [g.signatures(pts) for g in self.hashtables_g]
+
+    def add(self, pts, signatures=None):
         """Insert given points into each of the hash tables.
 
         Args:
             pts: collection of points (e.g., probes) to add to the hash
                 tables
+            signatures: if set, the output of self.signatures(pts), to
+                avoid recomputing hash values; if None and the family can
+                evaluate hash functions in bulk, they are computed here
         """
+        if signatures is None:
+            pts = list(pts)
+            signatures = self.signatures(pts)
         for j in range(self.num_tables):
             ht = self.hashtables[j]
-            g = self.hashtables_g[j].g
-            for p in pts:
-                ht[g(p)].append(p)
+            if signatures is not None:
+                keys = self.hashtables_g[j].keys(signatures[j])
+                for p, key in zip(pts, keys):
+                    ht[key].append(p)
+            else:
+                g = self.hashtables_g[j].g
+                for p in pts:
+                    ht[g(p)].append(p)
 
-    def query(self, q):
+    def query(self, q, signatures=None):
         """Find neighbors of a query point.
 
         Args:
             q: query point (e.g., probe)
+            signatures: if set, list giving, for each hash table j, the
+                row for q of the output of self.signatures() (i.e.,
+                S[j][i] if q is the i'th point)
 
         Returns:
             collection of stored points that are within self.dist_thres of
@@ -311,11 +576,24 @@ class NearNeighborLookup:
             returned points might not include all that are
         """
         neighbors = set()
+        candidates = []
         for j in range(self.num_tables):
             ht = self.hashtables[j]
-            g = self.hashtables_g[j].g
-            for p in ht[g(q)]:
+            if signatures is not None:
+                key = self.hashtables_g[j].keys(signatures[j][np.newaxis])[0]
+            else:
+                key = self.hashtables_g[j].g(q)
+            if self.batch_dist_fn is not None:
+                # Verify the candidates from all tables together below
+                candidates += ht[key]
+                continue
+            for p in ht[key]:
                 if self.dist_fn(q, p) <= self.dist_thres:
                     neighbors.add(p)
+        if candidates:
+            candidates = list(set(candidates))
+            dists = self.batch_dist_fn(q, candidates)
+            for p, dist in zip(candidates, dists):
+                if dist <= self.dist_thres:
+                    neighbors.add(p)
         return neighbors
-
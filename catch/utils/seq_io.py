@@ -4,13 +4,17 @@
 from collections import defaultdict
 from collections import OrderedDict
 import gzip
+import hashlib
 import logging
+import os
 import re
+import shutil
 import warnings
 
 import numpy as np
 
 from catch import genome
+from catch.utils import twobit
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
@@ -82,18 +86,36 @@ def read_dataset_genomes(dataset):
     return genomes
 
 
-def read_genomes_from_fasta(fn):
+def read_genomes_from_fasta(fn, index_dir=None):
     """Read genomes from a fasta file.
 
     This assumes that the genomes each have one chromosome -- i.e.,
     that genomes are not broken up into separate sequences within
     the fasta.
 
+    Args:
+        fn: path to FASTA file to read
+        index_dir: if set, path to a directory in which to store an
+            indexed copy of the sequences (see index_fasta()); the
+            returned genomes are then instances of genome.LazyGenome,
+            which read their sequences from this copy only when they
+            are needed, rather than holding them in memory
+
     Returns:
         list of genome.Genome
     """
     logger.debug("Reading fasta %s; assuming one sequence per genome", fn)
 
+    if index_dir is not None:
+        indexed_fasta = index_fasta(fn, index_dir)
+        # As with read_fasta(), a sequence whose name repeats an earlier
+        # one replaces the earlier one
+        record_for_name = OrderedDict()
+        for i in range(len(indexed_fasta)):
+            record_for_name[indexed_fasta.names[i]] = i
+        return [genome.LazyGenome(indexed_fasta, i)
+                for i in record_for_name.values()]
+
     genomes = []
     seqs = list(read_fasta(fn).values())
     for seq in seqs:
@@ -101,15 +123,172 @@ def read_genomes_from_fasta(fn):
     return genomes
 
 
+# Number of bytes to read from a FASTA file at a time
+_FASTA_BLOCK_SIZE = 2**24
+
+# Degenerate bases, which can be replaced with 'N'
+_DEGENERATE_BASES = b'YRWSMKBDHV'
+
+# Pattern matching a blank line in a record (after the line break that
+# ends the previous line) followed by more of the sequence
+_BLANK_LINE_BEFORE_SEQ_PATTERN = re.compile(rb'\n[ \t\r\x0b\x0c]*\n\s*\S')
+
+
+def _fasta_translation(replace_degenerate, skip_gaps, make_uppercase):
+    """Make arguments to bytes.translate() for processing sequences.
+
+    Args:
+        replace_degenerate/skip_gaps/make_uppercase: see read_fasta()
+
+    Returns:
+        tuple (table, delete) such that seq.translate(table, delete)
+        applies the processing to a sequence seq (bytes), and also removes
+        whitespace (including line breaks)
+    """
+    table = bytearray(range(256))
+    if make_uppercase:
+        for b in range(ord('a'), ord('z') + 1):
+            table[b] = b - ord('a') + ord('A')
+    if replace_degenerate:
+        # As with the other processing, this applies after making bases
+        # uppercase
+        for b in range(256):
+            if table[b] in _DEGENERATE_BASES:
+                table[b] = ord('N')
+    delete = b' \t\r\n\x0b\x0c'
+    if skip_gaps:
+        delete += b'-'
+    return (bytes(table), delete)
+
+
+def _open_fasta(fn):
+    """Open a FASTA file for reading bytes.
+
+    Args:
+        fn: path to FASTA file, which may be gzip-compressed (this is
+            detected from the file's contents, not its name)
+
+    Returns:
+        file object opened in binary mode
+    """
+    with open(fn, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(fn, 'rb')
+    return open(fn, 'rb')
+
+
+def _iterate_fasta_records(fn, replace_degenerate, skip_gaps,
+                           make_uppercase, blank_line_ends_record=True,
+                           block_size=_FASTA_BLOCK_SIZE):
+    """Iterate over the records of a FASTA file.
+
+    Rather than processing the file line by line, this reads it in large
+    blocks, splits the blocks into records, and processes the sequence of
+    each record -- changing case, replacing degenerate bases, and removing
+    gaps and line breaks -- with one call to bytes.translate().
+
+    Args:
+        fn: path to FASTA file to read; it may be gzip-compressed
+        replace_degenerate/skip_gaps/make_uppercase: see read_fasta()
+        blank_line_ends_record: when True, a blank line ends the sequence
+            being read, so the next non-blank line must start a new record
+            (as read_fasta() has done); when False, blank lines are
+            skipped (as iterate_fasta() has done)
+        block_size: number of bytes to read at a time
+
+    Yields:
+        tuple (name, seq) for each sequence in the file, where name is a
+        string and seq is bytes
+
+    Raises:
+        ValueError if the file has a header that is not UTF-8 or a
+        sequence that is not ASCII
+    """
+    table, delete = _fasta_translation(replace_degenerate, skip_gaps,
+                                       make_uppercase)
+
+    def parse(data):
+        # data consists of one or more whole records
+        data = data.lstrip()
+        if len(data) == 0:
+            return
+        # Must encounter a new sequence
+        assert data.startswith(b'>')
+        for record in data[1:].split(b'\n>'):
+            header, _, seq = record.partition(b'\n')
+            try:
+                name = header.rstrip().decode('utf-8')
+            except UnicodeDecodeError:
+                raise ValueError(("A header in fasta file %s is not "
+                                  "UTF-8") % fn)
+            if not seq.isascii():
+                raise ValueError(("The sequence %s in fasta file %s has "
+                                  "non-ASCII characters") % (name, fn))
+            if blank_line_ends_record:
+                # Must encounter a new sequence after a blank line; search
+                # from the line break after the header
+                assert _BLANK_LINE_BEFORE_SEQ_PATTERN.search(
+                    record, len(header)) is None
+            yield (name, seq.translate(table, delete))
+
+    # Accumulate blocks until one contains the start of a record (a '>'
+    # after a line break), and then parse the whole records before it
+    parts = []
+    with _open_fasta(fn) as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) == 0:
+                break
+            # Include the end of the previous block in case it ends with
+            # a line break
+            prev_end = parts[-1][-1:] if len(parts) > 0 else b''
+            i = (prev_end + block).rfind(b'\n>')
+            if i == -1:
+                parts += [block]
+                continue
+            i = i + 1 - len(prev_end)
+            parts += [block[:i]]
+            yield from parse(b''.join(parts))
+            parts = [block[i:]]
+    yield from parse(b''.join(parts))
+
+
+def _convert_seq(seq, data_type):
+    """Convert a sequence to a data type.
+
+    Args:
+        seq: sequence as bytes
+        data_type: see read_fasta()
+
+    Returns:
+        seq as data_type
+    """
+    if data_type == 'str':
+        return seq.decode('ascii')
+    elif data_type == 'np':
+        # Widen each byte to a UCS-4 code point, which is how NumPy
+        # stores 'U1' characters
+        return np.frombuffer(seq, dtype=np.uint8).astype(np.uint32).view('U1')
+    elif data_type == 'uint8':
+        return np.frombuffer(seq, dtype=np.uint8)
+    elif data_type == '2bit':
+        return twobit.encode(seq)
+    else:
+        raise ValueError("Unknown data_type " + data_type)
+
+
 def read_fasta(fn, data_type='str', replace_degenerate=True,
                skip_gaps=True, make_uppercase=True):
     """Read a FASTA file.
 
     Args:
-        fn: path to FASTA file to read
+        fn: path to FASTA file to read; it may be gzip-compressed
         data_type: determines whether to store a sequence as
-            a native Python string ('str') or as a numpy array
-            ('np')
+            a native Python string ('str'), as a numpy array of
+            single characters ('np'), as a (read-only) numpy array
+            of ASCII values ('uint8'), or as a numpy array of 2-bit
+            codes as given by twobit.encode() ('2bit')
         replace_degenerate: when True, replace the degenerate
             bases ('Y','R','W','S','M','K','B','D','H','V')
             with 'N'
@@ -124,55 +303,21 @@ def read_fasta(fn, data_type='str', replace_degenerate=True,
         the sequence is encountered in the FASTA file; this
         helps in particular with replicating past results,
         where the input order could affect the output.
+
+    Raises:
+        ValueError if the file has a sequence that is not ASCII (or a
+        header that is not UTF-8)
     """
     logger.info("Reading fasta file %s", fn)
 
-    degenerate_pattern = re.compile('[YRWSMKBDHV]')
-
-    def process(f):
-        m = OrderedDict()
-        curr_seq_name = ""
-        for line in f:
-            line = line.rstrip()
-            if len(line) == 0:
-                # Reset the sequence being read on an empty line
-                curr_seq_name = ""
-                continue
-            if curr_seq_name == "":
-                # Must encounter a new sequence
-                assert line.startswith('>')
-            if line.startswith('>'):
-                curr_seq_name = line[1:]
-                m[curr_seq_name] = ''
-            else:
-                # Append the sequence
-                if make_uppercase:
-                    line = line.upper()
-                if replace_degenerate:
-                    line = degenerate_pattern.sub('N', line)
-                if skip_gaps:
-                    line = line.replace('-', '')
-                m[curr_seq_name] += line
-        return m
-
-    if fn.endswith('.gz'):
-        with gzip.open(fn, 'rt') as f:
-            m = process(f)
-    else:
-        with open(fn, 'r') as f:
-            m = process(f)
-
-    if data_type == 'str':
-        # Already stored sequence as string
-        m_converted = m
-    elif data_type == 'np':
-        m_converted = OrderedDict()
-        for seq_name, seq in m.items():
-            m_converted[seq_name] = np.fromiter(seq, dtype='U1')
-    else:
-        raise ValueError("Unknown data_type " + data_type)
+    # Check data_type before reading
+    _convert_seq(b'', data_type)
 
-    return m_converted
+    m = OrderedDict()
+    for seq_name, seq in _iterate_fasta_records(fn, replace_degenerate,
+                                                skip_gaps, make_uppercase):
+        m[seq_name] = _convert_seq(seq, data_type)
+    return m
 
 
 def iterate_fasta(fn, data_type='str', replace_degenerate=True):
@@ -182,10 +327,9 @@ def iterate_fasta(fn, data_type='str', replace_degenerate=True):
     upon completing the read of a sequence, yields that sequence.
 
     Args:
-        fn: path to FASTA file to read
-        data_type: determines whether to store a sequence as
-            a native Python string ('str') or as a numpy array
-            ('np')
+        fn: path to FASTA file to read; it may be gzip-compressed
+        data_type: determines the type of each sequence; see
+            read_fasta()
         replace_degenerate: when True, replace the degenerate
             bases ('Y','R','W','S','M','K','B','D','H','V')
             with 'N'
@@ -193,44 +337,160 @@ def iterate_fasta(fn, data_type='str', replace_degenerate=True):
     Yields:
         each sequence in the FASTA file
     """
-    degenerate_pattern = re.compile('[YRWSMKBDHV]')
-
-    def format_seq(seq):
-        if data_type == 'str':
-            # Already stored as str
-            return seq
-        elif data_type == 'np':
-            return np.fromiter(seq, dtype='U1')
-        else:
-            raise ValueError("Unknown data_type " + data_type)
-
-    def process(f):
-        curr_seq = ''
-        for line in f:
-            line = line.rstrip()
-            if len(line) == 0:
-                # Skip the blank line
-                continue
-            if line.startswith('>'):
-                # Yield the current sequence (if there is one) and reset the
-                # sequence being read
-                if len(curr_seq) > 0:
-                    yield format_seq(curr_seq)
-                curr_seq = ''
+    # Check data_type before reading
+    _convert_seq(b'', data_type)
+
+    for _, seq in _iterate_fasta_records(fn, replace_degenerate, False,
+                                         False,
+                                         blank_line_ends_record=False):
+        if len(seq) > 0:
+            yield _convert_seq(seq, data_type)
+
+
+class IndexedFasta:
+    """Sequences from a FASTA file, stored flat on disk and read on demand.
+
+    This is an index, made by index_fasta(), of a copy of the sequences in
+    a FASTA file: the (processed) sequences are concatenated, without
+    headers or line breaks, into one file that is memory-mapped, and
+    offsets into that file give where each sequence begins and ends. A
+    sequence is only read when it is requested, and it is not kept in
+    memory afterward; processes that read the same index share its pages
+    through the OS page cache.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: path to a directory written by index_fasta()
+        """
+        self.path = path
+        self._load()
+
+    def _load(self):
+        self.offsets = np.load(os.path.join(self.path, 'offsets.npy'))
+        with open(os.path.join(self.path, 'names.txt')) as f:
+            self.names = [line.rstrip('\n') for line in f]
+        self._seqs = None
+
+    def _seqs_mmap(self):
+        """Memory-map the concatenated sequences, if not already.
+        """
+        if self._seqs is None:
+            if self.offsets[-1] == 0:
+                # np.memmap cannot map an empty file
+                self._seqs = np.zeros(0, dtype=np.uint8)
             else:
-                # Append the sequence
-                if replace_degenerate:
-                    line = degenerate_pattern.sub('N', line)
-                curr_seq += line
-        if len(curr_seq) > 0:
-            yield format_seq(curr_seq)
-
-    if fn.endswith('.gz'):
-        with gzip.open(fn, 'rt') as f:
-            yield from process(f)
-    else:
-        with open(fn, 'r') as f:
-            yield from process(f)
+                self._seqs = np.memmap(os.path.join(self.path, 'seqs.bin'),
+                                       dtype=np.uint8, mode='r')
+        return self._seqs
+
+    def seq(self, i):
+        """Read a sequence.
+
+        Args:
+            i: index of a sequence, in the order of the FASTA file
+
+        Returns:
+            sequence i, as a string
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self._seqs_mmap()[start:end].tobytes().decode('ascii')
+
+    def seq_bytes(self, i):
+        """Read a sequence as an array, without decoding it.
+
+        Args:
+            i: index of a sequence, in the order of the FASTA file
+
+        Returns:
+            np.uint8 array (a read-only view of the memory-mapped file) of
+            the ASCII values of sequence i
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self._seqs_mmap()[start:end]
+
+    def seq_len(self, i):
+        """Determine the length of a sequence without reading it.
+
+        Args:
+            i: index of a sequence, in the order of the FASTA file
+
+        Returns:
+            length of sequence i
+        """
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getstate__(self):
+        # Only pickle the path, so that sending this to another process
+        # does not copy the index
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._load()
+
+
+def index_fasta(fn, index_dir, replace_degenerate=True, skip_gaps=True,
+                make_uppercase=True):
+    """Make, or reuse, an indexed copy of the sequences in a FASTA file.
+
+    The copy is stored in a subdirectory of index_dir named by a hash of
+    the contents of the FASTA file and of the arguments, so an index is
+    reused when the same file (even at a different path) is read again.
+    The sequences are processed the same way as by read_fasta(), and
+    one sequence at a time is held in memory while making the copy.
+
+    Args:
+        fn: path to FASTA file to index; it may be gzip-compressed
+        index_dir: path to a directory in which to store indexes
+        replace_degenerate/skip_gaps/make_uppercase: see read_fasta()
+
+    Returns:
+        instance of IndexedFasta
+    """
+    # Determine a key for the index from the file contents
+    h = hashlib.sha224()
+    h.update(repr((replace_degenerate, skip_gaps,
+                   make_uppercase)).encode('utf-8'))
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            h.update(chunk)
+    path = os.path.join(index_dir, h.hexdigest())
+    if os.path.isdir(path):
+        logger.info("Reusing index of fasta file %s in %s", fn, path)
+        return IndexedFasta(path)
+
+    logger.info("Indexing fasta file %s into %s", fn, path)
+
+    # Write the index under a temporary name and then rename it, so that
+    # a partially written index is never read
+    tmp_path = path + '.tmp.' + str(os.getpid())
+    os.makedirs(tmp_path)
+    offsets = [0]
+
+    with open(os.path.join(tmp_path, 'seqs.bin'), 'wb') as seqs_f, \
+            open(os.path.join(tmp_path, 'names.txt'), 'w') as names_f:
+        for seq_name, seq in _iterate_fasta_records(fn, replace_degenerate,
+                                                    skip_gaps,
+                                                    make_uppercase):
+            seqs_f.write(seq)
+            names_f.write(seq_name + '\n')
+            offsets.append(offsets[-1] + len(seq))
+    np.save(os.path.join(tmp_path, 'offsets.npy'),
+            np.array(offsets, dtype=np.int64))
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another process may have written the same index to path in the
+        # meantime; keep that one
+        shutil.rmtree(tmp_path)
+    return IndexedFasta(path)
+
 
 def write_probe_fasta(probes, out_fn):
     """Write probe sequences to a FASTA file.
@@ -2,7 +2,12 @@
 """
 
 from collections import defaultdict
+from collections.abc import Mapping
+import heapq
 import logging
+import os
+
+import numpy as np
 
 from catch.utils import interval
 
@@ -150,6 +155,8 @@ def approx_multiuniverse(sets,
                          ranks=None,
                          use_arrays=False,
                          use_intervalsets=False,
+                         use_lazy_greedy=False,
+                         use_bitmap_universes=False,
                          logger_prefix=""):
     """Approximates the solution to a "multiuniverse" set problem.
 
@@ -219,6 +226,21 @@ def approx_multiuniverse(sets,
             has just one interval (i.e., the one specified by the tuple),
             which is useful for saving space, and the interval is converted
             into an instance of IntervalSet as needed.
+        use_lazy_greedy: when True, select sets with a lazy evaluation of
+            the greedy algorithm (see implementation note below) rather
+            than by recomputing the ratio of every set whenever the
+            minimum changes. This can be much faster when there are many
+            sets. It chooses the same sets, except possibly when two sets
+            have exactly the same ratio, in which case either may be
+            chosen.
+        use_bitmap_universes: when True, store the uncovered elements of
+            each universe in an instance of IntervalBitmap rather than of
+            IntervalSet. Counting the uncovered elements in a set then
+            takes time logarithmic in the size of the universe, rather
+            than time linear in the number of intervals in the universe,
+            at the cost of 1 byte of memory per integer spanned by the
+            universe. This can only be True when 'use_intervalsets' is
+            also True, and it gives the same output.
         logger_prefix: prefix to use before log messages
 
     Returns:
@@ -282,9 +304,27 @@ def approx_multiuniverse(sets,
         the usual approach that would not use this heuristic -- i.e.,
         compute the ratios for all sets not yet in the set cover and find
         the set with the minimum ratio.
+      - When use_lazy_greedy is True, the sets are instead kept in a
+        priority queue (a heap) keyed by their rank and by their ratio
+        as of when it was last computed (the "stale" ratio). The ratio of
+        a set can only increase as elements are covered, so a stale
+        ratio is a lower bound on the current ratio. On each iteration,
+        we pop the set at the top of the queue and recompute its ratio;
+        if it is still no greater than the stale ratio of the next set
+        in the queue (at the same or a higher rank), then it must have
+        the minimum ratio and it is put into the set cover. Otherwise,
+        we push it back with its recomputed ratio and repeat. This is
+        the "lazy greedy" (or CELF) approach, and usually only a handful
+        of ratios need to be recomputed on each iteration. Sets whose
+        ratio becomes infinite can never be chosen, so they are dropped
+        from the queue.
     """
     if use_arrays and use_intervalsets:
         raise ValueError("Cannot use both arrays and IntervalSets")
+    if use_bitmap_universes and not use_intervalsets:
+        raise ValueError("Bitmap universes require the use of IntervalSets")
+    if isinstance(sets, ColumnarSets) and not use_intervalsets:
+        raise ValueError("ColumnarSets require the use of IntervalSets")
 
     if costs is None:
         # Give each set a default cost of 1
@@ -302,22 +342,29 @@ def approx_multiuniverse(sets,
     if use_intervalsets:
         # Store the elements of each universe in an IntervalSet
         # First, collect a list of intervals for each universe
-        universes_unmerged = defaultdict(list)
-        for sets_by_universe in sets.values():
-            for universe_id, s in sets_by_universe.items():
-                if isinstance(s, tuple):
-                    # s is a single interval
-                    universes_unmerged[universe_id].append(s)
-                else:
-                    # s is an IntervalSet
-                    for i in s.intervals:
-                        universes_unmerged[universe_id].append(i)
+        if isinstance(sets, ColumnarSets):
+            # Read the intervals directly from the arrays
+            universes_unmerged = sets.intervals_by_universe()
+        else:
+            universes_unmerged = defaultdict(list)
+            for sets_by_universe in sets.values():
+                for universe_id, s in sets_by_universe.items():
+                    if isinstance(s, tuple):
+                        # s is a single interval
+                        universes_unmerged[universe_id].append(s)
+                    else:
+                        # s is an IntervalSet
+                        for i in s.intervals:
+                            universes_unmerged[universe_id].append(i)
         # Now, for each universe, create one IntervalSet from its list
         # of intervals; doing so will merge overlapping intervals
         # (effectively taking the union of all the intervals)
         universes = {}
         for universe_id, intervals in universes_unmerged.items():
-            universes[universe_id] = interval.IntervalSet(intervals)
+            if use_bitmap_universes:
+                universes[universe_id] = interval.IntervalBitmap(intervals)
+            else:
+                universes[universe_id] = interval.IntervalSet(intervals)
     else:
         # Store the elements of each universe in a set
         universes = defaultdict(set)
@@ -395,28 +442,54 @@ def approx_multiuniverse(sets,
         # for set_id that will be used to determine whether it should be placed
         # in the set cover
         num_needed_covered_across_universes = 0
-        for universe_id in sets[set_id].keys():
+        if isinstance(sets, ColumnarSets):
+            # Read set_id from the arrays, and only read its intervals in
+            # a universe if the count is not memoized
+            universe_ids = sets.universe_ids_of(set_id)
+        else:
+            sets_by_universe = sets[set_id]
+            universe_ids = sets_by_universe.keys()
+        for universe_id in universe_ids:
             if set_id in memoized_intersect_counts[universe_id]:
                 # We have num_covered memoized
                 num_covered = memoized_intersect_counts[universe_id][set_id]
+            elif isinstance(sets, ColumnarSets):
+                intervals = sets.intervals_of(set_id, universe_id)
+                universe = universes[universe_id]
+                if use_bitmap_universes:
+                    num_covered = universe.count(intervals)
+                else:
+                    num_covered = len(interval.IntervalSet(
+                        intervals).intersection(universe))
+                # Memoize num_covered
+                memoized_intersect_counts[universe_id][set_id] = num_covered
             else:
-                s = sets[set_id][universe_id]
+                s = sets_by_universe[universe_id]
                 universe = universes[universe_id]
-                if use_arrays:
-                    # It may seem faster to compute, in the case where s is
-                    # an array, num_covered as
-                    # sum([1 for v in s if v in universe])
-                    # in order to avoid converting s to a set. However,
-                    # it appears that, in practice, converting s to a set
-                    # and using set.intersection is faster.
-                    s = set(s)
-                if use_intervalsets and isinstance(s, tuple):
-                    # s is a single interval
-                    s = interval.IntervalSet([s])
-                # If use_intervalsets, then s and universe should already
-                # be IntervalSets, and the intersection method is defined
-                # for these
-                num_covered = len(s.intersection(universe))
+                if use_bitmap_universes:
+                    # Count the uncovered elements of universe in the
+                    # intervals of s, without making an IntervalSet
+                    if isinstance(s, tuple):
+                        # s is a single interval
+                        num_covered = universe.count([s])
+                    else:
+                        num_covered = universe.count(s.intervals)
+                else:
+                    if use_arrays:
+                        # It may seem faster to compute, in the case where s
+                        # is an array, num_covered as
+                        # sum([1 for v in s if v in universe])
+                        # in order to avoid converting s to a set. However,
+                        # it appears that, in practice, converting s to a set
+                        # and using set.intersection is faster.
+                        s = set(s)
+                    if use_intervalsets and isinstance(s, tuple):
+                        # s is a single interval
+                        s = interval.IntervalSet([s])
+                    # If use_intervalsets, then s and universe should
+                    # already be IntervalSets, and the intersection method
+                    # is defined for these
+                    num_covered = len(s.intersection(universe))
                 # Memoize num_covered
                 memoized_intersect_counts[universe_id][set_id] = num_covered
             # There is no need to cover more than num_left_to_cover
@@ -441,6 +514,18 @@ def approx_multiuniverse(sets,
     # cover when last_min_ratio was first computed.
     set_ids_with_same_ratio_as_last_min = []
 
+    if use_lazy_greedy:
+        # Build a heap of the sets not in the set cover, with entries
+        # (rank, stale ratio, counter, set_id); counter is unique, so it
+        # breaks ties without comparing set identifiers (which might not be
+        # comparable) and keeps the order deterministic
+        lazy_heap = []
+        for counter, set_id in enumerate(sets.keys()):
+            ratio = compute_ratio_for_set(set_id)
+            if ratio != float('inf'):
+                lazy_heap += [(ranks[set_id], ratio, counter, set_id)]
+        heapq.heapify(lazy_heap)
+
     set_ids_not_in_cover = set(sets.keys())
     set_ids_in_cover = set()
     # Keep iterating until desired partial cover of each universe
@@ -458,6 +543,39 @@ def approx_multiuniverse(sets,
         # it covers
         id_min_ratio = None
 
+        if use_lazy_greedy:
+            # Pop sets from the heap, recomputing their ratios, until one
+            # stays at the top
+            while lazy_heap:
+                rank, _, counter, set_id = heapq.heappop(lazy_heap)
+                ratio = compute_ratio_for_set(set_id)
+                if ratio == float('inf'):
+                    # set_id covers no elements that need to be covered,
+                    # and it never will again, so drop it; also discard
+                    # its memoized intersection counts, which will never
+                    # be accessed again
+                    if isinstance(sets, ColumnarSets):
+                        universe_ids = sets.universe_ids_of(set_id)
+                    else:
+                        universe_ids = sets[set_id].keys()
+                    for universe_id in universe_ids:
+                        memoized_intersect_counts[universe_id].pop(set_id,
+                                                                   None)
+                    continue
+                if not lazy_heap or (rank, ratio) <= lazy_heap[0][:2]:
+                    # The stale ratios of the other sets are lower bounds
+                    # on their current ratios, so set_id has the minimum
+                    id_min_ratio = set_id
+                    break
+                heapq.heappush(lazy_heap, (rank, ratio, counter, set_id))
+
+            if id_min_ratio is None:
+                # No set covers any of the elements that need to be covered
+                break
+            # Because id_min_ratio is set (and
+            # set_ids_with_same_ratio_as_last_min stays empty), the search
+            # below is skipped
+
         # First, look among all sets whose ratio equals the last minimum
         # ratio. Because the minimum ratio is nondecreasing across iterations,
         # if one set's ratio equals the last minimum ratio, this one must also
@@ -528,19 +646,38 @@ def approx_multiuniverse(sets,
         # id_min_ratio goes into the set cover
         set_ids_in_cover.add(id_min_ratio)
         set_ids_not_in_cover.remove(id_min_ratio)
-        for universe_id, universe in universes.items():
-            if universe_id not in sets[id_min_ratio]:
-                # id_min_ratio covers nothing in this universe
-                continue
-            s = sets[id_min_ratio][universe_id]
+        if isinstance(sets, ColumnarSets):
+            universe_ids = sets.universe_ids_of(id_min_ratio)
+        else:
+            sets_by_universe = sets[id_min_ratio]
+            universe_ids = sets_by_universe.keys()
+        for universe_id in universe_ids:
+            universe = universes[universe_id]
             prev_universe_size = len(universe)
+            if isinstance(sets, ColumnarSets):
+                # Read the intervals of id_min_ratio from the arrays
+                s_intervals = sets.intervals_of(id_min_ratio, universe_id)
+            else:
+                s = sets_by_universe[universe_id]
             # Remove s from universe
-            if use_intervalsets:
+            if isinstance(sets, ColumnarSets):
+                # A bitmap universe takes the intervals as they are
+                if use_bitmap_universes:
+                    universe.remove(s_intervals)
+                else:
+                    universe = universe.difference(
+                        interval.IntervalSet(s_intervals))
+                    universes[universe_id] = universe
+            elif use_intervalsets:
                 if isinstance(s, tuple):
                     # s is a single interval
                     s = interval.IntervalSet([s])
-                universe = universe.difference(s)
-                universes[universe_id] = universe
+                if use_bitmap_universes:
+                    # Remove s in place
+                    universe.remove(s.intervals)
+                else:
+                    universe = universe.difference(s)
+                    universes[universe_id] = universe
             elif use_arrays:
                 for v in s:
                     universe.discard(v)
@@ -550,7 +687,15 @@ def approx_multiuniverse(sets,
                 0, len(universe) - num_that_can_be_uncovered[universe_id])
             # Discard memoized values
             if len(universe) != prev_universe_size:
-                if use_intervalsets:
+                if isinstance(sets, ColumnarSets):
+                    # As below, only invalidate sets that overlap s; here
+                    # they can be found directly, with an index of the
+                    # intervals in this universe
+                    for set_id in sets.set_ids_overlapping(universe_id,
+                                                           s_intervals):
+                        memoized_intersect_counts[universe_id].pop(set_id,
+                                                                   None)
+                elif use_intervalsets:
                     # The universe was modified and since we are using interval
                     # sets we can optimize what values we choose to discard
                     # (i.e., invalidate). In particular, only invalidate
@@ -613,3 +758,316 @@ def approx_multiuniverse(sets,
                     del memoized_intersect_counts[universe_id][id_min_ratio]
 
     return set_ids_in_cover
+
+
+class ColumnarSets(Mapping):
+    """Compact, columnar storage of the 'sets' input to set cover.
+
+    The 'sets' input to approx_multiuniverse(..) is usually a dict of
+    dicts, whose values are intervals (tuples) or IntervalSets. With many
+    sets and universes, this is a large graph of Python objects that is
+    slow to pickle. This stores the same information in a handful of flat
+    NumPy arrays, in a two-level CSR (compressed sparse row) layout:
+      - set_offsets: the entries (i.e., (set, universe) pairs) of set i
+        are entries set_offsets[i] through set_offsets[i+1]-1
+      - universe_ids: the universe of each entry
+      - interval_offsets: the intervals of entry e are intervals
+        interval_offsets[e] through interval_offsets[e+1]-1
+      - starts/ends: the start (inclusive) and end (exclusive) of each
+        interval
+    Within an entry, intervals are sorted and non-overlapping. The arrays
+    can be saved as .npy files and loaded memory-mapped.
+
+    The set identifiers are 0, 1, ..., (number of sets)-1 and universe
+    identifiers are integers. This acts as a read-only dict that maps
+    each set identifier to a dict {universe_id: s} where s is a tuple
+    (start, end) if the set has a single interval in the universe and
+    an IntervalSet otherwise -- i.e., the same as the input to
+    approx_multiuniverse(..) with use_intervalsets. Such a dict is made
+    from the arrays each time a set is accessed, and is not kept;
+    approx_multiuniverse(..) does not make them, and instead reads the
+    universes and intervals of a set directly from the arrays (with
+    universe_ids_of(..) and intervals_of(..)) when it needs them.
+    """
+
+    _ARRAY_NAMES = ['set_offsets', 'universe_ids', 'interval_offsets',
+                    'starts', 'ends']
+
+    def __init__(self, set_offsets, universe_ids, interval_offsets, starts,
+                 ends):
+        """
+        Args:
+            set_offsets/universe_ids/interval_offsets/starts/ends: arrays
+                as described above
+        """
+        self.set_offsets = set_offsets
+        self.universe_ids = universe_ids
+        self.interval_offsets = interval_offsets
+        self.starts = starts
+        self.ends = ends
+
+        # Index of the intervals in each universe, built when needed by
+        # _index_by_universe()
+        self._universe_index = None
+
+    @staticmethod
+    def from_intervals(num_sets, set_ids, universe_ids, starts, ends):
+        """Construct from a flat list of intervals.
+
+        Args:
+            num_sets: number of sets; set identifiers are 0 through
+                num_sets-1
+            set_ids/universe_ids/starts/ends: sequences of the same length
+                such that set set_ids[i] contains the interval
+                (starts[i], ends[i]) in universe universe_ids[i]; the
+                intervals may be in any order and may overlap
+
+        Returns:
+            instance of ColumnarSets
+        """
+        set_ids = np.asarray(set_ids, dtype=np.int64)
+        universe_ids = np.asarray(universe_ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        # Sort the intervals by set, then universe, then start
+        order = np.lexsort((starts, universe_ids, set_ids))
+        set_ids = set_ids[order]
+        universe_ids = universe_ids[order]
+        starts = starts[order]
+        ends = ends[order]
+
+        # Find where each entry (set, universe pair) begins
+        n = len(starts)
+        new_entry = np.ones(n, dtype=bool)
+        new_entry[1:] = ((set_ids[1:] != set_ids[:-1]) |
+                         (universe_ids[1:] != universe_ids[:-1]))
+        entry_ind = np.cumsum(new_entry) - 1
+
+        # Merge overlapping (or touching) intervals within each entry. An
+        # interval begins a new merged interval if it begins an entry or
+        # starts after the largest end of the preceding intervals in its
+        # entry. To compute that largest end with one cumulative maximum
+        # over all entries, shift the ends of each entry above the ends of
+        # every preceding entry
+        if n > 0:
+            shift = (ends.max() - ends.min() + 1) * entry_ind
+            max_end = np.maximum.accumulate(ends + shift) - shift
+            new_interval = new_entry.copy()
+            new_interval[1:] |= starts[1:] > max_end[:-1]
+            merged_first = np.flatnonzero(new_interval)
+            merged_last = np.append(merged_first[1:] - 1, n - 1)
+            merged_starts = starts[merged_first]
+            merged_ends = max_end[merged_last]
+            merged_new_entry = new_entry[merged_first]
+        else:
+            merged_first = np.zeros(0, dtype=np.int64)
+            merged_starts = starts
+            merged_ends = ends
+            merged_new_entry = new_entry
+
+        entry_first = np.flatnonzero(merged_new_entry)
+        interval_offsets = np.append(entry_first,
+                                     len(merged_starts)).astype(np.int64)
+        entry_set_ids = set_ids[merged_first[entry_first]]
+        entry_universe_ids = universe_ids[merged_first[entry_first]]
+        set_offsets = np.searchsorted(entry_set_ids,
+                                      np.arange(num_sets + 1)).astype(
+                                          np.int64)
+
+        # Use 32-bit integers for the largest arrays when possible
+        def narrow(a):
+            if len(a) == 0 or (a.min() >= np.iinfo(np.int32).min and
+                               a.max() <= np.iinfo(np.int32).max):
+                return a.astype(np.int32)
+            return a
+        return ColumnarSets(set_offsets, narrow(entry_universe_ids),
+                            interval_offsets, narrow(merged_starts),
+                            narrow(merged_ends))
+
+    @staticmethod
+    def from_dict(sets):
+        """Construct from a dict input to approx_multiuniverse(..).
+
+        Args:
+            sets: dict mapping set identifiers 0, 1, ..., len(sets)-1 to
+                dicts that map integer universe identifiers to tuples
+                (start, end) or IntervalSets
+
+        Returns:
+            instance of ColumnarSets
+        """
+        set_ids, universe_ids, starts, ends = [], [], [], []
+        for set_id, sets_by_universe in sets.items():
+            for universe_id, s in sets_by_universe.items():
+                intervals = [s] if isinstance(s, tuple) else s.intervals
+                for start, end in intervals:
+                    set_ids += [set_id]
+                    universe_ids += [universe_id]
+                    starts += [start]
+                    ends += [end]
+        return ColumnarSets.from_intervals(len(sets), set_ids, universe_ids,
+                                           starts, ends)
+
+    def _index_by_universe(self):
+        """Index the intervals in each universe.
+
+        Returns:
+            dict mapping each universe identifier u to a tuple
+            (starts, ends, set_ids, max_len) where starts, ends, and
+            set_ids are arrays giving the intervals in u and the sets
+            that contain them, sorted by start, and max_len is the length
+            of the longest interval in u
+        """
+        if self._universe_index is not None:
+            return self._universe_index
+
+        interval_counts = np.diff(self.interval_offsets)
+        entry_set_ids = np.repeat(np.arange(len(self)),
+                                  np.diff(self.set_offsets))
+        interval_set_ids = np.repeat(entry_set_ids, interval_counts)
+        interval_universe_ids = np.repeat(np.asarray(self.universe_ids),
+                                          interval_counts)
+        starts = np.asarray(self.starts)
+        ends = np.asarray(self.ends)
+
+        order = np.lexsort((starts, interval_universe_ids))
+        interval_universe_ids = interval_universe_ids[order]
+        universe_firsts = np.flatnonzero(np.diff(interval_universe_ids,
+                                                 prepend=-1) != 0)
+        universe_lasts = np.append(universe_firsts[1:],
+                                   len(interval_universe_ids))
+
+        self._universe_index = {}
+        for first, last in zip(universe_firsts, universe_lasts):
+            ind = order[first:last]
+            u_starts = starts[ind]
+            u_ends = ends[ind]
+            max_len = int((u_ends - u_starts).max())
+            self._universe_index[int(interval_universe_ids[first])] = (
+                u_starts, u_ends, interval_set_ids[ind], max_len)
+        return self._universe_index
+
+    def intervals_by_universe(self):
+        """Collect the intervals of all sets in each universe.
+
+        Returns:
+            dict mapping each universe identifier to a list of the
+            intervals (start, end), possibly overlapping, of all the sets
+            in that universe
+        """
+        universes = {}
+        for universe_id, (starts, ends, _, _) in \
+                self._index_by_universe().items():
+            universes[universe_id] = list(zip(starts.tolist(),
+                                              ends.tolist()))
+        return universes
+
+    def set_ids_overlapping(self, universe_id, intervals):
+        """Find the sets that overlap intervals in a universe.
+
+        Args:
+            universe_id: identifier of a universe
+            intervals: collection of intervals (start, end)
+
+        Returns:
+            set of identifiers of the sets that have an interval in
+            universe_id that overlaps an interval in intervals
+        """
+        index = self._index_by_universe()
+        if universe_id not in index:
+            return set()
+        starts, ends, set_ids, max_len = index[universe_id]
+        overlapping = set()
+        for start, end in intervals:
+            # Only intervals that start in [start - max_len, end) can
+            # overlap (start, end)
+            i = np.searchsorted(starts, start - max_len, side='right')
+            j = np.searchsorted(starts, end, side='left')
+            overlaps = ends[i:j] > start
+            overlapping.update(set_ids[i:j][overlaps].tolist())
+        return overlapping
+
+    def universe_ids_of(self, set_id):
+        """Find the universes in which a set has intervals.
+
+        Args:
+            set_id: identifier of a set
+
+        Returns:
+            list of the identifiers of the universes in which set_id has
+            intervals, in sorted order
+        """
+        first = self.set_offsets[set_id]
+        last = self.set_offsets[set_id + 1]
+        return self.universe_ids[first:last].tolist()
+
+    def intervals_of(self, set_id, universe_id):
+        """Read the intervals of a set in a universe.
+
+        Args:
+            set_id: identifier of a set
+            universe_id: identifier of a universe
+
+        Returns:
+            list of the intervals (start, end) of set_id in universe_id,
+            sorted and non-overlapping (empty if there are none)
+        """
+        first = int(self.set_offsets[set_id])
+        last = int(self.set_offsets[set_id + 1])
+        # Within a set, the entries are sorted by universe
+        e = first + int(np.searchsorted(self.universe_ids[first:last],
+                                        universe_id))
+        if e == last or self.universe_ids[e] != universe_id:
+            return []
+        i = self.interval_offsets[e]
+        j = self.interval_offsets[e + 1]
+        return list(zip(self.starts[i:j].tolist(), self.ends[i:j].tolist()))
+
+    def __getitem__(self, set_id):
+        if not 0 <= set_id < len(self):
+            raise KeyError(set_id)
+        sets_by_universe = {}
+        for universe_id in self.universe_ids_of(set_id):
+            intervals = self.intervals_of(set_id, universe_id)
+            if len(intervals) == 1:
+                s = intervals[0]
+            else:
+                s = interval.IntervalSet(intervals)
+            sets_by_universe[universe_id] = s
+        return sets_by_universe
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self):
+        return len(self.set_offsets) - 1
+
+    def save(self, path):
+        """Save these sets to a directory, as one .npy file per array.
+
+        Args:
+            path: path to a directory, which is created if it does not
+                exist
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ColumnarSets._ARRAY_NAMES:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @staticmethod
+    def load(path, mmap=True):
+        """Load sets that were saved to a directory.
+
+        Args:
+            path: path to a directory written by save()
+            mmap: when True, memory-map the arrays (read-only) rather than
+                read them into memory
+
+        Returns:
+            instance of ColumnarSets
+        """
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(path, name + '.npy'),
+                                mmap_mode=mmap_mode)
+                  for name in ColumnarSets._ARRAY_NAMES}
+        return ColumnarSets(**arrays)
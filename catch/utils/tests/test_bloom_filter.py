@@ -0,0 +1,60 @@
+"""Tests for bloom_filter module.
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from catch.utils import bloom_filter
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Tests the BloomFilter class.
+    """
+
+    def setUp(self):
+        np.random.seed(1)
+        self.values = np.random.randint(0, 2**62, size=10000,
+                                        dtype=np.int64).astype(np.uint64)
+        self.others = np.random.randint(0, 2**62, size=10000,
+                                        dtype=np.int64).astype(np.uint64)
+
+    def test_no_false_negatives(self):
+        bf = bloom_filter.BloomFilter.with_capacity(len(self.values))
+        bf.add(self.values)
+        self.assertTrue(bf.contains(self.values).all())
+
+    def test_false_positive_rate(self):
+        bf = bloom_filter.BloomFilter.with_capacity(len(self.values),
+                                                    bits_per_value=10)
+        bf.add(self.values)
+        others = np.setdiff1d(self.others, self.values)
+        self.assertLess(np.mean(bf.contains(others)), 0.03)
+
+    def test_empty(self):
+        bf = bloom_filter.BloomFilter.with_capacity(0)
+        self.assertFalse(bf.contains(self.values).any())
+        self.assertEqual(len(bf.contains(np.zeros(0, dtype=np.uint64))), 0)
+
+    def test_save_and_load(self):
+        bf = bloom_filter.BloomFilter.with_capacity(len(self.values))
+        bf.add(self.values)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'bloom.npy')
+            bf.save(path)
+            for mmap in [True, False]:
+                bf_loaded = bloom_filter.BloomFilter.load(path, mmap=mmap)
+                self.assertEqual(bf_loaded.num_hashes, bf.num_hashes)
+                np.testing.assert_array_equal(
+                    bf_loaded.contains(self.others), bf.contains(self.others))
+                self.assertTrue(bf_loaded.contains(self.values).all())
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            bloom_filter.BloomFilter(np.zeros(24, dtype=np.uint64), 3)
+        with self.assertRaises(ValueError):
+            bloom_filter.BloomFilter(np.zeros(16, dtype=np.uint64), 8)
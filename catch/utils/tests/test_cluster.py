@@ -2,6 +2,7 @@
 """
 
 import logging
+import random
 import unittest
 import warnings
 
@@ -9,6 +10,7 @@ import numpy as np
 import scipy
 
 from catch.utils import cluster
+from catch.utils import lsh
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
@@ -227,3 +229,150 @@ class TestClusterWithMinHashSignatures(unittest.TestCase):
         # Re-enable logging
         logging.disable(logging.NOTSET)
 
+
+class TestClusterWithSparseMinHashDistances(unittest.TestCase):
+    """Test clustering functions that use MinHash candidate pairs."""
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        # Make signatures for sequences that form several clusters of
+        # varying similarity, including short sequences whose signatures
+        # repeat hash values
+        random.seed(1)
+        seqs = []
+        for _ in range(8):
+            base = ''.join(random.choice('ACGT') for _ in range(200))
+            for _ in range(random.randint(1, 6)):
+                s = list(base)
+                for i in random.sample(range(200), random.randint(0, 20)):
+                    s[i] = random.choice('ACGT')
+                seqs += [''.join(s)]
+        seqs += ['ACGTACGTAAACG', 'ACGTACGTAAACT']
+        self.family = lsh.MinHashFamily(6, N=20)
+        h = self.family.make_h()
+        self.signatures = np.array([h(s) for s in seqs], dtype=np.uint32)
+
+        def dist_fn(i, j):
+            return self.family.estimate_jaccard_dist(
+                tuple(self.signatures[i]), tuple(self.signatures[j]))
+        self.dist_fn = dist_fn
+
+    def test_jaccard_dists(self):
+        keys = cluster._minhash_keys(self.signatures)
+        n = len(self.signatures)
+        for i in range(n):
+            dists = cluster._jaccard_dists(keys, i, np.arange(n))
+            for j in range(n):
+                self.assertEqual(dists[j], self.dist_fn(i, j))
+
+    def test_connected_components_same_as_all_pairs(self):
+        n = len(self.signatures)
+        for threshold in [0.0, 0.2, 0.5, 0.8, 1.0]:
+            expected = cluster.find_connected_components(n, self.dist_fn,
+                    threshold, early_stop_threshold=0)
+            ccs = cluster.find_connected_components_with_minhash(
+                    self.signatures, threshold)
+            self.assertCountEqual(ccs, expected)
+            self.assertEqual([len(c) for c in ccs],
+                             [len(c) for c in expected])
+
+    def test_hierarchical_same_as_full_dist_matrix(self):
+        n = len(self.signatures)
+        dist_matrix = cluster.create_condensed_dist_matrix(n, self.dist_fn,
+                num_processes=1)
+        for threshold in [0.0, 0.2, 0.5, 0.8, 1.0]:
+            expected = cluster.cluster_hierarchically_from_dist_matrix(
+                    dist_matrix, threshold)
+            clusters = cluster.cluster_hierarchically_with_minhash(
+                    self.signatures, threshold)
+            self.assertCountEqual([sorted(c) for c in clusters],
+                                  [sorted(c) for c in expected])
+
+    def test_hierarchical_splits_large_components(self):
+        # Components larger than the maximum size are clustered in pieces,
+        # so no cluster is larger than the maximum size
+        n = len(self.signatures)
+        orig_max_size = cluster._MAX_COMPONENT_SIZE_FOR_DIST_MATRIX
+        cluster._MAX_COMPONENT_SIZE_FOR_DIST_MATRIX = 4
+        try:
+            for threshold in [0.5, 1.0]:
+                clusters = cluster.cluster_hierarchically_with_minhash(
+                        self.signatures, threshold)
+                self.assertEqual(sorted(i for c in clusters for i in c),
+                                 list(range(n)))
+                for c in clusters:
+                    self.assertLessEqual(len(c), 4)
+        finally:
+            cluster._MAX_COMPONENT_SIZE_FOR_DIST_MATRIX = orig_max_size
+
+    def test_split_component(self):
+        component = np.arange(3, len(self.signatures))
+        pieces = cluster._split_component(self.signatures, component, 4)
+        self.assertEqual(sorted(np.concatenate(pieces).tolist()),
+                         component.tolist())
+        for piece in pieces:
+            self.assertLessEqual(len(piece), 4)
+            self.assertEqual(piece.tolist(), sorted(piece.tolist()))
+
+    def test_hierarchical_with_pool(self):
+        # Fill in distance matrices with a pool, reading signatures from
+        # shared memory, even for small components
+        orig_min_size = cluster._MIN_COMPONENT_SIZE_FOR_POOL
+        cluster._MIN_COMPONENT_SIZE_FOR_POOL = 0
+        try:
+            for threshold in [0.5, 1.0]:
+                expected = cluster.cluster_hierarchically_with_minhash(
+                        self.signatures, threshold, num_processes=1)
+                for num_processes in [2, 4]:
+                    clusters = cluster.cluster_hierarchically_with_minhash(
+                            self.signatures, threshold,
+                            num_processes=num_processes)
+                    self.assertCountEqual(clusters, expected)
+        finally:
+            cluster._MIN_COMPONENT_SIZE_FOR_POOL = orig_min_size
+
+    def test_hierarchical_with_pool_frees_shared_memory(self):
+        # Shared memory should be unlinked even if filling in a distance
+        # matrix fails
+        created = []
+        orig_shared_memory = cluster.shared_memory.SharedMemory
+        def shared_memory_recording_names(*args, **kwargs):
+            shm = orig_shared_memory(*args, **kwargs)
+            created.append(shm.name)
+            return shm
+        def row_ranges_failing(m, num_ranges):
+            raise RuntimeError("Failed to divide rows")
+        orig_min_size = cluster._MIN_COMPONENT_SIZE_FOR_POOL
+        orig_row_ranges = cluster._row_ranges
+        cluster._MIN_COMPONENT_SIZE_FOR_POOL = 0
+        cluster.shared_memory.SharedMemory = shared_memory_recording_names
+        cluster._row_ranges = row_ranges_failing
+        try:
+            with self.assertRaises(RuntimeError):
+                cluster.cluster_hierarchically_with_minhash(
+                        self.signatures, 1.0, num_processes=2)
+        finally:
+            cluster._MIN_COMPONENT_SIZE_FOR_POOL = orig_min_size
+            cluster.shared_memory.SharedMemory = orig_shared_memory
+            cluster._row_ranges = orig_row_ranges
+
+        # Both the signatures and the distance matrix were in shared memory
+        self.assertEqual(len(created), 2)
+        for name in created:
+            with self.assertRaises(FileNotFoundError):
+                cluster.shared_memory.SharedMemory(name=name)
+
+    def test_row_ranges(self):
+        for m in [2, 3, 10, 101]:
+            for num_ranges in [1, 2, 3, 8]:
+                ranges = cluster._row_ranges(m, num_ranges)
+                self.assertEqual(ranges[0][0], 0)
+                self.assertEqual(ranges[-1][1], m)
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+
+    def tearDown(self):
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
@@ -0,0 +1,93 @@
+"""Tests for cover_cache module.
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from catch.utils import cover_cache
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+class TestCoverCache(unittest.TestCase):
+    """Tests the CoverCache class.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'cache')
+
+    def make_entry(self, n):
+        return (np.arange(n, dtype=np.uint64) * 7,
+                np.arange(n, dtype=np.uint32),
+                np.arange(n, dtype=np.int64) * 10,
+                np.arange(n, dtype=np.int64) * 10 + 5)
+
+    def test_get_and_put(self):
+        cache = cover_cache.CoverCache(self.path)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', *self.make_entry(3))
+        probe_hashes, probe_ind, starts, ends = cache.get('a')
+        self.assertEqual(list(probe_hashes), [0, 7, 14])
+        self.assertEqual(list(probe_ind), [0, 1, 2])
+        self.assertEqual(list(starts), [0, 10, 20])
+        self.assertEqual(list(ends), [5, 15, 25])
+
+        # Another instance with the same path reads the entry
+        cache2 = cover_cache.CoverCache(self.path)
+        self.assertEqual(list(cache2.get('a')[1]), [0, 1, 2])
+
+    def test_empty_entry(self):
+        cache = cover_cache.CoverCache(self.path)
+        cache.put('a', *self.make_entry(0))
+        probe_hashes, probe_ind, starts, ends = cache.get('a')
+        self.assertEqual(len(probe_hashes), 0)
+        self.assertEqual(len(probe_ind), 0)
+
+    def test_evicts_least_recently_used(self):
+        cache = cover_cache.CoverCache(self.path)
+        for key in ['a', 'b', 'c']:
+            cache.put(key, *self.make_entry(1000))
+        entry_size = os.path.getsize(os.path.join(self.path, 'a.npz'))
+
+        # Make 'a' the oldest entry, then read it so that it becomes the
+        # most recently used; 'b' should then be the least recently used
+        for i, key in enumerate(['a', 'b', 'c']):
+            os.utime(os.path.join(self.path, key + '.npz'), (i, i))
+        self.assertIsNotNone(cache.get('a'))
+
+        cache.max_size = 3 * entry_size
+        cache.put('d', *self.make_entry(1000))
+        self.assertIsNone(cache.get('b'))
+        for key in ['a', 'c', 'd']:
+            self.assertIsNotNone(cache.get(key))
+
+    def test_evicts_as_entries_are_put(self):
+        cache = cover_cache.CoverCache(self.path)
+        cache.put('x', *self.make_entry(100))
+        entry_size = os.path.getsize(os.path.join(self.path, 'x.npz'))
+        cache.max_size = 5 * entry_size
+        keys = ['k%d' % i for i in range(20)]
+        for key in keys:
+            cache.put(key, *self.make_entry(100))
+        self.assertCountEqual(os.listdir(self.path),
+                              [key + '.npz' for key in keys[-5:]])
+
+        # Overwriting an entry does not count it twice
+        cache.put(keys[-1], *self.make_entry(100))
+        self.assertEqual(len(os.listdir(self.path)), 5)
+
+        # An entry put by another instance is tracked once it is read
+        cache2 = cover_cache.CoverCache(self.path, max_size=cache.max_size)
+        cache2.put('y', *self.make_entry(100))
+        self.assertIsNotNone(cache.get('y'))
+        cache.put('z', *self.make_entry(100))
+        self.assertCountEqual(os.listdir(self.path),
+                              [key + '.npz' for key in keys[-3:] +
+                               ['y', 'z']])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
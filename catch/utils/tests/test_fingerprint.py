@@ -0,0 +1,82 @@
+"""Tests for fingerprint module.
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+from catch.utils import fingerprint
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+def _windows(seqs):
+    """Give a buffer and windows holding each of seqs."""
+    buf = np.frombuffer(''.join(seqs).encode(), dtype=np.uint8)
+    lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    return (buf, starts, lengths)
+
+
+class TestFingerprintWindows(unittest.TestCase):
+    """Tests the fingerprint_windows function.
+    """
+
+    def test_identical_windows(self):
+        buf = np.frombuffer(b'ACGTACGTAACGT', dtype=np.uint8)
+        h = fingerprint.fingerprint_windows(buf, np.array([0, 4, 9, 0]),
+                                            np.array([4, 4, 4, 3]))
+        self.assertEqual(h[0], h[1])
+        self.assertEqual(h[0], h[2])
+        self.assertNotEqual(h[0], h[3])
+
+    def test_independent_of_chunks(self):
+        random.seed(1)
+        seqs = [''.join(random.choice('ACGT')
+                        for _ in range(random.randint(1, 30)))
+                for _ in range(1000)]
+        buf, starts, lengths = _windows(seqs)
+        h = fingerprint.fingerprint_windows(buf, starts, lengths)
+        self.assertEqual(len(set(h)), len(set(seqs)))
+
+        orig_chunk_size = fingerprint._CHUNK_SIZE
+        fingerprint._CHUNK_SIZE = 7
+        try:
+            np.testing.assert_array_equal(
+                fingerprint.fingerprint_windows(buf, starts, lengths), h)
+        finally:
+            fingerprint._CHUNK_SIZE = orig_chunk_size
+
+
+class TestFirstOccurrences(unittest.TestCase):
+    """Tests the first_occurrences function.
+    """
+
+    def test_contrived(self):
+        h = np.array([5, 3, 5, 7, 3, 3, 9], dtype=np.uint64)
+        self.assertEqual(list(fingerprint.first_occurrences(h)),
+                         [0, 1, 0, 3, 1, 1, 6])
+
+    def test_windows(self):
+        random.seed(1)
+        seqs = [''.join(random.choice('AC') for _ in range(length))
+                for length in [5, 8, 17] for _ in range(100)]
+        h = fingerprint.fingerprint_windows(*_windows(seqs))
+        first = fingerprint.first_occurrences(h)
+        for i, s in enumerate(seqs):
+            self.assertEqual(first[i], seqs.index(s))
+
+    def test_comparable_across_buffers(self):
+        a = np.frombuffer(b'ACGTTT', dtype=np.uint8)
+        b = np.frombuffer(b'GGACGT', dtype=np.uint8)
+        h_a = fingerprint.fingerprint_windows(a, [0], [4], max_length=10)
+        h_b = fingerprint.fingerprint_windows(b, [2, 0], [4, 3],
+                                              max_length=10)
+        self.assertEqual(h_a[0], h_b[0])
+        self.assertEqual(list(fingerprint.first_occurrences(
+            np.concatenate((h_a, h_b)))), [0, 0, 2])
+
+    def test_empty(self):
+        self.assertEqual(len(fingerprint.first_occurrences(
+            np.zeros(0, dtype=np.uint64))), 0)
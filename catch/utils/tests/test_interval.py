@@ -1,9 +1,11 @@
 """Tests for interval module.
 """
 
+import random
 import unittest
 
 from catch.utils import interval
+from catch.utils.interval import IntervalBitmap
 from catch.utils.interval import IntervalSet
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
@@ -147,6 +149,59 @@ class TestIntervalSet(unittest.TestCase):
         self.compare_overlaps_interval([(1, 5), (10, 14)], (5, 10), False)
 
 
+class TestIntervalBitmap(unittest.TestCase):
+    """Tests the IntervalBitmap class and its methods.
+    """
+
+    def test_empty(self):
+        b = IntervalBitmap([])
+        self.assertEqual(len(b), 0)
+        self.assertEqual(b.count([(1, 10)]), 0)
+        self.assertEqual(b.remove([(1, 10)]), 0)
+
+    def test_count(self):
+        b = IntervalBitmap([(3, 6), (5, 10), (20, 25)])
+        self.assertEqual(len(b), 12)
+        self.assertEqual(b.count([(0, 100)]), 12)
+        self.assertEqual(b.count([(4, 8)]), 4)
+        self.assertEqual(b.count([(4, 8), (9, 22)]), 7)
+        self.assertEqual(b.count([(10, 20)]), 0)
+        self.assertEqual(b.count([(-5, 4), (24, 30)]), 2)
+
+    def test_remove(self):
+        b = IntervalBitmap([(3, 6), (5, 10), (20, 25)])
+        self.assertEqual(b.remove([(4, 8)]), 4)
+        self.assertEqual(len(b), 8)
+        self.assertEqual(b.count([(0, 100)]), 8)
+        self.assertEqual(b.count([(3, 10)]), 3)
+        self.assertEqual(b.remove([(0, 5), (22, 30)]), 4)
+        self.assertEqual(len(b), 4)
+        self.assertEqual(b.count([(0, 100)]), 4)
+        self.assertEqual(b.remove([(0, 100)]), 4)
+        self.assertEqual(len(b), 0)
+
+    def test_random_against_intervalset(self):
+        random.seed(1)
+        for n in range(20):
+            intervals = []
+            for i in range(random.randint(1, 50)):
+                start = random.randint(0, 5000)
+                intervals += [(start, start + random.randint(1, 300))]
+            b = IntervalBitmap(intervals)
+            s = IntervalSet(intervals)
+            self.assertEqual(len(b), len(s))
+            for i in range(50):
+                start = random.randint(-100, 5500)
+                query = IntervalSet([(start,
+                                      start + random.randint(1, 500))])
+                self.assertEqual(b.count(query.intervals),
+                                 len(s.intersection(query)))
+                if i % 5 == 0:
+                    b.remove(query.intervals)
+                    s = s.difference(query)
+                    self.assertEqual(len(b), len(s))
+
+
 class TestMergeOverlapping(unittest.TestCase):
     """Tests the merge_overlapping function.
     """
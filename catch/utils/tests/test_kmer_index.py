@@ -0,0 +1,182 @@
+"""Tests for kmer_index module.
+"""
+
+import logging
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from catch.utils import kmer_index
+from catch.utils import seq_io
+from catch.utils import twobit
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+class TestGenomeKmerIndex(unittest.TestCase):
+    """Tests building and querying an index of k-mers in genomes.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.INFO)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        # Write two temporary fasta files with lowercase and degenerate
+        # bases, gaps, an empty sequence, and repeated k-mers
+        np.random.seed(1)
+        self.fasta_paths = []
+        for seqs in [['ACGTACGTTTGCA' * 3 + 'nACGT-ACGTRTTGCA',
+                      ''.join(np.random.choice(['A', 'C', 'G', 'T'],
+                                               size=500)) +
+                      'ACGTACGTNNACGTACGTYACGTACGTacgtNacgt'],
+                     ['', 'acgTTGCAACGTTGCAtt']]:
+            path = os.path.join(self.tmp_dir.name,
+                                'genomes%d.fasta' % len(self.fasta_paths))
+            with open(path, 'w') as f:
+                for i, seq in enumerate(seqs):
+                    f.write('>genome_%d\n%s\n' % (i, seq))
+            self.fasta_paths += [path]
+
+        # Read the sequences as they are read when avoiding genomes, but
+        # keep empty sequences
+        self.seqs = [seq for path in self.fasta_paths
+                     for seq in seq_io.read_fasta(path, skip_gaps=False,
+                                                  make_uppercase=False
+                                                  ).values()]
+
+    def build(self, k, **kwargs):
+        path = os.path.join(self.tmp_dir.name, 'index')
+        kmer_index.build(self.fasta_paths, path, k=k, **kwargs)
+        return kmer_index.GenomeKmerIndex(path)
+
+    def expected_occurrences(self, k):
+        # Find, by brute force, the (canonical k-mer, position in the
+        # concatenated sequences, strand) of each k-mer
+        occurrences = []
+        offset = 0
+        for seq in self.seqs:
+            for i in range(len(seq) - k + 1):
+                value = twobit.kmer_value(seq[i:(i + k)])
+                if value is None:
+                    continue
+                rc_value = int(twobit.reverse_complement_values(
+                    np.array([value], dtype=np.uint64), k)[0])
+                occurrences += [(min(value, rc_value), offset + i,
+                                 rc_value < value)]
+            offset += len(seq)
+        return sorted(occurrences)
+
+    def expected_ambiguous_occurrences(self, k):
+        # Find, by brute force, the (k-mer, position in the concatenated
+        # sequences) of each k-mer that cannot be encoded but could be in
+        # a probe (i.e., is uppercase)
+        occurrences = []
+        offset = 0
+        for seq in self.seqs:
+            for i in range(len(seq) - k + 1):
+                kmer = seq[i:(i + k)]
+                if (twobit.kmer_value(kmer) is None and
+                        all('A' <= c <= 'Z' for c in kmer)):
+                    occurrences += [(kmer, offset + i)]
+            offset += len(seq)
+        return sorted(occurrences)
+
+    def check_index(self, index, k):
+        self.assertEqual(index.k, k)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(list(index.iterate_sequences()),
+                         [seq for seq in self.seqs if len(seq) > 0])
+        for j, seq in enumerate(self.seqs):
+            self.assertEqual(index.seq_bytes(j).tobytes().decode(), seq)
+        self.assertEqual(sorted(zip(index.keys.tolist(), index.pos.tolist(),
+                                    index.strands.tolist())),
+                         self.expected_occurrences(k))
+        self.assertTrue(np.all(np.diff(index.keys.astype(np.float64)) >= 0))
+
+        # Check the k-mers that cannot be encoded, and look some up
+        expected_ambiguous = self.expected_ambiguous_occurrences(k)
+        self.assertGreater(len(expected_ambiguous), 0)
+        self.assertEqual(sorted(zip([kmer.decode() for kmer in
+                                     index.ambiguous_keys.tolist()],
+                                    index.ambiguous_pos.tolist())),
+                         expected_ambiguous)
+        offsets = index.ambiguous_offsets
+        self.assertEqual(offsets[-1], len(index.ambiguous_keys))
+        for b in range(len(offsets) - 1):
+            partition = index.ambiguous_keys[offsets[b]:offsets[b + 1]]
+            self.assertEqual(partition.tolist(), sorted(partition.tolist()))
+        kmers = [expected_ambiguous[0][0], expected_ambiguous[-1][0],
+                 'N' * k]
+        query_ind, index_ind = index.lookup_ambiguous(kmers)
+        self.assertEqual(
+            [(kmers[q], kmer.decode()) for q, kmer in
+             zip(query_ind.tolist(), index.ambiguous_keys[index_ind])],
+            [(kmer, kmer) for kmer in kmers for kmer_pos in
+             expected_ambiguous if kmer_pos[0] == kmer])
+
+        # Look up the k-mers of the sequences, and some that are absent
+        values = sorted(set(v for v, _, _ in self.expected_occurrences(k)))
+        queries = np.array(values + [values[0]] + [4**k - 1],
+                           dtype=np.uint64)
+        query_ind, index_ind = index.lookup(queries)
+        self.assertEqual(len(query_ind),
+                         sum(np.count_nonzero(index.keys == v)
+                             for v in queries))
+        np.testing.assert_array_equal(index.keys[index_ind],
+                                      queries[query_ind])
+        self.assertTrue(np.all(np.diff(query_ind) >= 0))
+
+    def test_build_and_lookup(self):
+        for k in [4, 13]:
+            with self.subTest(k=k):
+                index = self.build(k)
+                self.check_index(index, k)
+                self.assertIsNone(index.bloom)
+                os.rename(index.path, index.path + '.' + str(k))
+
+    def test_many_passes(self):
+        self.check_index(self.build(6, num_passes=5), 6)
+
+    def test_bloom_filter(self):
+        index = self.build(6, bloom_bits_per_kmer=10)
+        self.assertIsNotNone(index.bloom)
+        self.check_index(index, 6)
+
+    def test_seq_index(self):
+        index = self.build(6)
+        offsets = np.cumsum([0] + [len(seq) for seq in self.seqs])
+        pos = np.array([0, offsets[1] - 1, offsets[1], offsets[3]])
+        # Sequence 2 is empty
+        self.assertEqual(index.seq_index(pos).tolist(), [0, 0, 1, 3])
+
+    def test_is_index(self):
+        index = self.build(6)
+        self.assertTrue(kmer_index.is_index(index.path))
+        self.assertFalse(kmer_index.is_index(self.fasta_paths[0]))
+        self.assertFalse(kmer_index.is_index(self.tmp_dir.name))
+
+    def test_pickle(self):
+        index = self.build(6)
+        index_unpickled = pickle.loads(pickle.dumps(index))
+        np.testing.assert_array_equal(index_unpickled.keys, index.keys)
+        self.assertEqual(index_unpickled.seq_bytes(3).tobytes().decode(),
+                         self.seqs[3])
+
+    def test_invalid_build(self):
+        with self.assertRaises(ValueError):
+            self.build(33)
+        index = self.build(6)
+        with self.assertRaises(ValueError):
+            self.build(6)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
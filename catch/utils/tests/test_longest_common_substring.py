@@ -3,6 +3,8 @@
 
 import unittest
 
+import numpy as np
+
 from catch.utils import longest_common_substring as lcf
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
@@ -156,3 +158,65 @@ class TestLCSAroundAnchorWithKMismatches(unittest.TestCase):
         a = 'ABCDEFGHIJKLM'
         b = 'ABZDEFSTIJWXY'
         self.assertEqual(lcf.k_lcf_around_anchor(a, b, 3, 6, 3), (10, 0))
+
+
+class TestLCSAroundAnchorsWithKMismatches(unittest.TestCase):
+    """Tests the k_lcf_around_anchors function.
+    """
+
+    def to_mat(self, seqs):
+        return np.array([np.frombuffer(s.encode(), dtype=np.uint8)
+                         for s in seqs])
+
+    def test_matches_single(self):
+        a = ['ABCDEFGHIJKLM', 'ABCDEFGHIJKLM', 'ABCDEFGHIJKLM',
+             'ABCDEFGHIJKLM']
+        b = ['XBZDEFSTUVWXY', 'XBZDEFGTUJKLM', 'XYCDEFSTUJKLM',
+             'ABZDEFSTIJWXY']
+        anchor_start = [3, 3, 10, 3]
+        anchor_end = [6, 6, 13, 6]
+        for k in range(4):
+            l, s = lcf.k_lcf_around_anchors(self.to_mat(a), self.to_mat(b),
+                                            anchor_start, anchor_end, k)
+            for r in range(len(a)):
+                self.assertEqual((l[r], s[r]),
+                                 lcf.k_lcf_around_anchor(a[r], b[r],
+                                     anchor_start[r], anchor_end[r], k))
+
+    def test_with_bounds(self):
+        a = self.to_mat(['ABCDEFGHIJKLM'])
+        b = self.to_mat(['ABCDEFGHIJKLM'])
+        l, s = lcf.k_lcf_around_anchors(a, b, [4], [7], 0,
+                                        start=[2], end=[10])
+        self.assertEqual((l[0], s[0]), (8, 2))
+
+    def test_different_anchors(self):
+        a = self.to_mat(['ABCDEF'])
+        b = self.to_mat(['ABXDEF'])
+        with self.assertRaises(ValueError):
+            lcf.k_lcf_around_anchors(a, b, [1], [4], 1)
+
+    def test_random(self):
+        np.random.seed(1)
+        n, w = 200, 50
+        a = np.random.choice(list(b'ACGT'), size=(n, w)).astype(np.uint8)
+        b = a.copy()
+        mutate = np.random.random((n, w)) < 0.1
+        b[mutate] = np.random.choice(list(b'ACGT'), size=mutate.sum())
+        start = np.random.randint(0, 10, size=n)
+        end = np.random.randint(40, w + 1, size=n)
+        anchor_start = np.random.randint(15, 30, size=n)
+        anchor_end = anchor_start + 5
+        # Make the anchors match
+        for r in range(n):
+            b[r, anchor_start[r]:anchor_end[r]] = \
+                a[r, anchor_start[r]:anchor_end[r]]
+        for k in range(5):
+            l, s = lcf.k_lcf_around_anchors(a, b, anchor_start, anchor_end,
+                                            k, start=start, end=end)
+            for r in range(n):
+                a_r = a[r, start[r]:end[r]]
+                b_r = b[r, start[r]:end[r]]
+                l_r, s_r = lcf.k_lcf_around_anchor(a_r, b_r,
+                    anchor_start[r] - start[r], anchor_end[r] - start[r], k)
+                self.assertEqual((l[r], s[r]), (l_r, s_r + start[r]))
@@ -5,6 +5,9 @@ import logging
 import random
 import unittest
 
+import numpy as np
+
+from catch import probe
 from catch.utils import lsh
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
@@ -60,6 +63,34 @@ class TestHammingDistanceFamily(unittest.TestCase):
         self.assertEqual(self.family.P1(2), 0.9)
 
 
+class TestHammingDistanceBulk(unittest.TestCase):
+    """Tests evaluating Hamming hash functions and distances in bulk.
+    """
+
+    def setUp(self):
+        # Set a random seed so hash functions are always the same
+        random.seed(0)
+
+        self.family = lsh.HammingDistanceFamily(20)
+        self.seqs = ['ATCGATATGGGCACTGCTAT', 'ATCGACATGGGCACTGGTAT',
+                     'AGTTGTCACCCTTGACGATA']
+
+    def test_signatures(self):
+        hs = [self.family.make_h() for _ in range(10)]
+        S = self.family.signatures(hs, self.seqs)
+        self.assertEqual(S.shape, (3, 10))
+        for i, seq in enumerate(self.seqs):
+            for j, h in enumerate(hs):
+                self.assertEqual(chr(S[i][j]), h(seq))
+
+    def test_hamming_dists(self):
+        probes = [probe.Probe.from_str(s) for s in self.seqs]
+        self.assertEqual(list(lsh.hamming_dists(self.seqs[0], self.seqs)),
+                         [0, 2, 18])
+        self.assertEqual(list(lsh.hamming_dists(probes[1], probes)),
+                         [2, 0, 18])
+
+
 class TestMinHashFamilyWithSingleHash(unittest.TestCase):
     """Tests family of hash functions for MinHash.
     """
@@ -182,6 +213,56 @@ class TestMinHashFamilySignatures(unittest.TestCase):
         logging.disable(logging.NOTSET)
 
 
+class TestMinHashFamilyBulkSignatures(unittest.TestCase):
+    """Tests evaluating many MinHash functions on many sequences at once.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        # Set a random seed so hash functions are always the same
+        random.seed(0)
+
+        self.seqs = ['ATCGATATGGGCACTGCTAT', 'ATCGACATGGGCACTGGTAT',
+                     'AGTTGTCACCCTTGACGATA', 'ATCGA', 'ATCGATATGGGCACTGCTAT']
+
+    def test_matches_single_hash(self):
+        for N in [1, 10]:
+            family = lsh.MinHashFamily(4, N=N)
+            hs = [family.make_h() for _ in range(5)]
+            S = family.signatures(hs, self.seqs)
+            if N == 1:
+                self.assertEqual(S.shape, (5, 5))
+            else:
+                self.assertEqual(S.shape, (5, 5, N))
+            for i, seq in enumerate(self.seqs):
+                for j, h in enumerate(hs):
+                    self.assertEqual(tuple(np.atleast_1d(S[i][j]).tolist()),
+                                     h(seq))
+            np.testing.assert_array_equal(S[0], S[4])
+
+    def test_probes_and_strings(self):
+        family = lsh.MinHashFamily(4)
+        hs = [family.make_h() for _ in range(5)]
+        probes = [probe.Probe.from_str(s) for s in self.seqs]
+        np.testing.assert_array_equal(family.signatures(hs, probes),
+                                      family.signatures(hs, self.seqs))
+
+    def test_kmer_hashes_deterministic(self):
+        # Hash values depend only on the k-mers
+        x = lsh.kmer_hashes([b'ATCGATCG', b'TCGATCGA'], 4)
+        self.assertEqual(x.shape, (2, 5))
+        self.assertEqual(x[0][0], x[0][4])
+        self.assertEqual(x[0][1], x[1][0])
+        self.assertNotEqual(x[0][0], x[0][1])
+        self.assertTrue(np.all(x < 2**31 - 1))
+
+    def tearDown(self):
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
 class TestHammingHashConcatenation(unittest.TestCase):
     """Tests concatenations of hash functions with Hamming distance.
     """
@@ -258,6 +339,22 @@ class TestHammingNearNeighborLookup(unittest.TestCase):
             # Although e was not added, a query for it should return d
             self.assertCountEqual(nnl.query(e), {d})
 
+    def test_batch_dist_fn(self):
+        a = 'ATCGATATGGGCACTGCTAT'
+        c = 'ATCGACATGGGCACTGGTAT'  # similar to a
+        d = 'AGTTGTCACCCTTGACGATA'  # not similar to a
+        e = 'AGTTGTCACCCTTGACGATA'  # similar to d
+
+        nnl = lsh.NearNeighborLookup(self.family, 5, self.dist_thres,
+            self.dist_fn, 0.95, batch_dist_fn=lsh.hamming_dists)
+        pts = [a, c, d]
+        signatures = nnl.signatures(pts)
+        nnl.add(pts, signatures)
+        self.assertCountEqual(nnl.query(a), {a, c})
+        self.assertCountEqual(nnl.query(a, [S[0] for S in signatures]),
+                              {a, c})
+        self.assertCountEqual(nnl.query(e), {d})
+
 
 class TestMinHashNearNeighborLookup(unittest.TestCase):
     """Tests approximate near neighbor lookups with MinHash."""
@@ -299,3 +396,19 @@ class TestMinHashNearNeighborLookup(unittest.TestCase):
             # Although e was not added, a query for it should return d
             self.assertCountEqual(nnl.query(e), {d})
 
+    def test_with_signatures(self):
+        a = 'ATCGATATGGGCACTGCTAT'
+        c = 'ATCGACATGGGCACTGGTAT'  # similar to a
+        d = 'AGTTGTCACCCTTGACGATA'  # not similar to a
+
+        nnl = lsh.NearNeighborLookup(self.family, 5, self.dist_thres,
+            self.dist_fn, 0.95)
+        pts = [a, c, d]
+        signatures = nnl.signatures(pts)
+        self.assertEqual(len(signatures), nnl.num_tables)
+        nnl.add(pts, signatures)
+        for i, q in enumerate(pts):
+            q_signatures = [S[i] for S in signatures]
+            self.assertCountEqual(nnl.query(q, q_signatures), nnl.query(q))
+        self.assertCountEqual(nnl.query(a, [S[0] for S in signatures]),
+                              {a, c})
@@ -2,13 +2,19 @@
 """
 
 from collections import OrderedDict
+import gzip
 import logging
+import os
 import pathlib
+import pickle
 import tempfile
 import unittest
 
+import numpy as np
+
 from catch import genome
 from catch.utils import seq_io
+from catch.utils import twobit
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
@@ -122,3 +128,195 @@ class TestFastaEmptyLineRead(unittest.TestCase):
 
         # Re-enable logging
         logging.disable(logging.NOTSET)
+
+
+class TestFastaProcessing(unittest.TestCase):
+    """Tests processing of sequences, data types, and compression when
+    reading a fasta file.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.INFO)
+
+        self.contents = (">seq 1\n"
+                         "acgtRYN\n"
+                         "AC-GT  \n"
+                         ">seq 2\r\n"
+                         "--ttk\r\n"
+                         "\n")
+        self.fasta = tempfile.NamedTemporaryFile(mode='w')
+        self.fasta.write(self.contents)
+        self.fasta.flush()
+
+    def test_processing(self):
+        self.assertEqual(seq_io.read_fasta(self.fasta.name),
+                         OrderedDict([('seq 1', 'ACGTNNNACGT'),
+                                      ('seq 2', 'TTN')]))
+        self.assertEqual(seq_io.read_fasta(self.fasta.name,
+                                           replace_degenerate=False,
+                                           skip_gaps=False,
+                                           make_uppercase=False),
+                         OrderedDict([('seq 1', 'acgtRYNAC-GT'),
+                                      ('seq 2', '--ttk')]))
+        self.assertEqual(seq_io.read_fasta(self.fasta.name,
+                                           make_uppercase=False),
+                         OrderedDict([('seq 1', 'acgtNNNACGT'),
+                                      ('seq 2', 'ttk')]))
+        self.assertEqual(list(seq_io.iterate_fasta(self.fasta.name)),
+                         ['acgtNNNAC-GT', '--ttk'])
+
+    def test_small_blocks(self):
+        # Records, and the line break before a record, should be able to
+        # span blocks
+        records = list(seq_io._iterate_fasta_records(
+            ZAIRE_EBOLAVIRUS_PATH, True, True, True))
+        for block_size in [1, 2, 3, 100]:
+            self.assertEqual(list(seq_io._iterate_fasta_records(
+                self.fasta.name, True, True, True, block_size=block_size)),
+                [('seq 1', b'ACGTNNNACGT'), ('seq 2', b'TTN')])
+        self.assertEqual(list(seq_io._iterate_fasta_records(
+            ZAIRE_EBOLAVIRUS_PATH, True, True, True, block_size=4096)),
+            records)
+
+    def test_data_types(self):
+        seqs = seq_io.read_fasta(self.fasta.name, data_type='np')
+        np.testing.assert_array_equal(seqs['seq 2'],
+                                      np.array(['T', 'T', 'N']))
+        self.assertEqual(seqs['seq 2'].dtype, np.dtype('U1'))
+        seqs = seq_io.read_fasta(self.fasta.name, data_type='uint8')
+        np.testing.assert_array_equal(seqs['seq 2'],
+                                      np.array([84, 84, 78], dtype=np.uint8))
+        seqs = seq_io.read_fasta(self.fasta.name, data_type='2bit')
+        np.testing.assert_array_equal(seqs['seq 1'],
+                                      twobit.encode('ACGTNNNACGT'))
+        seqs = list(seq_io.iterate_fasta(self.fasta.name, data_type='2bit'))
+        np.testing.assert_array_equal(seqs[1], twobit.encode('--ttk'))
+        with self.assertRaises(ValueError):
+            seq_io.read_fasta(self.fasta.name, data_type='list')
+
+    def test_blank_line_ends_record(self):
+        # A blank line ends the sequence being read by read_fasta(), so
+        # more sequence cannot follow it; iterate_fasta() skips it
+        for blank_line in ['\n', '  \n', '\r\n']:
+            with tempfile.NamedTemporaryFile(mode='w') as fasta:
+                fasta.write(">seq 1\nACGT\n" + blank_line + "TTGG\n"
+                            ">seq 2\n" + blank_line + "CCAA\n")
+                fasta.flush()
+                with self.assertRaises(AssertionError):
+                    seq_io.read_fasta(fasta.name)
+                self.assertEqual(list(seq_io.iterate_fasta(fasta.name)),
+                                 ['ACGTTTGG', 'CCAA'])
+
+    def test_non_ascii(self):
+        # Headers may be UTF-8, but sequences must be ASCII
+        with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8') as fasta:
+            fasta.write(">seq \u00e9\nACGT\n")
+            fasta.flush()
+            self.assertEqual(seq_io.read_fasta(fasta.name),
+                             OrderedDict([('seq \u00e9', 'ACGT')]))
+        with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8') as fasta:
+            fasta.write(">seq 1\nAC\u00e9GT\n")
+            fasta.flush()
+            with self.assertRaisesRegex(ValueError, fasta.name):
+                seq_io.read_fasta(fasta.name)
+            with self.assertRaisesRegex(ValueError, fasta.name):
+                list(seq_io.iterate_fasta(fasta.name))
+        with tempfile.NamedTemporaryFile(mode='wb') as fasta:
+            fasta.write(b">seq \xff\nACGT\n")
+            fasta.flush()
+            with self.assertRaisesRegex(ValueError, fasta.name):
+                seq_io.read_fasta(fasta.name)
+
+    def test_gzip_detected_from_contents(self):
+        with tempfile.NamedTemporaryFile(suffix='.fasta') as gz_fasta:
+            with gzip.open(gz_fasta.name, 'wt') as f:
+                f.write(self.contents)
+            self.assertEqual(seq_io.read_fasta(gz_fasta.name),
+                             seq_io.read_fasta(self.fasta.name))
+
+    def tearDown(self):
+        self.fasta.close()
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
+
+
+class TestIndexedFasta(unittest.TestCase):
+    """Tests indexing a FASTA file and reading genomes lazily from it.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.INFO)
+
+        self.index_dir = tempfile.TemporaryDirectory()
+
+        # Write a temporary fasta file with lowercase and degenerate bases,
+        # gaps, an empty sequence, and a repeated name
+        self.fasta = tempfile.NamedTemporaryFile(mode='w', suffix='.fasta')
+        self.fasta.write(">genome_1\n")
+        self.fasta.write("ATACG\n")
+        self.fasta.write("tayg-C\n")
+        self.fasta.write(">genome_2\n")
+        self.fasta.write("\n")
+        self.fasta.write(">genome_3\n")
+        self.fasta.write("AAA\n")
+        self.fasta.write(">genome_2\n")
+        self.fasta.write("GGG\n")
+        self.fasta.seek(0)
+
+    def test_index(self):
+        indexed = seq_io.index_fasta(self.fasta.name, self.index_dir.name)
+        self.assertEqual(len(indexed), 4)
+        self.assertEqual(indexed.names,
+                         ['genome_1', 'genome_2', 'genome_3', 'genome_2'])
+        self.assertEqual([indexed.seq(i) for i in range(4)],
+                         ['ATACGTANGC', '', 'AAA', 'GGG'])
+        self.assertEqual([indexed.seq_len(i) for i in range(4)],
+                         [10, 0, 3, 3])
+        self.assertEqual(indexed.seq_bytes(0).tobytes(), b'ATACGTANGC')
+
+    def test_index_is_reused(self):
+        indexed = seq_io.index_fasta(self.fasta.name, self.index_dir.name)
+        self.assertEqual(len(os.listdir(self.index_dir.name)), 1)
+        indexed_again = seq_io.index_fasta(self.fasta.name,
+                                           self.index_dir.name)
+        self.assertEqual(indexed_again.path, indexed.path)
+        self.assertEqual(len(os.listdir(self.index_dir.name)), 1)
+
+    def test_pickle(self):
+        indexed = seq_io.index_fasta(self.fasta.name, self.index_dir.name)
+        indexed.seq(0)
+        indexed_unpickled = pickle.loads(pickle.dumps(indexed))
+        self.assertEqual(indexed_unpickled.seq(0), 'ATACGTANGC')
+
+    def test_empty(self):
+        with tempfile.NamedTemporaryFile(mode='w') as empty_fasta:
+            indexed = seq_io.index_fasta(empty_fasta.name,
+                                         self.index_dir.name)
+            self.assertEqual(len(indexed), 0)
+
+    def test_read_genomes_lazily(self):
+        genomes = seq_io.read_genomes_from_fasta(self.fasta.name)
+        lazy_genomes = seq_io.read_genomes_from_fasta(
+            self.fasta.name, index_dir=self.index_dir.name)
+        for g in lazy_genomes:
+            self.assertIsInstance(g, genome.LazyGenome)
+        self.assertEqual(lazy_genomes, genomes)
+
+    def test_read_ebola_genomes_lazily(self):
+        genomes = seq_io.read_genomes_from_fasta(ZAIRE_EBOLAVIRUS_PATH)
+        lazy_genomes = seq_io.read_genomes_from_fasta(
+            ZAIRE_EBOLAVIRUS_PATH, index_dir=self.index_dir.name)
+        self.assertEqual(len(lazy_genomes), 1525)
+        self.assertEqual(lazy_genomes, genomes)
+        self.assertEqual([g.size() for g in lazy_genomes],
+                         [g.size() for g in genomes])
+
+    def tearDown(self):
+        self.fasta.close()
+        self.index_dir.cleanup()
+
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
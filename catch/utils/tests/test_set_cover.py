@@ -4,6 +4,7 @@
 from array import array
 from collections import defaultdict
 import logging
+import tempfile
 import unittest
 
 import numpy as np
@@ -478,6 +479,34 @@ class TestSetCoverApproxMultiuniverse(unittest.TestCase):
                                                  use_intervalsets=True),
                          desired_output)
 
+    def test_with_bitmap_universes(self):
+        sets = {
+            0: {0: interval.IntervalSet([(1, 100)]),
+                1: (1, 5)},
+            1: {0: (20, 30)},
+            2: {0: interval.IntervalSet([(40, 50)]),
+                1: interval.IntervalSet([(20, 30), (40, 50)])}
+        }
+
+        universe_p = {0: 1.0, 1: 0.1}
+        desired_output = {0}
+        self.assertEqual(sc.approx_multiuniverse(sets,
+                                                 universe_p=universe_p,
+                                                 use_intervalsets=True,
+                                                 use_bitmap_universes=True),
+                         desired_output)
+
+        universe_p = {0: 0.1, 1: 0.5}
+        desired_output = {2}
+        self.assertEqual(sc.approx_multiuniverse(sets,
+                                                 universe_p=universe_p,
+                                                 use_intervalsets=True,
+                                                 use_bitmap_universes=True),
+                         desired_output)
+
+        with self.assertRaises(ValueError):
+            sc.approx_multiuniverse(sets, use_bitmap_universes=True)
+
     def test_with_intervalsets_single_interval(self):
         """Give a single interval directly as a tuple rather than as an
         instance of IntervalSet.
@@ -555,7 +584,60 @@ class TestSetCoverApproxMultiuniverse(unittest.TestCase):
         output_intervalsets = self.run_random(False, True, True)
         self.assertEqual(output_set, output_intervalsets)
 
-    def run_random(self, use_arrays, use_intervalsets, make_contiguous):
+    def test_random_contiguous_bitmap_universes(self):
+        output_intervalsets = self.run_random(False, True, True)
+        output_bitmaps = self.run_random(False, True, True,
+                                         use_bitmap_universes=True)
+        self.assertEqual(output_intervalsets, output_bitmaps)
+
+    def test_random_contiguous_columnar_sets(self):
+        output_intervalsets = self.run_random(False, True, True)
+        output_columnar = self.run_random(False, True, True,
+                                          use_columnar_sets=True)
+        self.assertEqual(output_intervalsets, output_columnar)
+        output_columnar_bitmaps = self.run_random(
+            False, True, True, use_bitmap_universes=True,
+            use_columnar_sets=True)
+        self.assertEqual(output_intervalsets, output_columnar_bitmaps)
+        output_columnar_lazy = self.run_random(
+            False, True, True, use_lazy_greedy=True,
+            use_columnar_sets=True)
+        self.assertEqual(output_intervalsets, output_columnar_lazy)
+
+    def test_random_noncontiguous_lazy_greedy(self):
+        output = self.run_random(False, False, False)
+        output_lazy = self.run_random(False, False, False,
+                                      use_lazy_greedy=True)
+        self.assertEqual(output, output_lazy)
+
+    def test_random_contiguous_lazy_greedy(self):
+        output = self.run_random(False, True, True)
+        output_lazy = self.run_random(False, True, True,
+                                      use_lazy_greedy=True)
+        self.assertEqual(output, output_lazy)
+
+    def test_lazy_greedy_with_ranks(self):
+        sets = {0: {0: set([1, 2, 3]), 1: set([1])},
+                1: {0: set([4, 5, 6, 7]), 1: set([2, 3])},
+                2: {0: set([1, 2, 3, 4, 5, 6, 7, 8])},
+                3: {1: set([1, 2, 3, 4])},
+                4: {0: set([8])}}
+        universe_p = {0: 1.0, 1: 0.75}
+        costs = {0: 1, 1: 1, 2: 1, 3: 2, 4: 1}
+        for ranks in [None,
+                      {0: 0, 1: 0, 2: 1, 3: 1, 4: 0},
+                      {0: 1, 1: 1, 2: 0, 3: 2, 4: 2},
+                      {0: 2, 1: 2, 2: 2, 3: 0, 4: 1}]:
+            self.assertEqual(
+                sc.approx_multiuniverse(sets, costs=costs,
+                                        universe_p=universe_p, ranks=ranks,
+                                        use_lazy_greedy=True),
+                sc.approx_multiuniverse(sets, costs=costs,
+                                        universe_p=universe_p, ranks=ranks))
+
+    def run_random(self, use_arrays, use_intervalsets, make_contiguous,
+                   use_lazy_greedy=False, use_bitmap_universes=False,
+                   use_columnar_sets=False):
         """Run tests with randomly generated instances of set cover.
 
         This generates random instances of set cover, computes the
@@ -573,6 +655,12 @@ class TestSetCoverApproxMultiuniverse(unittest.TestCase):
             make_contiguous: when True, the elements (integers) put
                 into the sets form contigous stretches (when False,
                 they tend to be spaced apart)
+            use_lazy_greedy: when True, solve set cover with the lazy
+                greedy approach
+            use_bitmap_universes: when True (and use_intervalsets is
+                True), store universes in instances of IntervalBitmap
+            use_columnar_sets: when True (and use_intervalsets is True),
+                give the input sets as an instance of ColumnarSets
         """
         np.random.seed(1)
         weight_fracs = []
@@ -652,10 +740,15 @@ class TestSetCoverApproxMultiuniverse(unittest.TestCase):
                         else:
                             sets_as_intervalsets[set_id][universe_id] = \
                                 interval.IntervalSet(els_as_intervals)
+                if use_columnar_sets:
+                    sets_as_intervalsets = sc.ColumnarSets.from_dict(
+                        sets_as_intervalsets)
                 output = sc.approx_multiuniverse(sets_as_intervalsets, costs,
                                                  universe_p,
                                                  use_arrays=False,
-                                                 use_intervalsets=True)
+                                                 use_intervalsets=True,
+                                                 use_lazy_greedy=use_lazy_greedy,
+                                                 use_bitmap_universes=use_bitmap_universes)
             elif use_arrays:
                 sets_as_arrays = {}
                 for set_id in sets.keys():
@@ -667,11 +760,13 @@ class TestSetCoverApproxMultiuniverse(unittest.TestCase):
                 output = sc.approx_multiuniverse(sets_as_arrays, costs,
                                                  universe_p,
                                                  use_arrays=True,
-                                                 use_intervalsets=False)
+                                                 use_intervalsets=False,
+                                                 use_lazy_greedy=use_lazy_greedy)
             else:
                 output = sc.approx_multiuniverse(sets, costs, universe_p,
                                                  use_arrays=False,
-                                                 use_intervalsets=False)
+                                                 use_intervalsets=False,
+                                                 use_lazy_greedy=use_lazy_greedy)
             self.verify_partial_cover(sets, universe_p, output)
             weight_fracs += [self.weight_frac(costs, output)]
             outputs += [output]
@@ -694,3 +789,93 @@ class TestSetCoverApproxMultiuniverse(unittest.TestCase):
     def tearDown(self):
         # Re-enable logging
         logging.disable(logging.NOTSET)
+
+
+class TestColumnarSets(unittest.TestCase):
+    """Tests the ColumnarSets class.
+    """
+
+    def setUp(self):
+        # Disable logging
+        logging.disable(logging.WARNING)
+
+        self.sets = {
+            0: {0: (1, 100),
+                1: (1, 5)},
+            1: {},
+            2: {0: (20, 30)},
+            3: {0: interval.IntervalSet([(40, 50), (60, 70)]),
+                2: interval.IntervalSet([(20, 30), (5, 10)])}
+        }
+
+    def test_from_dict(self):
+        cs = sc.ColumnarSets.from_dict(self.sets)
+        self.assertEqual(len(cs), 4)
+        self.assertEqual(list(cs.keys()), [0, 1, 2, 3])
+        self.assertEqual(dict(cs), self.sets)
+        self.assertNotIn(4, cs)
+
+    def test_from_intervals_merges(self):
+        # Intervals can be in any order and can overlap or touch
+        cs = sc.ColumnarSets.from_intervals(
+            3,
+            [2, 0, 2, 0, 2, 2, 0],
+            [0, 1, 0, 1, 1, 0, 1],
+            [5, 10, 1, 1, 3, 9, 4],
+            [8, 15, 4, 3, 6, 10, 10])
+        self.assertEqual(cs[0], {1: interval.IntervalSet([(1, 3), (4, 15)])})
+        self.assertEqual(cs[1], {})
+        self.assertEqual(cs[2], {0: interval.IntervalSet([(1, 4), (5, 8),
+                                                          (9, 10)]),
+                                 1: (3, 6)})
+
+    def test_intervals_of_set(self):
+        cs = sc.ColumnarSets.from_dict(self.sets)
+        self.assertEqual(cs.universe_ids_of(0), [0, 1])
+        self.assertEqual(cs.universe_ids_of(1), [])
+        self.assertEqual(cs.universe_ids_of(3), [0, 2])
+        self.assertEqual(cs.intervals_of(0, 1), [(1, 5)])
+        self.assertEqual(cs.intervals_of(3, 0), [(40, 50), (60, 70)])
+        self.assertEqual(cs.intervals_of(3, 2), [(5, 10), (20, 30)])
+        self.assertEqual(cs.intervals_of(3, 1), [])
+        self.assertEqual(cs.intervals_of(1, 0), [])
+
+    def test_intervals_by_universe(self):
+        cs = sc.ColumnarSets.from_dict(self.sets)
+        self.assertEqual(cs.intervals_by_universe(),
+                         {0: [(1, 100), (20, 30), (40, 50), (60, 70)],
+                          1: [(1, 5)],
+                          2: [(5, 10), (20, 30)]})
+
+    def test_set_ids_overlapping(self):
+        cs = sc.ColumnarSets.from_dict(self.sets)
+        self.assertEqual(cs.set_ids_overlapping(0, [(25, 26)]), {0, 2})
+        self.assertEqual(cs.set_ids_overlapping(0, [(50, 60)]), {0})
+        self.assertEqual(cs.set_ids_overlapping(0, [(100, 200)]), set())
+        self.assertEqual(cs.set_ids_overlapping(0, [(0, 1), (69, 70)]),
+                         {0, 3})
+        self.assertEqual(cs.set_ids_overlapping(2, [(8, 22)]), {3})
+        self.assertEqual(cs.set_ids_overlapping(5, [(0, 100)]), set())
+
+    def test_save_and_load(self):
+        cs = sc.ColumnarSets.from_dict(self.sets)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cs.save(tmp_dir)
+            for mmap in [True, False]:
+                cs_loaded = sc.ColumnarSets.load(tmp_dir, mmap=mmap)
+                self.assertEqual(dict(cs_loaded), self.sets)
+                self.assertEqual(
+                    sc.approx_multiuniverse(cs_loaded,
+                                            universe_p={0: 1.0, 1: 0.1,
+                                                        2: 1.0},
+                                            use_intervalsets=True),
+                    {0, 3})
+
+    def test_requires_intervalsets(self):
+        cs = sc.ColumnarSets.from_dict(self.sets)
+        with self.assertRaises(ValueError):
+            sc.approx_multiuniverse(cs)
+
+    def tearDown(self):
+        # Re-enable logging
+        logging.disable(logging.NOTSET)
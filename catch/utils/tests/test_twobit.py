@@ -0,0 +1,96 @@
+"""Tests for twobit module.
+"""
+
+import unittest
+
+import numpy as np
+
+from catch.utils import twobit
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+class TestEncode(unittest.TestCase):
+    """Tests the encode function.
+    """
+
+    def test_unambiguous(self):
+        self.assertEqual(list(twobit.encode('ACGTTGCA')),
+                         [0, 1, 2, 3, 3, 2, 1, 0])
+
+    def test_invalid(self):
+        self.assertEqual(list(twobit.encode('ANcT-')),
+                         [0, 4, 4, 3, 4])
+
+    def test_input_types(self):
+        expected = [2, 0, 3, 1]
+        self.assertEqual(list(twobit.encode('GATC')), expected)
+        self.assertEqual(list(twobit.encode(b'GATC')), expected)
+        self.assertEqual(list(twobit.encode(
+            np.array(['G', 'A', 'T', 'C'], dtype='U1'))), expected)
+        self.assertEqual(list(twobit.encode(
+            np.frombuffer(b'GATC', dtype=np.uint8))), expected)
+
+
+class TestKmerValues(unittest.TestCase):
+    """Tests the kmer_values and kmer_value functions.
+    """
+
+    def test_exact_values(self):
+        values, valid = twobit.kmer_values(twobit.encode('ACGTA'), 3)
+        # ACG = 0b000110, CGT = 0b011011, GTA = 0b101100
+        self.assertEqual(list(values), [6, 27, 44])
+        self.assertEqual(list(valid), [True, True, True])
+
+    def test_invalid_windows(self):
+        values, valid = twobit.kmer_values(twobit.encode('ACNGTAC'), 3)
+        self.assertEqual(list(valid),
+                         [False, False, False, True, True])
+
+    def test_sequence_shorter_than_k(self):
+        values, valid = twobit.kmer_values(twobit.encode('ACG'), 4)
+        self.assertEqual(len(values), 0)
+        self.assertEqual(len(valid), 0)
+
+    def test_agrees_with_kmer_value(self):
+        np.random.seed(1)
+        seq = ''.join(np.random.choice(['A', 'C', 'G', 'T'], size=200))
+        for k in [1, 10, 32, 33, 60]:
+            values, valid = twobit.kmer_values(twobit.encode(seq), k)
+            self.assertTrue(valid.all())
+            for i in range(len(seq) - k + 1):
+                self.assertEqual(values[i], twobit.kmer_value(seq[i:(i + k)]))
+
+    def test_distinct_kmers_have_distinct_values(self):
+        np.random.seed(1)
+        seq = ''.join(np.random.choice(['A', 'C', 'G', 'T'], size=2000))
+        for k in [12, 32, 40]:
+            values, _ = twobit.kmer_values(twobit.encode(seq), k)
+            kmers = set(seq[i:(i + k)] for i in range(len(seq) - k + 1))
+            self.assertEqual(len(set(values.tolist())), len(kmers))
+
+    def test_kmer_value_invalid(self):
+        self.assertIsNone(twobit.kmer_value('ACNT'))
+
+
+class TestReverseComplementValues(unittest.TestCase):
+    """Tests the reverse_complement_values function.
+    """
+
+    def test_agrees_with_kmer_value(self):
+        np.random.seed(1)
+        rc_table = str.maketrans('ACGT', 'TGCA')
+        for k in [1, 2, 7, 20, 31, 32]:
+            kmers = [''.join(np.random.choice(['A', 'C', 'G', 'T'], size=k))
+                     for _ in range(20)]
+            values = np.array([twobit.kmer_value(kmer) for kmer in kmers],
+                              dtype=np.uint64)
+            rc_values = twobit.reverse_complement_values(values, k)
+            for kmer, rc_value in zip(kmers, rc_values):
+                self.assertEqual(rc_value, twobit.kmer_value(
+                    kmer[::-1].translate(rc_table)))
+
+    def test_hashed_values(self):
+        with self.assertRaises(ValueError):
+            twobit.reverse_complement_values(np.zeros(1, dtype=np.uint64),
+                                             33)
@@ -0,0 +1,171 @@
+"""Functions for encoding nucleotide sequences as compact NumPy arrays.
+
+Bases are encoded with 2 bits each ('A'=0, 'C'=1, 'G'=2, 'T'=3). This
+makes it possible to represent a k-mer, for k <= 32, exactly as a single
+64-bit integer and to compute the integers for all k-mers in a sequence
+with a handful of vectorized operations rather than by slicing strings.
+
+Only the uppercase unambiguous bases can be encoded with 2 bits. Any
+other character (e.g., 'N' or a lowercase base) is given the code
+INVALID_CODE, and k-mers that contain such a character are marked as
+invalid by the functions that compute k-mer values.
+"""
+
+import numpy as np
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# Code given to any character that is not one of 'A', 'C', 'G', or 'T'
+INVALID_CODE = 4
+
+# Largest k for which a k-mer fits exactly in a 64-bit integer
+MAX_EXACT_K = 32
+
+# Multiplier for the polynomial (rolling) hash used when k > MAX_EXACT_K;
+# it is odd so that multiplication is invertible modulo 2^64
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Lookup table from ASCII byte values to 2-bit codes
+_ENCODE_TABLE = np.full(256, INVALID_CODE, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    _ENCODE_TABLE[ord(_base)] = _code
+
+
+def to_bytes_array(seq):
+    """Convert a sequence to an array of its ASCII byte values.
+
+    Args:
+        seq: sequence as a Python string, bytes, NumPy array of
+            single characters (dtype 'U1' or 'S1'), or a NumPy uint8
+            array of ASCII values
+
+    Returns:
+        np.array of dtype uint8 giving the ASCII value of each base
+    """
+    if isinstance(seq, str):
+        return np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+    if isinstance(seq, (bytes, bytearray)):
+        return np.frombuffer(seq, dtype=np.uint8)
+    if isinstance(seq, np.ndarray):
+        if seq.dtype == np.uint8:
+            return seq
+        if seq.dtype.kind == 'S':
+            return np.frombuffer(seq.astype('S1').tobytes(), dtype=np.uint8)
+        if seq.dtype.kind == 'U':
+            return seq.astype('S1').view(np.uint8)
+    raise TypeError("Unable to convert sequence of type %s" % type(seq))
+
+
+def encode(seq):
+    """Encode a sequence with 2-bit codes.
+
+    Args:
+        seq: sequence in any form accepted by to_bytes_array()
+
+    Returns:
+        np.array of dtype uint8 with one code (0, 1, 2, or 3) per base,
+        or INVALID_CODE for bases other than 'A', 'C', 'G', and 'T'
+    """
+    return _ENCODE_TABLE[to_bytes_array(seq)]
+
+
+def kmer_values(codes, k):
+    """Compute an integer value for every k-mer in an encoded sequence.
+
+    When k <= MAX_EXACT_K, the value of a k-mer is its 2-bit packed
+    representation (the first base in the most significant bits), so
+    two k-mers have the same value if and only if they are equal.
+    When k > MAX_EXACT_K, the value is a polynomial hash modulo 2^64;
+    distinct k-mers may (rarely) collide, so callers should verify
+    equality of k-mers whose values match.
+
+    Args:
+        codes: np.array of 2-bit codes, as output by encode()
+        k: k-mer length
+
+    Returns:
+        tuple (values, valid) where values[i] is an np.uint64 value for
+        the k-mer starting at position i and valid[i] is False iff that
+        k-mer contains a base that could not be encoded; both arrays have
+        length len(codes)-k+1 (or 0 if len(codes) < k)
+    """
+    num_kmers = len(codes) - k + 1
+    if num_kmers <= 0:
+        return (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool))
+
+    # Count, using a cumulative sum, the number of invalid bases in
+    # each window of length k
+    invalid_cumsum = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == INVALID_CODE, out=invalid_cumsum[1:])
+    valid = (invalid_cumsum[k:] - invalid_cumsum[:num_kmers]) == 0
+
+    codes = (codes & 3).astype(np.uint64)
+    values = np.zeros(num_kmers, dtype=np.uint64)
+    for j in range(k):
+        if k <= MAX_EXACT_K:
+            values <<= np.uint64(2)
+            values |= codes[j:(j + num_kmers)]
+        else:
+            values *= _HASH_MULTIPLIER
+            values += codes[j:(j + num_kmers)]
+    return (values, valid)
+
+
+def kmer_value(kmer):
+    """Compute the integer value of a single k-mer.
+
+    This gives the same value as kmer_values() for the k-mer.
+
+    Args:
+        kmer: k-mer in any form accepted by to_bytes_array()
+
+    Returns:
+        np.uint64 value of kmer, or None if kmer contains a base that
+        could not be encoded
+    """
+    codes = encode(kmer)
+    values, valid = kmer_values(codes, len(codes))
+    if not valid[0]:
+        return None
+    return values[0]
+
+
+# Masks for reversing the order of the 2-bit codes in a 64-bit integer,
+# as tuples (shift, mask)
+_REVERSE_MASKS = [(2, np.uint64(0x3333333333333333)),
+                  (4, np.uint64(0x0F0F0F0F0F0F0F0F)),
+                  (8, np.uint64(0x00FF00FF00FF00FF)),
+                  (16, np.uint64(0x0000FFFF0000FFFF)),
+                  (32, np.uint64(0x00000000FFFFFFFF))]
+
+
+def reverse_complement_values(values, k):
+    """Compute the values of the reverse complements of k-mers.
+
+    Because complementary bases have codes that sum to 3, the complement
+    of a base is its code XOR 3; the reverse complement of a k-mer is
+    then found by reversing the order of its 2-bit codes.
+
+    Args:
+        values: np.uint64 array of values of k-mers, as output by
+            kmer_values()
+        k: k-mer length; must be <= MAX_EXACT_K
+
+    Returns:
+        np.uint64 array whose i'th entry is the value of the reverse
+        complement of the k-mer with value values[i]
+
+    Raises:
+        ValueError if k > MAX_EXACT_K, in which case values are hashes
+        and do not determine the k-mers
+    """
+    if k > MAX_EXACT_K:
+        raise ValueError(("Values of k-mers are only exact for k <= %d") %
+                         MAX_EXACT_K)
+    values = np.asarray(values, dtype=np.uint64)
+    for shift, mask in _REVERSE_MASKS:
+        shift = np.uint64(shift)
+        values = ((values >> shift) & mask) | ((values & mask) << shift)
+    values = values >> np.uint64(64 - 2*k)
+    return values ^ np.uint64(4**k - 1)
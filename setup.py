@@ -20,5 +20,6 @@ setup(name='catch',
           'bin/design.py',
           'bin/design_large.py',
           'bin/design_naively.py',
+          'bin/index_genomes.py',
           'bin/pool.py',
       ])